@@ -14,6 +14,7 @@ from pathlib import Path
 from dotenv import load_dotenv
 
 import os
+from celery.schedules import crontab
 load_dotenv()
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -74,6 +75,28 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
+CELERY_BEAT_SCHEDULE = {
+    'requeue-stale-ai-jobs': {
+        'task': 'ai_engine.tasks.requeue_stale_ai_jobs',
+        'schedule': 60.0,
+    },
+    'rollup-ai-usage': {
+        'task': 'ai_engine.tasks.rollup_ai_usage',
+        'schedule': 300.0,
+    },
+    'rebuild-resource-similarity': {
+        'task': 'elibrary.tasks.rebuild_similarity_index',
+        'schedule': crontab(hour=2, minute=30),
+    },
+    'flush-resource-counters': {
+        'task': 'elibrary.tasks.flush_resource_counters',
+        'schedule': 30.0,
+    },
+    'reconcile-resource-counters': {
+        'task': 'elibrary.tasks.update_resource_analytics',
+        'schedule': crontab(hour=3, minute=0),
+    },
+}
 
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
@@ -177,15 +200,212 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
+ASGI_APPLICATION = 'SkillNexus.asgi.application'
+
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
         'CONFIG': {
             "hosts": [('127.0.0.1', 6379)],
+            # Slow sockets drop old position frames instead of growing their queue
+            "capacity": 200,
+            "expiry": 30,
         },
     },
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'ai_responses': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/1',
+        'TIMEOUT': 60 * 60 * 24,
+    },
+    # Markers and locks that must be seen by every web and worker process
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/4',
+    },
+}
+
 # GPS Settings
 GPS_UPDATE_INTERVAL = 30  # seconds
-MIN_GPS_ACCURACY = 50  # meters
\ No newline at end of file
+MIN_GPS_ACCURACY = 50  # meters
+# Per-trip ingestion state (last fix, live wire, geofences, batch lock), shared by the ASGI and WSGI
+# processes; 'default' (LocMem) is only safe when a single process serves every GPS endpoint
+GPS_STATE_CACHE = 'shared'
+GPS_STATE_TTL = 60 * 60 * 4
+GPS_STOP_INDEX_TTL = 300  # seconds a route's stop index is reused per process
+# LocationUpdate rows are buffered and bulk-inserted from a background thread
+GPS_LOCATION_BUFFER_ENABLED = True
+GPS_LOCATION_FLUSH_SIZE = 200
+GPS_LOCATION_FLUSH_INTERVAL = 5  # seconds
+GPS_LOCATION_MAX_BUFFER = 50000
+
+# Batch uploads of fixes buffered on driver devices while offline (gps-batch endpoint)
+GPS_BATCH_MAX_POINTS = 1000
+GPS_BATCH_MAX_BYTES = 5 * 1024 * 1024  # decompressed body limit for gzip uploads
+GPS_BATCH_MAX_CLOCK_SKEW = 60  # seconds a fix may be ahead of the server clock
+GPS_BATCH_LOCK_TTL = 30  # seconds; one upload per trip at a time
+# location_updates is partitioned by day (PostgreSQL); raw days past retention are dropped after
+# finished trips are downsampled into TripTrack (one point per GPS_TRACK_ROLLUP_INTERVAL seconds)
+GPS_LOCATION_PARTITION_DAYS_AHEAD = 7
+GPS_LOCATION_RETENTION_DAYS = 7
+GPS_TRACK_ROLLUP_INTERVAL = 30  # seconds
+GPS_TRACK_ROLLUP_DELAY = 60 * 10  # seconds after a trip ends, so buffered pings are written
+GPS_TRACK_SIMPLIFY_TOLERANCE = 5  # meters; Douglas-Peucker tolerance of the stored replay path
+# Learned ETAs: median stop-to-stop times per time-of-day bucket, rebuilt nightly from trip tracks
+GPS_ETA_HISTORY_DAYS = 28
+GPS_ETA_BUCKET_MINUTES = 60
+GPS_ETA_MIN_SAMPLES = 3  # trips needed before a bucket gets its own time
+GPS_ETA_PROFILE_TTL = 600  # seconds a route's ETA table is reused per process
+# Geofences: every stop gets an arrival circle and an approach ring (parents alerted on entry);
+# fixes are checked against the fences of their grid cell only
+GEOFENCE_STOP_RADIUS = 50  # meters
+GEOFENCE_APPROACH_RADIUS = 1000  # meters
+GEOFENCE_EXIT_MARGIN = 20  # meters past the radius before a fence counts as left
+GEOFENCE_DWELL_SECONDS = 60
+GEOFENCE_CELL_SIZE = 250  # meters
+
+# Daily trip generation (transport.tasks.generate_daily_trips): trips are created this many days ahead;
+# with FANOUT each school is its own Celery task instead of one inline pass
+TRANSPORT_TRIP_DAYS_AHEAD = 7
+TRANSPORT_TRIP_WEEKDAYS = (0, 1, 2, 3, 4, 5, 6)  # Monday=0; days buses run
+TRANSPORT_TRIP_GENERATION_FANOUT = False
+
+# Route stop-order optimization
+ROUTE_MATRIX_CACHE = 'default'
+ROUTE_MATRIX_TTL = 60 * 60 * 24 * 7
+ROUTE_HAVERSINE_DETOUR_FACTOR = 1.3  # straight-line km -> approximate road km when routing offline
+ROUTE_OPTIMIZER_SPEED_KMH = 25
+ROUTE_OPTIMIZER_DWELL_SECONDS = 60
+ROUTE_OPTIMIZER_TIME_BUDGET = 0.5  # seconds spent repairing pickup-window lateness
+
+# Geocoding/routing proxy (transport/geocoding.py): Nominatim and OSRM behind a process LRU and the
+# geocode_cache table; point the URLs at `manage.py geo_stub_server` for load tests
+GEO_NOMINATIM_URL = os.getenv('GEO_NOMINATIM_URL', 'https://nominatim.openstreetmap.org')
+GEO_OSRM_URL = os.getenv('GEO_OSRM_URL', 'http://router.project-osrm.org')
+# The token buckets are per process: N web/worker processes may send up to N times these rates,
+# so keep public Nominatim (1 request/s overall) behind a single process or a self-hosted instance
+GEO_RATE_LIMITS = {
+    'nominatim': (1, 1),  # (requests per second, burst); public Nominatim allows 1/s
+    'osrm': (5, 10),
+}
+GEO_RATE_LIMIT_WAIT = 2  # seconds a caller waits for a token before failing fast
+GEO_HTTP_TIMEOUT = (3, 10)  # (connect, read) seconds
+GEO_HTTP_POOL_SIZE = 10
+GEO_USER_AGENT = 'SkillXP-Transport/1.0'
+GEO_COORDINATE_PRECISION = 5  # decimals (~1 m) coordinates are rounded to before lookup
+GEO_CACHE_TTL_DAYS = 90
+GEO_CACHE_NEGATIVE_TTL = 60 * 60 * 24  # seconds a "not found" answer is remembered
+GEO_CACHE_LOCAL_TTL = 60 * 60  # seconds entries stay in the per-process LRU
+GEO_CACHE_LOCAL_MAX_ENTRIES = 4096
+GEO_BULK_MAX_ADDRESSES = 500
+GEO_BULK_TIME_BUDGET = 10  # seconds a bulk request spends on uncached lookups; the rest come back unresolved
+
+# Live bus positions for websocket clients: per-school snapshot hash in Redis, fanned out through CHANNEL_LAYERS
+TRANSPORT_LIVE_REDIS_URL = 'redis://127.0.0.1:6379/2'
+TRANSPORT_LIVE_REDIS_TIMEOUT = 0.2  # seconds; a slow Redis must not stall GPS ingestion
+TRANSPORT_LIVE_SNAPSHOT_TTL = 60 * 60  # seconds the whole snapshot survives without updates
+TRANSPORT_LIVE_MAX_AGE = 300  # seconds before a bus drops out of the snapshot
+
+# Arrival/delay notifications: per trip/stop/student sent-markers, shared by all workers
+TRANSPORT_NOTIFICATION_CACHE = 'shared'
+TRANSPORT_NOTIFICATION_SENT_TTL = 60 * 60 * 12
+
+# AI Engine
+# Workers per lane: celery -A SkillNexus worker -Q ai_critical,ai_high (and ai_default,ai_low)
+AI_ENGINE_BACKEND = os.getenv('AI_ENGINE_BACKEND', 'gemini')  # 'gemini' or 'fake'
+AI_FAKE_LATENCY_MS = 200
+AI_FAKE_ERROR_RATE = 0.0
+AI_JOB_MAX_ATTEMPTS = 3
+AI_JOB_LANES = {
+    'WELLBEING': 'CRITICAL',
+    'SOCIAL': 'HIGH',
+    'CLASSROOM': 'DEFAULT',
+    'ANALYTICS': 'LOW',
+    'ELIBRARY': 'LOW',
+}
+AI_CONFIG_CACHE_TTL = 60  # seconds an active AIModelConfig is reused per process
+AI_MAX_CONCURRENT_REQUESTS_PER_MODEL = 8
+AI_CLIENT_ACQUIRE_TIMEOUT = 2  # seconds to wait for a per-model slot before failing fast
+AI_MAX_IN_FLIGHT = 32  # upstream calls per process, across all models
+AI_IN_FLIGHT_WAIT_SECONDS = 0.5
+AI_MAX_RETRIES = 2
+AI_RETRY_BASE_DELAY = 0.5
+AI_RETRY_MAX_DELAY = 4
+AI_RETRY_BUDGET_RATIO = 0.1  # at most ~10% extra upstream calls from retries
+AI_RETRY_BUDGET_MIN_PER_SECOND = 0.5
+AI_RETRY_BUDGET_MAX = 20
+AI_BREAKER_FAILURE_THRESHOLD = 5
+AI_BREAKER_RESET_SECONDS = 30
+AI_BREAKER_SYNC_SECONDS = 5
+# Point the Gemini client at another host, e.g. 'http://127.0.0.1:8765' for `manage.py ai_stub_server`
+AI_GEMINI_API_ENDPOINT = os.getenv('AI_GEMINI_API_ENDPOINT', '')
+# Toxicity/sentiment jobs are collected for up to AI_BATCH_WINDOW_MS or AI_BATCH_MAX_ITEMS per prompt
+AI_BATCH_ENABLED = True
+AI_BATCH_WINDOW_MS = 250
+AI_BATCH_MAX_ITEMS = 20
+AI_BATCH_LOCK_CACHE = 'ai_responses'  # must be shared by all processes (Redis)
+
+# AI response cache (TTLs in seconds, per AIService method)
+AI_CACHE_ENABLED = True
+AI_CACHE_LOCAL_MAX_ENTRIES = 1024
+AI_CACHE_LOCAL_TTL = 300
+AI_CACHE_TTLS = {
+    'analyze_toxicity': 60 * 60 * 24 * 7,
+    'analyze_sentiment': 60 * 60 * 24 * 7,
+    'summarize_content': 60 * 60 * 24 * 30,
+    'generate_quiz_questions': 60 * 60 * 24,
+    'extract_keywords': 60 * 60 * 24 * 30,
+    'score_difficulty': 60 * 60 * 24 * 30,
+}
+
+# AI request logging (rows are buffered and bulk-inserted from a background thread)
+AI_LOG_BUFFER_ENABLED = True
+AI_LOG_FLUSH_SIZE = 100
+AI_LOG_FLUSH_INTERVAL = 5  # seconds
+AI_LOG_MAX_BUFFER = 10000
+AI_LOG_SUCCESS_SAMPLE_RATE = 1.0  # e.g. 0.1 keeps 1 in 10 successful calls
+AI_LOG_TEXT_MODE = 'full'  # 'full', 'truncate' or 'compress'
+AI_LOG_MAX_TEXT_CHARS = 2000
+
+# eLibrary search (PostgreSQL full-text index on LearningResource.search_vector)
+ELIBRARY_SEARCH_CONFIG = 'english'  # text search configuration; run ResourceSearchIndex.reindex_all() after changing
+ELIBRARY_SEARCH_CONTENT_CHARS = 100000  # characters of a resource body that are indexed
+ELIBRARY_SEARCH_HEADLINE_CHARS = 20000  # characters scanned for result snippets
+ELIBRARY_SEARCH_MAX_TERMS = 10
+ELIBRARY_SEARCH_MIN_PREFIX = 2  # shortest last word that is matched as a prefix
+
+# eLibrary similar resources (ResourceNeighbor, rebuilt nightly by elibrary.tasks.rebuild_similarity_index)
+ELIBRARY_SIMILARITY_TOP_K = 20
+ELIBRARY_SIMILARITY_WEIGHTS = {
+    'interactions': 0.5,  # users who used both
+    'categories': 0.3,
+    'keywords': 0.2,  # ai_keywords and tags
+    'difficulty': 0.3,  # share of the score scaled by difficulty closeness
+}
+ELIBRARY_SIMILARITY_HISTORY_DAYS = 180
+ELIBRARY_SIMILARITY_MAX_USER_ITEMS = 500  # users with more resources than this are ignored
+ELIBRARY_SIMILARITY_MAX_PAIRS = 4000000  # sparse product terms per computed block (bounds memory)
+
+# eLibrary personalized recommendations (elibrary.recommendations, generate_daily_recommendations)
+ELIBRARY_RECOMMENDATIONS_PER_USER = 10
+ELIBRARY_RECOMMENDATION_TTL_DAYS = 7
+ELIBRARY_RECOMMENDATION_ACTIVE_DAYS = 30  # users who logged in within this many days get recommendations
+ELIBRARY_RECOMMENDATION_BLOCK_CELLS = 2000000  # users x resources scored per block (bounds memory)
+# with FANOUT each school is its own Celery task instead of one inline pass
+ELIBRARY_RECOMMENDATION_FANOUT = False
+# Interactions open a per-user window; the user's recommendations are recomputed once when it closes.
+# The window markers live in the shared cache so events from every web process coalesce.
+ELIBRARY_RECOMMENDATION_REFRESH_WINDOW = 60  # seconds
+ELIBRARY_RECOMMENDATION_REFRESH_CACHE = 'shared'
+
+# eLibrary write-behind counters (elibrary.counters); flushed by flush-resource-counters in CELERY_BEAT_SCHEDULE
+ELIBRARY_COUNTER_REDIS_URL = 'redis://127.0.0.1:6379/3'
+ELIBRARY_COUNTER_REDIS_TIMEOUT = 0.2  # seconds; if Redis is slower the increment is written to the row
+ELIBRARY_COUNTER_FLUSH_BATCH = 500  # resources per UPDATE statement
+ELIBRARY_COUNTER_FLUSH_LOCK_TTL = 300  # seconds
+ELIBRARY_COUNTER_RECONCILE_LOCK_TTL = 60 * 60  # seconds; flushes wait while a recount runs
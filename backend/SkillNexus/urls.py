@@ -26,5 +26,6 @@ urlpatterns = [
     path('api/social/', include('social.urls')),
     path('api/rewards/', include('rewards.urls')),
     path('api/ai-engine/', include('ai_engine.urls')),
+    path('api/transport/', include('transport.urls')),
     path('api/notifications/', include('notifications.urls')),
 ]
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import AIModelConfig, AIRequestLog
+from .models import AIModelConfig, AIRequestLog, AIJob, AIUsageRollup, AICircuitBreakerState
 
 @admin.register(AIModelConfig)
 class AIModelConfigAdmin(admin.ModelAdmin):
@@ -12,20 +12,58 @@ class AIModelConfigAdmin(admin.ModelAdmin):
     fieldsets = (
         (None, {'fields': ('name', 'model_type', 'provider', 'is_active')}),
         ('API Details', {'fields': ('api_key_env',)}),
-        ('Parameters', {'fields': ('temperature', 'max_tokens')}),
+        ('Parameters', {'fields': ('temperature', 'max_tokens', 'timeout_seconds')}),
+        ('Pricing (USD per 1k tokens)', {'fields': ('input_cost_per_1k_tokens', 'output_cost_per_1k_tokens')}),
     )
 
 @admin.register(AIRequestLog)
 class AIRequestLogAdmin(admin.ModelAdmin):
     list_display = (
         'created_at', 'model_config', 'target_app', 'user', 
-        'was_successful', 'latency_ms', 'cost_usd'
+        'was_successful', 'cache_hit', 'latency_ms', 'cost_usd'
     )
-    list_filter = ('target_app', 'model_config__model_type', 'was_successful')
+    list_filter = ('target_app', 'model_config__model_type', 'was_successful', 'cache_hit')
     search_fields = ('prompt_text', 'error_message', 'user__email')
     readonly_fields = [
         'model_config', 'user', 'target_app', 'prompt_text', 'response_text', 
         'input_tokens', 'output_tokens', 'cost_usd', 'latency_ms', 
-        'was_successful', 'error_message', 'created_at'
+        'was_successful', 'cache_hit', 'sample_weight', 'error_message', 'created_at'
     ]
-    date_hierarchy = 'created_at'
\ No newline at end of file
+    date_hierarchy = 'created_at'
+
+@admin.register(AIJob)
+class AIJobAdmin(admin.ModelAdmin):
+    list_display = (
+        'created_at', 'method', 'target_app', 'lane', 'status',
+        'attempts', 'target_model', 'target_id', 'finished_at'
+    )
+    list_filter = ('status', 'lane', 'target_app', 'method')
+    search_fields = ('method', 'target_model', 'error_message', 'requesting_user__email')
+    readonly_fields = [
+        'method', 'params', 'target_app', 'lane', 'requesting_user', 'target_model',
+        'target_id', 'callback', 'result', 'error_message', 'attempts', 'max_attempts',
+        'created_at', 'started_at', 'finished_at'
+    ]
+    date_hierarchy = 'created_at'
+
+@admin.register(AIUsageRollup)
+class AIUsageRollupAdmin(admin.ModelAdmin):
+    list_display = (
+        'bucket_start', 'target_app', 'model_type', 'request_count', 'error_count',
+        'cache_hit_count', 'input_tokens', 'output_tokens', 'cost_usd'
+    )
+    list_filter = ('target_app', 'model_type')
+    readonly_fields = [field.name for field in AIUsageRollup._meta.fields]
+    date_hierarchy = 'bucket_start'
+
+@admin.register(AICircuitBreakerState)
+class AICircuitBreakerStateAdmin(admin.ModelAdmin):
+    list_display = ('model_config', 'state', 'consecutive_failures', 'opened_at', 'updated_at')
+    list_filter = ('state',)
+    readonly_fields = ['model_config', 'state', 'consecutive_failures', 'opened_at', 'last_error', 'updated_at']
+    actions = ['reset_breakers']
+
+    @admin.action(description='Reset selected circuit breakers (close)')
+    def reset_breakers(self, request, queryset):
+        updated = queryset.update(state=AICircuitBreakerState.State.CLOSED, consecutive_failures=0)
+        self.message_user(request, f"{updated} circuit breaker(s) reset; workers pick this up within a few seconds.")
@@ -0,0 +1,80 @@
+import re
+import time
+import json
+import random
+import hashlib
+from django.conf import settings
+
+
+class FakeModelBackend:
+    """
+    Deterministic offline stand-in for the Gemini API.
+
+    Reads the "- field: description" lines every AIService prompt uses and returns a
+    JSON object with plausible values, so the whole job pipeline can be load-tested
+    without network access or API spend.
+    """
+    FIELD_PATTERN = re.compile(r'^\s*-\s*([a-z_]+):\s*(.*)$', re.MULTILINE)
+    OPTIONS_PATTERN = re.compile(r'\(([^)]*,[^)]*)\)')
+    ITEM_PATTERN = re.compile(r'^\s*\[(\d+)\]\s*(.*)$', re.MULTILINE)
+
+    @staticmethod
+    def is_enabled(model_config):
+        """Use the fake backend globally or for configs whose provider is 'fake'"""
+        if getattr(settings, 'AI_ENGINE_BACKEND', 'gemini') == 'fake':
+            return True
+        return (model_config.provider or '').lower().startswith('fake')
+
+    @staticmethod
+    def generate(prompt, latency_ms=None):
+        """Return a fake model response text for the prompt"""
+        if latency_ms is None:
+            latency_ms = getattr(settings, 'AI_FAKE_LATENCY_MS', 200)
+        if latency_ms:
+            time.sleep(latency_ms / 1000)
+
+        seed = int(hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12], 16)
+        rng = random.Random(seed)
+
+        error_rate = getattr(settings, 'AI_FAKE_ERROR_RATE', 0.0)
+        if error_rate and random.random() < error_rate:
+            raise RuntimeError("Simulated model failure")
+
+        fields = FakeModelBackend.FIELD_PATTERN.findall(prompt)
+        items = FakeModelBackend.ITEM_PATTERN.findall(prompt)
+
+        # Batched prompts: one result object per numbered item
+        if items and '"results"' in prompt:
+            results = []
+            for item_id, item_text in items:
+                item_rng = random.Random(hashlib.sha256(item_text.encode('utf-8')).hexdigest())
+                result = {
+                    name: FakeModelBackend._fake_value(name, description.lower(), item_rng)
+                    for name, description in fields if name != 'id'
+                }
+                result['id'] = int(item_id)
+                results.append(result)
+            return json.dumps({'results': results})
+
+        response = {}
+        for name, description in fields:
+            response[name] = FakeModelBackend._fake_value(name, description.lower(), rng)
+
+        return json.dumps(response)
+
+    @staticmethod
+    def _fake_value(name, description, rng):
+        """Pick a value matching the type described in the prompt"""
+        options = FakeModelBackend.OPTIONS_PATTERN.search(description)
+
+        if description.startswith('array'):
+            return [] if 'object' in description else [f"fake {name} {i + 1}" for i in range(3)]
+        if description.startswith('boolean'):
+            return rng.random() < 0.1
+        if 'number' in description or 'estimated' in description or name.endswith(('_score', '_minutes')):
+            if '-1' in description:
+                return round(rng.uniform(-1, 1), 2)
+            return round(rng.random(), 2)
+        if options:
+            return rng.choice([option.strip() for option in options.group(1).split(',')])
+        return f"fake {name.replace('_', ' ')}"
@@ -0,0 +1,150 @@
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+
+logger = logging.getLogger(__name__)
+
+# Bump a method's version whenever its prompt template changes so old answers are not served
+PROMPT_VERSIONS = {
+    'analyze_toxicity': 1,
+    'analyze_sentiment': 1,
+    'summarize_content': 1,
+    'generate_quiz_questions': 1,
+    'extract_keywords': 1,
+    'score_difficulty': 1,
+}
+
+DEFAULT_TTLS = {
+    'analyze_toxicity': 60 * 60 * 24 * 7,
+    'analyze_sentiment': 60 * 60 * 24 * 7,
+    'summarize_content': 60 * 60 * 24 * 30,
+    'generate_quiz_questions': 60 * 60 * 24,
+    'extract_keywords': 60 * 60 * 24 * 30,
+    'score_difficulty': 60 * 60 * 24 * 30,
+}
+
+
+class LocalLRUCache:
+    """
+    Small thread-safe in-process LRU with per-entry expiry, used in front of Redis.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_local_cache = LocalLRUCache(getattr(settings, 'AI_CACHE_LOCAL_MAX_ENTRIES', 1024))
+
+
+class AIResponseCache:
+    """
+    Two-tier (process LRU + Redis) cache of parsed AIService responses.
+
+    Keys combine the model config (and its last update, so edits invalidate), the prompt
+    template version of the method and a hash of the whitespace-normalized inputs.
+    """
+
+    @staticmethod
+    def is_enabled(method):
+        return getattr(settings, 'AI_CACHE_ENABLED', True) and method in PROMPT_VERSIONS
+
+    @staticmethod
+    def ttl_for(method):
+        ttls = getattr(settings, 'AI_CACHE_TTLS', DEFAULT_TTLS)
+        return ttls.get(method, DEFAULT_TTLS.get(method, 3600))
+
+    @staticmethod
+    def normalize(value):
+        """Collapse whitespace so trivially different reposts share an entry"""
+        if isinstance(value, str):
+            return ' '.join(value.split())
+        if isinstance(value, dict):
+            return {k: AIResponseCache.normalize(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [AIResponseCache.normalize(v) for v in value]
+        return value
+
+    @staticmethod
+    def make_key(method, model_config, inputs):
+        payload = json.dumps(AIResponseCache.normalize(inputs), sort_keys=True, default=str)
+        input_hash = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+        config_version = int(model_config.updated_at.timestamp()) if model_config.updated_at else 0
+        return (
+            f"ai:{method}:v{PROMPT_VERSIONS.get(method, 0)}:"
+            f"{model_config.pk}:{config_version}:{input_hash}"
+        )
+
+    @staticmethod
+    def _shared_cache():
+        try:
+            return caches['ai_responses']
+        except InvalidCacheBackendError:
+            return None
+
+    @staticmethod
+    def get(key):
+        value = _local_cache.get(key)
+        if value is not None:
+            return value
+
+        shared = AIResponseCache._shared_cache()
+        if shared is None:
+            return None
+        try:
+            value = shared.get(key)
+        except Exception as e:
+            # Redis down - behave like a miss
+            logger.warning(f"AI response cache read failed: {str(e)}")
+            return None
+
+        if value is not None:
+            _local_cache.set(key, value, getattr(settings, 'AI_CACHE_LOCAL_TTL', 300))
+        return value
+
+    @staticmethod
+    def set(key, value, ttl):
+        _local_cache.set(key, value, min(ttl, getattr(settings, 'AI_CACHE_LOCAL_TTL', 300)))
+
+        shared = AIResponseCache._shared_cache()
+        if shared is None:
+            return
+        try:
+            shared.set(key, value, ttl)
+        except Exception as e:
+            logger.warning(f"AI response cache write failed: {str(e)}")
+
+    @staticmethod
+    def clear_local():
+        _local_cache.clear()
@@ -0,0 +1,109 @@
+import os
+import time
+import threading
+
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+from django.conf import settings
+
+from .models import AIModelConfig
+
+GEMINI_MODEL_NAME = 'models/gemini-2.0-flash'
+
+
+class ModelConfigCache:
+    """
+    Process-level cache of the active AIModelConfig per model type.
+    Entries expire after AI_CONFIG_CACHE_TTL seconds and are dropped by the
+    post_save/post_delete signals in ai_engine.signals when a config changes.
+    """
+    _entries = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get(model_type):
+        now = time.monotonic()
+        entry = ModelConfigCache._entries.get(model_type)
+        if entry and entry[0] > now:
+            return entry[1]
+
+        try:
+            config = AIModelConfig.objects.get(model_type=model_type, is_active=True)
+        except AIModelConfig.DoesNotExist:
+            config = None
+
+        # Missing configs are cached too, so unconfigured features don't query on every call
+        ttl = getattr(settings, 'AI_CONFIG_CACHE_TTL', 60)
+        with ModelConfigCache._lock:
+            ModelConfigCache._entries[model_type] = (now + ttl, config)
+        return config
+
+    @staticmethod
+    def invalidate(model_type=None):
+        with ModelConfigCache._lock:
+            if model_type is None:
+                ModelConfigCache._entries.clear()
+            else:
+                ModelConfigCache._entries.pop(model_type, None)
+
+
+class GeminiClientRegistry:
+    """
+    Process-level registry of GenerativeModel instances keyed by AIModelConfig.
+
+    genai.configure() throws away the underlying gRPC/HTTP client, so it is only called
+    when a different API key is needed; each model keeps the client it was built with,
+    which keeps its connection alive across calls. Every model also gets a bounded
+    semaphore capping concurrent in-flight requests from this process.
+    """
+    _clients = {}
+    _configured_api_key = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _version(model_config, api_key):
+        return (model_config.updated_at, api_key)
+
+    @staticmethod
+    def get(model_config):
+        """Return (GenerativeModel, semaphore) for a config, building them on first use"""
+        api_key = os.getenv(model_config.api_key_env)
+        if not api_key:
+            raise ValueError(f"API key not found for environment variable: {model_config.api_key_env}")
+
+        version = GeminiClientRegistry._version(model_config, api_key)
+        entry = GeminiClientRegistry._clients.get(model_config.pk)
+        if entry and entry[0] == version:
+            return entry[1], entry[2]
+
+        with GeminiClientRegistry._lock:
+            entry = GeminiClientRegistry._clients.get(model_config.pk)
+            if entry and entry[0] == version:
+                return entry[1], entry[2]
+
+            if GeminiClientRegistry._configured_api_key != api_key:
+                endpoint = getattr(settings, 'AI_GEMINI_API_ENDPOINT', '')
+                if endpoint:
+                    # Alternate endpoint (e.g. the ai_stub_server command) over plain REST
+                    genai.configure(api_key=api_key, transport='rest', client_options={'api_endpoint': endpoint})
+                else:
+                    genai.configure(api_key=api_key)
+                GeminiClientRegistry._configured_api_key = api_key
+
+            model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+            # Pin the current client so a later configure() for another key doesn't affect this model
+            model._client = genai_client.get_default_generative_client()
+
+            semaphore = entry[2] if entry else threading.BoundedSemaphore(
+                getattr(settings, 'AI_MAX_CONCURRENT_REQUESTS_PER_MODEL', 8)
+            )
+            GeminiClientRegistry._clients[model_config.pk] = (version, model, semaphore)
+            return model, semaphore
+
+    @staticmethod
+    def invalidate(config_id=None):
+        with GeminiClientRegistry._lock:
+            if config_id is None:
+                GeminiClientRegistry._clients.clear()
+            else:
+                GeminiClientRegistry._clients.pop(config_id, None)
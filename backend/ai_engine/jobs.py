@@ -0,0 +1,337 @@
+import logging
+from datetime import timedelta
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import AIJob
+
+logger = logging.getLogger(__name__)
+
+# WELLBEING crisis checks must never wait behind eLibrary summaries
+DEFAULT_LANES = {
+    'WELLBEING': AIJob.Lane.CRITICAL,
+    'SOCIAL': AIJob.Lane.HIGH,
+    'CLASSROOM': AIJob.Lane.DEFAULT,
+    'ANALYTICS': AIJob.Lane.LOW,
+    'ELIBRARY': AIJob.Lane.LOW,
+}
+
+# AIService methods that may be run as jobs
+JOB_METHODS = {
+    'analyze_toxicity', 'analyze_sentiment', 'generate_recommendations', 'summarize_content',
+    'extract_keywords', 'score_difficulty', 'answer_question', 'detect_crisis_indicators',
+    'analyze_assignment_quality', 'provide_submission_feedback', 'detect_plagiarism_risk',
+    'generate_quiz_questions', 'analyze_student_engagement',
+}
+
+# Single-text methods whose jobs are coalesced into one multi-item prompt
+BATCH_METHODS = {
+    'analyze_toxicity': 'analyze_toxicity_batch',
+    'analyze_sentiment': 'analyze_sentiment_batch',
+}
+
+
+class AIJobQueue:
+    """
+    Durable queue for AIService calls. Jobs are stored in the database and executed by
+    Celery workers on per-lane queues, so request latency is independent of model latency.
+    """
+
+    @staticmethod
+    def lane_for(target_app):
+        """Priority lane for a target app"""
+        lanes = getattr(settings, 'AI_JOB_LANES', DEFAULT_LANES)
+        return lanes.get(target_app, AIJob.Lane.DEFAULT)
+
+    @staticmethod
+    def queue_name(lane):
+        """Celery queue consumed by the workers of a lane"""
+        return f"ai_{lane.lower()}"
+
+    @staticmethod
+    def enqueue(method, params, target_app, requesting_user=None, target=None, callback='',
+                lane=None, dispatch=True):
+        """Persist a job and hand it to a worker once the current transaction commits"""
+        if method not in JOB_METHODS:
+            raise ValueError(f"Unsupported AI job method: {method}")
+
+        target_model = target._meta.label if target is not None else ''
+        target_id = target.pk if target is not None else None
+
+        # Collapse repeated saves of the same object into the pending job
+        if target is not None:
+            pending = AIJob.objects.filter(
+                method=method,
+                target_model=target_model,
+                target_id=target_id,
+                status=AIJob.Status.PENDING
+            ).first()
+            if pending:
+                pending.params = params
+                pending.save(update_fields=['params'])
+                return pending
+
+        job = AIJob.objects.create(
+            method=method,
+            params=params,
+            target_app=target_app,
+            lane=lane or AIJobQueue.lane_for(target_app),
+            requesting_user=requesting_user,
+            target_model=target_model,
+            target_id=target_id,
+            callback=callback,
+            max_attempts=getattr(settings, 'AI_JOB_MAX_ATTEMPTS', 3)
+        )
+
+        if dispatch:
+            if AIJobQueue.is_batchable(method, params):
+                transaction.on_commit(lambda: AIJobQueue.schedule_batch(method, job.lane))
+            else:
+                transaction.on_commit(lambda: AIJobQueue.dispatch(job.id, job.lane))
+
+        return job
+
+    @staticmethod
+    def is_batchable(method, params):
+        return (
+            getattr(settings, 'AI_BATCH_ENABLED', True)
+            and method in BATCH_METHODS
+            and set(params) == {'text'}
+        )
+
+    @staticmethod
+    def schedule_batch(method, lane):
+        """Flush the method's pending jobs after the batch window, once per window"""
+        from .tasks import flush_ai_batch
+
+        window_seconds = getattr(settings, 'AI_BATCH_WINDOW_MS', 250) / 1000
+        lock_key = f"ai_batch_flush:{method}:{lane}"
+        # The lock must be visible to every web process, or each one schedules its own flush
+        lock_cache = caches[getattr(settings, 'AI_BATCH_LOCK_CACHE', 'ai_responses')]
+        try:
+            # Whole seconds (Redis); flush_batch releases it when it starts
+            if not lock_cache.add(lock_key, True, timeout=int(window_seconds) + 5):
+                # A flush is already scheduled and will pick this job up
+                return
+        except Exception as e:
+            # Cache unavailable - schedule anyway; flushes of an empty queue are cheap
+            logger.warning(f"Could not take AI batch lock for {method}: {str(e)}")
+
+        try:
+            flush_ai_batch.apply_async(
+                args=[method, lane],
+                queue=AIJobQueue.queue_name(lane),
+                countdown=window_seconds
+            )
+        except Exception as e:
+            try:
+                lock_cache.delete(lock_key)
+            except Exception:
+                pass
+            logger.error(f"Could not schedule AI batch flush for {method}: {str(e)}")
+
+    @staticmethod
+    def flush_batch(method, lane, reschedule=True):
+        """
+        Claim up to AI_BATCH_MAX_ITEMS first-attempt jobs of a method and run them as one prompt.
+        Items that fail in the batch are retried individually through run_ai_job.
+        """
+        from .services import AIService
+
+        # Jobs queued from now on schedule the next flush
+        try:
+            caches[getattr(settings, 'AI_BATCH_LOCK_CACHE', 'ai_responses')].delete(f"ai_batch_flush:{method}:{lane}")
+        except Exception as e:
+            logger.warning(f"Could not release AI batch lock for {method}: {str(e)}")
+
+        max_items = getattr(settings, 'AI_BATCH_MAX_ITEMS', 20)
+        pending = AIJob.objects.filter(
+            method=method,
+            lane=lane,
+            status=AIJob.Status.PENDING,
+            attempts=0
+        )
+
+        with transaction.atomic():
+            job_ids = list(
+                pending.select_for_update(skip_locked=True)
+                .order_by('created_at')
+                .values_list('id', flat=True)[:max_items]
+            )
+            AIJob.objects.filter(id__in=job_ids).update(
+                status=AIJob.Status.RUNNING,
+                started_at=timezone.now(),
+                attempts=F('attempts') + 1
+            )
+
+        if not job_ids:
+            return 0
+
+        jobs = list(AIJob.objects.filter(id__in=job_ids).select_related('requesting_user').order_by('created_at'))
+
+        # One prompt per target app, so usage is logged against the app (and users) that asked
+        by_app = {}
+        for job in jobs:
+            by_app.setdefault(job.target_app, []).append(job)
+
+        results = {}
+        for target_app, app_jobs in by_app.items():
+            try:
+                app_results = getattr(AIService, BATCH_METHODS[method])(
+                    [job.params.get('text', '') for job in app_jobs],
+                    target_app=target_app,
+                    requesting_users=[job.requesting_user for job in app_jobs]
+                )
+            except Exception as e:
+                app_results = [{'error': str(e)} for _ in app_jobs]
+            for job, result in zip(app_jobs, app_results):
+                results[job.id] = result
+
+        for job in jobs:
+            result = results[job.id]
+            job = AIJobQueue.complete(job, result)
+            if reschedule and job.status == AIJob.Status.PENDING:
+                AIJobQueue.dispatch(job.id, job.lane, countdown=min(60, 2 ** job.attempts))
+
+        # More arrived than fit in one batch - keep draining
+        if reschedule and pending.exists():
+            from .tasks import flush_ai_batch
+            try:
+                flush_ai_batch.apply_async(args=[method, lane], queue=AIJobQueue.queue_name(lane))
+            except Exception as e:
+                logger.error(f"Could not schedule AI batch flush for {method}: {str(e)}")
+
+        return len(jobs)
+
+    @staticmethod
+    def dispatch(job_id, lane, countdown=0):
+        """Send a job id to the Celery queue of its lane"""
+        from .tasks import run_ai_job
+
+        try:
+            run_ai_job.apply_async(args=[job_id], queue=AIJobQueue.queue_name(lane), countdown=countdown)
+        except Exception as e:
+            # Broker unavailable - the job stays PENDING and requeue_stale picks it up
+            logger.error(f"Could not dispatch AI job {job_id}: {str(e)}")
+            return
+
+        # requeue_stale leaves the job alone until this message is overdue
+        AIJob.objects.filter(id=job_id, status=AIJob.Status.PENDING).update(
+            next_attempt_at=timezone.now() + timedelta(seconds=countdown)
+        )
+
+    @staticmethod
+    def run(job_id):
+        """Execute a job. Only one worker can claim a pending job, so duplicate deliveries are harmless."""
+        claimed = AIJob.objects.filter(id=job_id, status=AIJob.Status.PENDING).update(
+            status=AIJob.Status.RUNNING,
+            started_at=timezone.now(),
+            attempts=F('attempts') + 1
+        )
+        if not claimed:
+            return None
+
+        job = AIJob.objects.select_related('requesting_user').get(id=job_id)
+
+        from .services import AIService
+        try:
+            if job.method not in JOB_METHODS:
+                raise ValueError(f"Unsupported AI job method: {job.method}")
+            method = getattr(AIService, job.method)
+            result = method(requesting_user=job.requesting_user, **job.params)
+        except Exception as e:
+            result = {'error': str(e)}
+
+        return AIJobQueue.complete(job, result)
+
+    @staticmethod
+    def complete(job, result):
+        """Record a job outcome, leaving it PENDING for another attempt on failure"""
+        if isinstance(result, dict) and 'error' in result:
+            job.error_message = str(result['error'])
+            if job.attempts < job.max_attempts:
+                job.status = AIJob.Status.PENDING
+            else:
+                job.status = AIJob.Status.FAILED
+                job.finished_at = timezone.now()
+            job.save(update_fields=['status', 'error_message', 'finished_at'])
+            return job
+
+        job.status = AIJob.Status.SUCCEEDED
+        job.result = result
+        job.error_message = None
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'result', 'error_message', 'finished_at'])
+
+        if job.callback:
+            AIJobQueue.write_back(job)
+
+        return job
+
+    @staticmethod
+    def write_back(job):
+        """Call the job's result hook with the (re-fetched) target object"""
+        try:
+            target = None
+            if job.target_model and job.target_id is not None:
+                model = apps.get_model(job.target_model)
+                target = model.objects.filter(pk=job.target_id).first()
+                if target is None:
+                    # Target deleted while the job was queued
+                    return
+
+            import_string(job.callback)(target, job.result)
+
+        except Exception as e:
+            logger.error(f"Error in write-back for AI job {job.id}: {str(e)}")
+            AIJob.objects.filter(id=job.id).update(error_message=f"Write-back failed: {str(e)}")
+
+    @staticmethod
+    def requeue_stale(pending_after_seconds=120, running_after_seconds=600):
+        """
+        Re-dispatch jobs whose broker message was lost or whose worker died. Only jobs whose
+        last message is overdue are sent again; first-attempt batchable jobs go back through
+        schedule_batch, and jobs that already used up their attempts are failed.
+        """
+        now = timezone.now()
+
+        # A worker that died mid-job (OOM, hard time limit) counts as a failed attempt
+        stale_running = AIJob.objects.filter(
+            status=AIJob.Status.RUNNING,
+            started_at__lt=now - timedelta(seconds=running_after_seconds)
+        )
+        stale_running.filter(attempts__gte=F('max_attempts')).update(
+            status=AIJob.Status.FAILED,
+            error_message='Worker did not finish the job',
+            finished_at=now
+        )
+        stale_running.update(status=AIJob.Status.PENDING, next_attempt_at=None)
+
+        overdue = now - timedelta(seconds=pending_after_seconds)
+        stale_jobs = AIJob.objects.filter(
+            status=AIJob.Status.PENDING
+        ).annotate(
+            due_at=Coalesce('next_attempt_at', 'created_at')
+        ).filter(
+            due_at__lt=overdue
+        ).values_list('id', 'lane', 'method', 'params', 'attempts')
+
+        requeued = 0
+        batches = set()
+        for job_id, lane, method, params, attempts in stale_jobs:
+            if attempts == 0 and AIJobQueue.is_batchable(method, params):
+                batches.add((method, lane))
+            else:
+                AIJobQueue.dispatch(job_id, lane)
+            requeued += 1
+
+        for method, lane in batches:
+            AIJobQueue.schedule_batch(method, lane)
+
+        return requeued
@@ -0,0 +1,143 @@
+import time
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from ai_engine.jobs import AIJobQueue
+from ai_engine.models import AIModelConfig, AIJob
+
+# Methods that can be load-tested with a single text argument, and the config type they use
+LOADTEST_METHODS = {
+    'analyze_toxicity': 'TOXICITY',
+    'analyze_sentiment': 'NLP',
+    'summarize_content': 'SUMMARIZATION',
+}
+
+class Command(BaseCommand):
+    help = 'Load-tests the AI job queue against the fake model backend.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jobs', type=int, default=200, help='Number of jobs to enqueue.')
+        parser.add_argument(
+            '--method',
+            default='analyze_toxicity',
+            choices=sorted(LOADTEST_METHODS),
+            help='AIService method to run.'
+        )
+        parser.add_argument('--target-app', default='SOCIAL', help='Target app (selects the priority lane).')
+        parser.add_argument('--concurrency', type=int, default=8, help='Worker threads for --inline mode.')
+        parser.add_argument(
+            '--inline',
+            action='store_true',
+            help='Run jobs in this process instead of dispatching them to Celery workers.'
+        )
+        parser.add_argument(
+            '--batch',
+            action='store_true',
+            help='In --inline mode, run jobs as batched multi-item prompts.'
+        )
+        parser.add_argument('--timeout', type=int, default=300, help='Seconds to wait for Celery workers.')
+
+    def handle(self, *args, **options):
+        # Never spend real API budget on a load test
+        settings.AI_ENGINE_BACKEND = 'fake'
+
+        method = options['method']
+        total = options['jobs']
+        if total < 1:
+            raise CommandError('--jobs must be at least 1')
+
+        model_type = LOADTEST_METHODS[method]
+        if not AIModelConfig.objects.filter(model_type=model_type, is_active=True).exists():
+            AIModelConfig.objects.create(
+                name=f'Load Test {model_type}',
+                model_type=model_type,
+                provider='fake',
+                api_key_env='AI_LOADTEST_KEY'
+            )
+            self.stdout.write(f"Created fake {model_type} model config")
+
+        self.stdout.write(f"Enqueuing {total} '{method}' jobs...")
+        enqueue_times = []
+        job_ids = []
+        started = time.perf_counter()
+
+        for i in range(total):
+            t0 = time.perf_counter()
+            job = AIJobQueue.enqueue(
+                method,
+                {'text': f'Load test message #{i}: this is a sample post to analyze.'},
+                target_app=options['target_app'],
+                dispatch=not options['inline']
+            )
+            enqueue_times.append((time.perf_counter() - t0) * 1000)
+            job_ids.append(job.id)
+
+        if options['inline'] and options['batch']:
+            lane = AIJobQueue.lane_for(options['target_app'])
+            self._run_inline_batches(method, lane, options['concurrency'])
+            self._run_inline(job_ids, options['concurrency'])
+        elif options['inline']:
+            self._run_inline(job_ids, options['concurrency'])
+        else:
+            self._wait_for_workers(job_ids, options['timeout'])
+
+        elapsed = time.perf_counter() - started
+        self._report(job_ids, enqueue_times, elapsed)
+
+    def _run_inline(self, job_ids, concurrency):
+        # In batch mode this only picks up items that failed inside a batch
+        def work(job_id):
+            try:
+                job = AIJobQueue.run(job_id)
+                # Retry failed attempts immediately - there is no broker to back off on
+                while job and job.status == AIJob.Status.PENDING:
+                    job = AIJobQueue.run(job_id)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(work, job_ids))
+
+    def _run_inline_batches(self, method, lane, concurrency):
+        def work(_):
+            try:
+                while AIJobQueue.flush_batch(method, lane, reschedule=False):
+                    pass
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(work, range(concurrency)))
+
+    def _wait_for_workers(self, job_ids, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            remaining = AIJob.objects.filter(
+                id__in=job_ids,
+                status__in=[AIJob.Status.PENDING, AIJob.Status.RUNNING]
+            ).count()
+            if not remaining:
+                return
+            time.sleep(0.5)
+        self.stdout.write(self.style.WARNING('Timed out waiting for Celery workers'))
+
+    def _report(self, job_ids, enqueue_times, elapsed):
+        jobs = AIJob.objects.filter(id__in=job_ids)
+        succeeded = jobs.filter(status=AIJob.Status.SUCCEEDED).count()
+        failed = jobs.filter(status=AIJob.Status.FAILED).count()
+
+        enqueue_times.sort()
+        p95_index = max(0, int(len(enqueue_times) * 0.95) - 1)
+
+        self.stdout.write("-" * 50)
+        self.stdout.write(f"Enqueue latency p50: {statistics.median(enqueue_times):.2f} ms")
+        self.stdout.write(f"Enqueue latency p95: {enqueue_times[p95_index]:.2f} ms")
+        self.stdout.write(f"Throughput: {succeeded / elapsed:.1f} jobs/s over {elapsed:.2f} s")
+        self.stdout.write(self.style.SUCCESS(f"Succeeded: {succeeded}"))
+        if failed:
+            self.stdout.write(self.style.ERROR(f"Failed: {failed}"))
+        self.stdout.write("-" * 50)
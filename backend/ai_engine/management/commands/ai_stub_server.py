@@ -0,0 +1,79 @@
+import json
+import time
+import random
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+from ai_engine.backends import FakeModelBackend
+
+class Command(BaseCommand):
+    help = (
+        'Runs a local stand-in for the Gemini REST API for timeout, retry and circuit breaker '
+        'testing. Point the app at it with AI_GEMINI_API_ENDPOINT=http://127.0.0.1:<port>.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency-ms', type=int, default=200, help='Delay before every response.')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with HTTP 503.')
+        parser.add_argument('--hang-rate', type=float, default=0.0, help='Fraction of requests that never answer in time.')
+        parser.add_argument('--hang-seconds', type=int, default=120)
+
+    def handle(self, *args, **options):
+        command = self
+
+        class StubHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b'{}')
+
+                if not self.path.split('?')[0].endswith(':generateContent'):
+                    return self._send(404, {'error': {'code': 404, 'message': 'Not found', 'status': 'NOT_FOUND'}})
+
+                roll = random.random()
+                if roll < options['hang_rate']:
+                    time.sleep(options['hang_seconds'])
+                time.sleep(options['latency_ms'] / 1000)
+
+                if roll >= options['hang_rate'] and roll < options['hang_rate'] + options['error_rate']:
+                    return self._send(503, {'error': {'code': 503, 'message': 'Stub overloaded', 'status': 'UNAVAILABLE'}})
+
+                prompt = ''.join(
+                    part.get('text', '')
+                    for content in body.get('contents', [])
+                    for part in content.get('parts', [])
+                )
+                text = FakeModelBackend.generate(prompt, latency_ms=0)
+                self._send(200, {
+                    'candidates': [{
+                        'content': {'parts': [{'text': text}], 'role': 'model'},
+                        'finishReason': 'STOP',
+                        'index': 0,
+                    }],
+                    'usageMetadata': {
+                        'promptTokenCount': max(1, len(prompt) // 4),
+                        'candidatesTokenCount': max(1, len(text) // 4),
+                        'totalTokenCount': max(1, len(prompt) // 4) + max(1, len(text) // 4),
+                    },
+                })
+
+            def _send(self, status, payload):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                command.stdout.write(f"{self.address_string()} - {format % args}")
+
+        server = ThreadingHTTPServer(('127.0.0.1', options['port']), StubHandler)
+        self.stdout.write(self.style.SUCCESS(f"Gemini stub listening on http://127.0.0.1:{options['port']}"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
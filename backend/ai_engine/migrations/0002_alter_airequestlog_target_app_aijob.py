@@ -0,0 +1,50 @@
+# Generated by Django 5.2.7 on 2026-10-17 14:59
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_engine', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='airequestlog',
+            name='target_app',
+            field=models.CharField(choices=[('ELIBRARY', 'eLibrary'), ('SOCIAL', 'Social'), ('WELLBEING', 'Wellbeing'), ('ANALYTICS', 'Analytics'), ('CLASSROOM', 'Classroom')], default='ELIBRARY', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='AIJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(help_text='AIService method to call.', max_length=100)),
+                ('params', models.JSONField(blank=True, default=dict)),
+                ('target_app', models.CharField(choices=[('ELIBRARY', 'eLibrary'), ('SOCIAL', 'Social'), ('WELLBEING', 'Wellbeing'), ('ANALYTICS', 'Analytics'), ('CLASSROOM', 'Classroom')], default='ELIBRARY', max_length=20)),
+                ('lane', models.CharField(choices=[('CRITICAL', 'Critical'), ('HIGH', 'High'), ('DEFAULT', 'Default'), ('LOW', 'Low')], default='DEFAULT', max_length=10)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('RUNNING', 'Running'), ('SUCCEEDED', 'Succeeded'), ('FAILED', 'Failed')], default='PENDING', max_length=10)),
+                ('target_model', models.CharField(blank=True, help_text='Model label, e.g. classroom.Submission.', max_length=100)),
+                ('target_id', models.BigIntegerField(blank=True, null=True)),
+                ('callback', models.CharField(blank=True, help_text='Dotted path called as callback(target, result).', max_length=200)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('error_message', models.TextField(blank=True, null=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('max_attempts', models.IntegerField(default=3)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('requesting_user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ai_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'AI Job',
+                'db_table': 'ai_jobs',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'lane', 'created_at'], name='ai_jobs_status_865df5_idx'), models.Index(fields=['target_model', 'target_id', 'method', 'status'], name='ai_jobs_target__947761_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 15:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_engine', '0002_alter_airequestlog_target_app_aijob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='airequestlog',
+            name='cache_hit',
+            field=models.BooleanField(default=False, help_text='Served from the response cache without a model call.'),
+        ),
+    ]
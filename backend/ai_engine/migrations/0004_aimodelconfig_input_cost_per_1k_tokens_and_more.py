@@ -0,0 +1,49 @@
+# Generated by Django 5.2.7 on 2026-10-17 15:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_engine', '0003_airequestlog_cache_hit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aimodelconfig',
+            name='input_cost_per_1k_tokens',
+            field=models.DecimalField(decimal_places=6, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='aimodelconfig',
+            name='output_cost_per_1k_tokens',
+            field=models.DecimalField(decimal_places=6, default=0, max_digits=10),
+        ),
+        migrations.CreateModel(
+            name='AIUsageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_start', models.DateTimeField()),
+                ('target_app', models.CharField(choices=[('ELIBRARY', 'eLibrary'), ('SOCIAL', 'Social'), ('WELLBEING', 'Wellbeing'), ('ANALYTICS', 'Analytics'), ('CLASSROOM', 'Classroom')], max_length=20)),
+                ('model_type', models.CharField(blank=True, choices=[('NLP', 'Natural Language Processing'), ('TOXICITY', 'Toxicity/Safety Filter'), ('RECOMMENDATION', 'Recommendation Engine'), ('SUMMARIZATION', 'Summarization'), ('QNA', 'Question Answering')], max_length=20)),
+                ('request_count', models.IntegerField(default=0)),
+                ('error_count', models.IntegerField(default=0)),
+                ('cache_hit_count', models.IntegerField(default=0)),
+                ('input_tokens', models.BigIntegerField(default=0)),
+                ('output_tokens', models.BigIntegerField(default=0)),
+                ('cost_usd', models.DecimalField(decimal_places=8, default=0, max_digits=14)),
+                ('latency_count', models.IntegerField(default=0)),
+                ('latency_total_ms', models.BigIntegerField(default=0)),
+                ('latency_histogram', models.JSONField(default=dict, help_text='Bucket upper bound (ms) -> request count.')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'AI Usage Rollup',
+                'db_table': 'ai_usage_rollups',
+                'ordering': ['-bucket_start'],
+                'indexes': [models.Index(fields=['target_app', 'model_type', 'bucket_start'], name='ai_usage_ro_target__e5b7d0_idx')],
+                'unique_together': {('bucket_start', 'target_app', 'model_type')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 15:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_engine', '0004_aimodelconfig_input_cost_per_1k_tokens_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='airequestlog',
+            name='sample_weight',
+            field=models.FloatField(default=1.0, help_text='Number of requests this row stands for when successful calls are sampled.'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.7 on 2026-10-17 15:06
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_engine', '0005_airequestlog_sample_weight'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aimodelconfig',
+            name='timeout_seconds',
+            field=models.FloatField(default=15.0, help_text='Per-request upstream timeout.', validators=[django.core.validators.MinValueValidator(1.0)]),
+        ),
+        migrations.CreateModel(
+            name='AICircuitBreakerState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.CharField(choices=[('CLOSED', 'Closed'), ('OPEN', 'Open'), ('HALF_OPEN', 'Half Open')], default='CLOSED', max_length=10)),
+                ('consecutive_failures', models.IntegerField(default=0)),
+                ('opened_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('model_config', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='circuit_breaker', to='ai_engine.aimodelconfig')),
+            ],
+            options={
+                'verbose_name': 'AI Circuit Breaker',
+                'db_table': 'ai_circuit_breaker_states',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_engine', '0006_aimodelconfig_timeout_seconds_aicircuitbreakerstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aijob',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, help_text='When the last dispatched message is due on a worker.', null=True),
+        ),
+    ]
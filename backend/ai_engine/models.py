@@ -22,6 +22,12 @@ class AIModelConfig(models.Model):
     api_key_env = models.CharField(max_length=50, help_text="Environment variable name for the API Key.")
     temperature = models.FloatField(default=0.7, validators=[MinValueValidator(0.0), MaxValueValidator(1.0)])
     max_tokens = models.IntegerField(default=1024)
+    timeout_seconds = models.FloatField(default=15.0, validators=[MinValueValidator(1.0)], help_text="Per-request upstream timeout.")
+    
+    # Pricing (USD per 1,000 tokens)
+    input_cost_per_1k_tokens = models.DecimalField(max_digits=10, decimal_places=6, default=0)
+    output_cost_per_1k_tokens = models.DecimalField(max_digits=10, decimal_places=6, default=0)
+    
     is_active = models.BooleanField(default=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
@@ -43,6 +49,7 @@ class AIRequestLog(models.Model):
         SOCIAL = 'SOCIAL', 'Social'
         WELLBEING = 'WELLBEING', 'Wellbeing'
         ANALYTICS = 'ANALYTICS', 'Analytics'
+        CLASSROOM = 'CLASSROOM', 'Classroom'
         
     model_config = models.ForeignKey(AIModelConfig, on_delete=models.SET_NULL, null=True, blank=True)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
@@ -60,6 +67,8 @@ class AIRequestLog(models.Model):
     # Status
     was_successful = models.BooleanField(default=False)
     error_message = models.TextField(blank=True, null=True)
+    cache_hit = models.BooleanField(default=False, help_text="Served from the response cache without a model call.")
+    sample_weight = models.FloatField(default=1.0, help_text="Number of requests this row stands for when successful calls are sampled.")
     
     created_at = models.DateTimeField(default=timezone.now)
     
@@ -70,3 +79,120 @@ class AIRequestLog(models.Model):
 
     def __str__(self):
         return f"Log for {self.model_config.name if self.model_config else 'Unknown'} at {self.created_at.strftime('%Y-%m-%d %H:%M')}"
+
+
+class AIJob(models.Model):
+    """
+    Durable queue entry for an AIService call that runs on a Celery worker instead of the request thread.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', 'Pending'
+        RUNNING = 'RUNNING', 'Running'
+        SUCCEEDED = 'SUCCEEDED', 'Succeeded'
+        FAILED = 'FAILED', 'Failed'
+
+    class Lane(models.TextChoices):
+        CRITICAL = 'CRITICAL', 'Critical'
+        HIGH = 'HIGH', 'High'
+        DEFAULT = 'DEFAULT', 'Default'
+        LOW = 'LOW', 'Low'
+
+    method = models.CharField(max_length=100, help_text="AIService method to call.")
+    params = models.JSONField(default=dict, blank=True)
+    target_app = models.CharField(max_length=20, choices=AIRequestLog.TargetApp.choices, default=AIRequestLog.TargetApp.ELIBRARY)
+    lane = models.CharField(max_length=10, choices=Lane.choices, default=Lane.DEFAULT)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    requesting_user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='ai_jobs')
+    
+    # Write-back target and hook
+    target_model = models.CharField(max_length=100, blank=True, help_text="Model label, e.g. classroom.Submission.")
+    target_id = models.BigIntegerField(null=True, blank=True)
+    callback = models.CharField(max_length=200, blank=True, help_text="Dotted path called as callback(target, result).")
+    
+    # Outcome
+    result = models.JSONField(null=True, blank=True)
+    error_message = models.TextField(blank=True, null=True)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    
+    created_at = models.DateTimeField(default=timezone.now)
+    next_attempt_at = models.DateTimeField(null=True, blank=True, help_text="When the last dispatched message is due on a worker.")
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'ai_jobs'
+        ordering = ['-created_at']
+        verbose_name = 'AI Job'
+        indexes = [
+            models.Index(fields=['status', 'lane', 'created_at']),
+            models.Index(fields=['target_model', 'target_id', 'method', 'status']),
+        ]
+
+    def __str__(self):
+        return f"{self.method} [{self.get_status_display()}] ({self.get_lane_display()})"
+
+
+class AIUsageRollup(models.Model):
+    """
+    Hourly aggregate of AIRequestLog rows per target app and model type, used for
+    capacity planning without scanning the raw log.
+    """
+    # Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended
+    LATENCY_BUCKETS_MS = [50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000, 10000, 30000]
+
+    bucket_start = models.DateTimeField()
+    target_app = models.CharField(max_length=20, choices=AIRequestLog.TargetApp.choices)
+    model_type = models.CharField(max_length=20, choices=AIModelConfig.ModelType.choices, blank=True)
+    
+    request_count = models.IntegerField(default=0)
+    error_count = models.IntegerField(default=0)
+    cache_hit_count = models.IntegerField(default=0)
+    input_tokens = models.BigIntegerField(default=0)
+    output_tokens = models.BigIntegerField(default=0)
+    cost_usd = models.DecimalField(max_digits=14, decimal_places=8, default=0)
+    
+    # Latency of successful model calls (cache hits excluded)
+    latency_count = models.IntegerField(default=0)
+    latency_total_ms = models.BigIntegerField(default=0)
+    latency_histogram = models.JSONField(default=dict, help_text="Bucket upper bound (ms) -> request count.")
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'ai_usage_rollups'
+        ordering = ['-bucket_start']
+        verbose_name = 'AI Usage Rollup'
+        unique_together = ['bucket_start', 'target_app', 'model_type']
+        indexes = [
+            models.Index(fields=['target_app', 'model_type', 'bucket_start']),
+        ]
+
+    def __str__(self):
+        return f"{self.target_app}/{self.model_type or '-'} @ {self.bucket_start.strftime('%Y-%m-%d %H:00')}"
+
+
+class AICircuitBreakerState(models.Model):
+    """
+    Last known circuit breaker state per model config, written on every transition.
+    Setting a row back to CLOSED from the admin resets open breakers in all processes.
+    """
+    class State(models.TextChoices):
+        CLOSED = 'CLOSED', 'Closed'
+        OPEN = 'OPEN', 'Open'
+        HALF_OPEN = 'HALF_OPEN', 'Half Open'
+
+    model_config = models.OneToOneField(AIModelConfig, on_delete=models.CASCADE, related_name='circuit_breaker')
+    state = models.CharField(max_length=10, choices=State.choices, default=State.CLOSED)
+    consecutive_failures = models.IntegerField(default=0)
+    opened_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, null=True)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'ai_circuit_breaker_states'
+        verbose_name = 'AI Circuit Breaker'
+
+    def __str__(self):
+        return f"{self.model_config.name}: {self.get_state_display()}"
@@ -0,0 +1,138 @@
+import os
+import zlib
+import base64
+import atexit
+import random
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import AIRequestLog
+
+logger = logging.getLogger(__name__)
+
+COMPRESSED_PREFIX = 'zlib:'
+
+
+def encode_text(text):
+    """Apply AI_LOG_TEXT_MODE ('full', 'truncate' or 'compress') to a prompt/response"""
+    if not text:
+        return text
+
+    mode = getattr(settings, 'AI_LOG_TEXT_MODE', 'full')
+    if mode == 'truncate':
+        max_chars = getattr(settings, 'AI_LOG_MAX_TEXT_CHARS', 2000)
+        return text if len(text) <= max_chars else text[:max_chars] + '…'
+    if mode == 'compress':
+        compressed = zlib.compress(text.encode('utf-8'), 6)
+        return COMPRESSED_PREFIX + base64.b64encode(compressed).decode('ascii')
+    return text
+
+
+def decode_text(value):
+    """Reverse encode_text for stored values (truncated text is returned as-is)"""
+    if value and value.startswith(COMPRESSED_PREFIX):
+        try:
+            return zlib.decompress(base64.b64decode(value[len(COMPRESSED_PREFIX):])).decode('utf-8')
+        except (ValueError, zlib.error):
+            return value
+    return value
+
+
+class BufferedRequestLogger:
+    """
+    Collects AIRequestLog rows in memory and writes them with bulk_create from a
+    background thread, every AI_LOG_FLUSH_SIZE rows or AI_LOG_FLUSH_INTERVAL seconds.
+
+    Successful calls can be sampled (AI_LOG_SUCCESS_SAMPLE_RATE); kept rows carry a
+    sample_weight of 1/rate so usage rollups stay unbiased. Failures are always kept.
+    """
+
+    def __init__(self):
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def log(self, **fields):
+        weight = self._sample_weight(fields)
+        if weight is None:
+            return None
+
+        fields['sample_weight'] = weight
+        fields['prompt_text'] = encode_text(fields.get('prompt_text'))
+        fields['response_text'] = encode_text(fields.get('response_text'))
+
+        if not getattr(settings, 'AI_LOG_BUFFER_ENABLED', True):
+            return AIRequestLog.objects.create(**fields)
+
+        entry = AIRequestLog(**fields)
+        self._ensure_worker()
+
+        with self._lock:
+            self._buffer.append(entry)
+            # DB unreachable for a long time - keep memory bounded by dropping the oldest rows
+            max_buffer = getattr(settings, 'AI_LOG_MAX_BUFFER', 10000)
+            if len(self._buffer) > max_buffer:
+                del self._buffer[:len(self._buffer) - max_buffer]
+            full = len(self._buffer) >= getattr(settings, 'AI_LOG_FLUSH_SIZE', 100)
+
+        if full:
+            self._wakeup.set()
+        return entry
+
+    def flush(self):
+        """Write all buffered rows; returns how many were written"""
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+
+        if not batch:
+            return 0
+
+        try:
+            AIRequestLog.objects.bulk_create(batch, batch_size=500)
+            return len(batch)
+        except Exception as e:
+            logger.error(f"Could not write {len(batch)} AI request logs: {str(e)}")
+            return 0
+
+    def _sample_weight(self, fields):
+        if not fields.get('was_successful', True):
+            return 1.0
+
+        rate = getattr(settings, 'AI_LOG_SUCCESS_SAMPLE_RATE', 1.0)
+        if rate >= 1.0:
+            return 1.0
+        if rate <= 0 or random.random() >= rate:
+            return None
+        return 1.0 / rate
+
+    def _ensure_worker(self):
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None and self._thread.is_alive():
+            return
+
+        with self._lock:
+            if self._pid == pid and self._thread is not None and self._thread.is_alive():
+                return
+            if self._pid != pid:
+                # Forked worker: rows in the inherited buffer belong to the parent process
+                self._buffer = []
+                self._wakeup = threading.Event()
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name='ai-request-log-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(getattr(settings, 'AI_LOG_FLUSH_INTERVAL', 5))
+            self._wakeup.clear()
+            self.flush()
+            close_old_connections()
+
+
+request_logger = BufferedRequestLogger()
+atexit.register(request_logger.flush)
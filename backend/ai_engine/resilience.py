@@ -0,0 +1,204 @@
+import time
+import random
+import logging
+import threading
+
+from django.conf import settings
+from django.utils import timezone
+from google.api_core import exceptions as google_exceptions
+from requests import exceptions as requests_exceptions
+
+from .models import AICircuitBreakerState
+
+logger = logging.getLogger(__name__)
+
+# Upstream errors worth retrying; anything else (bad key, bad request) fails immediately
+RETRYABLE_ERRORS = (
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.RetryError,
+    # REST transport (AI_GEMINI_API_ENDPOINT) surfaces network errors from requests
+    requests_exceptions.Timeout,
+    requests_exceptions.ConnectionError,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class InFlightLimitError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Per-model breaker: opens after AI_BREAKER_FAILURE_THRESHOLD consecutive failures, fails
+    fast for AI_BREAKER_RESET_SECONDS, then lets a single trial call through (half-open).
+    State lives in-process; transitions are mirrored to AICircuitBreakerState for the admin,
+    and an admin reset there closes open breakers in every process.
+    """
+    CLOSED = AICircuitBreakerState.State.CLOSED
+    OPEN = AICircuitBreakerState.State.OPEN
+    HALF_OPEN = AICircuitBreakerState.State.HALF_OPEN
+
+    _breakers = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, model_config):
+        self.model_config_id = model_config.pk
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.last_synced = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_config(cls, model_config):
+        breaker = cls._breakers.get(model_config.pk)
+        if breaker is None:
+            with cls._registry_lock:
+                breaker = cls._breakers.setdefault(model_config.pk, cls(model_config))
+        return breaker
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go through"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+
+            if self.state == self.OPEN:
+                self._sync_admin_reset()
+                if self.state == self.CLOSED:
+                    return
+                reset_seconds = getattr(settings, 'AI_BREAKER_RESET_SECONDS', 30)
+                if time.monotonic() - self.opened_at < reset_seconds:
+                    raise CircuitOpenError(f"Circuit open for model config {self.model_config_id}")
+                self._transition(self.HALF_OPEN)
+
+            # HALF_OPEN: exactly one trial call at a time
+            if self.trial_in_flight:
+                raise CircuitOpenError(f"Circuit half-open for model config {self.model_config_id}")
+            self.trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.trial_in_flight = False
+            self.consecutive_failures = 0
+            if self.state != self.CLOSED:
+                self._transition(self.CLOSED)
+
+    def abandon_trial(self):
+        """The call never reached the upstream; let another caller make the trial"""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_failure(self, error):
+        with self._lock:
+            self.trial_in_flight = False
+            self.consecutive_failures += 1
+            threshold = getattr(settings, 'AI_BREAKER_FAILURE_THRESHOLD', 5)
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= threshold:
+                self.opened_at = time.monotonic()
+                self._transition(self.OPEN, error)
+
+    def _transition(self, state, error=None):
+        self.state = state
+        logger.warning(f"AI circuit breaker for model config {self.model_config_id} is now {state}")
+        try:
+            defaults = {'state': state, 'consecutive_failures': self.consecutive_failures}
+            if state == self.OPEN:
+                defaults['opened_at'] = timezone.now()
+                defaults['last_error'] = str(error)[:1000] if error else None
+            AICircuitBreakerState.objects.update_or_create(
+                model_config_id=self.model_config_id,
+                defaults=defaults
+            )
+        except Exception as e:
+            logger.error(f"Could not persist AI circuit breaker state: {str(e)}")
+
+    def _sync_admin_reset(self):
+        """Close this breaker if an admin reset the persisted state (checked every few seconds)"""
+        now = time.monotonic()
+        if now - self.last_synced < getattr(settings, 'AI_BREAKER_SYNC_SECONDS', 5):
+            return
+        self.last_synced = now
+        try:
+            persisted = AICircuitBreakerState.objects.filter(model_config_id=self.model_config_id).first()
+        except Exception:
+            return
+        if persisted and persisted.state == self.CLOSED:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self.trial_in_flight = False
+
+
+class RetryBudget:
+    """
+    Process-wide retry budget: each request deposits AI_RETRY_BUDGET_RATIO tokens and
+    each retry spends one, plus a small time-based allowance, so retries can never
+    multiply load on an upstream that is already failing.
+    """
+    _lock = threading.Lock()
+    _balance = 0.0
+    _last_refill = time.monotonic()
+
+    @classmethod
+    def record_request(cls):
+        with cls._lock:
+            cls._refill()
+            cls._balance = min(
+                cls._balance + getattr(settings, 'AI_RETRY_BUDGET_RATIO', 0.1),
+                getattr(settings, 'AI_RETRY_BUDGET_MAX', 20)
+            )
+
+    @classmethod
+    def try_spend(cls):
+        with cls._lock:
+            cls._refill()
+            if cls._balance >= 1:
+                cls._balance -= 1
+                return True
+            return False
+
+    @classmethod
+    def _refill(cls):
+        now = time.monotonic()
+        per_second = getattr(settings, 'AI_RETRY_BUDGET_MIN_PER_SECOND', 0.5)
+        cls._balance = min(
+            cls._balance + (now - cls._last_refill) * per_second,
+            getattr(settings, 'AI_RETRY_BUDGET_MAX', 20)
+        )
+        cls._last_refill = now
+
+
+class InFlightLimiter:
+    """Process-wide cap on concurrent upstream calls; callers wait briefly, then fail fast"""
+    _semaphore = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def acquire(cls):
+        if cls._semaphore is None:
+            with cls._lock:
+                if cls._semaphore is None:
+                    cls._semaphore = threading.BoundedSemaphore(getattr(settings, 'AI_MAX_IN_FLIGHT', 32))
+        if not cls._semaphore.acquire(timeout=getattr(settings, 'AI_IN_FLIGHT_WAIT_SECONDS', 0.5)):
+            raise InFlightLimitError("Too many AI requests in flight")
+
+    @classmethod
+    def release(cls):
+        cls._semaphore.release()
+
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter"""
+    base = getattr(settings, 'AI_RETRY_BASE_DELAY', 0.5)
+    cap = getattr(settings, 'AI_RETRY_MAX_DELAY', 4)
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
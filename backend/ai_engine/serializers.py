@@ -1,12 +1,14 @@
 from rest_framework import serializers
-from .models import AIModelConfig, AIRequestLog
+from .models import AIModelConfig, AIRequestLog, AIJob, AIUsageRollup
+from .request_log import decode_text
 
 class AIModelConfigSerializer(serializers.ModelSerializer):
     class Meta:
         model = AIModelConfig
         fields = [
             'id', 'name', 'model_type', 'provider', 'temperature', 
-            'max_tokens', 'is_active', 'created_at', 'updated_at'
+            'max_tokens', 'timeout_seconds', 'input_cost_per_1k_tokens', 'output_cost_per_1k_tokens',
+            'is_active', 'created_at', 'updated_at'
         ]
         read_only_fields = ['created_at', 'updated_at']
         extra_kwargs = {
@@ -23,7 +25,36 @@ class AIRequestLogSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'model_name', 'user_display_name', 'target_app', 'prompt_text', 
             'response_text', 'input_tokens', 'output_tokens', 'cost_usd', 
-            'latency_ms', 'was_successful', 'error_message', 'created_at'
+            'latency_ms', 'was_successful', 'cache_hit', 'sample_weight', 'error_message', 'created_at'
         ]
        
-        read_only_fields = fields
\ No newline at end of file
+        read_only_fields = fields
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Prompts/responses may be stored compressed (AI_LOG_TEXT_MODE = 'compress')
+        data['prompt_text'] = decode_text(data['prompt_text'])
+        data['response_text'] = decode_text(data['response_text'])
+        return data
+
+class AIJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AIJob
+        fields = [
+            'id', 'method', 'target_app', 'lane', 'status', 'target_model', 'target_id',
+            'result', 'error_message', 'attempts', 'max_attempts',
+            'created_at', 'started_at', 'finished_at'
+        ]
+
+        read_only_fields = fields
+
+class AIUsageRollupSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AIUsageRollup
+        fields = [
+            'id', 'bucket_start', 'target_app', 'model_type', 'request_count', 'error_count',
+            'cache_hit_count', 'input_tokens', 'output_tokens', 'cost_usd',
+            'latency_count', 'latency_total_ms', 'latency_histogram'
+        ]
+
+        read_only_fields = fields
@@ -1,9 +1,21 @@
-import os
 import json
+import time
+from decimal import Decimal
 import google.generativeai as genai
+from datetime import timedelta
 from django.conf import settings
+from django.db.models import Sum, Max, Q, F, FloatField
+from django.db.models.functions import TruncHour
 from django.utils import timezone
-from .models import AIModelConfig, AIRequestLog
+from .models import AIRequestLog, AIUsageRollup
+from .backends import FakeModelBackend
+from .cache import AIResponseCache
+from .clients import ModelConfigCache, GeminiClientRegistry
+from .request_log import request_logger
+from .resilience import (
+    CircuitBreaker, CircuitOpenError, InFlightLimiter, InFlightLimitError,
+    RetryBudget, RETRYABLE_ERRORS, backoff_delay
+)
 
 class AIService:
     """
@@ -13,17 +25,14 @@ class AIService:
     @staticmethod
     def get_model_config(model_type):
         """Get active model configuration for a specific type"""
-        try:
-            return AIModelConfig.objects.get(model_type=model_type, is_active=True)
-        except AIModelConfig.DoesNotExist:
-            return None
+        return ModelConfigCache.get(model_type)
     
     @staticmethod
     def log_request(model_config, requesting_user, target_app, prompt, response=None, 
                    input_tokens=0, output_tokens=0, cost=0.0, latency=0, 
-                   was_successful=True, error_message=None):
-        """Log AI request for auditing and analytics"""
-        return AIRequestLog.objects.create(
+                   was_successful=True, error_message=None, cache_hit=False):
+        """Queue an AI request log row for auditing and analytics (written in bulk off the hot path)"""
+        return request_logger.log(
             model_config=model_config,
             user=requesting_user,
             target_app=target_app,
@@ -34,29 +43,89 @@ class AIService:
             cost_usd=cost,
             latency_ms=latency,
             was_successful=was_successful,
-            error_message=error_message
+            error_message=error_message,
+            cache_hit=cache_hit
         )
     
+    @staticmethod
+    def estimate_tokens(text):
+        """Rough token count (~4 characters per token) when the API reports no usage"""
+        return max(1, len(text or '') // 4)
+    
+    @staticmethod
+    def calculate_cost(model_config, input_tokens, output_tokens):
+        """Cost in USD from the config's per-1k-token pricing"""
+        return (
+            Decimal(input_tokens) * model_config.input_cost_per_1k_tokens
+            + Decimal(output_tokens) * model_config.output_cost_per_1k_tokens
+        ) / 1000
+    
+    @staticmethod
+    def generate_with_retries(model_config, prompt):
+        """
+        Call the model with a per-config timeout, retrying transient upstream errors with
+        exponential backoff while the retry budget allows. Raises on final failure.
+        """
+        model, semaphore = GeminiClientRegistry.get(model_config)
+        max_retries = getattr(settings, 'AI_MAX_RETRIES', 2)
+        RetryBudget.record_request()
+        
+        attempt = 0
+        while True:
+            acquire_timeout = getattr(settings, 'AI_CLIENT_ACQUIRE_TIMEOUT', 2)
+            if not semaphore.acquire(timeout=acquire_timeout):
+                raise InFlightLimitError(f"Too many concurrent requests to {model_config.name}")
+            try:
+                return model.generate_content(
+                    prompt,
+                    generation_config=genai.types.GenerationConfig(
+                        temperature=model_config.temperature,
+                        max_output_tokens=model_config.max_tokens
+                    ),
+                    # retry=None: the client library would otherwise retry 503s for up to 10 minutes
+                    request_options={'timeout': model_config.timeout_seconds, 'retry': None}
+                )
+            except RETRYABLE_ERRORS:
+                if attempt >= max_retries or not RetryBudget.try_spend():
+                    raise
+            finally:
+                semaphore.release()
+            
+            attempt += 1
+            time.sleep(backoff_delay(attempt))
+    
     @staticmethod
     def call_gemini_api(model_config, prompt, requesting_user=None, target_app='SOCIAL'):
-        """Call Google Gemini API"""
+        """Call Google Gemini API (fails fast with a degraded result when the upstream is unhealthy)"""
+        breaker = CircuitBreaker.for_config(model_config)
         try:
-            api_key = os.getenv(model_config.api_key_env)
-            if not api_key:
-                raise ValueError(f"API key not found for environment variable: {model_config.api_key_env}")
-            
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel('models/gemini-2.0-flash')
-            
-            start_time = timezone.now()
-            response = model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=model_config.temperature,
-                    max_output_tokens=model_config.max_tokens
-                )
+            # Limiter first: claiming the half-open trial and then being rejected would leave
+            # the trial unfinished and the breaker failing fast for good
+            InFlightLimiter.acquire()
+            try:
+                breaker.before_call()
+            except CircuitOpenError:
+                InFlightLimiter.release()
+                raise
+        except (CircuitOpenError, InFlightLimitError) as e:
+            AIService.log_request(
+                model_config=model_config,
+                requesting_user=requesting_user,
+                target_app=target_app,
+                prompt=prompt,
+                error_message=str(e),
+                was_successful=False
             )
+            return {'error': str(e), 'degraded': True}
+        
+        try:
+            start_time = timezone.now()
+            try:
+                response = AIService.generate_with_retries(model_config, prompt)
+            finally:
+                InFlightLimiter.release()
             end_time = timezone.now()
+            breaker.record_success()
             
             latency = (end_time - start_time).total_seconds() * 1000
             
@@ -65,6 +134,14 @@ class AIService:
                 'latency_ms': latency
             }
             
+            usage = getattr(response, 'usage_metadata', None)
+            if usage is not None:
+                input_tokens = usage.prompt_token_count or 0
+                output_tokens = usage.candidates_token_count or 0
+            else:
+                input_tokens = AIService.estimate_tokens(prompt)
+                output_tokens = AIService.estimate_tokens(response.text)
+            
             # Log the request
             AIService.log_request(
                 model_config=model_config,
@@ -72,15 +149,59 @@ class AIService:
                 target_app=target_app,
                 prompt=prompt,
                 response=response.text,
-                input_tokens=len(prompt),
-                output_tokens=len(response.text),
+                input_tokens=input_tokens,
+                output_tokens=output_tokens,
                 latency=latency,
-                cost=0.0,  
+                cost=AIService.calculate_cost(model_config, input_tokens, output_tokens),
                 was_successful=True
             )
             
             return result
             
+        except Exception as e:
+            # Local back-pressure says nothing about upstream health
+            if isinstance(e, InFlightLimitError):
+                breaker.abandon_trial()
+            else:
+                breaker.record_failure(e)
+            AIService.log_request(
+                model_config=model_config,
+                requesting_user=requesting_user,
+                target_app=target_app,
+                prompt=prompt,
+                error_message=str(e),
+                was_successful=False
+            )
+            if isinstance(e, InFlightLimitError):
+                return {'error': str(e), 'degraded': True}
+            return {'error': str(e)}
+    
+    @staticmethod
+    def call_fake_api(model_config, prompt, requesting_user=None, target_app='SOCIAL'):
+        """Call the offline fake model backend (load tests and local development)"""
+        try:
+            start_time = timezone.now()
+            text = FakeModelBackend.generate(prompt)
+            latency = (timezone.now() - start_time).total_seconds() * 1000
+            
+            input_tokens = AIService.estimate_tokens(prompt)
+            output_tokens = AIService.estimate_tokens(text)
+            
+            AIService.log_request(
+                model_config=model_config,
+                requesting_user=requesting_user,
+                target_app=target_app,
+                prompt=prompt,
+                response=text,
+                input_tokens=input_tokens,
+                output_tokens=output_tokens,
+                latency=latency,
+                cost=AIService.calculate_cost(model_config, input_tokens, output_tokens),
+                was_successful=True
+            )
+            
+            return {'text': text, 'latency_ms': latency}
+            
         except Exception as e:
             AIService.log_request(
                 model_config=model_config,
@@ -94,7 +215,9 @@ class AIService:
     
     @staticmethod
     def call_external_api(model_config, prompt, requesting_user=None, target_app='SOCIAL'):
-        """Route to the appropriate API - currently only Gemini"""
+        """Route to the appropriate API - Gemini, or the fake backend when enabled"""
+        if FakeModelBackend.is_enabled(model_config):
+            return AIService.call_fake_api(model_config, prompt, requesting_user, target_app)
         return AIService.call_gemini_api(model_config, prompt, requesting_user, target_app)
     
     @staticmethod
@@ -116,6 +239,36 @@ class AIService:
         except json.JSONDecodeError:
             return {'raw_response': api_response.get('text', '')}
     
+    @staticmethod
+    def cached_call(method, model_config, inputs, prompt, requesting_user=None, target_app='SOCIAL'):
+        """Call the model through the response cache; hits are logged with zero latency and cost"""
+        if not AIResponseCache.is_enabled(method):
+            api_response = AIService.call_external_api(model_config, prompt, requesting_user, target_app)
+            return AIService.parse_json_response(api_response)
+        
+        cache_key = AIResponseCache.make_key(method, model_config, inputs)
+        cached = AIResponseCache.get(cache_key)
+        if cached is not None:
+            AIService.log_request(
+                model_config=model_config,
+                requesting_user=requesting_user,
+                target_app=target_app,
+                prompt=prompt,
+                response=json.dumps(cached),
+                was_successful=True,
+                cache_hit=True
+            )
+            return cached
+        
+        api_response = AIService.call_external_api(model_config, prompt, requesting_user, target_app)
+        result = AIService.parse_json_response(api_response)
+        
+        # Only cache well-formed answers
+        if 'error' not in result and 'raw_response' not in result:
+            AIResponseCache.set(cache_key, result, AIResponseCache.ttl_for(method))
+        
+        return result
+    
     @staticmethod
     def analyze_toxicity(text, requesting_user=None):
         """Analyze text for toxic content using Gemini"""
@@ -135,14 +288,14 @@ class AIService:
         Text to analyze: "{text}"
         """
         
-        api_response = AIService.call_external_api(
-            model_config=model_config,
-            prompt=prompt,
+        return AIService.cached_call(
+            'analyze_toxicity',
+            model_config,
+            {'text': text},
+            prompt,
             requesting_user=requesting_user,
             target_app='SOCIAL'
         )
-        
-        return AIService.parse_json_response(api_response)
     
     @staticmethod
     def analyze_sentiment(text, requesting_user=None):
@@ -163,15 +316,146 @@ class AIService:
         Text: "{text}"
         """
         
+        return AIService.cached_call(
+            'analyze_sentiment',
+            model_config,
+            {'text': text},
+            prompt,
+            requesting_user=requesting_user,
+            target_app='WELLBEING'
+        )
+
+    @staticmethod
+    def batched_call(method, model_config, texts, instructions, fields, required_field,
+                     requesting_user=None, target_app='SOCIAL', requesting_users=None):
+        """
+        Score many texts with one structured prompt. Returns one result per text, in order;
+        items the model skipped or mangled get their own {'error': ...} result.
+        requesting_users gives the user of each text when they differ (queued batches).
+        """
+        users = list(requesting_users) if requesting_users is not None else [requesting_user] * len(texts)
+        results = [None] * len(texts)
+        cache_keys = [None] * len(texts)
+        pending = []
+
+        for index, text in enumerate(texts):
+            if AIResponseCache.is_enabled(method):
+                cache_keys[index] = AIResponseCache.make_key(method, model_config, {'text': text})
+                cached = AIResponseCache.get(cache_keys[index])
+                if cached is not None:
+                    AIService.log_request(
+                        model_config=model_config,
+                        requesting_user=users[index],
+                        target_app=target_app,
+                        prompt=text,
+                        response=json.dumps(cached),
+                        was_successful=True,
+                        cache_hit=True
+                    )
+                    results[index] = cached
+                    continue
+            pending.append(index)
+
+        if not pending:
+            return results
+
+        numbered_texts = "\n".join(f"[{index + 1}] {json.dumps(texts[index])}" for index in pending)
+        field_lines = "\n".join(f"        - {field}" for field in fields)
+        prompt = f"""
+        {instructions}
+        Return ONLY a valid JSON object with a single field "results": an array with one object
+        per numbered text, each with these exact fields:
+        - id: the number of the text
+{field_lines}
+
+        Texts:
+{numbered_texts}
+        """
+
+        # The one call is charged to the user of its texts, or to no user if they are mixed
+        pending_user_ids = {getattr(users[index], 'pk', None) for index in pending}
         api_response = AIService.call_external_api(
             model_config=model_config,
             prompt=prompt,
+            requesting_user=users[pending[0]] if len(pending_user_ids) == 1 else None,
+            target_app=target_app
+        )
+        parsed = AIService.parse_json_response(api_response)
+
+        if 'error' in parsed:
+            for index in pending:
+                results[index] = {'error': parsed['error']}
+            return results
+
+        by_id = {}
+        for item in parsed.get('results') or []:
+            try:
+                by_id[int(item.get('id'))] = item
+            except (AttributeError, TypeError, ValueError):
+                continue
+
+        for index in pending:
+            item = by_id.get(index + 1)
+            if not item or required_field not in item:
+                results[index] = {'error': 'No result for this item in batch response'}
+                continue
+            item = {key: value for key, value in item.items() if key != 'id'}
+            if cache_keys[index]:
+                AIResponseCache.set(cache_keys[index], item, AIResponseCache.ttl_for(method))
+            results[index] = item
+
+        return results
+
+    @staticmethod
+    def analyze_toxicity_batch(texts, requesting_user=None, target_app='SOCIAL', requesting_users=None):
+        """Analyze many texts for toxic content in a single Gemini call"""
+        model_config = AIService.get_model_config('TOXICITY')
+        if not model_config:
+            return [{'error': 'No active toxicity model configured'} for _ in texts]
+
+        return AIService.batched_call(
+            'analyze_toxicity',
+            model_config,
+            texts,
+            instructions="Analyze each of these texts for toxic, harmful, or inappropriate content.",
+            fields=[
+                'toxicity_score: number between 0 and 1',
+                'is_toxic: boolean',
+                'categories: array of strings (harassment, hate_speech, violence, etc.)',
+                'confidence: number between 0 and 1',
+                'explanation: brief explanation of the analysis',
+            ],
+            required_field='toxicity_score',
             requesting_user=requesting_user,
-            target_app='WELLBEING'
+            target_app=target_app,
+            requesting_users=requesting_users
         )
-        
-        return AIService.parse_json_response(api_response)
-    
+
+    @staticmethod
+    def analyze_sentiment_batch(texts, requesting_user=None, target_app='WELLBEING', requesting_users=None):
+        """Analyze the sentiment of many texts in a single Gemini call"""
+        model_config = AIService.get_model_config('NLP')
+        if not model_config:
+            return [{'error': 'No active NLP model configured'} for _ in texts]
+
+        return AIService.batched_call(
+            'analyze_sentiment',
+            model_config,
+            texts,
+            instructions="Analyze the sentiment and emotional tone of each of these texts.",
+            fields=[
+                'sentiment_score: number from -1 (very negative) to 1 (very positive)',
+                'primary_emotion: string (happy, sad, angry, anxious, neutral, etc.)',
+                'urgency_level: string (low, medium, high)',
+                'needs_support: boolean',
+                'confidence: number between 0 and 1',
+            ],
+            required_field='sentiment_score',
+            requesting_user=requesting_user,
+            target_app=target_app,
+            requesting_users=requesting_users
+        )
+
     @staticmethod
     def generate_recommendations(user_context, content_type, requesting_user=None):
         """Generate personalized recommendations using Gemini"""
@@ -216,14 +500,64 @@ class AIService:
         Text to summarize: "{text}"
         """
         
-        api_response = AIService.call_external_api(
-            model_config=model_config,
-            prompt=prompt,
+        return AIService.cached_call(
+            'summarize_content',
+            model_config,
+            {'text': text, 'max_length': max_length},
+            prompt,
             requesting_user=requesting_user,
             target_app='ELIBRARY'
         )
+    
+    @staticmethod
+    def extract_keywords(text, requesting_user=None):
+        """Extract educational keywords from content using Gemini"""
+        model_config = AIService.get_model_config('NLP')
+        if not model_config:
+            return {'error': 'No active NLP model configured'}
         
-        return AIService.parse_json_response(api_response)
+        prompt = f"""
+        Extract 5-8 relevant educational keywords from this content.
+        Return ONLY a valid JSON object with these exact fields:
+        - keywords: array of strings (the extracted keywords)
+        
+        Content: "{text}"
+        """
+        
+        return AIService.cached_call(
+            'extract_keywords',
+            model_config,
+            {'text': text},
+            prompt,
+            requesting_user=requesting_user,
+            target_app='ELIBRARY'
+        )
+    
+    @staticmethod
+    def score_difficulty(text, resource_type, difficulty_level, requesting_user=None):
+        """Score the difficulty of an educational resource using Gemini"""
+        model_config = AIService.get_model_config('NLP')
+        if not model_config:
+            return {'error': 'No active NLP model configured'}
+        
+        prompt = f"""
+        Analyze difficulty level of this educational resource for students.
+        Return ONLY a valid JSON object with these exact fields:
+        - difficulty_score: number between 0 and 1
+        
+        Resource: "{text}"
+        Resource Type: {resource_type}
+        Current Level: {difficulty_level}
+        """
+        
+        return AIService.cached_call(
+            'score_difficulty',
+            model_config,
+            {'text': text, 'resource_type': resource_type, 'difficulty_level': difficulty_level},
+            prompt,
+            requesting_user=requesting_user,
+            target_app='ELIBRARY'
+        )
     
     @staticmethod
     def answer_question(question, context, requesting_user=None):
@@ -394,14 +728,14 @@ class AIService:
         Number of Questions: {count}
         """
         
-        api_response = AIService.call_external_api(
-            model_config=model_config,
-            prompt=prompt,
+        return AIService.cached_call(
+            'generate_quiz_questions',
+            model_config,
+            {'topic': topic, 'difficulty': difficulty, 'count': count},
+            prompt,
             requesting_user=requesting_user,
             target_app='CLASSROOM'
         )
-        
-        return AIService.parse_json_response(api_response)
 
     @staticmethod
     def analyze_student_engagement(student_data, activity_logs, requesting_user=None):
@@ -431,4 +765,148 @@ class AIService:
             target_app='CLASSROOM'
         )
         
-        return AIService.parse_json_response(api_response)
\ No newline at end of file
+        return AIService.parse_json_response(api_response)
+
+
+class AIUsageService:
+    """
+    Hourly usage rollups and latency percentiles built from AIRequestLog.
+    """
+    
+    @staticmethod
+    def histogram_key(upper_bound):
+        return str(upper_bound) if upper_bound is not None else 'inf'
+    
+    @staticmethod
+    def rollup_usage(backfill_hours=24 * 7):
+        """
+        Aggregate request logs into AIUsageRollup rows. Only the buckets since the latest
+        rollup (re-doing the last one, which may have been partial) are recomputed.
+        """
+        latest_bucket = AIUsageRollup.objects.aggregate(latest=Max('bucket_start'))['latest']
+        if latest_bucket:
+            since = latest_bucket - timedelta(hours=1)
+        else:
+            since = (timezone.now() - timedelta(hours=backfill_hours)).replace(minute=0, second=0, microsecond=0)
+        
+        timed = Q(was_successful=True, cache_hit=False)
+        bounds = AIUsageRollup.LATENCY_BUCKETS_MS + [None]
+        
+        # Sampled rows stand for 1/rate requests, so every count is a sum of sample weights
+        histogram_aggregates = {}
+        lower = None
+        for index, upper in enumerate(bounds):
+            condition = timed
+            if lower is not None:
+                condition &= Q(latency_ms__gt=lower)
+            if upper is not None:
+                condition &= Q(latency_ms__lte=upper)
+            histogram_aggregates[f'latency_bucket_{index}'] = Sum('sample_weight', filter=condition)
+            lower = upper
+        
+        rows = AIRequestLog.objects.filter(
+            created_at__gte=since
+        ).annotate(
+            bucket=TruncHour('created_at')
+        ).values(
+            'bucket', 'target_app', 'model_config__model_type'
+        ).annotate(
+            request_count=Sum('sample_weight'),
+            error_count=Sum('sample_weight', filter=Q(was_successful=False)),
+            cache_hit_count=Sum('sample_weight', filter=Q(cache_hit=True)),
+            total_input_tokens=Sum(F('input_tokens') * F('sample_weight'), output_field=FloatField()),
+            total_output_tokens=Sum(F('output_tokens') * F('sample_weight'), output_field=FloatField()),
+            total_cost=Sum(F('cost_usd') * F('sample_weight'), output_field=FloatField()),
+            latency_count=Sum('sample_weight', filter=timed),
+            latency_total_ms=Sum(F('latency_ms') * F('sample_weight'), filter=timed, output_field=FloatField()),
+            **histogram_aggregates
+        ).order_by()
+        
+        updated = 0
+        for row in rows:
+            histogram = {
+                AIUsageService.histogram_key(upper): round(row[f'latency_bucket_{index}'] or 0)
+                for index, upper in enumerate(bounds)
+            }
+            AIUsageRollup.objects.update_or_create(
+                bucket_start=row['bucket'],
+                target_app=row['target_app'],
+                model_type=row['model_config__model_type'] or '',
+                defaults={
+                    'request_count': round(row['request_count'] or 0),
+                    'error_count': round(row['error_count'] or 0),
+                    'cache_hit_count': round(row['cache_hit_count'] or 0),
+                    'input_tokens': round(row['total_input_tokens'] or 0),
+                    'output_tokens': round(row['total_output_tokens'] or 0),
+                    'cost_usd': Decimal(str(round(row['total_cost'] or 0, 8))),
+                    'latency_count': round(row['latency_count'] or 0),
+                    'latency_total_ms': round(row['latency_total_ms'] or 0),
+                    'latency_histogram': histogram,
+                }
+            )
+            updated += 1
+        
+        return updated
+    
+    @staticmethod
+    def latency_percentiles(histogram, percentiles=(50, 95, 99)):
+        """Percentiles (as bucket upper bounds, in ms) from a latency histogram"""
+        bounds = AIUsageRollup.LATENCY_BUCKETS_MS + [None]
+        total = sum(histogram.get(AIUsageService.histogram_key(upper), 0) for upper in bounds)
+        result = {}
+        for percentile in percentiles:
+            if not total:
+                result[f'p{percentile}'] = None
+                continue
+            threshold = total * percentile / 100
+            cumulative = 0
+            for upper in bounds:
+                cumulative += histogram.get(AIUsageService.histogram_key(upper), 0)
+                if cumulative >= threshold:
+                    # Open-ended last bucket is reported as its lower bound
+                    result[f'p{percentile}'] = upper if upper is not None else AIUsageRollup.LATENCY_BUCKETS_MS[-1]
+                    break
+        return result
+    
+    @staticmethod
+    def usage_summary(start, end=None, target_app=None, model_type=None):
+        """Merge rollup buckets in a time range, grouped by target app and model type"""
+        rollups = AIUsageRollup.objects.filter(bucket_start__gte=start)
+        if end:
+            rollups = rollups.filter(bucket_start__lt=end)
+        if target_app:
+            rollups = rollups.filter(target_app=target_app)
+        if model_type:
+            rollups = rollups.filter(model_type=model_type)
+        
+        groups = {}
+        for rollup in rollups.order_by():
+            group = groups.setdefault((rollup.target_app, rollup.model_type), {
+                'target_app': rollup.target_app,
+                'model_type': rollup.model_type,
+                'request_count': 0,
+                'error_count': 0,
+                'cache_hit_count': 0,
+                'input_tokens': 0,
+                'output_tokens': 0,
+                'cost_usd': Decimal(0),
+                'latency_count': 0,
+                'latency_total_ms': 0,
+                'latency_histogram': {},
+            })
+            for field in ['request_count', 'error_count', 'cache_hit_count', 'input_tokens',
+                          'output_tokens', 'cost_usd', 'latency_count', 'latency_total_ms']:
+                group[field] += getattr(rollup, field)
+            for bucket, count in rollup.latency_histogram.items():
+                group['latency_histogram'][bucket] = group['latency_histogram'].get(bucket, 0) + count
+        
+        summary = []
+        for group in groups.values():
+            group['avg_latency_ms'] = (
+                group['latency_total_ms'] / group['latency_count'] if group['latency_count'] else None
+            )
+            group.update(AIUsageService.latency_percentiles(group['latency_histogram']))
+            group['cost_usd'] = str(group['cost_usd'])
+            summary.append(group)
+        
+        return sorted(summary, key=lambda g: (g['target_app'], g['model_type']))
@@ -0,0 +1,13 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import AIModelConfig
+from .clients import ModelConfigCache, GeminiClientRegistry
+
+@receiver(post_save, sender=AIModelConfig)
+@receiver(post_delete, sender=AIModelConfig)
+def invalidate_model_config(sender, instance, **kwargs):
+    """Drop cached configs and clients when a model configuration changes"""
+    # A config can move between types or be (de)activated, so clear every type
+    ModelConfigCache.invalidate()
+    GeminiClientRegistry.invalidate(instance.pk)
@@ -0,0 +1,31 @@
+from celery import shared_task
+
+from .jobs import AIJobQueue
+from .models import AIJob
+from .services import AIUsageService
+
+@shared_task(acks_late=True)
+def run_ai_job(job_id):
+    """Task to execute a queued AI job, retrying with exponential backoff"""
+    job = AIJobQueue.run(job_id)
+    if job and job.status == AIJob.Status.PENDING:
+        AIJobQueue.dispatch(job.id, job.lane, countdown=min(60, 2 ** job.attempts))
+    return job.status if job else None
+
+@shared_task(acks_late=True)
+def flush_ai_batch(method, lane):
+    """Task to run the pending jobs of one method as a single batched prompt"""
+    flushed = AIJobQueue.flush_batch(method, lane)
+    return f"Flushed {flushed} {method} jobs"
+
+@shared_task
+def requeue_stale_ai_jobs():
+    """Task to re-dispatch AI jobs lost by the broker or a crashed worker"""
+    requeued = AIJobQueue.requeue_stale()
+    return f"Requeued {requeued} AI jobs"
+
+@shared_task
+def rollup_ai_usage():
+    """Task to refresh the hourly AI usage rollups"""
+    updated = AIUsageService.rollup_usage()
+    return f"Updated {updated} AI usage buckets"
@@ -7,6 +7,8 @@ app_name = 'ai_engine'
 router = DefaultRouter()
 router.register(r'configs', views.AIModelConfigViewSet)
 router.register(r'logs', views.AIRequestLogViewSet)
+router.register(r'jobs', views.AIJobViewSet)
+router.register(r'usage', views.AIUsageRollupViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
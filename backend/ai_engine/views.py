@@ -1,8 +1,13 @@
+from datetime import timedelta
+from django.utils import timezone
 from rest_framework import viewsets, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from .models import AIModelConfig, AIRequestLog
-from .serializers import AIModelConfigSerializer, AIRequestLogSerializer
+from .models import AIModelConfig, AIRequestLog, AIJob, AIUsageRollup
+from .serializers import (
+    AIModelConfigSerializer, AIRequestLogSerializer, AIJobSerializer, AIUsageRollupSerializer
+)
+from .services import AIUsageService
 from users.permissions import IsSchoolAdmin 
 
 class AIModelConfigViewSet(viewsets.ModelViewSet):
@@ -30,8 +35,60 @@ class AIRequestLogViewSet(viewsets.ReadOnlyModelViewSet):
     # Only Admins/School Admins can view logs
     permission_classes = [permissions.IsAuthenticated, IsSchoolAdmin] 
     
-    filter_fields = ['model_config__model_type', 'target_app', 'was_successful']
+    filter_fields = ['model_config__model_type', 'target_app', 'was_successful', 'cache_hit']
     search_fields = ['prompt_text', 'error_message']
 
     def get_queryset(self):
-        return AIRequestLog.objects.all()
\ No newline at end of file
+        return AIRequestLog.objects.all()
+
+class AIJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint for monitoring queued AI jobs (Read-only). Restricted to Admins.
+    """
+    queryset = AIJob.objects.all()
+    serializer_class = AIJobSerializer
+    permission_classes = [permissions.IsAuthenticated, IsSchoolAdmin]
+
+    filter_fields = ['status', 'lane', 'target_app', 'method']
+
+    def get_queryset(self):
+        queryset = AIJob.objects.all()
+        status = self.request.query_params.get('status')
+        if status:
+            queryset = queryset.filter(status=status.upper())
+        return queryset
+
+class AIUsageRollupViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint for hourly AI usage rollups (tokens, cost, latency). Restricted to Admins.
+    """
+    queryset = AIUsageRollup.objects.all()
+    serializer_class = AIUsageRollupSerializer
+    permission_classes = [permissions.IsAuthenticated, IsSchoolAdmin]
+
+    def get_queryset(self):
+        queryset = AIUsageRollup.objects.filter(bucket_start__gte=self._since())
+        target_app = self.request.query_params.get('target_app')
+        model_type = self.request.query_params.get('model_type')
+        if target_app:
+            queryset = queryset.filter(target_app=target_app)
+        if model_type:
+            queryset = queryset.filter(model_type=model_type)
+        return queryset
+
+    def _since(self):
+        try:
+            hours = int(self.request.query_params.get('hours', 24))
+        except ValueError:
+            hours = 24
+        return timezone.now() - timedelta(hours=max(1, min(hours, 24 * 90)))
+
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        """Totals and p50/p95/p99 latency per target app and model type"""
+        summary = AIUsageService.usage_summary(
+            start=self._since(),
+            target_app=request.query_params.get('target_app'),
+            model_type=request.query_params.get('model_type')
+        )
+        return Response(summary)
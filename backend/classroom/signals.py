@@ -1,7 +1,7 @@
 from django.db.models.signals import post_save, pre_save, m2m_changed
 from django.dispatch import receiver
 from django.db import transaction
-from ai_engine.services import AIService
+from ai_engine.jobs import AIJobQueue
 from .models import Classroom, Assignment, Submission, Enrollment, StudentProgress, ClassPost, Comment
 from .tasks import send_assignment_notification, send_grade_notification, update_classroom_analytics
 
@@ -70,84 +70,73 @@ def create_student_progress(sender, instance, created, **kwargs):
 
 @receiver(post_save, sender=Assignment)
 def analyze_assignment_quality(sender, instance, created, **kwargs):
-    """AI analysis when new assignment is created"""
+    """Queue AI analysis when new assignment is created"""
     if created and instance.description and instance.status == 'PUBLISHED':
-        try:
-            # Prevent recursive signal triggering
-            if hasattr(instance, '_ai_processing'):
-                return
-            
-            instance._ai_processing = True
-            
-            # Call AI engine for assignment quality analysis
-            quality_result = AIService.analyze_assignment_quality(
-                assignment_title=instance.title,
-                assignment_description=instance.description,
-                rubric=instance.rubric or "Standard educational rubric",
-                requesting_user=instance.created_by
-            )
-            
-            if 'error' not in quality_result:
-                # Update assignment with AI insights (without triggering save signal)
-                Assignment.objects.filter(id=instance.id).update(
-                    ai_clarity_score=quality_result.get('clarity_score', 0),
-                    ai_difficulty_level=quality_result.get('difficulty_level', 'medium'),
-                    ai_suggestions=quality_result.get('suggested_improvements', [])
-                )
-                print(f"✅ Assignment analyzed: {instance.title} - Clarity: {quality_result.get('clarity_score', 0)}")
-                
-        except Exception as e:
-            print(f"❌ Error analyzing assignment: {e}")
-        finally:
-            # Clean up flag
-            if hasattr(instance, '_ai_processing'):
-                delattr(instance, '_ai_processing')
+        AIJobQueue.enqueue(
+            'analyze_assignment_quality',
+            {
+                'assignment_title': instance.title,
+                'assignment_description': instance.description,
+                'rubric': instance.rubric or "Standard educational rubric",
+            },
+            target_app='CLASSROOM',
+            requesting_user=instance.created_by,
+            target=instance,
+            callback='classroom.signals.apply_assignment_quality'
+        )
+
+def apply_assignment_quality(assignment, quality_result):
+    """Write AI assignment insights back (without triggering save signal)"""
+    Assignment.objects.filter(id=assignment.id).update(
+        ai_clarity_score=quality_result.get('clarity_score', 0),
+        ai_difficulty_level=quality_result.get('difficulty_level', 'medium'),
+        ai_suggestions=quality_result.get('suggested_improvements', [])
+    )
+    print(f"✅ Assignment analyzed: {assignment.title} - Clarity: {quality_result.get('clarity_score', 0)}")
 
 @receiver(post_save, sender=Submission)
 def handle_submission_ai_feedback(sender, instance, created, **kwargs):
-    """AI feedback when submission is created or updated"""
+    """Queue AI feedback and plagiarism analysis when submission is created or updated"""
     if instance.content and instance.status == 'SUBMITTED':
-        try:
-            # Prevent recursive signal triggering
-            if hasattr(instance, '_ai_processing'):
-                return
-            
-            instance._ai_processing = True
-            
-            # 1. AI Feedback Generation
-            feedback_result = AIService.provide_submission_feedback(
-                submission_content=instance.content,
-                assignment_rubric=instance.assignment.rubric or {},
-                requesting_user=instance.assignment.created_by
-            )
-            
-            # 2. Plagiarism Risk Analysis
-            plagiarism_result = AIService.detect_plagiarism_risk(
-                submission_content=instance.content,
-                assignment_context=f"{instance.assignment.title} - {instance.assignment.description}",
-                requesting_user=instance.assignment.created_by
-            )
-            
-            # Update submission with AI insights
-            update_data = {}
-            
-            if 'error' not in feedback_result:
-                update_data['ai_feedback'] = feedback_result.get('overall_feedback', '')
-                print(f"✅ AI feedback generated for submission #{instance.id}")
-            
-            if 'error' not in plagiarism_result:
-                update_data['similarity_score'] = plagiarism_result.get('originality_score', 1.0)
-                print(f"✅ Plagiarism analysis completed for submission #{instance.id}")
-            
-            if update_data:
-                Submission.objects.filter(id=instance.id).update(**update_data)
-                
-        except Exception as e:
-            print(f"❌ Error processing submission with AI: {e}")
-        finally:
-            # Clean up flag
-            if hasattr(instance, '_ai_processing'):
-                delattr(instance, '_ai_processing')
+        # 1. AI Feedback Generation
+        AIJobQueue.enqueue(
+            'provide_submission_feedback',
+            {
+                'submission_content': instance.content,
+                'assignment_rubric': instance.assignment.rubric or {},
+            },
+            target_app='CLASSROOM',
+            requesting_user=instance.assignment.created_by,
+            target=instance,
+            callback='classroom.signals.apply_submission_feedback'
+        )
+        
+        # 2. Plagiarism Risk Analysis
+        AIJobQueue.enqueue(
+            'detect_plagiarism_risk',
+            {
+                'submission_content': instance.content,
+                'assignment_context': f"{instance.assignment.title} - {instance.assignment.description}",
+            },
+            target_app='CLASSROOM',
+            requesting_user=instance.assignment.created_by,
+            target=instance,
+            callback='classroom.signals.apply_plagiarism_result'
+        )
+
+def apply_submission_feedback(submission, feedback_result):
+    """Write AI feedback back onto the submission"""
+    Submission.objects.filter(id=submission.id).update(
+        ai_feedback=feedback_result.get('overall_feedback', '')
+    )
+    print(f"✅ AI feedback generated for submission #{submission.id}")
+
+def apply_plagiarism_result(submission, plagiarism_result):
+    """Write plagiarism analysis back onto the submission"""
+    Submission.objects.filter(id=submission.id).update(
+        similarity_score=plagiarism_result.get('originality_score', 1.0)
+    )
+    print(f"✅ Plagiarism analysis completed for submission #{submission.id}")
 
 @receiver(post_save, sender=Submission)
 def handle_submission_xp(sender, instance, created, **kwargs):
@@ -181,56 +170,49 @@ def publish_assignment(sender, instance, created, **kwargs):
 
 @receiver(post_save, sender=ClassPost)
 def analyze_class_post_toxicity(sender, instance, created, **kwargs):
-    """AI toxicity analysis for class posts"""
+    """Queue AI toxicity analysis for class posts"""
     if created and instance.content:
-        try:
-            # Use existing toxicity analysis from social app
-            toxicity_result = AIService.analyze_toxicity(
-                instance.content, 
-                instance.author
-            )
-            
-            if 'error' not in toxicity_result:
-                toxicity_score = toxicity_result.get('toxicity_score', 0)
-                
-                # Update post with toxicity score
-                ClassPost.objects.filter(id=instance.id).update(
-                    toxicity_score=toxicity_score
-                )
-                
-                # Auto-moderate high toxicity posts
-                if toxicity_score > 0.7:
-                    ClassPost.objects.filter(id=instance.id).update(is_approved=False)
-                    print(f"🚨 High toxicity class post flagged: Post #{instance.id}")
-                    
-        except Exception as e:
-            print(f"❌ Error analyzing class post toxicity: {e}")
+        AIJobQueue.enqueue(
+            'analyze_toxicity',
+            {'text': instance.content},
+            target_app='CLASSROOM',
+            requesting_user=instance.author,
+            target=instance,
+            callback='classroom.signals.apply_class_post_toxicity'
+        )
+
+def apply_class_post_toxicity(post, toxicity_result):
+    """Update post with toxicity score and auto-moderate high toxicity posts"""
+    toxicity_score = toxicity_result.get('toxicity_score', 0)
+    
+    ClassPost.objects.filter(id=post.id).update(toxicity_score=toxicity_score)
+    
+    if toxicity_score > 0.7:
+        ClassPost.objects.filter(id=post.id).update(is_approved=False)
+        print(f"🚨 High toxicity class post flagged: Post #{post.id}")
 
 @receiver(post_save, sender=Comment)
 def analyze_class_comment_toxicity(sender, instance, created, **kwargs):
-    """AI toxicity analysis for class comments"""
+    """Queue AI toxicity analysis for class comments"""
     if created and instance.content:
-        try:
-            toxicity_result = AIService.analyze_toxicity(
-                instance.content, 
-                instance.author
-            )
-            
-            if 'error' not in toxicity_result:
-                toxicity_score = toxicity_result.get('toxicity_score', 0)
-                
-                # Update comment with toxicity score
-                Comment.objects.filter(id=instance.id).update(
-                    toxicity_score=toxicity_score
-                )
-                
-                # Auto-remove high toxicity comments
-                if toxicity_score > 0.8:
-                    Comment.objects.filter(id=instance.id).update(is_approved=False)
-                    print(f"🚨 High toxicity comment removed: Comment #{instance.id}")
-                    
-        except Exception as e:
-            print(f"❌ Error analyzing class comment toxicity: {e}")
+        AIJobQueue.enqueue(
+            'analyze_toxicity',
+            {'text': instance.content},
+            target_app='CLASSROOM',
+            requesting_user=instance.author,
+            target=instance,
+            callback='classroom.signals.apply_class_comment_toxicity'
+        )
+
+def apply_class_comment_toxicity(comment, toxicity_result):
+    """Update comment with toxicity score and auto-remove high toxicity comments"""
+    toxicity_score = toxicity_result.get('toxicity_score', 0)
+    
+    Comment.objects.filter(id=comment.id).update(toxicity_score=toxicity_score)
+    
+    if toxicity_score > 0.8:
+        Comment.objects.filter(id=comment.id).update(is_approved=False)
+        print(f"🚨 High toxicity comment removed: Comment #{comment.id}")
 
 @receiver(m2m_changed, sender=Classroom.students.through)
 def update_classroom_stats(sender, instance, action, **kwargs):
@@ -0,0 +1,257 @@
+import logging
+import threading
+from collections import defaultdict
+from datetime import timedelta
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+# Interaction type -> LearningResource counter it feeds
+COUNTER_FIELDS = {
+    'VIEW': 'view_count',
+    'DOWNLOAD': 'download_count',
+    'FAVORITE': 'favorite_count',
+}
+
+PENDING_KEY = 'elibrary:counters:pending'
+FLUSHING_KEY = 'elibrary:counters:flushing'
+FLUSH_LOCK_KEY = 'elibrary:counters:flush_lock'
+RECONCILED_AT_KEY = 'elibrary:counters:reconciled_at'
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _redis():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = redis.Redis.from_url(
+                    getattr(settings, 'ELIBRARY_COUNTER_REDIS_URL', 'redis://127.0.0.1:6379/3'),
+                    socket_timeout=getattr(settings, 'ELIBRARY_COUNTER_REDIS_TIMEOUT', 0.2),
+                    socket_connect_timeout=getattr(settings, 'ELIBRARY_COUNTER_REDIS_TIMEOUT', 0.2),
+                    decode_responses=True,
+                )
+    return _client
+
+
+def _parse(entries):
+    # {"<resource id>:<field>": "<delta>"} -> {resource id: {field: delta}}, dropping zero deltas
+    deltas = defaultdict(dict)
+    for member, value in entries.items():
+        resource_id, field = member.split(':', 1)
+        if int(value):
+            deltas[int(resource_id)][field] = int(value)
+    return dict(deltas)
+
+
+class ResourceCounterService:
+    # Write-behind view/download/favorite counters. An interaction is one HINCRBY on a Redis hash
+    # of pending deltas instead of an UPDATE of the resource row; flush() moves the deltas into the
+    # database with one bulk UPDATE per ELIBRARY_COUNTER_FLUSH_BATCH resources, and reads add the
+    # deltas that are not flushed yet. If Redis is unavailable the delta is written straight to
+    # the row. reconcile() recounts the resources with new interactions since its last run.
+
+    @staticmethod
+    def increment(resource_id, field, amount=1):
+        # Buffers a counter change once the current transaction commits
+        transaction.on_commit(lambda: ResourceCounterService._increment(resource_id, field, amount))
+
+    @staticmethod
+    def _increment(resource_id, field, amount):
+        try:
+            _redis().hincrby(PENDING_KEY, f"{resource_id}:{field}", amount)
+        except redis.RedisError as e:
+            logger.warning(f"Could not buffer {field} for resource {resource_id}, writing through: {str(e)}")
+            ResourceCounterService.apply({resource_id: {field: amount}})
+
+    @staticmethod
+    def apply(deltas):
+        # Adds {resource id: {field: delta}} to the rows, one UPDATE per batch of resources
+        from .models import LearningResource
+
+        batch_size = getattr(settings, 'ELIBRARY_COUNTER_FLUSH_BATCH', 500)
+        resource_ids = sorted(deltas)
+        updated = 0
+        for start in range(0, len(resource_ids), batch_size):
+            batch = resource_ids[start:start + batch_size]
+            changes = {}
+            for field in COUNTER_FIELDS.values():
+                whens = [
+                    When(id=resource_id, then=Value(deltas[resource_id][field]))
+                    for resource_id in batch if deltas[resource_id].get(field)
+                ]
+                if whens:
+                    changes[field] = F(field) + Case(*whens, default=Value(0), output_field=IntegerField())
+            if changes:
+                updated += LearningResource.objects.filter(id__in=batch).update(**changes)
+        return updated
+
+    @staticmethod
+    def pending(resource_ids):
+        # {resource id: {field: delta}} not in the database yet (buffered or being flushed)
+        members = [f"{resource_id}:{field}" for resource_id in resource_ids for field in COUNTER_FIELDS.values()]
+        if not members:
+            return {}
+        try:
+            pipeline = _redis().pipeline(transaction=False)
+            pipeline.hmget(PENDING_KEY, members)
+            pipeline.hmget(FLUSHING_KEY, members)
+            buffered, flushing = pipeline.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Could not read pending resource counters: {str(e)}")
+            return {}
+
+        totals = {}
+        for member, value, in_flight in zip(members, buffered, flushing):
+            total = int(value or 0) + int(in_flight or 0)
+            if total:
+                totals[member] = total
+        return _parse(totals)
+
+    @staticmethod
+    def merge_pending(resources):
+        # Adds the pending deltas to the counters of already loaded resources (one Redis round trip)
+        resources = [resource for resource in resources if not getattr(resource, '_counters_merged', False)]
+        deltas = ResourceCounterService.pending([resource.id for resource in resources])
+        for resource in resources:
+            for field, delta in deltas.get(resource.id, {}).items():
+                setattr(resource, field, getattr(resource, field) + delta)
+            resource._counters_merged = True
+        return resources
+
+    @staticmethod
+    def current(resource, field):
+        # A loaded resource's counter including pending deltas
+        ResourceCounterService.merge_pending([resource])
+        return getattr(resource, field)
+
+    @staticmethod
+    def _lock(client, ttl):
+        # True if this process now holds the flush lock; flush() and reconcile() exclude each other
+        return bool(client.set(FLUSH_LOCK_KEY, '1', nx=True, ex=ttl))
+
+    @staticmethod
+    def _unlock(client):
+        try:
+            client.delete(FLUSH_LOCK_KEY)
+        except redis.RedisError:
+            pass
+
+    @staticmethod
+    def flush():
+        # Moves the buffered deltas into the database; returns how many resources were updated
+        client = _redis()
+        try:
+            if not ResourceCounterService._lock(client, getattr(settings, 'ELIBRARY_COUNTER_FLUSH_LOCK_TTL', 300)):
+                return 0
+        except redis.RedisError as e:
+            logger.warning(f"Could not flush resource counters: {str(e)}")
+            return 0
+        try:
+            return ResourceCounterService._flush_locked(client)
+        finally:
+            ResourceCounterService._unlock(client)
+
+    @staticmethod
+    def _flush_locked(client):
+        # The hash is renamed first, so increments during the flush land in a fresh one
+        try:
+            # A flushing hash left by a crashed run is applied first; reconcile() corrects it if
+            # that run had already written it
+            if not client.exists(FLUSHING_KEY):
+                if not client.exists(PENDING_KEY):
+                    return 0
+                client.rename(PENDING_KEY, FLUSHING_KEY)
+            deltas = _parse(client.hgetall(FLUSHING_KEY))
+            with transaction.atomic():
+                updated = ResourceCounterService.apply(deltas)
+            client.delete(FLUSHING_KEY)
+            return updated
+        except redis.RedisError as e:
+            logger.warning(f"Could not flush resource counters: {str(e)}")
+            return 0
+
+    @staticmethod
+    def counts(interactions):
+        # {resource id: {field: count}} for a queryset of interactions, in one grouped query
+        rows = interactions.order_by().values('resource_id').annotate(**{
+            field: Count('id', filter=Q(interaction_type=interaction_type))
+            for interaction_type, field in COUNTER_FIELDS.items()
+        })
+        return {
+            row['resource_id']: {field: row[field] for field in COUNTER_FIELDS.values()}
+            for row in rows
+        }
+
+    @staticmethod
+    def reconcile():
+        # Recounts the resources with interactions since the last reconcile (every resource on the
+        # first run) and corrects rows that drifted; returns how many rows were corrected.
+        # The flush lock is held for the whole recount: a flush in between would move deltas from
+        # the pending hashes into rows already read, and the correction would count them twice.
+        client = _redis()
+        try:
+            if not ResourceCounterService._lock(client, getattr(settings, 'ELIBRARY_COUNTER_RECONCILE_LOCK_TTL', 60 * 60)):
+                return 0
+        except redis.RedisError as e:
+            # Nothing can be buffered or flushed without Redis, so the recount is safe unlocked
+            logger.warning(f"Could not lock resource counters, reconciling anyway: {str(e)}")
+        try:
+            return ResourceCounterService._reconcile_locked(client)
+        finally:
+            ResourceCounterService._unlock(client)
+
+    @staticmethod
+    def _reconcile_locked(client):
+        from .models import LearningResource, ResourceInteraction
+
+        started = timezone.now()
+        ResourceCounterService._flush_locked(client)
+        try:
+            last_run = client.get(RECONCILED_AT_KEY)
+        except redis.RedisError as e:
+            logger.warning(f"Could not read last counter reconcile, recounting everything: {str(e)}")
+            last_run = None
+        since = parse_datetime(last_run) if last_run else None
+
+        batch_size = getattr(settings, 'ELIBRARY_COUNTER_FLUSH_BATCH', 500)
+        if since is None:
+            resource_ids = list(LearningResource.objects.order_by('id').values_list('id', flat=True))
+        else:
+            # Overlap so interactions committed late in the previous run are looked at again
+            resource_ids = sorted(set(ResourceInteraction.objects.filter(
+                created_at__gte=since - timedelta(hours=1)
+            ).order_by().values_list('resource_id', flat=True)))
+
+        corrected = 0
+        fields = list(COUNTER_FIELDS.values())
+        for start in range(0, len(resource_ids), batch_size):
+            batch = resource_ids[start:start + batch_size]
+            actual = ResourceCounterService.counts(ResourceInteraction.objects.filter(resource_id__in=batch))
+            pending = ResourceCounterService.pending(batch)
+            stale = []
+            for resource_id, *stored in LearningResource.objects.filter(id__in=batch).values_list('id', *fields):
+                # Deltas still buffered will be added by the next flush, so the row must not include them
+                target = {
+                    field: actual.get(resource_id, {}).get(field, 0) - pending.get(resource_id, {}).get(field, 0)
+                    for field in fields
+                }
+                if list(target.values()) != stored:
+                    stale.append(LearningResource(id=resource_id, **target))
+            if stale:
+                LearningResource.objects.bulk_update(stale, fields)
+                corrected += len(stale)
+
+        try:
+            client.set(RECONCILED_AT_KEY, started.isoformat())
+        except redis.RedisError as e:
+            logger.warning(f"Could not store counter reconcile time: {str(e)}")
+        return corrected
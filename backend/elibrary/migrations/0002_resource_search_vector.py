@@ -0,0 +1,50 @@
+# Generated by Django 5.2.7 on 2026-10-17 15:51
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models.functions import Left
+
+
+def build_search_vectors(apps, schema_editor):
+    # Index the existing resources (PostgreSQL only), in batches before the GIN index is built.
+    # The document is spelled out here, as it was when this migration was written, so later changes
+    # to elibrary.search don't change what the migration does (reindex_all rebuilds with current settings)
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    document = (
+        SearchVector('title', weight='A', config='english') +
+        SearchVector('author', 'tags', 'ai_keywords', weight='B', config='english') +
+        SearchVector('description', weight='C', config='english') +
+        SearchVector(Left('content', 100000), weight='D', config='english')
+    )
+    LearningResource = apps.get_model('elibrary', 'LearningResource')
+    ids = list(LearningResource.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(ids), 1000):
+        LearningResource.objects.filter(id__in=ids[start:start + 1000]).update(search_vector=document)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classroom', '0002_assignment_ai_clarity_score_and_more'),
+        ('elibrary', '0001_initial'),
+        ('users', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='learningresource',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(build_search_vectors, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='learningresource',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='resource_search_vector_gin'),
+        ),
+    ]
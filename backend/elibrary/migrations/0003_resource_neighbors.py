@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-17 15:54
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elibrary', '0002_resource_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResourceNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('computed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbor_of', to='elibrary.learningresource')),
+                ('resource', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbors', to='elibrary.learningresource')),
+            ],
+            options={
+                'db_table': 'resource_neighbors',
+                'ordering': ['resource', 'rank'],
+                'constraints': [models.UniqueConstraint(fields=('resource', 'rank'), name='unique_resource_neighbor_rank')],
+            },
+        ),
+    ]
@@ -1,4 +1,6 @@
 from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.utils import timezone
 from django.core.validators import FileExtensionValidator
 from django.db.models import Max
@@ -119,6 +121,9 @@ class LearningResource(models.Model):
     requires_approval = models.BooleanField(default=False)
     is_approved = models.BooleanField(default=True)
     
+    # Search (weighted tsvector maintained by elibrary.search.ResourceSearchIndex)
+    search_vector = SearchVectorField(null=True, editable=False)
+    
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -132,6 +137,7 @@ class LearningResource(models.Model):
             models.Index(fields=['school', 'access_level']),
             models.Index(fields=['created_by', 'is_published']),
             models.Index(fields=['is_featured', 'is_published']),
+            GinIndex(fields=['search_vector'], name='resource_search_vector_gin'),
         ]
     
     def __str__(self):
@@ -303,6 +309,24 @@ class CollectionItem(models.Model):
     def __str__(self):
         return f"{self.collection.name} - {self.resource.title}"
 
+class ResourceNeighbor(models.Model):
+    # Precomputed similar resources (top-K per resource, see elibrary.similarity)
+    resource = models.ForeignKey(LearningResource, on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey(LearningResource, on_delete=models.CASCADE, related_name='neighbor_of')
+    rank = models.PositiveSmallIntegerField()  # 1 = most similar
+    score = models.FloatField()
+    computed_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        db_table = 'resource_neighbors'
+        ordering = ['resource', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['resource', 'rank'], name='unique_resource_neighbor_rank'),
+        ]
+    
+    def __str__(self):
+        return f"{self.resource_id} -> {self.neighbor_id} (#{self.rank})"
+
 class AIRecommendation(models.Model):
     # AI-powered resource recommendations
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ai_recommendations')
@@ -0,0 +1,209 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+# Interactions that change what a user should be recommended
+REFRESH_INTERACTIONS = ('DOWNLOAD', 'COMPLETE', 'FAVORITE')
+
+SIMILAR_PER_RESOURCE = 5
+PROGRESSION_PER_RESOURCE = 3
+PROGRESSION_MIN_PROGRESS = 80
+REFRESH_EXPIRY_DAYS = 30
+
+
+def _window():
+    return getattr(settings, 'ELIBRARY_RECOMMENDATION_REFRESH_WINDOW', 60)
+
+
+def _cache():
+    return caches[getattr(settings, 'ELIBRARY_RECOMMENDATION_REFRESH_CACHE', 'shared')]
+
+
+class RecommendationRefreshQueue:
+    # Event-driven recommendation refresh. ResourceInteraction rows are the event log: saving a
+    # significant interaction only opens a per-user window (one cache add) and, on the first event
+    # of the window, schedules refresh_user_recommendations after ELIBRARY_RECOMMENDATION_REFRESH_WINDOW
+    # seconds. The worker reads the user's interactions of the window and recomputes their
+    # recommendations once, however many events arrived, so the request path never scores anything.
+
+    @staticmethod
+    def pending_key(user_id):
+        return f"elibrary_recommendation_refresh_{user_id}"
+
+    @staticmethod
+    def enqueue(interaction):
+        # Called from the post_save of a ResourceInteraction; the refresh is scheduled after commit
+        if interaction.interaction_type not in REFRESH_INTERACTIONS:
+            return
+        user_id, since = interaction.user_id, interaction.created_at or timezone.now()
+        transaction.on_commit(lambda: RecommendationRefreshQueue.schedule(user_id, since))
+
+    @staticmethod
+    def schedule(user_id, since):
+        # Returns True if a refresh was scheduled, False if one is already pending for the user
+        window = _window()
+        key = RecommendationRefreshQueue.pending_key(user_id)
+        # The key outlives the countdown so a slow worker doesn't let a second refresh in
+        try:
+            if not _cache().add(key, since.isoformat(), timeout=window * 2 + 60):
+                return False
+        except Exception as e:
+            # Cache unavailable - refresh without coalescing; the upserts are idempotent
+            logger.warning(f"Could not open recommendation refresh window for user {user_id}: {str(e)}")
+
+        from .tasks import refresh_user_recommendations
+        try:
+            refresh_user_recommendations.apply_async(args=[user_id, since.isoformat()], countdown=window)
+        except Exception as e:
+            # Broker unavailable - let the next interaction try again; the nightly batch covers the gap
+            RecommendationRefreshQueue.close(user_id)
+            logger.error(f"Could not schedule recommendation refresh for user {user_id}: {str(e)}")
+            return False
+        return True
+
+    @staticmethod
+    def close(user_id):
+        try:
+            _cache().delete(RecommendationRefreshQueue.pending_key(user_id))
+        except Exception as e:
+            logger.warning(f"Could not close recommendation refresh window for user {user_id}: {str(e)}")
+
+    @staticmethod
+    def refresh(user_id, since):
+        # Recomputes one user's recommendations from the interactions since `since` (ISO string);
+        # returns how many recommendations were stored
+        from users.models import User
+        from .models import ResourceInteraction
+        from .recommendations import RecommendationBatchService
+
+        # Events from now on open a new window; those already saved are read below
+        RecommendationRefreshQueue.close(user_id)
+
+        user = User.objects.filter(id=user_id, is_active=True).only('id', 'school_id').first()
+        if user is None:
+            return 0
+
+        # Reach back one window: upserts are idempotent and transactions may commit out of order
+        since = (parse_datetime(since) if isinstance(since, str) else since) or timezone.now()
+        events = list(ResourceInteraction.objects.filter(
+            user_id=user_id,
+            interaction_type__in=REFRESH_INTERACTIONS,
+            created_at__gte=since - timedelta(seconds=_window())
+        ).order_by('created_at').values_list('resource_id', 'interaction_type', 'progress_percentage'))
+
+        stored = 0
+        if user.school_id:
+            stored += RecommendationBatchService.generate_for_school(user.school_id, user_ids=[user_id])
+
+        picks = RecommendationRefreshQueue.similar_picks({resource_id for resource_id, _, _ in events})
+        # Progression picks go last so they win over similar ones for the same resource
+        picks.update(RecommendationRefreshQueue.progression_picks({
+            resource_id for resource_id, interaction_type, progress in events
+            if interaction_type == 'COMPLETE' and (progress or 0) >= PROGRESSION_MIN_PROGRESS
+        }))
+        stored += RecommendationRefreshQueue.store(user_id, picks)
+        return stored
+
+    @staticmethod
+    def similar_picks(resource_ids):
+        # {resource id: (score, type, reason)} for the stored neighbours of the interacted resources,
+        # falling back to shared categories for resources without neighbours yet (e.g. just published)
+        from .models import LearningResource, ResourceNeighbor
+
+        if not resource_ids:
+            return {}
+
+        sources = {
+            resource.id: resource
+            for resource in LearningResource.objects.filter(id__in=resource_ids).only(
+                'id', 'resource_type', 'difficulty_level'
+            )
+        }
+        neighbors = ResourceNeighbor.objects.filter(
+            resource_id__in=list(sources),
+            rank__lte=SIMILAR_PER_RESOURCE,
+            neighbor__is_published=True,
+            neighbor__is_approved=True
+        ).order_by('resource_id', 'rank').values_list(
+            'resource_id', 'neighbor_id', 'neighbor__resource_type', 'neighbor__difficulty_level'
+        )
+
+        similar = {resource_id: [] for resource_id in sources}
+        for resource_id, neighbor_id, resource_type, difficulty_level in neighbors:
+            similar[resource_id].append((neighbor_id, resource_type, difficulty_level))
+        for resource_id, found in similar.items():
+            if not found:
+                found.extend(LearningResource.objects.filter(
+                    categories__in=sources[resource_id].categories.all(),
+                    is_published=True,
+                    is_approved=True
+                ).exclude(id=resource_id).distinct().values_list(
+                    'id', 'resource_type', 'difficulty_level'
+                )[:SIMILAR_PER_RESOURCE])
+
+        picks = {}
+        for resource_id, found in similar.items():
+            source = sources[resource_id]
+            for neighbor_id, resource_type, difficulty_level in found:
+                # Same scoring as the per-interaction version: 0.7, +0.1 same type, +0.1 same level
+                confidence = 0.7
+                if resource_type == source.resource_type:
+                    confidence += 0.1
+                if difficulty_level == source.difficulty_level:
+                    confidence += 0.1
+                confidence = min(confidence, 0.95)
+                if neighbor_id not in picks or picks[neighbor_id][0] < confidence:
+                    picks[neighbor_id] = (
+                        confidence, 'PERSONALIZED', "Based on your interest in similar resources"
+                    )
+        return picks
+
+    @staticmethod
+    def progression_picks(resource_ids):
+        # {resource id: (score, type, reason)} of advanced resources in the categories of completed ones
+        from .models import LearningResource
+
+        picks = {}
+        for resource in LearningResource.objects.filter(id__in=resource_ids).only('id', 'title'):
+            next_level_resources = LearningResource.objects.filter(
+                categories__in=resource.categories.all(),
+                difficulty_level='ADVANCED',
+                is_published=True,
+                is_approved=True
+            ).exclude(id=resource.id).values_list('id', flat=True)[:PROGRESSION_PER_RESOURCE]
+            for next_id in next_level_resources:
+                picks[next_id] = (0.8, 'PROGRESSION', f"Next step after completing {resource.title}")
+        return picks
+
+    @staticmethod
+    def store(user_id, picks):
+        # Upserts the picks in one statement (one row per resource, so no row is hit twice)
+        from .models import AIRecommendation
+
+        if not picks:
+            return 0
+        expires_at = timezone.now() + timedelta(days=REFRESH_EXPIRY_DAYS)
+        AIRecommendation.objects.bulk_create(
+            [
+                AIRecommendation(
+                    user_id=user_id,
+                    resource_id=resource_id,
+                    confidence_score=score,
+                    recommendation_type=recommendation_type,
+                    reason=reason,
+                    expires_at=expires_at
+                )
+                for resource_id, (score, recommendation_type, reason) in picks.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['user', 'resource'],
+            update_fields=['confidence_score', 'recommendation_type', 'reason', 'expires_at']
+        )
+        return len(picks)
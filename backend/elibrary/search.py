@@ -0,0 +1,142 @@
+import re
+import logging
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, FloatField, TextField, Value
+from django.db.models.functions import Coalesce, Concat, Left
+from django.utils.html import escape
+
+logger = logging.getLogger(__name__)
+
+# Fields that feed the search document; a save touching one of them reindexes the resource
+SEARCH_FIELDS = ('title', 'author', 'tags', 'ai_keywords', 'description', 'content')
+
+# Rank weight per tsvector class, in Postgres' {D, C, B, A} order:
+# A title, B author/tags/keywords, C description, D content
+RANK_WEIGHTS = [0.1, 0.2, 0.4, 1.0]
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+# ts_headline returns the source text unescaped, so matches are marked with control characters
+# that can't appear in a title or description and turned into <mark> after escaping
+MARK_START = '\x02'
+MARK_STOP = '\x03'
+
+
+def _config():
+    return getattr(settings, 'ELIBRARY_SEARCH_CONFIG', 'english')
+
+
+def _mark(headline):
+    if headline is None:
+        return None
+    return escape(headline).replace(MARK_START, '<mark>').replace(MARK_STOP, '</mark>')
+
+
+class ResourceSearchIndex:
+    # Full-text search over LearningResource on PostgreSQL: a weighted tsvector column
+    # (search_vector) behind a GIN index, kept current per resource on save. Queries match
+    # every term, the last one as a prefix (search-as-you-type), and are ranked by field weight.
+
+    @staticmethod
+    def is_supported():
+        return connection.vendor == 'postgresql'
+
+    @staticmethod
+    def document():
+        # The tsvector expression stored in search_vector; long bodies are cut to
+        # ELIBRARY_SEARCH_CONTENT_CHARS (positions past 16k are not kept by Postgres anyway)
+        config = _config()
+        content_chars = getattr(settings, 'ELIBRARY_SEARCH_CONTENT_CHARS', 100000)
+        return (
+            SearchVector('title', weight='A', config=config) +
+            SearchVector('author', 'tags', 'ai_keywords', weight='B', config=config) +
+            SearchVector('description', weight='C', config=config) +
+            SearchVector(Left('content', content_chars), weight='D', config=config)
+        )
+
+    @staticmethod
+    def reindex(resource_ids):
+        # Recomputes search_vector for the given resources in one UPDATE
+        from .models import LearningResource
+
+        if not ResourceSearchIndex.is_supported() or not resource_ids:
+            return 0
+        try:
+            return LearningResource.objects.filter(id__in=resource_ids).update(
+                search_vector=ResourceSearchIndex.document()
+            )
+        except Exception as e:
+            logger.error(f"Error reindexing resources {list(resource_ids)[:10]}: {str(e)}")
+            return 0
+
+    @staticmethod
+    def reindex_all(batch_size=1000):
+        # Rebuilds the whole index in id-ordered batches (e.g. after changing ELIBRARY_SEARCH_CONFIG)
+        from .models import LearningResource
+
+        ids = list(LearningResource.objects.order_by('id').values_list('id', flat=True))
+        total = 0
+        for start in range(0, len(ids), batch_size):
+            total += ResourceSearchIndex.reindex(ids[start:start + batch_size])
+        return total
+
+    @staticmethod
+    def parse_query(text):
+        # "linear alg" -> SearchQuery for 'linear & alg:*', or None when nothing searchable is left
+        tokens = TOKEN_PATTERN.findall((text or '').lower())[:getattr(settings, 'ELIBRARY_SEARCH_MAX_TERMS', 10)]
+        if not tokens:
+            return None
+        terms = [f"'{token}'" for token in tokens]
+        if len(tokens[-1]) >= getattr(settings, 'ELIBRARY_SEARCH_MIN_PREFIX', 2):
+            # One-letter prefixes would match (and rank) nearly every resource
+            terms[-1] += ':*'
+        return SearchQuery(' & '.join(terms), search_type='raw', config=_config())
+
+    @staticmethod
+    def search(queryset, text):
+        # Filters `queryset` to the resources matching `text` (GIN index) and annotates search_rank
+        query = ResourceSearchIndex.parse_query(text)
+        if query is None:
+            # Nothing searchable (e.g. only punctuation); still annotated so callers can sort by rank
+            return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query, weights=RANK_WEIGHTS, normalization=1)
+        )
+
+    @staticmethod
+    def highlights(resources, text):
+        # {resource id: {'title', 'snippet'}} as escaped HTML with matches wrapped in <mark>, for one
+        # page of results. Headlines are built in a second query over just these rows, as ts_headline re-parses the text.
+        from .models import LearningResource
+
+        query = ResourceSearchIndex.parse_query(text)
+        ids = [resource.id for resource in resources]
+        if query is None or not ids or not ResourceSearchIndex.is_supported():
+            return {}
+
+        config = _config()
+        options = {
+            'start_sel': MARK_START,
+            'stop_sel': MARK_STOP,
+            'config': config,
+        }
+        headline_chars = getattr(settings, 'ELIBRARY_SEARCH_HEADLINE_CHARS', 20000)
+        rows = LearningResource.objects.filter(id__in=ids).annotate(
+            title_highlight=SearchHeadline('title', query, highlight_all=True, **options),
+            snippet=SearchHeadline(
+                Concat('description', Value(' '), Left(Coalesce('content', Value('')), headline_chars),
+                       output_field=TextField()),
+                query, max_words=30, min_words=12, max_fragments=2, fragment_delimiter=' … ', **options
+            )
+        ).values_list('id', 'title_highlight', 'snippet')
+        try:
+            return {
+                resource_id: {'title': _mark(title), 'snippet': _mark(snippet)}
+                for resource_id, title, snippet in rows
+            }
+        except Exception as e:
+            logger.error(f"Error building search highlights: {str(e)}")
+            return {}
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from django.core.validators import FileExtensionValidator
+from django.db import models
 from .models import (
     ResourceCategory, LearningResource, ResourceReview, 
     ResourceInteraction, StudyCollection, CollectionItem,
@@ -7,6 +8,7 @@ from .models import (
 )
 from users.serializers import UserSerializer
 from classroom.serializers import ClassroomSerializer
+from .counters import ResourceCounterService
 
 class ResourceCategorySerializer(serializers.ModelSerializer):
     resource_count = serializers.SerializerMethodField()
@@ -28,6 +30,13 @@ class ResourceCategorySerializer(serializers.ModelSerializer):
         subcategories = obj.subcategories.filter(is_active=True)
         return ResourceCategorySerializer(subcategories, many=True, context=self.context).data
 
+class LearningResourceListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # Pending counter deltas for the whole page in one lookup
+        resources = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        ResourceCounterService.merge_pending(resources)
+        return super().to_representation(resources)
+
 class LearningResourceSerializer(serializers.ModelSerializer):
     created_by_details = UserSerializer(source='created_by', read_only=True)
     categories_details = ResourceCategorySerializer(source='categories', many=True, read_only=True)
@@ -63,6 +72,12 @@ class LearningResourceSerializer(serializers.ModelSerializer):
             'external_url': {'required': False},
             'content': {'required': False}
         }
+        list_serializer_class = LearningResourceListSerializer
+    
+    def to_representation(self, instance):
+        # Counters include increments not flushed to the row yet
+        ResourceCounterService.merge_pending([instance])
+        return super().to_representation(instance)
     
     def get_file_size(self, obj):
         return obj.get_file_size()
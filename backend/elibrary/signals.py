@@ -1,213 +1,118 @@
 from django.db.models.signals import post_save, pre_save, m2m_changed
 from django.dispatch import receiver
 from django.db import transaction
-from django.db.models import Avg, F
+from django.db.models import Avg
 from django.utils import timezone
-from datetime import timedelta
-from ai_engine.services import AIService  # ✅ DIRECT AI IMPORT
+from ai_engine.jobs import AIJobQueue
 
 from .models import (
     LearningResource, ResourceReview, ResourceInteraction, 
-    StudyCollection, ReadingList, AIRecommendation
+    StudyCollection, ReadingList
 )
-from .tasks import process_new_resource
+from .tasks import process_new_resource, refresh_resource_similarity
+from .search import ResourceSearchIndex, SEARCH_FIELDS
+from .refresher import RecommendationRefreshQueue
+from .counters import ResourceCounterService, COUNTER_FIELDS
 
-# ✅ AI PROCESSING FUNCTIONS (Direct approach like social app)
+# ✅ AI PROCESSING FUNCTIONS (queued as AI jobs, results written back by the callbacks below)
 
 def generate_ai_metadata(resource_instance):
-    """Generate AI metadata for resources - DIRECT APPROACH"""
+    """Queue AI metadata generation for resources"""
     if not resource_instance.title and not resource_instance.description:
         return
     
     try:
-        # Prevent recursive processing
-        if getattr(resource_instance, '_ai_processing', False):
-            return
-        
-        resource_instance._ai_processing = True
-        
-        # ✅ AI SUMMARY GENERATION
         content_for_ai = f"Title: {resource_instance.title}. Description: {resource_instance.description}"
         if resource_instance.content:
             content_for_ai += f". Content: {resource_instance.content[:500]}"
         
-        summary_result = AIService.summarize_content(
-            text=content_for_ai,
-            max_length=150,
-            requesting_user=resource_instance.created_by
+        # ✅ AI SUMMARY GENERATION
+        AIJobQueue.enqueue(
+            'summarize_content',
+            {'text': content_for_ai, 'max_length': 150},
+            target_app='ELIBRARY',
+            requesting_user=resource_instance.created_by,
+            target=resource_instance,
+            callback='elibrary.signals.apply_ai_summary'
         )
         
-        if 'error' not in summary_result:
-            summary = summary_result.get('summary', '')
-            # Update without triggering signals
-            LearningResource.objects.filter(id=resource_instance.id).update(
-                ai_summary=summary
-            )
-            print(f"✅ AI Summary generated for: {resource_instance.title}")
-        
-        # ✅ AI KEYWORD EXTRACTION  
-        keyword_prompt = f"""
-        Extract 5-8 relevant educational keywords from this content.
-        Return ONLY a valid JSON with: {{"keywords": ["keyword1", "keyword2"]}}
-        
-        Content: "{content_for_ai}"
-        """
-        
-        model_config = AIService.get_model_config('NLP')
-        if model_config:
-            keyword_response = AIService.call_external_api(
-                model_config=model_config,
-                prompt=keyword_prompt,
-                requesting_user=resource_instance.created_by,
-                target_app='ELIBRARY'
-            )
-            
-            parsed_keywords = AIService.parse_json_response(keyword_response)
-            if 'error' not in parsed_keywords:
-                keywords = parsed_keywords.get('keywords', [])
-                LearningResource.objects.filter(id=resource_instance.id).update(
-                    ai_keywords=keywords
-                )
-                print(f"✅ AI Keywords extracted: {keywords}")
+        # ✅ AI KEYWORD EXTRACTION
+        AIJobQueue.enqueue(
+            'extract_keywords',
+            {'text': content_for_ai},
+            target_app='ELIBRARY',
+            requesting_user=resource_instance.created_by,
+            target=resource_instance,
+            callback='elibrary.signals.apply_ai_keywords'
+        )
         
         # ✅ AI DIFFICULTY SCORING
-        difficulty_prompt = f"""
-        Analyze difficulty level of this educational resource for students.
-        Return ONLY a valid JSON with: {{"difficulty_score": 0.65}}
-        
-        Resource: "{content_for_ai}"
-        Resource Type: {resource_instance.resource_type}
-        Current Level: {resource_instance.difficulty_level}
-        """
-        
-        if model_config:
-            difficulty_response = AIService.call_external_api(
-                model_config=model_config,
-                prompt=difficulty_prompt,
-                requesting_user=resource_instance.created_by,
-                target_app='ELIBRARY'
-            )
-            
-            parsed_difficulty = AIService.parse_json_response(difficulty_response)
-            if 'error' not in parsed_difficulty:
-                difficulty_score = parsed_difficulty.get('difficulty_score', 0.5)
-                LearningResource.objects.filter(id=resource_instance.id).update(
-                    ai_difficulty_score=difficulty_score
-                )
-                print(f"✅ AI Difficulty score: {difficulty_score}")
+        AIJobQueue.enqueue(
+            'score_difficulty',
+            {
+                'text': content_for_ai,
+                'resource_type': resource_instance.resource_type,
+                'difficulty_level': resource_instance.difficulty_level,
+            },
+            target_app='ELIBRARY',
+            requesting_user=resource_instance.created_by,
+            target=resource_instance,
+            callback='elibrary.signals.apply_ai_difficulty'
+        )
                 
     except Exception as e:
-        print(f"❌ Error in AI metadata generation: {e}")
-    finally:
-        if hasattr(resource_instance, '_ai_processing'):
-            delattr(resource_instance, '_ai_processing')
+        print(f"❌ Error queueing AI metadata generation: {e}")
+
+def apply_ai_summary(resource, summary_result):
+    # Update without triggering signals
+    LearningResource.objects.filter(id=resource.id).update(
+        ai_summary=summary_result.get('summary', '')
+    )
+    print(f"✅ AI Summary generated for: {resource.title}")
+
+def apply_ai_keywords(resource, keyword_result):
+    keywords = keyword_result.get('keywords', [])
+    LearningResource.objects.filter(id=resource.id).update(
+        ai_keywords=keywords
+    )
+    ResourceSearchIndex.reindex([resource.id])
+    print(f"✅ AI Keywords extracted: {keywords}")
+
+def apply_ai_difficulty(resource, difficulty_result):
+    difficulty_score = difficulty_result.get('difficulty_score', 0.5)
+    LearningResource.objects.filter(id=resource.id).update(
+        ai_difficulty_score=difficulty_score
+    )
+    print(f"✅ AI Difficulty score: {difficulty_score}")
 
 def analyze_review_with_ai(review_instance):
-    """✅ AI SENTIMENT ANALYSIS FOR REVIEWS"""
+    """✅ QUEUE AI SENTIMENT ANALYSIS FOR REVIEWS"""
     if not review_instance.review_text:
         return
     
     try:
-        if getattr(review_instance, '_ai_processing', False):
-            return
-        
-        review_instance._ai_processing = True
-        
-        sentiment_result = AIService.analyze_sentiment(
-            text=review_instance.review_text,
-            requesting_user=review_instance.user
+        AIJobQueue.enqueue(
+            'analyze_sentiment',
+            {'text': review_instance.review_text},
+            target_app='ELIBRARY',
+            requesting_user=review_instance.user,
+            target=review_instance,
+            callback='elibrary.signals.apply_review_sentiment'
         )
-        
-        if 'error' not in sentiment_result:
-            sentiment_score = sentiment_result.get('sentiment_score', 0)
-            primary_emotion = sentiment_result.get('primary_emotion', 'neutral')
-            needs_support = sentiment_result.get('needs_support', False)
-            
-            print(f"✅ Review sentiment: {sentiment_score} ({primary_emotion})")
-            
-            # Flag concerning reviews for moderation
-            if sentiment_score < -0.3 or needs_support:
-                print(f"🚨 Review may need moderator attention - Score: {sentiment_score}")
-                # You could auto-flag here or notify moderators
-                
     except Exception as e:
-        print(f"❌ Error analyzing review sentiment: {e}")
-    finally:
-        if hasattr(review_instance, '_ai_processing'):
-            delattr(review_instance, '_ai_processing')
+        print(f"❌ Error queueing review sentiment analysis: {e}")
 
-def generate_personalized_recommendations(user, resource_instance=None):
-    """✅ GENERATE AI RECOMMENDATIONS BASED ON USER BEHAVIOR"""
-    try:
-        # Get user's interaction history
-        user_interactions = ResourceInteraction.objects.filter(
-            user=user
-        ).select_related('resource')[:10]  # Limit to recent interactions
-        
-        # Build user context for AI
-        user_context = {
-            'user_profile': {
-                'grade_level': getattr(user, 'grade_level', 'Unknown'),
-                'interests': getattr(user, 'interests', []),
-            },
-            'recent_activity': [
-                {
-                    'resource': ir.resource.title,
-                    'type': ir.interaction_type,
-                    'resource_type': ir.resource.resource_type
-                } for ir in user_interactions
-            ],
-            'preferred_categories': list(
-                user_interactions.values_list('resource__categories__name', flat=True).distinct()
-            )
-        }
-        
-        # If we have a specific resource, find similar ones
-        if resource_instance:
-            similar_resources = LearningResource.objects.filter(
-                categories__in=resource_instance.categories.all(),
-                is_published=True,
-                is_approved=True
-            ).exclude(id=resource_instance.id).distinct()[:5]
-        else:
-            # General recommendations based on user history
-            similar_resources = LearningResource.objects.filter(
-                categories__name__in=user_context['preferred_categories'],
-                is_published=True,
-                is_approved=True
-            ).exclude(
-                id__in=user_interactions.values_list('resource_id', flat=True)
-            ).distinct()[:5]
-        
-        # Create AI recommendations
-        for similar_resource in similar_resources:
-            # Calculate confidence score based on relevance
-            confidence = 0.7  # Base confidence
-            
-            # Increase confidence if same resource type
-            if resource_instance and similar_resource.resource_type == resource_instance.resource_type:
-                confidence += 0.1
-                
-            # Increase confidence if same difficulty level
-            if resource_instance and similar_resource.difficulty_level == resource_instance.difficulty_level:
-                confidence += 0.1
-            
-            # Create or update recommendation
-            AIRecommendation.objects.update_or_create(
-                user=user,
-                resource=similar_resource,
-                defaults={
-                    'confidence_score': min(confidence, 0.95),  # Cap at 0.95
-                    'recommendation_type': 'PERSONALIZED',
-                    'reason': f"Based on your interest in similar resources",
-                    'expires_at': timezone.now() + timedelta(days=30)
-                }
-            )
-        
-        print(f"✅ AI recommendations generated for {user.get_display_name()}")
-        
-    except Exception as e:
-        print(f"❌ Error generating AI recommendations: {e}")
+def apply_review_sentiment(review, sentiment_result):
+    sentiment_score = sentiment_result.get('sentiment_score', 0)
+    primary_emotion = sentiment_result.get('primary_emotion', 'neutral')
+    needs_support = sentiment_result.get('needs_support', False)
+    
+    print(f"✅ Review sentiment: {sentiment_score} ({primary_emotion})")
+    
+    # Flag concerning reviews for moderation
+    if sentiment_score < -0.3 or needs_support:
+        print(f"🚨 Review may need moderator attention - Score: {sentiment_score}")
+        # You could auto-flag here or notify moderators
 
 # ✅ SIGNAL HANDLERS
 
@@ -218,7 +123,7 @@ def handle_new_resource(sender, instance, created, **kwargs):
         # Process resource asynchronously
         transaction.on_commit(lambda: process_new_resource(instance.id))
         
-        # ✅ DIRECT AI PROCESSING
+        # ✅ QUEUED AI PROCESSING
         generate_ai_metadata(instance)
 
 @receiver(post_save, sender=ResourceReview)
@@ -239,57 +144,15 @@ def update_resource_rating(sender, instance, created, **kwargs):
 
 @receiver(post_save, sender=ResourceInteraction)
 def update_resource_counts(sender, instance, created, **kwargs):
-    """Update resource counts and generate recommendations"""
+    """Update resource counts and queue a recommendation refresh"""
     if created:
-        resource = instance.resource
+        # Buffered counter increment (flushed to the row by flush_resource_counters)
+        if instance.interaction_type in COUNTER_FIELDS:
+            ResourceCounterService.increment(instance.resource_id, COUNTER_FIELDS[instance.interaction_type])
         
-        # Update counts atomically
-        if instance.interaction_type == 'VIEW':
-            LearningResource.objects.filter(id=resource.id).update(
-                view_count=F('view_count') + 1
-            )
-        elif instance.interaction_type == 'DOWNLOAD':
-            LearningResource.objects.filter(id=resource.id).update(
-                download_count=F('download_count') + 1
-            )
-        elif instance.interaction_type == 'FAVORITE':
-            LearningResource.objects.filter(id=resource.id).update(
-                favorite_count=F('favorite_count') + 1
-            )
-        
-        # ✅ GENERATE AI RECOMMENDATIONS AFTER SIGNIFICANT INTERACTIONS
-        if instance.interaction_type in ['DOWNLOAD', 'COMPLETE', 'FAVORITE']:
-            generate_personalized_recommendations(instance.user, instance.resource)
-
-@receiver(post_save, sender=ResourceInteraction)
-def handle_completion(sender, instance, created, **kwargs):
-    """Handle resource completion and generate progression recommendations"""
-    if created and instance.interaction_type == 'COMPLETE' and instance.progress_percentage >= 80:
-        try:
-            # Find next-level resources in the same category
-            next_level_resources = LearningResource.objects.filter(
-                categories__in=instance.resource.categories.all(),
-                difficulty_level='ADVANCED',  # Or calculate next level
-                is_published=True,
-                is_approved=True
-            ).exclude(id=instance.resource.id)[:3]
-            
-            for next_resource in next_level_resources:
-                AIRecommendation.objects.update_or_create(
-                    user=instance.user,
-                    resource=next_resource,
-                    defaults={
-                        'confidence_score': 0.8,
-                        'recommendation_type': 'PROGRESSION',
-                        'reason': f"Next step after completing {instance.resource.title}",
-                        'expires_at': timezone.now() + timedelta(days=30)
-                    }
-                )
-            
-            print(f"✅ Progression recommendations generated for {instance.user.get_display_name()}")
-            
-        except Exception as e:
-            print(f"❌ Error generating progression recommendations: {e}")
+        # ✅ REFRESH AI RECOMMENDATIONS AFTER SIGNIFICANT INTERACTIONS
+        # (coalesced per user and computed by a worker, including progression after a completion)
+        RecommendationRefreshQueue.enqueue(instance)
 
 @receiver(m2m_changed, sender=StudyCollection.resources.through)
 def update_collection_timestamps(sender, instance, action, **kwargs):
@@ -339,6 +202,23 @@ def handle_content_updates(sender, instance, **kwargs):
         print(f"🔄 Content changed, regenerating AI metadata for: {instance.title}")
         generate_ai_metadata(instance)
 
+@receiver(post_save, sender=LearningResource)
+def update_search_index(sender, instance, created, update_fields=None, **kwargs):
+    """Reindex a resource for search when a searchable field changed"""
+    if update_fields is not None and not set(update_fields) & set(SEARCH_FIELDS):
+        return
+    if created or set(instance.get_dirty_fields()) & set(SEARCH_FIELDS):
+        transaction.on_commit(lambda: ResourceSearchIndex.reindex([instance.id]))
+
+@receiver(post_save, sender=LearningResource)
+def update_similarity_index(sender, instance, created, **kwargs):
+    """Give a resource its similar-resource list as soon as it becomes visible"""
+    if not (instance.is_published and instance.is_approved):
+        return
+    dirty_fields = instance.get_dirty_fields()
+    if created or 'is_published' in dirty_fields or 'is_approved' in dirty_fields:
+        transaction.on_commit(lambda: refresh_resource_similarity([instance.id]))
+
 @receiver(post_save, sender=LearningResource)
 def notify_on_approval(sender, instance, **kwargs):
     """Notify user when their resource is approved"""
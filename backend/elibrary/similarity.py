@@ -0,0 +1,269 @@
+import logging
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, IntegerField, Max, Value, When
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# How strongly an interaction ties a user to a resource (strongest one per user and resource counts)
+INTERACTION_WEIGHTS = {
+    'VIEW': 1,
+    'DOWNLOAD': 2,
+    'SHARE': 2,
+    'FAVORITE': 3,
+    'COMPLETE': 3,
+}
+
+# Fallback difficulty (0-1) when a resource has no ai_difficulty_score, as in calculate_difficulty_score
+DIFFICULTY_LEVEL_SCORES = {'BEGINNER': 0.3, 'INTERMEDIATE': 0.5, 'ADVANCED': 0.8}
+
+
+def _ranges(starts, lengths):
+    # Concatenation of arange(start, start + length) for each pair, without a Python loop
+    total = int(lengths.sum())
+    if not total:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+    return offsets + np.arange(total)
+
+
+class Incidence:
+    # Sparse item x feature matrix (feature: a user, a category or a keyword) held twice,
+    # grouped by item and by feature (CSR / CSC), for cosine similarities between items
+
+    def __init__(self, item_count, items, features, weights):
+        items = np.asarray(items, dtype=np.int64)
+        features = np.asarray(features, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.float64)
+        feature_count = int(features.max()) + 1 if len(features) else 0
+        self.item_count = item_count
+
+        order = np.argsort(items, kind='stable')
+        self.item_ptr = np.concatenate(([0], np.cumsum(np.bincount(items, minlength=item_count))))
+        self.item_features = features[order]
+        self.item_weights = weights[order]
+
+        order = np.argsort(features, kind='stable')
+        self.feature_ptr = np.concatenate(([0], np.cumsum(np.bincount(features, minlength=feature_count))))
+        self.feature_items = items[order]
+        self.feature_weights = weights[order]
+
+        self.norms = np.sqrt(np.bincount(items, weights=weights ** 2, minlength=item_count))
+        # Entries a row's product expands to, used to size blocks
+        self.row_cost = np.bincount(items, weights=np.diff(self.feature_ptr)[features], minlength=item_count)
+
+    def cosine(self, rows):
+        # Dense (len(rows), item_count) cosine similarities of `rows` against every item
+        lengths = self.item_ptr[rows + 1] - self.item_ptr[rows]
+        entries = _ranges(self.item_ptr[rows], lengths)
+        entry_rows = np.repeat(np.arange(len(rows)), lengths)
+        features = self.item_features[entries]
+        weights = self.item_weights[entries]
+
+        # Every item sharing the feature: the (row, item, weight product) terms of X[rows] @ X.T
+        spans = self.feature_ptr[features + 1] - self.feature_ptr[features]
+        pairs = _ranges(self.feature_ptr[features], spans)
+        flat = np.repeat(entry_rows, spans) * self.item_count + self.feature_items[pairs]
+        products = np.repeat(weights, spans) * self.feature_weights[pairs]
+
+        dots = np.bincount(flat, weights=products, minlength=len(rows) * self.item_count)
+        dots = dots.reshape(len(rows), self.item_count)
+        scale = self.norms[rows][:, None] * self.norms[None, :]
+        return np.divide(dots, scale, out=np.zeros(dots.shape), where=scale > 0)
+
+
+class SimilarityIndexService:
+    # Top-K similar resources per published resource, stored in ResourceNeighbor so lookups are one
+    # indexed read. Scores blend cosine similarities of co-interaction (users), shared categories and
+    # keywords (ai_keywords and tags), damped by difficulty distance. Each school is computed on its
+    # own, in row blocks of the sparse products sized by ELIBRARY_SIMILARITY_MAX_PAIRS.
+
+    @staticmethod
+    def load_school(school_id):
+        # Resource ids plus the three incidences and difficulties for a school's published resources:
+        # three queries (resources, categories, aggregated interactions)
+        from .models import LearningResource, ResourceInteraction
+
+        rows = list(LearningResource.objects.filter(
+            school_id=school_id, is_published=True, is_approved=True
+        ).order_by('id').values_list('id', 'ai_keywords', 'tags', 'ai_difficulty_score', 'difficulty_level'))
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        position = {resource_id: i for i, resource_id in enumerate(ids.tolist())}
+        count = len(ids)
+
+        difficulty = np.array([
+            score if score is not None else DIFFICULTY_LEVEL_SCORES.get(level, 0.5)
+            for _, _, _, score, level in rows
+        ], dtype=np.float64)
+
+        vocabulary = {}
+        keyword_items, keyword_ids = [], []
+        for i, (_, keywords, tags, _, _) in enumerate(rows):
+            terms = {
+                str(term).strip().lower()
+                for term in list(keywords or []) + list(tags or [])
+                if isinstance(term, str) and term.strip()
+            }
+            for term in terms:
+                keyword_items.append(i)
+                keyword_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+
+        through = LearningResource.categories.through
+        categories = {}
+        category_items, category_ids = [], []
+        for resource_id, category_id in through.objects.filter(
+            learningresource__school_id=school_id
+        ).values_list('learningresource_id', 'resourcecategory_id'):
+            if resource_id in position:
+                category_items.append(position[resource_id])
+                category_ids.append(categories.setdefault(category_id, len(categories)))
+
+        history_start = timezone.now() - timedelta(days=getattr(settings, 'ELIBRARY_SIMILARITY_HISTORY_DAYS', 180))
+        strength = Max(Case(
+            *[When(interaction_type=kind, then=Value(weight)) for kind, weight in INTERACTION_WEIGHTS.items()],
+            default=Value(1),
+            output_field=IntegerField()
+        ))
+        interactions = ResourceInteraction.objects.filter(
+            resource__school_id=school_id,
+            resource__is_published=True,
+            resource__is_approved=True,
+            created_at__gte=history_start
+        ).order_by().values('user_id', 'resource_id').annotate(strength=strength).values_list('user_id', 'resource_id', 'strength')
+
+        # Users who touched a large share of the library say little about any pair and make the
+        # product quadratic, so they are left out
+        max_items = getattr(settings, 'ELIBRARY_SIMILARITY_MAX_USER_ITEMS', 500)
+        interactions = list(interactions)
+        per_user = {}
+        for user_id, _, _ in interactions:
+            per_user[user_id] = per_user.get(user_id, 0) + 1
+        users = {}
+        user_items, user_ids, user_weights = [], [], []
+        for user_id, resource_id, weight in interactions:
+            if per_user[user_id] > max_items or resource_id not in position:
+                continue
+            user_items.append(position[resource_id])
+            user_ids.append(users.setdefault(user_id, len(users)))
+            user_weights.append(weight)
+
+        return ids, difficulty, {
+            'interactions': Incidence(count, user_items, user_ids, user_weights),
+            'categories': Incidence(count, category_items, category_ids, np.ones(len(category_items))),
+            'keywords': Incidence(count, keyword_items, keyword_ids, np.ones(len(keyword_items))),
+        }
+
+    @staticmethod
+    def blocks(incidences, rows):
+        # Splits `rows` so the expanded products of one block stay under ELIBRARY_SIMILARITY_MAX_PAIRS
+        budget = getattr(settings, 'ELIBRARY_SIMILARITY_MAX_PAIRS', 4_000_000)
+        item_count = next(iter(incidences.values())).item_count
+        cost = sum(incidence.row_cost[rows] for incidence in incidences.values()) + item_count
+        block, spent = [], 0
+        for row, row_cost in zip(rows.tolist(), cost.tolist()):
+            if block and spent + row_cost > budget:
+                yield np.array(block, dtype=np.int64)
+                block, spent = [], 0
+            block.append(row)
+            spent += row_cost
+        if block:
+            yield np.array(block, dtype=np.int64)
+
+    @staticmethod
+    def top_neighbors(ids, difficulty, incidences, rows, k=None):
+        # {resource id: [(neighbor id, score), ...]} best first, for the resources at positions `rows`
+        if k is None:
+            k = getattr(settings, 'ELIBRARY_SIMILARITY_TOP_K', 20)
+        weights = getattr(settings, 'ELIBRARY_SIMILARITY_WEIGHTS', {})
+        difficulty_weight = weights.get('difficulty', 0.3)
+
+        neighbors = {}
+        for block in SimilarityIndexService.blocks(incidences, rows):
+            scores = sum(
+                weights.get(name, 1.0) * incidence.cosine(block)
+                for name, incidence in incidences.items()
+            )
+            # Difficulty alone doesn't make resources related; it only scales the other signals
+            closeness = 1 - np.abs(difficulty[block][:, None] - difficulty[None, :])
+            scores *= (1 - difficulty_weight) + difficulty_weight * closeness
+            scores[np.arange(len(block)), block] = 0
+
+            keep = min(k, len(ids) - 1)
+            if keep <= 0:
+                break
+            best = np.argpartition(-scores, keep - 1, axis=1)[:, :keep]
+            best_scores = np.take_along_axis(scores, best, axis=1)
+            order = np.argsort(-best_scores, axis=1, kind='stable')
+            best = np.take_along_axis(best, order, axis=1)
+            best_scores = np.take_along_axis(best_scores, order, axis=1)
+            for row, columns, values in zip(block.tolist(), best, best_scores):
+                neighbors[int(ids[row])] = [
+                    (int(ids[column]), round(float(value), 6))
+                    for column, value in zip(columns, values)
+                    if value > 0
+                ]
+        return neighbors
+
+    @staticmethod
+    def store(neighbors):
+        # Replaces the stored neighbour lists of the given resources
+        from .models import ResourceNeighbor
+
+        now = timezone.now()
+        rows = [
+            ResourceNeighbor(resource_id=resource_id, neighbor_id=neighbor_id, rank=rank, score=score, computed_at=now)
+            for resource_id, ranked in neighbors.items()
+            for rank, (neighbor_id, score) in enumerate(ranked, 1)
+        ]
+        with transaction.atomic():
+            ResourceNeighbor.objects.filter(resource_id__in=list(neighbors)).delete()
+            ResourceNeighbor.objects.bulk_create(rows, batch_size=2000)
+        return len(rows)
+
+    @staticmethod
+    def rebuild_school(school_id):
+        # Recomputes every published resource of the school; returns how many neighbour rows were stored
+        from .models import LearningResource, ResourceNeighbor
+
+        ids, difficulty, incidences = SimilarityIndexService.load_school(school_id)
+        neighbors = SimilarityIndexService.top_neighbors(
+            ids, difficulty, incidences, np.arange(len(ids), dtype=np.int64)
+        )
+        stored = SimilarityIndexService.store(neighbors)
+        # Resources that were unpublished since the last run
+        ResourceNeighbor.objects.filter(
+            resource__in=LearningResource.objects.filter(school_id=school_id)
+        ).exclude(resource_id__in=ids.tolist()).delete()
+        return stored
+
+    @staticmethod
+    def refresh_resources(resource_ids):
+        # Incremental update: recomputes just these resources' lists (e.g. when one is published);
+        # they show up in other resources' lists at the next rebuild
+        from .models import LearningResource
+
+        stored = 0
+        schools = LearningResource.objects.filter(id__in=resource_ids).order_by().values_list('school_id', flat=True)
+        for school_id in set(schools):
+            ids, difficulty, incidences = SimilarityIndexService.load_school(school_id)
+            rows = np.flatnonzero(np.isin(ids, list(resource_ids)))
+            if len(rows):
+                stored += SimilarityIndexService.store(
+                    SimilarityIndexService.top_neighbors(ids, difficulty, incidences, rows)
+                )
+        return stored
+
+    @staticmethod
+    def neighbors_of(resource, limit=10):
+        # The stored similar resources that are still published, best first (one indexed query)
+        from .models import LearningResource
+
+        return list(LearningResource.objects.filter(
+            neighbor_of__resource=resource,
+            is_published=True,
+            is_approved=True
+        ).order_by('neighbor_of__rank')[:limit])
@@ -1,9 +1,12 @@
 from django.core.mail import send_mail
 from django.conf import settings
 from django.utils import timezone
+from django.db import transaction
 from datetime import timedelta
 from django.db.models import Count, Q
+from celery import shared_task
 import logging
+import threading
 
 from .models import LearningResource, ResourceInteraction, StudyCollection, AIRecommendation, ReadingList
 from .utils import AIResourceHelper, ResourceAnalyzer
@@ -40,29 +43,40 @@ def process_new_resource(resource_id):
         logger.error(f"Error processing resource {resource_id}: {str(e)}")
 
 def generate_daily_recommendations():
-    # Generate daily recommendations for all active users
-    try:
-        active_users = User.objects.filter(
-            is_active=True,
-            last_login__gte=timezone.now() - timedelta(days=30)
-        )
-        
-        total_recommendations = 0
-        for user in active_users:
-            try:
-                recommendations = AIResourceHelper.generate_recommendations(user, limit=10)
-                total_recommendations += recommendations.count()
-                logger.info(f"Generated {recommendations.count()} recommendations for user {user.id}")
-            except Exception as e:
-                logger.error(f"Error generating recommendations for user {user.id}: {str(e)}")
-                continue
-        
-        logger.info(f"Generated total {total_recommendations} daily recommendations")
-        return total_recommendations
-        
-    except Exception as e:
-        logger.error(f"Error in daily recommendation generation: {str(e)}")
+    # Generate daily recommendations for all active users, one batch per school.
+    # With ELIBRARY_RECOMMENDATION_FANOUT each school is a separate Celery task.
+    from .recommendations import RecommendationBatchService
+    
+    school_ids = RecommendationBatchService.school_ids()
+    if getattr(settings, 'ELIBRARY_RECOMMENDATION_FANOUT', False):
+        for school_id in school_ids:
+            generate_school_recommendations.delay(school_id)
+        logger.info(f"Queued recommendation generation for {len(school_ids)} schools")
         return 0
+    
+    total_recommendations = 0
+    for school_id in school_ids:
+        try:
+            total_recommendations += RecommendationBatchService.generate_for_school(school_id)
+        except Exception as e:
+            logger.error(f"Error generating recommendations for school {school_id}: {str(e)}")
+    
+    logger.info(f"Generated total {total_recommendations} daily recommendations")
+    return total_recommendations
+
+@shared_task(acks_late=True)
+def generate_school_recommendations(school_id):
+    # One school's shard of generate_daily_recommendations
+    from .recommendations import RecommendationBatchService
+    
+    return RecommendationBatchService.generate_for_school(school_id)
+
+@shared_task(acks_late=True)
+def refresh_user_recommendations(user_id, since):
+    # Recompute one user's recommendations after a window of interactions (see RecommendationRefreshQueue)
+    from .refresher import RecommendationRefreshQueue
+    
+    return RecommendationRefreshQueue.refresh(user_id, since)
 
 def send_resource_recommendations():
     # Send weekly resource recommendations via email
@@ -125,35 +139,22 @@ def send_resource_recommendations():
         logger.error(f"Error sending resource recommendations: {str(e)}")
         return 0
 
+@shared_task
+def flush_resource_counters():
+    # Write buffered view/download/favorite increments to the resource rows
+    from .counters import ResourceCounterService
+    
+    return ResourceCounterService.flush()
+
+@shared_task
 def update_resource_analytics():
-    # Update analytics for all resources
+    # Reconcile resource counters with the interactions recorded since the last run
+    from .counters import ResourceCounterService
+    
     try:
-        resources = LearningResource.objects.filter(is_published=True, is_approved=True)
-        
-        updated_count = 0
-        for resource in resources:
-            try:
-                analytics = ResourceAnalyzer.get_resource_analytics(resource)
-                
-                # Update resource with new analytics data
-                resource.view_count = analytics.get('total_views', 0)
-                resource.download_count = analytics.get('total_downloads', 0)
-                resource.favorite_count = analytics.get('total_favorites', 0)
-                
-                # Only update rating if we have new data
-                if analytics.get('rating_count', 0) > 0:
-                    resource.average_rating = analytics.get('average_rating', 0)
-                    resource.rating_count = analytics.get('rating_count', 0)
-                
-                resource.save()
-                updated_count += 1
-                
-            except Exception as e:
-                logger.error(f"Error updating analytics for resource {resource.id}: {str(e)}")
-                continue
-        
-        logger.info(f"Updated analytics for {updated_count} resources")
-        return updated_count
+        corrected = ResourceCounterService.reconcile()
+        logger.info(f"Reconciled counters, corrected {corrected} resources")
+        return corrected
         
     except Exception as e:
         logger.error(f"Error updating resource analytics: {str(e)}")
@@ -173,7 +174,16 @@ def cleanup_old_data():
         one_year_ago = timezone.now() - timedelta(days=365)
         old_interactions = ResourceInteraction.objects.filter(created_at__lt=one_year_ago)
         interactions_count = old_interactions.count()
-        old_interactions.delete()
+        
+        # Counters reflect the interactions kept, so take the deleted ones off
+        from .counters import ResourceCounterService
+        removed = ResourceCounterService.counts(old_interactions) if interactions_count else {}
+        with transaction.atomic():
+            old_interactions.delete()
+            ResourceCounterService.apply({
+                resource_id: {field: -count for field, count in fields.items()}
+                for resource_id, fields in removed.items()
+            })
         
         # Clean up unused collections (no resources, older than 6 months)
         six_months_ago = timezone.now() - timedelta(days=180)
@@ -349,4 +359,36 @@ def update_popular_resources():
         
     except Exception as e:
         logger.error(f"Error updating popular resources: {str(e)}")
-        return 0
\ No newline at end of file
+        return 0
+@shared_task
+def rebuild_similarity_index():
+    # Nightly: recompute the top-K similar resources of every school's published resources
+    from .similarity import SimilarityIndexService
+    
+    total = 0
+    for school_id in LearningResource.objects.filter(
+        is_published=True, is_approved=True
+    ).order_by().values_list('school_id', flat=True).distinct():
+        try:
+            total += SimilarityIndexService.rebuild_school(school_id)
+        except Exception as e:
+            logger.error(f"Error rebuilding similarity index for school {school_id}: {str(e)}")
+    
+    logger.info(f"Rebuilt similarity index: {total} neighbour rows")
+    return total
+
+def refresh_resource_similarity(resource_ids):
+    # Compute neighbours for newly published resources outside the request that published them
+    def _refresh():
+        from django.db import close_old_connections
+        from .similarity import SimilarityIndexService
+        try:
+            SimilarityIndexService.refresh_resources(resource_ids)
+        except Exception as e:
+            logger.error(f"Error refreshing similarity for resources {resource_ids}: {str(e)}")
+        finally:
+            close_old_connections()
+    
+    thread = threading.Thread(target=_refresh)
+    thread.daemon = True
+    thread.start()
@@ -4,6 +4,10 @@ from datetime import timedelta
 import logging
 import json
 
+from .search import ResourceSearchIndex
+from .similarity import SimilarityIndexService
+from .recommendations import RecommendationBatchService
+
 logger = logging.getLogger(__name__)
 
 class AIResourceHelper:
@@ -68,6 +72,11 @@ class AIResourceHelper:
         from .models import LearningResource
         
         try:
+            # Precomputed neighbours (nightly SimilarityIndexService rebuild) when the resource has them
+            similar = SimilarityIndexService.neighbors_of(resource, limit)
+            if similar:
+                return similar
+            
             # Get resources with same categories
             similar = LearningResource.objects.filter(
                 school=user.school,
@@ -99,78 +108,12 @@ class AIResourceHelper:
     
     @staticmethod
     def generate_recommendations(user, limit=20):
-        # Generate personalized resource recommendations
-        from .models import LearningResource, AIRecommendation, ResourceInteraction
+        # Generate personalized resource recommendations (the batch scorer, for one user)
+        from .models import AIRecommendation
         
         try:
-            # Get user's interaction history
-            user_interactions = ResourceInteraction.objects.filter(user=user)
-            viewed_resources = user_interactions.filter(interaction_type='VIEW').values_list('resource_id', flat=True)
-            favorited_resources = user_interactions.filter(interaction_type='FAVORITE').values_list('resource_id', flat=True)
-            
-            # Get resources from favorite categories
-            favorite_categories = LearningResource.objects.filter(
-                id__in=favorited_resources
-            ).values_list('categories', flat=True)
-            
-            # Generate recommendations
-            recommendations = LearningResource.objects.filter(
-                school=user.school,
-                is_published=True,
-                is_approved=True
-            ).exclude(id__in=viewed_resources)
-            
-            if favorite_categories:
-                recommendations = recommendations.filter(categories__in=favorite_categories)
-            
-            # Calculate confidence scores based on various factors
-            recommended_resources = []
-            for resource in recommendations[:limit]:
-                confidence = 0.5
-                
-                # Boost confidence for same categories as favorites
-                if favorite_categories:
-                    category_match = resource.categories.filter(id__in=favorite_categories).count()
-                    confidence += category_match * 0.1
-                
-                # Boost confidence for high-rated resources
-                if resource.average_rating > 4.0:
-                    confidence += 0.2
-                elif resource.average_rating > 3.0:
-                    confidence += 0.1
-                
-                # Adjust based on difficulty (prefer similar to viewed resources)
-                viewed_difficulty = LearningResource.objects.filter(
-                    id__in=viewed_resources
-                ).aggregate(avg_difficulty=Avg('ai_difficulty_score'))['avg_difficulty'] or 0.5
-                
-                if resource.ai_difficulty_score:
-                    difficulty_diff = abs(resource.ai_difficulty_score - viewed_difficulty)
-                    confidence += (1 - difficulty_diff) * 0.2
-                
-                confidence = min(1.0, max(0.1, confidence))
-                
-                recommended_resources.append({
-                    'resource': resource,
-                    'confidence_score': confidence,
-                    'reason': f"Based on your interests and learning pattern"
-                })
-            
-            # Sort by confidence and create AIRecommendation objects
-            recommended_resources.sort(key=lambda x: x['confidence_score'], reverse=True)
-            
-            for rec_data in recommended_resources[:10]:
-                AIRecommendation.objects.update_or_create(
-                    user=user,
-                    resource=rec_data['resource'],
-                    defaults={
-                        'confidence_score': rec_data['confidence_score'],
-                        'reason': rec_data['reason'],
-                        'recommendation_type': 'PERSONALIZED',
-                        'expires_at': timezone.now() + timedelta(days=7)
-                    }
-                )
-            
+            if user.school_id:
+                RecommendationBatchService.generate_for_school(user.school_id, user_ids=[user.id])
             return AIRecommendation.objects.filter(user=user).order_by('-confidence_score')[:limit]
             
         except Exception as e:
@@ -193,8 +136,11 @@ class SearchHelper:
                 is_approved=True
             )
             
-            # Text search
-            if query:
+            # Text search: the full-text index where available (PostgreSQL), substring matching otherwise
+            use_index = bool(query) and ResourceSearchIndex.is_supported()
+            if use_index:
+                queryset = ResourceSearchIndex.search(queryset, query)
+            elif query:
                 queryset = queryset.filter(
                     Q(title__icontains=query) |
                     Q(description__icontains=query) |
@@ -221,7 +167,9 @@ class SearchHelper:
                     queryset = queryset.filter(tags__icontains=tag)
             
             # Apply sorting
-            if sort_by == 'relevance' and query:
+            if sort_by == 'relevance' and use_index:
+                queryset = queryset.order_by('-search_rank', '-created_at')
+            elif sort_by == 'relevance' and query:
                 # Basic relevance scoring for text search
                 queryset = queryset.annotate(
                     relevance=Count('title', filter=Q(title__icontains=query)) * 3 +
@@ -239,12 +187,23 @@ class SearchHelper:
             else:
                 queryset = queryset.order_by('-created_at')
             
-            return queryset.distinct()[:limit]
+            # A single category filter can't repeat rows; only the substring path needs DISTINCT
+            if not use_index:
+                queryset = queryset.distinct()
+            return queryset.defer('search_vector')[:limit]
             
         except Exception as e:
             logger.error(f"Error in resource search: {str(e)}")
             return LearningResource.objects.none()
     
+    @staticmethod
+    def highlight_results(serialized, resources, query):
+        # Add a 'highlight' ({'title', 'snippet'} with <mark> tags) to serialized search results
+        highlights = ResourceSearchIndex.highlights(resources, query) if query else {}
+        for item in serialized:
+            item['highlight'] = highlights.get(item.get('id'))
+        return serialized
+    
     @staticmethod
     def build_search_filters(user):
         # Build available search filters for the current user
@@ -27,6 +27,7 @@ from .permissions import (
     SearchPermission, RecommendationPermission, DashboardPermission
 )
 from .utils import AIResourceHelper, SearchHelper, ResourceAnalyzer
+from .counters import ResourceCounterService
 from users.models import User
 
 class ResourceCategoryViewSet(ModelViewSet):
@@ -133,11 +134,11 @@ class LearningResourceViewSet(ModelViewSet):
             interaction_type='VIEW'
         )
         
-        resource.view_count = F('view_count') + 1
-        resource.save()
-        resource.refresh_from_db()
-        
-        return Response({'status': 'View recorded', 'view_count': resource.view_count})
+        # The interaction's post_save buffers the counter increment
+        return Response({
+            'status': 'View recorded',
+            'view_count': ResourceCounterService.current(resource, 'view_count')
+        })
     
     @action(detail=True, methods=['post'])
     def record_download(self, request, pk=None):
@@ -150,11 +151,11 @@ class LearningResourceViewSet(ModelViewSet):
             interaction_type='DOWNLOAD'
         )
         
-        resource.download_count = F('download_count') + 1
-        resource.save()
-        resource.refresh_from_db()
-        
-        return Response({'status': 'Download recorded', 'download_count': resource.download_count})
+        # The interaction's post_save buffers the counter increment
+        return Response({
+            'status': 'Download recorded',
+            'download_count': ResourceCounterService.current(resource, 'download_count')
+        })
     
     @action(detail=True, methods=['post'])
     def toggle_favorite(self, request, pk=None):
@@ -167,20 +168,17 @@ class LearningResourceViewSet(ModelViewSet):
             interaction_type='FAVORITE'
         )
         
+        # Adding is counted by the interaction's post_save, removing here
         if not created:
             interaction.delete()
-            resource.favorite_count = F('favorite_count') - 1
+            ResourceCounterService.increment(resource.id, 'favorite_count', -1)
             is_favorited = False
         else:
-            resource.favorite_count = F('favorite_count') + 1
             is_favorited = True
         
-        resource.save()
-        resource.refresh_from_db()
-        
         return Response({
             'favorited': is_favorited, 
-            'favorite_count': resource.favorite_count
+            'favorite_count': ResourceCounterService.current(resource, 'favorite_count')
         })
     
     @action(detail=True, methods=['post'])
@@ -642,7 +640,9 @@ def search_resources(request):
     available_filters = SearchHelper.build_search_filters(request.user)
     
     return Response({
-        'results': resource_serializer.data,
+        'results': SearchHelper.highlight_results(
+            resource_serializer.data, paginated_results, serializer.validated_data.get('query')
+        ),
         'total_count': paginator.count,
         'page_count': paginator.num_pages,
         'current_page': paginated_results.number,
@@ -744,7 +744,9 @@ def global_search(request):
     )[:5]
     
     return Response({
-        'resources': LearningResourceSerializer(resources, many=True, context={'request': request}).data,
+        'resources': SearchHelper.highlight_results(
+            LearningResourceSerializer(resources, many=True, context={'request': request}).data, resources, query
+        ),
         'collections': StudyCollectionSerializer(collections, many=True, context={'request': request}).data,
         'categories': ResourceCategorySerializer(categories, many=True, context={'request': request}).data
     })
\ No newline at end of file
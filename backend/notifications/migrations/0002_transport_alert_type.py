@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 15:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='notification_type',
+            field=models.CharField(choices=[('ACCOUNT_ALERT', 'Account Alert'), ('SYSTEM_MESSAGE', 'System Message'), ('ASSIGNMENT_DUE', 'Assignment Due'), ('ASSIGNMENT_GRADED', 'Assignment Graded'), ('NEW_POST', 'New Classroom Post'), ('RESOURCE_APPROVED', 'Resource Approved'), ('POST_REPLY', 'Post Reply'), ('COMMENT_REPLY', 'Comment Reply'), ('NEW_FOLLOWER', 'New Follower'), ('MENTION', 'Mention'), ('NEW_MESSAGE', 'New Message'), ('CRISIS_ALERT', 'Crisis Alert'), ('TICKET_RESPONSE', 'Support Ticket Response'), ('TRANSPORT_ALERT', 'Transport Alert')], max_length=30),
+        ),
+    ]
@@ -27,6 +27,9 @@ class Notification(models.Model):
         # Wellbeing Notifications
         CRISIS_ALERT = 'CRISIS_ALERT', 'Crisis Alert'
         TICKET_RESPONSE = 'TICKET_RESPONSE', 'Support Ticket Response'
+        
+        # Transport Notifications
+        TRANSPORT_ALERT = 'TRANSPORT_ALERT', 'Transport Alert'
 
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
     notification_type = models.CharField(max_length=30, choices=Type.choices)
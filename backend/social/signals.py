@@ -9,7 +9,7 @@ from .models import (
     Post, Comment, DirectMessage, Notification, UserFollow,
     CommunityMembership, Vote, Report, TrendingTopic
 )
-from ai_engine.services import AIService  # ✅ AI IMPORT
+from ai_engine.jobs import AIJobQueue
 
 @receiver(post_save, sender=Post)
 def handle_new_post(sender, instance, created, **kwargs):
@@ -86,79 +86,78 @@ def handle_new_comment(sender, instance, created, **kwargs):
 
 def analyze_post_toxicity(post_instance):
     """
-    Analyze post content for toxicity using AI engine
+    Queue post content for toxicity analysis by the AI engine
     """
-    if not post_instance.content or getattr(post_instance, '_ai_processing', False):
+    if not post_instance.content:
         return
     
     try:
-        # Prevent recursive signal triggering
-        post_instance._ai_processing = True
-        
-        # Call AI engine for toxicity analysis
-        toxicity_result = AIService.analyze_toxicity(post_instance.content, post_instance.author)
-        
-        if 'error' not in toxicity_result:
-            # Update post with toxicity analysis
-            toxicity_score = toxicity_result.get('toxicity_score', 0)
-            is_toxic = toxicity_result.get('is_toxic', False)
-            
-            # Update the post without triggering signals again
-            Post.objects.filter(id=post_instance.id).update(
-                toxicity_score=toxicity_score
-            )
-            
-            # Auto-flag high toxicity content for moderation
-            if toxicity_score > 0.7:
-                print(f"🚨 High toxicity post flagged (Score: {toxicity_score}): Post #{post_instance.id}")
-            elif toxicity_score > 0.4:
-                print(f"⚠️ Medium toxicity post (Score: {toxicity_score}): Post #{post_instance.id}")
-            else:
-                print(f"✅ Low toxicity post (Score: {toxicity_score}): Post #{post_instance.id}")
-                
+        AIJobQueue.enqueue(
+            'analyze_toxicity',
+            {'text': post_instance.content},
+            target_app='SOCIAL',
+            requesting_user=post_instance.author,
+            target=post_instance,
+            callback='social.signals.apply_post_toxicity'
+        )
     except Exception as e:
-        print(f"❌ Error analyzing post toxicity: {e}")
-    finally:
-        # Clean up flag
-        if hasattr(post_instance, '_ai_processing'):
-            delattr(post_instance, '_ai_processing')
+        print(f"❌ Error queueing post toxicity analysis: {e}")
+
+def apply_post_toxicity(post, toxicity_result):
+    """
+    Write toxicity analysis back onto the post
+    """
+    toxicity_score = toxicity_result.get('toxicity_score', 0)
+    
+    # Update the post without triggering signals again
+    Post.objects.filter(id=post.id).update(
+        toxicity_score=toxicity_score
+    )
+    
+    # Auto-flag high toxicity content for moderation
+    if toxicity_score > 0.7:
+        print(f"🚨 High toxicity post flagged (Score: {toxicity_score}): Post #{post.id}")
+    elif toxicity_score > 0.4:
+        print(f"⚠️ Medium toxicity post (Score: {toxicity_score}): Post #{post.id}")
+    else:
+        print(f"✅ Low toxicity post (Score: {toxicity_score}): Post #{post.id}")
 
 def analyze_comment_toxicity(comment_instance):
     """
-    Analyze comment content for toxicity using AI engine
+    Queue comment content for toxicity analysis by the AI engine
     """
-    if not comment_instance.content or getattr(comment_instance, '_ai_processing', False):
+    if not comment_instance.content:
         return
     
     try:
-        # Prevent recursive signal triggering
-        comment_instance._ai_processing = True
-        
-        # Call AI engine for toxicity analysis
-        toxicity_result = AIService.analyze_toxicity(comment_instance.content, comment_instance.author)
-        
-        if 'error' not in toxicity_result:
-            # Update comment with toxicity analysis
-            toxicity_score = toxicity_result.get('toxicity_score', 0)
-            
-            # Update the comment without triggering signals again
-            Comment.objects.filter(id=comment_instance.id).update(
-                toxicity_score=toxicity_score
-            )
-            
-            # Auto-remove high toxicity comments
-            if toxicity_score > 0.8:
-                print(f"🚨 High toxicity comment removed (Score: {toxicity_score}): Comment #{comment_instance.id}")
-                Comment.objects.filter(id=comment_instance.id).update(is_removed=True)
-            elif toxicity_score > 0.6:
-                print(f"⚠️ High toxicity comment flagged (Score: {toxicity_score}): Comment #{comment_instance.id}")
-                
+        AIJobQueue.enqueue(
+            'analyze_toxicity',
+            {'text': comment_instance.content},
+            target_app='SOCIAL',
+            requesting_user=comment_instance.author,
+            target=comment_instance,
+            callback='social.signals.apply_comment_toxicity'
+        )
     except Exception as e:
-        print(f"❌ Error analyzing comment toxicity: {e}")
-    finally:
-        # Clean up flag
-        if hasattr(comment_instance, '_ai_processing'):
-            delattr(comment_instance, '_ai_processing')
+        print(f"❌ Error queueing comment toxicity analysis: {e}")
+
+def apply_comment_toxicity(comment, toxicity_result):
+    """
+    Write toxicity analysis back onto the comment
+    """
+    toxicity_score = toxicity_result.get('toxicity_score', 0)
+    
+    # Update the comment without triggering signals again
+    Comment.objects.filter(id=comment.id).update(
+        toxicity_score=toxicity_score
+    )
+    
+    # Auto-remove high toxicity comments
+    if toxicity_score > 0.8:
+        print(f"🚨 High toxicity comment removed (Score: {toxicity_score}): Comment #{comment.id}")
+        Comment.objects.filter(id=comment.id).update(is_removed=True)
+    elif toxicity_score > 0.6:
+        print(f"⚠️ High toxicity comment flagged (Score: {toxicity_score}): Comment #{comment.id}")
 
 # ✅ AI ANALYSIS TO REPORT HANDLING
 
@@ -2,7 +2,8 @@ from django.contrib import admin
 from .models import (
     Bus, Driver, Route, BusStop, Trip, LocationUpdate,
     StudentTransport, AttendanceLog, MaintenanceLog,
-    NotificationPreference, EmergencyAlert
+    NotificationPreference, EmergencyAlert, GPSDevice, TripTrack, RouteEtaProfile,
+    GeocodeCacheEntry, Geofence, GeofenceEvent
 )
 
 @admin.register(Bus)
@@ -20,6 +21,9 @@ class BusAdmin(admin.ModelAdmin):
         ('Status & Assignment', {
             'fields': ('status', 'fuel_type', 'current_driver', 'current_route')
         }),
+        ('GPS', {
+            'fields': ('gps_device_id', 'gps_status', 'last_gps_update')
+        }),
         ('Maintenance', {
             'fields': ('last_maintenance_date', 'next_maintenance_date', 'mileage', 'insurance_expiry')
         }),
@@ -32,6 +36,13 @@ class BusAdmin(admin.ModelAdmin):
         })
     )
 
+@admin.register(GPSDevice)
+class GPSDeviceAdmin(admin.ModelAdmin):
+    list_display = ('device_id', 'bus', 'device_model', 'status', 'battery_level', 'last_communication')
+    list_filter = ('status', 'bus__school')
+    search_fields = ('device_id', 'imei_number', 'bus__bus_number')
+    readonly_fields = ('created_at', 'updated_at', 'last_communication')
+
 @admin.register(Driver)
 class DriverAdmin(admin.ModelAdmin):
     list_display = ('user', 'license_number', 'license_type', 'license_expiry', 'is_active', 'assigned_bus')
@@ -121,7 +132,7 @@ class TripAdmin(admin.ModelAdmin):
             'fields': ('current_latitude', 'current_longitude', 'last_location_update')
         }),
         ('Metrics', {
-            'fields': ('students_onboard', 'average_speed')
+            'fields': ('students_onboard', 'average_speed', 'max_speed', 'distance_traveled')
         }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at'),
@@ -129,6 +140,40 @@ class TripAdmin(admin.ModelAdmin):
         })
     )
 
+@admin.register(TripTrack)
+class TripTrackAdmin(admin.ModelAdmin):
+    list_display = ('trip', 'point_count', 'raw_point_count', 'distance_km', 'interval_seconds', 'started_at')
+    list_filter = ('trip__bus__school',)
+    search_fields = ('trip__bus__bus_number', 'trip__route__name')
+    readonly_fields = ('created_at', 'points')
+
+@admin.register(RouteEtaProfile)
+class RouteEtaProfileAdmin(admin.ModelAdmin):
+    list_display = ('route', 'trip_count', 'bucket_minutes', 'built_at')
+    list_filter = ('route__school',)
+    search_fields = ('route__name', 'route__route_number')
+    readonly_fields = ('built_at', 'stop_ids', 'segment_seconds', 'segment_default_seconds', 'segment_samples')
+
+@admin.register(Geofence)
+class GeofenceAdmin(admin.ModelAdmin):
+    list_display = ('name', 'school', 'kind', 'shape', 'radius_meters', 'is_active')
+    list_filter = ('kind', 'shape', 'is_active', 'school')
+    search_fields = ('name',)
+    list_editable = ('is_active',)
+
+@admin.register(GeofenceEvent)
+class GeofenceEventAdmin(admin.ModelAdmin):
+    list_display = ('trip', 'event_type', 'bus_stop', 'geofence', 'occurred_at')
+    list_filter = ('event_type',)
+    readonly_fields = ('trip', 'bus_stop', 'geofence', 'event_type', 'latitude', 'longitude', 'occurred_at')
+
+@admin.register(GeocodeCacheEntry)
+class GeocodeCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ('key', 'kind', 'created_at')
+    list_filter = ('kind',)
+    search_fields = ('key',)
+    readonly_fields = ('created_at',)
+
 @admin.register(LocationUpdate)
 class LocationUpdateAdmin(admin.ModelAdmin):
     list_display = ('trip', 'latitude', 'longitude', 'speed', 'created_at')
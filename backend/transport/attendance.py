@@ -0,0 +1,169 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import serializers
+
+from .models import Trip, BusStop, AttendanceLog, StudentTransport, GeofenceEvent
+
+User = get_user_model()
+
+
+class AttendanceError(Exception):
+    pass
+
+
+class BulkAttendanceService:
+    # Records a stop's worth of attendance at a constant number of queries: one student lookup,
+    # one idempotency-key lookup, one bulk insert and one students_onboard update.
+    # Batches for a trip are serialized on the trip row, so retries and concurrent submissions
+    # can't double count. Notifications are queued once per batch after commit.
+
+    @staticmethod
+    def entry_key(idempotency_key, entry):
+        # Per-row key: the entry's own, else derived from the batch key and the student
+        if entry.get('idempotency_key'):
+            return str(entry['idempotency_key'])[:100]
+        if idempotency_key:
+            return f"{idempotency_key}:{entry.get('student_id')}"[:100]
+        return None
+
+    @staticmethod
+    def mark(trip_id, bus_stop_id, attendance_type, entries, marked_by, idempotency_key=None):
+        # Returns {'created_count', 'duplicate_count', 'invalid_students'}; raises Trip.DoesNotExist
+        # for an unknown trip and AttendanceError for a bad stop, attendance type or is_present value
+        if attendance_type not in AttendanceLog.AttendanceType.values:
+            raise AttendanceError('Invalid attendance_type')
+
+        # Strings such as "false" or "0" from form posts are parsed, not taken as truthy
+        presence = []
+        parse_boolean = serializers.BooleanField().to_internal_value
+        for entry in entries:
+            try:
+                value = entry.get('is_present')
+                presence.append(False if value is None else parse_boolean(value))
+            except serializers.ValidationError:
+                raise AttendanceError(f"Invalid is_present value for student {entry.get('student_id')}")
+
+        student_ids = set()
+        for entry in entries:
+            try:
+                student_ids.add(int(entry.get('student_id')))
+            except (TypeError, ValueError):
+                continue
+        students = set(User.objects.filter(id__in=student_ids, role=User.Role.STUDENT).values_list('id', flat=True))
+
+        now = timezone.now()
+        with transaction.atomic():
+            trip = Trip.objects.select_for_update().get(id=trip_id)
+            if not BusStop.objects.filter(id=bus_stop_id, route_id=trip.route_id).exists():
+                raise AttendanceError('Invalid bus stop')
+
+            keys = [BulkAttendanceService.entry_key(idempotency_key, entry) for entry in entries]
+            seen = set(AttendanceLog.objects.filter(
+                trip_id=trip.id,
+                idempotency_key__in=[key for key in keys if key]
+            ).values_list('idempotency_key', flat=True)) if any(keys) else set()
+
+            logs = []
+            invalid = []
+            duplicates = 0
+            for entry, key, is_present in zip(entries, keys, presence):
+                try:
+                    student_id = int(entry.get('student_id'))
+                except (TypeError, ValueError):
+                    student_id = None
+                if student_id not in students:
+                    invalid.append(entry.get('student_id'))
+                    continue
+                if key and key in seen:
+                    duplicates += 1
+                    continue
+                if key:
+                    seen.add(key)
+
+                logs.append(AttendanceLog(
+                    trip_id=trip.id,
+                    student_id=student_id,
+                    bus_stop_id=bus_stop_id,
+                    attendance_type=attendance_type,
+                    scheduled_time=now,
+                    actual_time=now if is_present else None,
+                    is_present=is_present,
+                    marked_by=marked_by,
+                    notes=entry.get('notes', '') or '',
+                    idempotency_key=key,
+                    created_at=now
+                ))
+
+            AttendanceLog.objects.bulk_create(logs, batch_size=500)
+
+            present = [log for log in logs if log.is_present]
+            delta = len(present) if attendance_type == AttendanceLog.AttendanceType.PICKUP else -len(present)
+            if delta:
+                Trip.objects.filter(id=trip.id).update(students_onboard=F('students_onboard') + delta)
+                # update() skips reset_trip_gps_state; live frames read the count from the cached state
+                from .ingestion import GPSIngestionService
+                transaction.on_commit(lambda: GPSIngestionService.clear_state(trip.id))
+
+            if present:
+                from .tasks import send_attendance_notifications
+                actual_times = {log.student_id: log.actual_time for log in present}
+                transaction.on_commit(lambda: send_attendance_notifications(
+                    trip.id, bus_stop_id, attendance_type, actual_times
+                ))
+
+        return {
+            'created_count': len(logs),
+            'duplicate_count': duplicates,
+            'invalid_students': invalid,
+        }
+
+
+class AttendanceSuggestionService:
+    # Who the driver should mark at the stop the bus most recently reached (geofence ENTER/DWELL):
+    # the stop's active assignments without an attendance log of the trip's type yet
+
+    @staticmethod
+    def for_trip(trip):
+        event = GeofenceEvent.objects.filter(
+            trip_id=trip.id,
+            bus_stop__isnull=False,
+            event_type__in=[GeofenceEvent.EventType.ENTER, GeofenceEvent.EventType.DWELL]
+        ).select_related('bus_stop').first()
+        if event is None:
+            return None
+
+        attendance_type = (
+            AttendanceLog.AttendanceType.DROPOFF
+            if trip.trip_type == Trip.TripType.EVENING_DROPOFF
+            else AttendanceLog.AttendanceType.PICKUP
+        )
+        pending = StudentTransport.objects.filter(
+            route_id=trip.route_id,
+            bus_stop_id=event.bus_stop_id,
+            is_active=True
+        ).exclude(
+            student_id__in=AttendanceLog.objects.filter(
+                trip_id=trip.id, attendance_type=attendance_type
+            ).values('student_id')
+        ).select_related('student')
+        left = GeofenceEvent.objects.filter(
+            trip_id=trip.id,
+            bus_stop_id=event.bus_stop_id,
+            event_type=GeofenceEvent.EventType.EXIT,
+            occurred_at__gte=event.occurred_at
+        ).exists()
+
+        return {
+            'bus_stop': {'id': event.bus_stop_id, 'name': event.bus_stop.name},
+            'at_stop': not left,
+            'arrived_at': event.occurred_at.isoformat(),
+            'attendance_type': attendance_type,
+            # Submitting the batch with this key makes retries of it harmless (see bulk_mark_attendance)
+            'idempotency_key': f"geofence-{trip.id}-{event.bus_stop_id}-{attendance_type}",
+            'students': [
+                {'student_id': assignment.student_id, 'name': assignment.student.get_display_name()}
+                for assignment in pending
+            ],
+        }
@@ -1,16 +1,66 @@
 import json
 import asyncio
+from datetime import datetime, timezone as dt_timezone
+from urllib.parse import parse_qs
+
+import msgpack
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from .models import Trip, LocationUpdate
+from .models import Trip
+from .live import LivePositionService, from_wire, merge_frames
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
-class BusTrackingConsumer(AsyncWebsocketConsumer):
+
+class CoalescingSenderMixin:
+    # Per-socket outbox for position frames. Frames for the same trip that arrive while the client is
+    # still receiving earlier ones are merged (msgpack deltas) or replaced (JSON), so a slow client
+    # gets the latest position instead of a growing backlog.
+    # Clients opt into msgpack deltas with ?format=msgpack; everyone else gets JSON.
+
+    def setup_outbox(self):
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.binary = query.get('format', [''])[0] == 'msgpack'
+        self.pending = {}
+        self.drain_task = None
+        self.frames_sent = 0
+        self.frames_coalesced = 0
+
+    def enqueue_frame(self, event):
+        key = event['key']
+        frame = event['bytes'] if self.binary else event['text']
+        previous = self.pending.get(key)
+        if previous is not None:
+            self.frames_coalesced += 1
+            if self.binary:
+                frame = merge_frames(previous, frame)
+        self.pending[key] = frame
+
+        if self.drain_task is None or self.drain_task.done():
+            self.drain_task = asyncio.ensure_future(self.drain_outbox())
+
+    async def drain_outbox(self):
+        while self.pending:
+            key = next(iter(self.pending))
+            frame = self.pending.pop(key)
+            if self.binary:
+                await self.send(bytes_data=frame)
+            else:
+                await self.send(text_data=frame)
+            self.frames_sent += 1
+
+    def close_outbox(self):
+        if self.drain_task is not None and not self.drain_task.done():
+            self.drain_task.cancel()
+        self.pending = {}
+
+
+class BusTrackingConsumer(CoalescingSenderMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.trip_id = self.scope['url_route']['kwargs']['trip_id']
         self.trip_group_name = f'trip_{self.trip_id}'
+        self.setup_outbox()
         
         # Verify user has permission to access this trip
         if await self.verify_access():
@@ -32,15 +82,16 @@ class BusTrackingConsumer(AsyncWebsocketConsumer):
     
     async def disconnect(self, close_code):
         # Leave trip group
+        self.close_outbox()
         await self.channel_layer.group_discard(
             self.trip_group_name,
             self.channel_name
         )
     
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         # Receive message from WebSocket (for driver updates)
         try:
-            data = json.loads(text_data)
+            data = json.loads(text_data) if text_data is not None else msgpack.unpackb(bytes_data)
             message_type = data.get('type')
             
             if message_type == 'location_update':
@@ -56,39 +107,23 @@ class BusTrackingConsumer(AsyncWebsocketConsumer):
                     }
                 )
                 
-        except json.JSONDecodeError:
+        except (json.JSONDecodeError, msgpack.ExtraData, msgpack.FormatError, ValueError):
             await self.send(text_data=json.dumps({
                 'error': 'Invalid JSON format'
             }))
     
     async def handle_location_update(self, location_data):
-        # Process and broadcast location update
-        # Save to database
+        # Save through the shared ingestion path, which also broadcasts the fix to trip and school groups
         location_update = await self.save_location_update(location_data)
         
-        if location_update:
-            # Broadcast to all connected clients
-            await self.channel_layer.group_send(
-                self.trip_group_name,
-                {
-                    'type': 'location_update',
-                    'data': {
-                        'latitude': float(location_data['latitude']),
-                        'longitude': float(location_data['longitude']),
-                        'speed': float(location_data.get('speed', 0)),
-                        'heading': float(location_data.get('heading', 0)),
-                        'accuracy': float(location_data.get('accuracy', 0)),
-                        'timestamp': location_update.created_at.isoformat()
-                    }
-                }
-            )
+        if location_update is None:
+            await self.send(text_data=json.dumps({
+                'error': 'Location update rejected'
+            }))
     
     async def location_update(self, event):
-        # Receive location update from group
-        await self.send(text_data=json.dumps({
-            'type': 'location_update',
-            'data': event['data']
-        }))
+        # Receive location update from group (pre-encoded by LivePositionService)
+        self.enqueue_frame(event)
     
     async def trip_status_update(self, event):
         # Receive trip status update from group
@@ -97,6 +132,13 @@ class BusTrackingConsumer(AsyncWebsocketConsumer):
             'data': event['data']
         }))
     
+    async def geofence_event(self, event):
+        # Bus entered, left or is waiting at a stop or school zone; drivers fetch attendance suggestions
+        await self.send(text_data=json.dumps({
+            'type': 'geofence',
+            'data': event['data']
+        }))
+    
     @database_sync_to_async
     def verify_access(self):
         # Verify user has permission to access this trip
@@ -139,8 +181,9 @@ class BusTrackingConsumer(AsyncWebsocketConsumer):
             trip = Trip.objects.select_related('bus', 'route', 'driver__user').get(id=self.trip_id)
             
             # Get recent location updates
-            recent_updates = LocationUpdate.objects.filter(
-                trip=trip
+            from .tracks import LocationPartitionService
+            recent_updates = LocationPartitionService.trip_updates(
+                trip
             ).order_by('-created_at')[:10]
             
             location_history = [
@@ -172,43 +215,40 @@ class BusTrackingConsumer(AsyncWebsocketConsumer):
     
     @database_sync_to_async
     def save_location_update(self, location_data):
-        # Save location update to database
+        # Save location update through the shared GPS ingestion path (only the trip's driver)
+        from django.conf import settings
+        from .ingestion import GPSIngestionService
+        from .serializers import LiveLocationSerializer
+        from .services import GPSService
+        
+        # Same checks as GPSLocationUpdateView
+        serializer = LiveLocationSerializer(data=location_data)
+        if not serializer.is_valid():
+            return None
+        location_data = serializer.validated_data
+        
+        is_valid, _ = GPSService.validate_coordinates(location_data['latitude'], location_data['longitude'])
+        if not is_valid:
+            return None
+        if (location_data.get('accuracy') and
+                location_data['accuracy'] > getattr(settings, 'MIN_GPS_ACCURACY', 50)):
+            return None
+        if not location_data.get('device_id'):
+            location_data['device_id'] = 'mobile_app'
+        
         try:
-            trip = Trip.objects.get(id=self.trip_id)
-            
-            # Create location update
-            location_update = LocationUpdate.objects.create(
-                trip=trip,
-                latitude=location_data['latitude'],
-                longitude=location_data['longitude'],
-                speed=location_data.get('speed'),
-                heading=location_data.get('heading'),
-                accuracy=location_data.get('accuracy'),
-                altitude=location_data.get('altitude'),
-                device_id=location_data.get('device_id', '')
-            )
-            
-            # Update trip's current location
-            trip.current_latitude = location_data['latitude']
-            trip.current_longitude = location_data['longitude']
-            trip.last_location_update = location_update.created_at
-            
-            if location_data.get('speed'):
-                trip.average_speed = location_data['speed']
-                trip.max_speed = max(trip.max_speed or 0, location_data['speed'])
-            
-            trip.save()
-            
-            return location_update
+            result = GPSIngestionService.ingest(self.trip_id, location_data, user=self.scope['user'])
+            return result['location_update']
             
         except Trip.DoesNotExist:
             return None
 
-class SchoolTrackingConsumer(AsyncWebsocketConsumer):
+class SchoolTrackingConsumer(CoalescingSenderMixin, AsyncWebsocketConsumer):
     # WebSocket for school-wide bus tracking 
     async def connect(self):
         self.school_id = self.scope['user'].school_id
         self.school_group_name = f'school_{self.school_id}'
+        self.setup_outbox()
         
         if self.scope['user'].is_authenticated:
             await self.channel_layer.group_add(
@@ -217,8 +257,16 @@ class SchoolTrackingConsumer(AsyncWebsocketConsumer):
             )
             await self.accept()
             
-            # Send initial bus locations
-            bus_locations = await self.get_active_bus_locations()
+            # Send initial bus locations from the live snapshot (the database only when Redis is down)
+            frames = await database_sync_to_async(LivePositionService.get_snapshot)(self.school_id)
+            if frames is not None and self.binary:
+                await self.send(bytes_data=msgpack.packb({'s': frames}))
+                return
+
+            if frames is not None:
+                bus_locations = [self.snapshot_location(frame) for frame in frames]
+            else:
+                bus_locations = await self.get_active_bus_locations()
             await self.send(text_data=json.dumps({
                 'type': 'initial_locations',
                 'data': bus_locations
@@ -227,17 +275,15 @@ class SchoolTrackingConsumer(AsyncWebsocketConsumer):
             await self.close()
     
     async def disconnect(self, close_code):
+        self.close_outbox()
         await self.channel_layer.group_discard(
             self.school_group_name,
             self.channel_name
         )
     
     async def bus_location_update(self, event):
-        # Receive bus location update for school
-        await self.send(text_data=json.dumps({
-            'type': 'bus_location',
-            'data': event['data']
-        }))
+        # Receive bus location update for school (pre-encoded by LivePositionService)
+        self.enqueue_frame(event)
     
     async def trip_status_change(self, event):
         # Receive trip status change
@@ -246,6 +292,23 @@ class SchoolTrackingConsumer(AsyncWebsocketConsumer):
             'data': event['data']
         }))
     
+    async def geofence_event(self, event):
+        # Stop and zone events of the school's buses
+        await self.send(text_data=json.dumps({
+            'type': 'geofence',
+            'data': event['data']
+        }))
+    
+    @staticmethod
+    def snapshot_location(frame):
+        # Snapshot wire frame -> the JSON shape of get_active_bus_locations
+        position = from_wire(frame)
+        timestamp = position.pop('timestamp', None)
+        position['last_update'] = (
+            datetime.fromtimestamp(timestamp, tz=dt_timezone.utc).isoformat() if timestamp else None
+        )
+        return position
+    
     @database_sync_to_async
     def get_active_bus_locations(self):
         # Get locations of all active buses in school
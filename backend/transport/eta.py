@@ -0,0 +1,246 @@
+import time
+import logging
+import threading
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Route, BusStop, TripTrack, RouteEtaProfile
+from .services import GPSService
+from .stop_index import RouteStopIndex
+
+logger = logging.getLogger(__name__)
+
+# Speed assumed for segments no trip has been recorded on (km/h)
+DEFAULT_SEGMENT_SPEED = 30
+
+# A track passes a stop at its closest point within this distance (km); tracks are ~30 s apart
+PASSAGE_DISTANCE = 0.3
+
+# Segment times above this are GPS gaps or parked buses, not travel (seconds)
+MAX_SEGMENT_SECONDS = 60 * 60
+
+
+def stop_passages(index, points):
+    # Seconds (track offsets) at which a TripTrack's points pass each stop of `index`, in route
+    # order; None for stops the track never came near. Stops are matched strictly forward in time.
+    passages = [None] * len(index)
+    if not points or not len(index):
+        return passages
+
+    track = np.asarray(points, dtype=np.float64)
+    offsets = track[:, 0]
+    px = (track[:, 2] - index.origin_lng) * index.x_scale
+    py = (track[:, 1] - index.origin_lat) * index.y_scale
+
+    cursor = 0
+    for stop in range(len(index)):
+        distances = np.hypot(px[cursor:] - index.x[stop], py[cursor:] - index.y[stop])
+        within = np.flatnonzero(distances <= PASSAGE_DISTANCE)
+        if not len(within):
+            continue
+        # Closest point of the first visit, not of any later one (loops, out-and-back routes)
+        first = within[0]
+        leaving = np.flatnonzero(distances[first:] > PASSAGE_DISTANCE)
+        end = first + leaving[0] if len(leaving) else len(distances)
+        closest = first + int(np.argmin(distances[first:end]))
+        passages[stop] = float(offsets[cursor + closest])
+        cursor += closest
+    return passages
+
+
+class EtaProfileBuilder:
+    # Learns per-segment travel times by time of day from finished trips' tracks
+
+    @staticmethod
+    def bucket_count(bucket_minutes):
+        return (24 * 60) // bucket_minutes
+
+    @staticmethod
+    def bucket_of(moment, bucket_minutes):
+        local = timezone.localtime(moment)
+        return (local.hour * 60 + local.minute) // bucket_minutes
+
+    @staticmethod
+    def build(index, tracks, bucket_minutes=None, min_samples=None):
+        # RouteEtaProfile field values for one route from an iterable of TripTracks
+        if bucket_minutes is None:
+            bucket_minutes = getattr(settings, 'GPS_ETA_BUCKET_MINUTES', 60)
+        if min_samples is None:
+            min_samples = getattr(settings, 'GPS_ETA_MIN_SAMPLES', 3)
+
+        buckets = EtaProfileBuilder.bucket_count(bucket_minutes)
+        samples = [[[] for _ in range(buckets)] for _ in range(index.segment_count)]
+        trip_count = 0
+
+        for track in tracks:
+            if not track.started_at:
+                continue
+            passages = stop_passages(index, track.points)
+            used = False
+            for segment in range(index.segment_count):
+                start, end = passages[segment], passages[segment + 1]
+                if start is None or end is None or not 0 < end - start <= MAX_SEGMENT_SECONDS:
+                    continue
+                bucket = EtaProfileBuilder.bucket_of(track.started_at + timedelta(seconds=start), bucket_minutes)
+                samples[segment][bucket].append(end - start)
+                used = True
+            trip_count += used
+
+        segment_seconds = []
+        segment_default_seconds = []
+        segment_samples = []
+        for by_bucket in samples:
+            segment_seconds.append([
+                round(float(np.median(values))) if len(values) >= min_samples else None
+                for values in by_bucket
+            ])
+            everything = [value for values in by_bucket for value in values]
+            segment_default_seconds.append(round(float(np.median(everything))) if everything else None)
+            segment_samples.append(len(everything))
+
+        return {
+            'stop_ids': [stop.id for stop in index.stops],
+            'bucket_minutes': bucket_minutes,
+            'segment_seconds': segment_seconds,
+            'segment_default_seconds': segment_default_seconds,
+            'segment_samples': segment_samples,
+            'trip_count': trip_count,
+        }
+
+    @staticmethod
+    def route_tracks(route_id, since, until=None):
+        tracks = TripTrack.objects.filter(trip__route_id=route_id, started_at__gte=since).only(
+            'started_at', 'points'
+        )
+        if until is not None:
+            tracks = tracks.filter(started_at__lt=until)
+        return tracks
+
+    @staticmethod
+    def rebuild_route(route_id, history_days=None):
+        if history_days is None:
+            history_days = getattr(settings, 'GPS_ETA_HISTORY_DAYS', 28)
+
+        stops = list(BusStop.objects.filter(route_id=route_id).order_by('sequence'))
+        if len(stops) < 2:
+            RouteEtaProfile.objects.filter(route_id=route_id).delete()
+            return None
+
+        index = RouteStopIndex(route_id, stops)
+        since = timezone.now() - timedelta(days=history_days)
+        values = EtaProfileBuilder.build(index, EtaProfileBuilder.route_tracks(route_id, since).iterator())
+        values['built_at'] = timezone.now()
+        profile, _ = RouteEtaProfile.objects.update_or_create(route_id=route_id, defaults=values)
+        return profile
+
+    @staticmethod
+    def rebuild_all():
+        # Nightly: one profile per active route; returns how many were built
+        built = 0
+        for route_id in Route.objects.filter(status=Route.RouteStatus.ACTIVE).values_list('id', flat=True):
+            try:
+                if EtaProfileBuilder.rebuild_route(route_id):
+                    built += 1
+            except Exception as e:
+                logger.error(f"Could not build ETA profile for route {route_id}: {str(e)}")
+        return built
+
+
+class EtaTable:
+    # Runtime form of a RouteEtaProfile: a full (bucket x segment) matrix of seconds, gaps filled with
+    # the segment's all-day median or its length at DEFAULT_SEGMENT_SPEED, plus cumulative sums so the
+    # time between any two stops is one subtraction.
+
+    def __init__(self, index, profile):
+        self.bucket_minutes = profile['bucket_minutes']
+        buckets = EtaProfileBuilder.bucket_count(self.bucket_minutes)
+
+        fallback = index.segment_lengths / DEFAULT_SEGMENT_SPEED * 3600
+        seconds = np.empty((buckets, index.segment_count), dtype=np.float64)
+        for segment in range(index.segment_count):
+            default = profile['segment_default_seconds'][segment]
+            if default is None:
+                default = fallback[segment]
+            for bucket, value in enumerate(profile['segment_seconds'][segment]):
+                seconds[bucket, segment] = default if value is None else value
+
+        self.seconds = seconds
+        self.cumulative = np.concatenate([np.zeros((buckets, 1)), np.cumsum(seconds, axis=1)], axis=1)
+
+    def estimate(self, index, target, distance_km, moment):
+        # (seconds to stop `target`, seconds to the final stop) for a bus `distance_km` short of `target`
+        bucket = EtaProfileBuilder.bucket_of(moment, self.bucket_minutes)
+        segment = target - 1
+        length = index.segment_lengths[segment]
+        fraction = min(1.0, distance_km / length) if length > 0 else 0.0
+
+        to_target = fraction * self.seconds[bucket, segment]
+        final = len(index) - 1
+        return to_target, to_target + self.cumulative[bucket, final] - self.cumulative[bucket, target]
+
+
+class EtaProfileCache:
+    # Process-level EtaTable per route (None when the route has no usable profile),
+    # reloaded after GPS_ETA_PROFILE_TTL seconds so nightly rebuilds are picked up
+    _entries = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get(index):
+        now = time.monotonic()
+        entry = EtaProfileCache._entries.get(index.route_id)
+        if entry and entry[0] > now and entry[1] is index:
+            return entry[2]
+
+        table = None
+        profile = RouteEtaProfile.objects.filter(route_id=index.route_id).values(
+            'stop_ids', 'bucket_minutes', 'segment_seconds', 'segment_default_seconds'
+        ).first()
+        # A profile built for a different stop list would attribute times to the wrong segments
+        if profile and profile['stop_ids'] == [stop.id for stop in index.stops]:
+            table = EtaTable(index, profile)
+
+        ttl = getattr(settings, 'GPS_ETA_PROFILE_TTL', 600)
+        with EtaProfileCache._lock:
+            EtaProfileCache._entries[index.route_id] = (now + ttl, index, table)
+        return table
+
+    @staticmethod
+    def invalidate(route_id=None):
+        with EtaProfileCache._lock:
+            if route_id is None:
+                EtaProfileCache._entries.clear()
+            else:
+                EtaProfileCache._entries.pop(route_id, None)
+
+
+class EtaService:
+
+    @staticmethod
+    def target_position(index, next_stop, segment):
+        # Route position of `next_stop`; on a loop, heading back to stop 0 means heading to the final stop
+        target = index.positions[next_stop.id]
+        if target == 0 and index.is_loop and segment:
+            return len(index) - 1
+        return target
+
+    @staticmethod
+    def estimate(index, next_stop, distance_km, segment, latitude, longitude, speed, moment, table=None):
+        # (minutes to next_stop, minutes to the final stop). Uses the route's learned profile and falls
+        # back to straight-line distance over the current speed without one, or before the first stop.
+        if table is None:
+            table = EtaProfileCache.get(index)
+        target = EtaService.target_position(index, next_stop, segment)
+
+        if table is not None and target > 0:
+            to_next, to_final = table.estimate(index, target, distance_km, moment)
+            return max(1, round(to_next / 60)), max(1, round(to_final / 60))
+
+        final_stop = index.final_stop
+        return (
+            GPSService.calculate_eta(latitude, longitude, float(next_stop.latitude), float(next_stop.longitude), speed),
+            GPSService.calculate_eta(latitude, longitude, float(final_stop.latitude), float(final_stop.longitude), speed),
+        )
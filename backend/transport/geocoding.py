@@ -0,0 +1,266 @@
+import time
+import hashlib
+import logging
+import threading
+from datetime import timedelta
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.utils import timezone
+
+from ai_engine.cache import LocalLRUCache
+from .models import GeocodeCacheEntry
+
+logger = logging.getLogger(__name__)
+
+# Marks a cached "nothing found" in the LRU, where None means "not cached"
+NOT_FOUND = {'found': False}
+
+
+class GeoRateLimitError(Exception):
+    pass
+
+
+class GeoUpstreamError(Exception):
+    # Network error or non-200 answer; unlike an empty result this is never cached
+    pass
+
+
+class TokenBucket:
+    # Process-wide limiter for upstream calls: refills `rate` tokens per second up to `burst`;
+    # callers wait up to `wait` seconds for a token, then fail fast
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, wait=0):
+        deadline = time.monotonic() + wait
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                shortfall = (1 - self._tokens) / self.rate
+            if now + shortfall > deadline:
+                raise GeoRateLimitError("Geocoding rate limit reached")
+            time.sleep(shortfall)
+
+
+_session = None
+_session_lock = threading.Lock()
+_limiters = {}
+_local_cache = LocalLRUCache(getattr(settings, 'GEO_CACHE_LOCAL_MAX_ENTRIES', 4096))
+
+
+def _http():
+    # One pooled session per process (keep-alive to Nominatim/OSRM)
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=getattr(settings, 'GEO_HTTP_POOL_SIZE', 10))
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                # Nominatim's usage policy requires an identifying User-Agent
+                session.headers['User-Agent'] = getattr(settings, 'GEO_USER_AGENT', 'SkillXP-Transport/1.0')
+                _session = session
+    return _session
+
+
+def _limiter(upstream):
+    if upstream not in _limiters:
+        with _session_lock:
+            if upstream not in _limiters:
+                rates = getattr(settings, 'GEO_RATE_LIMITS', {})
+                rate, burst = rates.get(upstream, (1, 1))
+                _limiters[upstream] = TokenBucket(rate, burst)
+    return _limiters[upstream]
+
+
+class GeoService:
+    # Nominatim geocoding and OSRM routing behind a process LRU and the geocode_cache table.
+    # Upstream calls share a pooled session with timeouts and a per-upstream token bucket.
+    # GEO_NOMINATIM_URL / GEO_OSRM_URL can point at `manage.py geo_stub_server` for tests.
+
+    @staticmethod
+    def normalize_address(address):
+        return ' '.join(address.lower().replace(',', ' ').split())
+
+    @staticmethod
+    def round_coordinate(value):
+        return round(float(value), getattr(settings, 'GEO_COORDINATE_PRECISION', 5))
+
+    @staticmethod
+    def make_key(kind, value):
+        key = f"{kind.lower()}:{value}"
+        if len(key) > 255:
+            key = f"{kind.lower()}:sha1:{hashlib.sha1(value.encode('utf-8')).hexdigest()}"
+        return key
+
+    @staticmethod
+    def request(upstream, path, params, wait=None):
+        # GET against an upstream ('nominatim' or 'osrm'); returns parsed JSON.
+        # Raises GeoRateLimitError when no token is free within `wait` seconds (default GEO_RATE_LIMIT_WAIT),
+        # GeoUpstreamError when the call fails.
+        base = getattr(settings, 'GEO_NOMINATIM_URL' if upstream == 'nominatim' else 'GEO_OSRM_URL')
+        if wait is None:
+            wait = getattr(settings, 'GEO_RATE_LIMIT_WAIT', 2)
+        _limiter(upstream).acquire(wait)
+        try:
+            response = _http().get(
+                f"{base.rstrip('/')}/{path.lstrip('/')}",
+                params=params,
+                timeout=getattr(settings, 'GEO_HTTP_TIMEOUT', (3, 10))
+            )
+            # OSRM answers "no route" with HTTP 400 and a JSON code
+            if response.status_code == 400 and upstream == 'osrm':
+                return response.json()
+            response.raise_for_status()
+            return response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise GeoUpstreamError(f"{upstream} request failed: {str(e)}")
+
+    @staticmethod
+    def cached(keys):
+        # {key: result or NOT_FOUND} for keys found in the LRU or the table (one query for the rest)
+        found = {}
+        missing = []
+        for key in keys:
+            value = _local_cache.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+        if not missing:
+            return found
+
+        now = timezone.now()
+        ttl = timedelta(days=getattr(settings, 'GEO_CACHE_TTL_DAYS', 90))
+        negative_ttl = timedelta(seconds=getattr(settings, 'GEO_CACHE_NEGATIVE_TTL', 60 * 60 * 24))
+        for key, result, created_at in GeocodeCacheEntry.objects.filter(key__in=missing).values_list(
+            'key', 'result', 'created_at'
+        ):
+            if created_at < now - (ttl if result is not None else negative_ttl):
+                continue
+            value = result if result is not None else NOT_FOUND
+            found[key] = value
+            _local_cache.set(key, value, getattr(settings, 'GEO_CACHE_LOCAL_TTL', 60 * 60))
+        return found
+
+    @staticmethod
+    def store(kind, results):
+        # results: {key: result or None}; replaces expired rows, keeps rows another worker just wrote
+        if not results:
+            return
+        for key, result in results.items():
+            _local_cache.set(key, result if result is not None else NOT_FOUND, getattr(settings, 'GEO_CACHE_LOCAL_TTL', 60 * 60))
+        try:
+            GeocodeCacheEntry.objects.filter(key__in=list(results)).delete()
+            GeocodeCacheEntry.objects.bulk_create(
+                [GeocodeCacheEntry(kind=kind, key=key, result=result) for key, result in results.items()],
+                ignore_conflicts=True
+            )
+        except Exception as e:
+            logger.error(f"Could not store {len(results)} geocode cache entries: {str(e)}")
+
+    @staticmethod
+    def _lookup(kind, key, fetch):
+        value = GeoService.cached([key]).get(key)
+        if value is None:
+            result = fetch()
+            GeoService.store(kind, {key: result})
+            return result
+        return None if value == NOT_FOUND else value
+
+    @staticmethod
+    def _fetch_address(address, wait=None):
+        results = GeoService.request('nominatim', 'search', {'q': address, 'format': 'json', 'limit': 1}, wait=wait)
+        if not results:
+            return None
+        return {
+            'latitude': float(results[0]['lat']),
+            'longitude': float(results[0]['lon']),
+            'formatted_address': results[0]['display_name']
+        }
+
+    @staticmethod
+    def geocode(address):
+        # {'latitude', 'longitude', 'formatted_address'} or None
+        normalized = GeoService.normalize_address(address)
+        if not normalized:
+            return None
+        key = GeoService.make_key(GeocodeCacheEntry.Kind.GEOCODE, normalized)
+        return GeoService._lookup(GeocodeCacheEntry.Kind.GEOCODE, key, lambda: GeoService._fetch_address(normalized))
+
+    @staticmethod
+    def bulk_geocode(addresses):
+        # {address: result or None} for many addresses: duplicates collapse, cached ones cost one query,
+        # the rest go upstream one by one under the rate limit. Stops early (leaving None) after
+        # GEO_BULK_TIME_BUDGET seconds or when the limiter can't hand out a token in the time left, so
+        # a large import never holds a web worker past the budget; callers retry the unresolved ones.
+        normalized = {address: GeoService.normalize_address(address) for address in addresses if address}
+        keys = {value: GeoService.make_key(GeocodeCacheEntry.Kind.GEOCODE, value) for value in set(normalized.values()) if value}
+        found = GeoService.cached(list(keys.values()))
+
+        fetched = {}
+        deadline = time.monotonic() + getattr(settings, 'GEO_BULK_TIME_BUDGET', 10)
+        for value, key in keys.items():
+            if key in found:
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.info(f"Bulk geocoding left the rest for a retry after {len(fetched)} lookups")
+                break
+            try:
+                fetched[key] = GeoService._fetch_address(value, wait=min(getattr(settings, 'GEO_RATE_LIMIT_WAIT', 2), remaining))
+            except (GeoRateLimitError, GeoUpstreamError) as e:
+                logger.warning(f"Bulk geocoding stopped after {len(fetched)} lookups: {str(e)}")
+                break
+        GeoService.store(GeocodeCacheEntry.Kind.GEOCODE, fetched)
+        found.update({key: result if result is not None else NOT_FOUND for key, result in fetched.items()})
+
+        results = {}
+        for address in addresses:
+            value = found.get(keys.get(normalized.get(address)))
+            results[address] = None if value is None or value == NOT_FOUND else value
+        return results
+
+    @staticmethod
+    def reverse(latitude, longitude):
+        # Display name for a coordinate, or None
+        lat, lng = GeoService.round_coordinate(latitude), GeoService.round_coordinate(longitude)
+        key = GeoService.make_key(GeocodeCacheEntry.Kind.REVERSE, f"{lat},{lng}")
+
+        def fetch():
+            result = GeoService.request('nominatim', 'reverse', {'lat': lat, 'lon': lng, 'format': 'json'})
+            return {'display_name': result['display_name']} if result and result.get('display_name') else None
+
+        result = GeoService._lookup(GeocodeCacheEntry.Kind.REVERSE, key, fetch)
+        return result['display_name'] if result else None
+
+    @staticmethod
+    def route(origin_lat, origin_lng, dest_lat, dest_lng):
+        # OSRM driving route between two points: the first route of the response, or None
+        origin = f"{GeoService.round_coordinate(origin_lng)},{GeoService.round_coordinate(origin_lat)}"
+        destination = f"{GeoService.round_coordinate(dest_lng)},{GeoService.round_coordinate(dest_lat)}"
+        key = GeoService.make_key(GeocodeCacheEntry.Kind.ROUTE, f"{origin};{destination}")
+
+        def fetch():
+            data = GeoService.request('osrm', f"route/v1/driving/{origin};{destination}", {
+                'overview': 'full',
+                'geometries': 'geojson',
+                'steps': 'true'
+            })
+            if data.get('code') == 'Ok' and data.get('routes'):
+                return data['routes'][0]
+            return None
+
+        return GeoService._lookup(GeocodeCacheEntry.Kind.ROUTE, key, fetch)
@@ -0,0 +1,231 @@
+import math
+import time
+import logging
+import threading
+from collections import namedtuple
+
+import numpy as np
+from django.conf import settings
+
+from .models import BusStop, Route, Geofence, GeofenceEvent
+from .stop_index import EARTH_RADIUS_KM
+
+logger = logging.getLogger(__name__)
+
+# Fence kinds inside the engine. Stop fences come from BusStop rows: an ARRIVAL circle at the stop and
+# an APPROACH circle around it for "bus arriving soon" alerts; ZONE fences come from Geofence rows.
+ARRIVAL = 'arrival'
+APPROACH = 'approach'
+ZONE = 'zone'
+
+# key: 's<stop id>', 'a<stop id>' or 'g<geofence id>'; x/y/radii in km on the index's flat projection;
+# polygon: (n, 2) array of x/y vertices or None for circles
+Fence = namedtuple('Fence', 'key kind stop_id geofence_id x y radius exit_radius polygon')
+
+
+def _point_in_polygon(vertices, px, py):
+    # Ray casting over all edges at once
+    x, y = vertices[:, 0], vertices[:, 1]
+    nx, ny = np.roll(x, -1), np.roll(y, -1)
+    crosses = (y > py) != (ny > py)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        at_x = (nx - x) * (py - y) / (ny - y) + x
+    return bool(np.count_nonzero(crosses & (px < at_x)) % 2)
+
+
+def _distance_to_polygon(vertices, px, py):
+    # Distance (km) from a point to the nearest polygon edge
+    start = vertices
+    end = np.roll(vertices, -1, axis=0)
+    d = end - start
+    length_sq = (d ** 2).sum(axis=1)
+    r = np.array([px, py]) - start
+    t = np.clip(np.divide((r * d).sum(axis=1), length_sq, out=np.zeros_like(length_sq), where=length_sq > 0), 0, 1)
+    offsets = r - t[:, None] * d
+    return float(np.sqrt((offsets ** 2).sum(axis=1)).min())
+
+
+class GeofenceIndex:
+    # The fences a route's trips are checked against (its stops plus its school's Geofence rows),
+    # bucketed in a uniform grid of GEOFENCE_CELL_SIZE km. A fix only looks at the fences registered
+    # in its own cell, so per-ping cost depends on how many fences are nearby, not on the route size.
+
+    def __init__(self, route_id, stops, geofences):
+        self.route_id = route_id
+        self.cell_size = getattr(settings, 'GEOFENCE_CELL_SIZE', 250) / 1000
+        stop_radius = getattr(settings, 'GEOFENCE_STOP_RADIUS', 50) / 1000
+        approach_radius = getattr(settings, 'GEOFENCE_APPROACH_RADIUS', 1000) / 1000
+        margin = getattr(settings, 'GEOFENCE_EXIT_MARGIN', 20) / 1000
+
+        points = [(float(stop.latitude), float(stop.longitude)) for stop in stops]
+        for geofence in geofences:
+            if geofence.shape == Geofence.Shape.POLYGON:
+                points.extend((float(lat), float(lng)) for lat, lng in geofence.polygon)
+            elif geofence.latitude is not None:
+                points.append((float(geofence.latitude), float(geofence.longitude)))
+        self.origin_lat = float(np.mean([p[0] for p in points])) if points else 0.0
+        self.origin_lng = float(np.mean([p[1] for p in points])) if points else 0.0
+        self.x_scale = math.radians(1) * EARTH_RADIUS_KM * math.cos(math.radians(self.origin_lat))
+        self.y_scale = math.radians(1) * EARTH_RADIUS_KM
+
+        self.stop_positions = {stop.id: i for i, stop in enumerate(stops)}
+        self.fences = {}
+        self.cells = {}
+        for stop in stops:
+            x, y = self.project(float(stop.latitude), float(stop.longitude))
+            self._add(Fence(f"s{stop.id}", ARRIVAL, stop.id, None, x, y, stop_radius, stop_radius + margin, None))
+            self._add(Fence(f"a{stop.id}", APPROACH, stop.id, None, x, y, approach_radius, approach_radius + margin, None))
+        for geofence in geofences:
+            if geofence.shape == Geofence.Shape.POLYGON:
+                if len(geofence.polygon) < 3:
+                    continue
+                vertices = np.array([self.project(float(lat), float(lng)) for lat, lng in geofence.polygon])
+                x, y = vertices.mean(axis=0)
+                radius = float(np.sqrt(((vertices - [x, y]) ** 2).sum(axis=1)).max())
+                self._add(Fence(f"g{geofence.id}", ZONE, None, geofence.id, x, y, radius, radius + margin, vertices))
+            elif geofence.latitude is not None and geofence.longitude is not None:
+                x, y = self.project(float(geofence.latitude), float(geofence.longitude))
+                radius = geofence.radius_meters / 1000
+                self._add(Fence(f"g{geofence.id}", ZONE, None, geofence.id, x, y, radius, radius + margin, None))
+
+    def project(self, latitude, longitude):
+        return (longitude - self.origin_lng) * self.x_scale, (latitude - self.origin_lat) * self.y_scale
+
+    def cell_of(self, x, y):
+        return int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size))
+
+    def _add(self, fence):
+        # Registered in every cell its exit circle overlaps
+        self.fences[fence.key] = fence
+        low_x, low_y = self.cell_of(fence.x - fence.exit_radius, fence.y - fence.exit_radius)
+        high_x, high_y = self.cell_of(fence.x + fence.exit_radius, fence.y + fence.exit_radius)
+        for cx in range(low_x, high_x + 1):
+            for cy in range(low_y, high_y + 1):
+                self.cells.setdefault((cx, cy), []).append(fence.key)
+
+    def candidates(self, x, y):
+        return self.cells.get(self.cell_of(x, y), ())
+
+    def contains(self, fence, x, y, inside):
+        # Fences are left only past exit_radius (polygons: that far outside an edge), so GPS jitter
+        # around the boundary doesn't produce ENTER/EXIT pairs
+        distance = math.hypot(x - fence.x, y - fence.y)
+        if fence.polygon is None:
+            return distance <= (fence.exit_radius if inside else fence.radius)
+        if distance > fence.exit_radius:
+            return False
+        if _point_in_polygon(fence.polygon, x, y):
+            return True
+        return inside and _distance_to_polygon(fence.polygon, x, y) <= fence.exit_radius - fence.radius
+
+
+class GeofenceIndexCache:
+    # Process-level GeofenceIndex per route, expiring after GPS_STOP_INDEX_TTL seconds and dropped by the
+    # BusStop / Geofence signals in transport.signals
+    _entries = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get(route_id):
+        now = time.monotonic()
+        entry = GeofenceIndexCache._entries.get(route_id)
+        if entry and entry[0] > now:
+            return entry[1]
+
+        stops = list(BusStop.objects.filter(route_id=route_id).order_by('sequence'))
+        geofences = list(Geofence.objects.filter(
+            school_id__in=Route.objects.filter(id=route_id).values('school_id'),
+            is_active=True
+        ))
+        index = GeofenceIndex(route_id, stops, geofences)
+
+        ttl = getattr(settings, 'GPS_STOP_INDEX_TTL', 300)
+        with GeofenceIndexCache._lock:
+            GeofenceIndexCache._entries[route_id] = (now + ttl, index)
+        return index
+
+    @staticmethod
+    def invalidate(route_id=None):
+        with GeofenceIndexCache._lock:
+            if route_id is None:
+                GeofenceIndexCache._entries.clear()
+            else:
+                GeofenceIndexCache._entries.pop(route_id, None)
+
+
+class GeofenceEngine:
+    # Incremental fence evaluation for GPS ingestion. The fences a trip is inside (and since when) live
+    # in its ingestion state, so each fix only checks the fences of its grid cell plus those.
+
+    @staticmethod
+    def evaluate(state, latitude, longitude, moment):
+        # Updates state['geofences'] and returns the ENTER/EXIT/DWELL events of this fix:
+        # [{'type', 'kind', 'key', 'stop_id', 'geofence_id'}]
+        index = GeofenceIndexCache.get(state['route_id'])
+        inside = state.setdefault('geofences', {})
+        x, y = index.project(latitude, longitude)
+        timestamp = moment.timestamp()
+        dwell_seconds = getattr(settings, 'GEOFENCE_DWELL_SECONDS', 60)
+
+        events = []
+        for key in set(index.candidates(x, y)) | set(inside):
+            fence = index.fences.get(key)
+            if fence is None:
+                # Fence removed since the trip entered it
+                inside.pop(key, None)
+                continue
+
+            entry = inside.get(key)
+            now_inside = index.contains(fence, x, y, entry is not None)
+            if entry is None and now_inside:
+                inside[key] = [timestamp, False]
+                events.append(('ENTER', fence))
+            elif entry is not None and not now_inside:
+                del inside[key]
+                events.append(('EXIT', fence))
+            elif entry is not None and not entry[1] and timestamp - entry[0] >= dwell_seconds:
+                entry[1] = True
+                events.append(('DWELL', fence))
+
+        return [
+            {
+                'type': event_type,
+                'kind': fence.kind,
+                'key': fence.key,
+                'stop_id': fence.stop_id,
+                'geofence_id': fence.geofence_id,
+            }
+            for event_type, fence in events
+        ]
+
+    @staticmethod
+    def inside_stop(state):
+        # Id of the stop whose arrival fence the trip is in, or None
+        for key in state.get('geofences', {}):
+            if key.startswith('s'):
+                return int(key[1:])
+        return None
+
+    @staticmethod
+    def record(trip_id, events, latitude, longitude, moment):
+        # Stores the arrival-fence and zone events (approach rings only drive notifications)
+        rows = [
+            GeofenceEvent(
+                trip_id=trip_id,
+                bus_stop_id=event['stop_id'] if event['kind'] == ARRIVAL else None,
+                geofence_id=event['geofence_id'],
+                event_type=event['type'],
+                latitude=round(latitude, 6),
+                longitude=round(longitude, 6),
+                occurred_at=moment
+            )
+            for event in events
+            if event['kind'] != APPROACH
+        ]
+        if not rows:
+            return []
+        try:
+            return GeofenceEvent.objects.bulk_create(rows)
+        except Exception as e:
+            logger.error(f"Could not record {len(rows)} geofence events for trip {trip_id}: {str(e)}")
+            return []
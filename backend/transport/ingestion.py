@@ -0,0 +1,554 @@
+import os
+import math
+import atexit
+import logging
+import threading
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import Trip, LocationUpdate, GPSDevice
+from .services import GPSService
+from .stop_index import StopIndexCache
+from .eta import EtaService
+from .live import LivePositionService
+from .geofence import GeofenceEngine, ARRIVAL, APPROACH
+
+logger = logging.getLogger(__name__)
+
+# Trip columns mirrored in the ingestion state; only the ones that changed are written
+TRACKED_COLUMNS = ('location_accuracy', 'location_heading', 'location_altitude', 'average_speed')
+
+
+class GPSBatchError(Exception):
+    pass
+
+
+def _state_cache():
+    # Must be shared by every process that ingests fixes (websocket, REST and batch endpoints)
+    return caches[getattr(settings, 'GPS_STATE_CACHE', 'shared')]
+
+
+def _to_float(value):
+    return float(value) if value is not None else None
+
+
+class LocationUpdateBuffer:
+    # Collects LocationUpdate rows in memory and writes them with bulk_create from a
+    # background thread, every GPS_LOCATION_FLUSH_SIZE rows or GPS_LOCATION_FLUSH_INTERVAL seconds.
+    # The trip row itself is updated synchronously, so only track history can lag behind.
+
+    def __init__(self):
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def add(self, location_update):
+        if not getattr(settings, 'GPS_LOCATION_BUFFER_ENABLED', True):
+            location_update.save()
+            return location_update
+
+        self._ensure_worker()
+
+        with self._lock:
+            self._buffer.append(location_update)
+            # DB unreachable for a long time - keep memory bounded by dropping the oldest rows
+            max_buffer = getattr(settings, 'GPS_LOCATION_MAX_BUFFER', 50000)
+            if len(self._buffer) > max_buffer:
+                del self._buffer[:len(self._buffer) - max_buffer]
+            full = len(self._buffer) >= getattr(settings, 'GPS_LOCATION_FLUSH_SIZE', 200)
+
+        if full:
+            self._wakeup.set()
+        return location_update
+
+    def flush(self):
+        # Write all buffered rows; returns how many were written
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+
+        if not batch:
+            return 0
+
+        try:
+            LocationUpdate.objects.bulk_create(batch, batch_size=500)
+            return len(batch)
+        except Exception as e:
+            logger.error(f"Could not write {len(batch)} location updates: {str(e)}")
+            return 0
+
+    def _ensure_worker(self):
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None and self._thread.is_alive():
+            return
+
+        with self._lock:
+            if self._pid == pid and self._thread is not None and self._thread.is_alive():
+                return
+            if self._pid != pid:
+                # Forked worker: rows in the inherited buffer belong to the parent process
+                self._buffer = []
+                self._wakeup = threading.Event()
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name='gps-location-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(getattr(settings, 'GPS_LOCATION_FLUSH_INTERVAL', 5))
+            self._wakeup.clear()
+            self.flush()
+            close_old_connections()
+
+
+location_buffer = LocationUpdateBuffer()
+atexit.register(location_buffer.flush)
+
+
+class GPSIngestionService:
+    # Single write path for GPS pings (REST endpoint and driver websocket).
+    # Last position, trip ownership and progress along the route are kept in the GPS state cache and
+    # stops and learned ETAs come from process caches, so a ping costs one UPDATE on the trip row;
+    # LocationUpdate rows go through location_buffer and the fix is fanned out by LivePositionService.
+
+    @staticmethod
+    def state_key(trip_id):
+        return f"gps_trip_state_{trip_id}"
+
+    @staticmethod
+    def get_state(trip_id):
+        # Cached ingestion state for a trip, seeded from the trip row on a miss; None if the trip doesn't exist
+        cache = _state_cache()
+        key = GPSIngestionService.state_key(trip_id)
+        try:
+            state = cache.get(key)
+        except Exception:
+            state = None
+        if state is not None:
+            return state
+
+        trip = Trip.objects.filter(pk=trip_id).select_related('bus', 'route', 'driver__user').first()
+        if trip is None:
+            return None
+
+        state = {
+            'trip_id': trip.id,
+            'bus_id': trip.bus_id,
+            'route_id': trip.route_id,
+            'school_id': trip.bus.school_id,
+            'driver_user_id': trip.driver.user_id,
+            'latitude': _to_float(trip.current_latitude),
+            'longitude': _to_float(trip.current_longitude),
+            # Unix time of the fix the position above comes from; batch uploads only move it forward
+            'fix_time': trip.last_location_update.timestamp() if trip.last_location_update else None,
+            # Unix time before which a fix can't belong to the trip (it may start ahead of schedule)
+            'start_time': min(filter(None, (trip.actual_start, trip.scheduled_start))).timestamp(),
+            'stop_progress': None,
+            # Fences the bus is in: {key: [entered at (unix seconds), dwell reported]}
+            'geofences': {},
+            # [stop id, whole minutes] of the last ETA seen inside the next stop's approach ring
+            'approach_eta': None,
+            # Static details for live broadcasts, and the last frame sent (deltas are relative to it)
+            'bus_number': trip.bus.bus_number,
+            'route_name': trip.route.name,
+            'driver_name': trip.driver.user.get_display_name(),
+            'students_onboard': trip.students_onboard,
+            'live_wire': None,
+        }
+        for column in TRACKED_COLUMNS:
+            state[column] = _to_float(getattr(trip, column))
+
+        GPSIngestionService._save_state(state)
+        return state
+
+    @staticmethod
+    def clear_state(trip_id):
+        try:
+            _state_cache().delete(GPSIngestionService.state_key(trip_id))
+        except Exception:
+            pass
+
+    @staticmethod
+    def ingest(trip_id, location_data, user=None):
+        # Record one GPS fix. Raises Trip.DoesNotExist if the trip is missing or `user` isn't its driver.
+        state = GPSIngestionService.get_state(trip_id)
+        if state is None or (user is not None and state['driver_user_id'] != user.id):
+            raise Trip.DoesNotExist(f"Trip {trip_id} not found")
+
+        now = timezone.now()
+        latitude = float(location_data['latitude'])
+        longitude = float(location_data['longitude'])
+        speed = location_data.get('speed')
+
+        updates = {
+            'current_latitude': location_data['latitude'],
+            'current_longitude': location_data['longitude'],
+            'last_location_update': now,
+        }
+
+        # Running distance from the previous fix held in the state, not a "previous row" query
+        distance = 0.0
+        if state['latitude'] is not None and state['longitude'] is not None:
+            distance = GPSService.calculate_distance(state['latitude'], state['longitude'], latitude, longitude)
+        if distance > 0:
+            updates['distance_traveled'] = F('distance_traveled') + Decimal(f"{distance:.3f}")
+
+        changed = {
+            'location_accuracy': location_data.get('accuracy'),
+            'location_heading': location_data.get('heading'),
+            'location_altitude': location_data.get('altitude'),
+        }
+        if speed:
+            changed['average_speed'] = speed
+            updates['max_speed'] = Greatest(F('max_speed'), speed)
+        for column, value in changed.items():
+            if _to_float(value) != state[column]:
+                updates[column] = value
+                state[column] = _to_float(value)
+
+        # Geofences around the stops and the school's zones (only the ones near this fix are checked)
+        stop_index = StopIndexCache.get(state['route_id'])
+        events = GPSIngestionService._track_geofences(state, stop_index, latitude, longitude, now)
+        next_stop = GPSIngestionService._estimate(state, stop_index, latitude, longitude, now, updates)
+
+        Trip.objects.filter(pk=trip_id).update(**updates)
+
+        location_update = location_buffer.add(LocationUpdate(
+            trip_id=trip_id,
+            latitude=latitude,
+            longitude=longitude,
+            speed=float(speed or 0),
+            heading=_to_float(location_data.get('heading')),
+            accuracy=_to_float(location_data.get('accuracy')),
+            altitude=_to_float(location_data.get('altitude')),
+            device_id=location_data.get('device_id') or '',
+            battery_level=location_data.get('battery_level'),
+            signal_strength=location_data.get('signal_strength'),
+            created_at=now,
+        ))
+
+        state['latitude'] = latitude
+        state['longitude'] = longitude
+        state['fix_time'] = now.timestamp()
+
+        GPSIngestionService._dispatch_events(state, stop_index, events, latitude, longitude, now)
+        GPSIngestionService._recheck_arrival(state, next_stop, updates, latitude, longitude, now)
+
+        state['live_wire'] = LivePositionService.publish(state['school_id'], {
+            'trip_id': trip_id,
+            'latitude': latitude,
+            'longitude': longitude,
+            'speed': _to_float(speed) or 0,
+            'heading': _to_float(location_data.get('heading')),
+            'accuracy': _to_float(location_data.get('accuracy')),
+            'students_onboard': state['students_onboard'],
+            'timestamp': int(now.timestamp()),
+            'last_update': now.isoformat(),
+            'bus_number': state['bus_number'],
+            'route_name': state['route_name'],
+            'driver_name': state['driver_name'],
+        }, state['live_wire'])
+
+        GPSIngestionService._save_state(state)
+
+        return {
+            'location_update': location_update,
+            'timestamp': now,
+            'distance_km': distance,
+            'next_stop_id': next_stop.id if next_stop else None,
+        }
+
+    @staticmethod
+    def _track_geofences(state, stop_index, latitude, longitude, moment):
+        # Fence events of one fix; leaving a stop's fence means it was served, so route progress
+        # continues from the segment starting there
+        events = GeofenceEngine.evaluate(state, latitude, longitude, moment)
+        for event in events:
+            position = stop_index.positions.get(event['stop_id'])
+            if event['kind'] != ARRIVAL or event['type'] != 'EXIT' or position is None:
+                continue
+            if stop_index.is_loop and stop_index.segment_count:
+                state['stop_progress'] = position % stop_index.segment_count
+            elif position < stop_index.segment_count and (state.get('stop_progress') or 0) <= position:
+                state['stop_progress'] = position
+        return events
+
+    @staticmethod
+    def _estimate(state, stop_index, latitude, longitude, moment, updates):
+        # ETAs from the route's stop index (matched forward from the last known progress)
+        # and its learned segment travel times; returns the next stop
+        current_speed = state['average_speed'] or 30
+        next_stop, next_stop_distance, state['stop_progress'] = stop_index.locate(
+            latitude, longitude, state.get('stop_progress')
+        )
+        if next_stop:
+            next_stop_minutes, school_minutes = EtaService.estimate(
+                stop_index, next_stop, next_stop_distance, state['stop_progress'],
+                latitude, longitude, current_speed, moment
+            )
+            updates['next_stop_eta'] = moment + timedelta(minutes=next_stop_minutes)
+            updates['school_eta'] = moment + timedelta(minutes=school_minutes)
+        if GeofenceEngine.inside_stop(state) is not None:
+            # Standing at a stop: that stop is due now
+            updates['next_stop_eta'] = moment
+        return next_stop
+
+    @staticmethod
+    def _dispatch_events(state, stop_index, events, latitude, longitude, moment, notify=True):
+        # Entering a stop's approach ring alerts its students, for stops still ahead of the bus;
+        # events are stored and broadcast off the request path
+        if not events:
+            return
+        from .tasks import send_arrival_notifications, handle_geofence_events
+        trip_id = state['trip_id']
+        progress = state['stop_progress'] if state['stop_progress'] is not None else -1
+        for event in events if notify else ():
+            position = stop_index.positions.get(event['stop_id'])
+            if (event['kind'] == APPROACH and event['type'] == 'ENTER' and position is not None
+                    and (stop_index.is_loop or position > progress)):
+                stop = stop_index.stops[position]
+                send_arrival_notifications(trip_id, stop.id, GPSService.calculate_distance(
+                    latitude, longitude, float(stop.latitude), float(stop.longitude)
+                ))
+        if any(event['kind'] != APPROACH for event in events):
+            handle_geofence_events(trip_id, state['school_id'], events, latitude, longitude, moment)
+
+    @staticmethod
+    def _recheck_arrival(state, next_stop, updates, latitude, longitude, moment):
+        # The approach ENTER only alerts students whose window already covers the ETA. While the bus
+        # stays in the next stop's approach ring, the stop is checked again whenever the ETA drops to a
+        # new whole minute, so shorter windows are reached too; claim markers keep one alert per student
+        if next_stop is None or f"a{next_stop.id}" not in state['geofences'] or 'next_stop_eta' not in updates:
+            state.pop('approach_eta', None)
+            return
+        minutes = math.ceil(max(0, (updates['next_stop_eta'] - moment).total_seconds()) / 60)
+        last = state.get('approach_eta')
+        state['approach_eta'] = [next_stop.id, minutes]
+        if last is None or last[0] != next_stop.id or minutes >= last[1]:
+            # First ping in the ring is covered by the ENTER alert
+            return
+        from .tasks import send_arrival_notifications
+        send_arrival_notifications(state['trip_id'], next_stop.id, GPSService.calculate_distance(
+            latitude, longitude, float(next_stop.latitude), float(next_stop.longitude)
+        ))
+
+    @staticmethod
+    def device_settings(state, device_id):
+        # (registered to another bus, accuracy threshold in meters) for a device id, cached in the state
+        devices = state.setdefault('devices', {})
+        if device_id not in devices:
+            device = GPSDevice.objects.filter(device_id=device_id).values('bus_id', 'gps_accuracy_threshold').first()
+            if device is None:
+                devices[device_id] = [False, getattr(settings, 'MIN_GPS_ACCURACY', 50)]
+            else:
+                devices[device_id] = [device['bus_id'] != state['bus_id'], device['gps_accuracy_threshold']]
+        return devices[device_id]
+
+    @staticmethod
+    def ingest_batch(trip_id, points, device_id='', user=None):
+        # Record an ordered upload of buffered fixes (validated BatchLocationPointSerializer data).
+        # Fixes already stored for (device_id, timestamp) are skipped, the rest are bulk inserted.
+        # Fixes newer than the trip's current position advance it: distance, geofences and progress
+        # are replayed over them in one pass, the trip row is updated once and only the latest fix
+        # is broadcast. Rejected fixes are returned in invalid_points by their index in points.
+        # Raises Trip.DoesNotExist like ingest(), GPSBatchError for a foreign device or a concurrent
+        # upload for the same trip.
+        state = GPSIngestionService.get_state(trip_id)
+        if state is None or (user is not None and state['driver_user_id'] != user.id):
+            raise Trip.DoesNotExist(f"Trip {trip_id} not found")
+
+        device_id = device_id or 'mobile_app'
+        foreign, accuracy_threshold = GPSIngestionService.device_settings(state, device_id)
+        if foreign:
+            raise GPSBatchError(f"Device {device_id} belongs to another bus")
+
+        cache = _state_cache()
+        lock_key = f"gps_batch_lock_{trip_id}"
+        try:
+            locked = cache.add(lock_key, 1, getattr(settings, 'GPS_BATCH_LOCK_TTL', 30))
+        except Exception:
+            locked = True
+        if not locked:
+            raise GPSBatchError("Another upload for this trip is in progress")
+
+        try:
+            return GPSIngestionService._ingest_batch(state, points, device_id, accuracy_threshold)
+        finally:
+            try:
+                cache.delete(lock_key)
+            except Exception:
+                pass
+
+    @staticmethod
+    def _ingest_batch(state, points, device_id, accuracy_threshold):
+        trip_id = state['trip_id']
+        now = timezone.now()
+        skew = timedelta(seconds=getattr(settings, 'GPS_BATCH_MAX_CLOCK_SKEW', 60))
+        latest_allowed = now + skew
+        # Older fixes would land outside every daily partition of the location table
+        earliest_allowed = (now - timedelta(days=getattr(settings, 'GPS_LOCATION_RETENTION_DAYS', 7))).timestamp()
+        if state.get('start_time') is not None:
+            earliest_allowed = max(earliest_allowed, state['start_time'] - skew.total_seconds())
+
+        # Order by device time, drop fixes from the future, from before the trip, too inaccurate,
+        # or repeated in the batch
+        invalid = []
+        by_time = {}
+        for position, point in enumerate(points):
+            accuracy = _to_float(point.get('accuracy'))
+            if point['timestamp'] > latest_allowed:
+                invalid.append({'index': position, 'errors': 'Timestamp is ahead of the server clock'})
+            elif point['timestamp'].timestamp() < earliest_allowed:
+                invalid.append({'index': position, 'errors': 'Timestamp is too old for this trip'})
+            elif accuracy is not None and accuracy > accuracy_threshold:
+                invalid.append({'index': position, 'errors': f'Accuracy above {accuracy_threshold} meters'})
+            else:
+                by_time.setdefault(point['timestamp'], point)
+        ordered = sorted(by_time.items(), key=lambda item: item[0])
+        duplicates = len(points) - len(invalid) - len(ordered)
+
+        # One range query on (trip, created_at) for what earlier (retried) uploads already stored
+        if ordered:
+            stored = set(LocationUpdate.objects.filter(
+                trip_id=trip_id,
+                device_id=device_id,
+                created_at__gte=ordered[0][0],
+                created_at__lte=ordered[-1][0]
+            ).values_list('created_at', flat=True))
+            fresh = [(moment, point) for moment, point in ordered if moment not in stored]
+            duplicates += len(ordered) - len(fresh)
+        else:
+            fresh = []
+
+        LocationUpdate.objects.bulk_create([
+            LocationUpdate(
+                trip_id=trip_id,
+                latitude=float(point['latitude']),
+                longitude=float(point['longitude']),
+                speed=float(point.get('speed') or 0),
+                heading=_to_float(point.get('heading')),
+                accuracy=_to_float(point.get('accuracy')),
+                altitude=_to_float(point.get('altitude')),
+                device_id=device_id,
+                battery_level=point.get('battery_level'),
+                signal_strength=point.get('signal_strength'),
+                created_at=moment,
+            )
+            for moment, point in fresh
+        ], batch_size=500)
+
+        # Only fixes after the current position move the bus; older ones are history only
+        live = [(moment, point) for moment, point in fresh
+                if state.get('fix_time') is None or moment.timestamp() > state['fix_time']]
+        updates = {}
+        max_speed = max((float(point.get('speed') or 0) for _, point in fresh), default=0)
+        if max_speed:
+            updates['max_speed'] = Greatest(F('max_speed'), max_speed)
+
+        distance = 0.0
+        if live:
+            moment, point = live[-1]
+            updates.update({
+                'current_latitude': point['latitude'],
+                'current_longitude': point['longitude'],
+                'last_location_update': moment,
+            })
+            changed = {
+                'location_accuracy': point.get('accuracy'),
+                'location_heading': point.get('heading'),
+                'location_altitude': point.get('altitude'),
+            }
+            if point.get('speed'):
+                changed['average_speed'] = point['speed']
+            for column, value in changed.items():
+                if _to_float(value) != state[column]:
+                    updates[column] = value
+                    state[column] = _to_float(value)
+
+            stop_index = StopIndexCache.get(state['route_id'])
+            latitude, longitude = state['latitude'], state['longitude']
+            approached = []
+            next_stop = None
+            for position, (moment, point) in enumerate(live, 1):
+                point_lat, point_lng = float(point['latitude']), float(point['longitude'])
+                if latitude is not None and longitude is not None:
+                    distance += GPSService.calculate_distance(latitude, longitude, point_lat, point_lng)
+                latitude, longitude = point_lat, point_lng
+                events = GPSIngestionService._track_geofences(state, stop_index, latitude, longitude, moment)
+                if position < len(live):
+                    # Progress follows the path, so stops passed while offline aren't matched again
+                    state['stop_progress'] = stop_index.locate(latitude, longitude, state.get('stop_progress'))[2]
+                else:
+                    next_stop = GPSIngestionService._estimate(state, stop_index, latitude, longitude, moment, updates)
+                GPSIngestionService._dispatch_events(state, stop_index, events, latitude, longitude, moment, notify=False)
+                approached.extend(event for event in events if event['kind'] == APPROACH and event['type'] == 'ENTER')
+
+            # Arrival alerts only for the approach rings the bus is still in, not for stops passed while offline
+            GPSIngestionService._dispatch_events(state, stop_index, [
+                event for event in approached if event['key'] in state['geofences']
+            ], latitude, longitude, moment)
+            GPSIngestionService._recheck_arrival(state, next_stop, updates, latitude, longitude, moment)
+
+            if distance > 0:
+                updates['distance_traveled'] = F('distance_traveled') + Decimal(f"{distance:.3f}")
+            state['latitude'] = latitude
+            state['longitude'] = longitude
+            state['fix_time'] = live[-1][0].timestamp()
+
+        if updates:
+            Trip.objects.filter(pk=trip_id).update(**updates)
+
+        if fresh:
+            latest = fresh[-1][1]
+            GPSDevice.objects.filter(device_id=device_id, bus_id=state['bus_id']).update(
+                last_communication=now,
+                **({'battery_level': latest['battery_level']} if latest.get('battery_level') is not None else {})
+            )
+
+        if live:
+            moment, point = live[-1]
+            state['live_wire'] = LivePositionService.publish(state['school_id'], {
+                'trip_id': trip_id,
+                'latitude': state['latitude'],
+                'longitude': state['longitude'],
+                'speed': _to_float(point.get('speed')) or 0,
+                'heading': _to_float(point.get('heading')),
+                'accuracy': _to_float(point.get('accuracy')),
+                'students_onboard': state['students_onboard'],
+                'timestamp': int(moment.timestamp()),
+                'last_update': moment.isoformat(),
+                'bus_number': state['bus_number'],
+                'route_name': state['route_name'],
+                'driver_name': state['driver_name'],
+            }, state['live_wire'])
+
+        GPSIngestionService._save_state(state)
+
+        return {
+            'accepted': len(fresh),
+            'duplicates': duplicates,
+            'rejected': len(invalid),
+            'invalid_points': invalid,
+            'live': len(live),
+            'distance_km': distance,
+            'latest_timestamp': live[-1][0] if live else None,
+        }
+
+    @staticmethod
+    def _save_state(state):
+        try:
+            _state_cache().set(
+                GPSIngestionService.state_key(state['trip_id']),
+                state,
+                getattr(settings, 'GPS_STATE_TTL', 60 * 60 * 4)
+            )
+        except Exception as e:
+            logger.warning(f"Could not cache GPS state for trip {state['trip_id']}: {str(e)}")
@@ -0,0 +1,193 @@
+import json
+import time
+import logging
+import threading
+
+import msgpack
+import redis
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# msgpack wire format: short keys, coordinates and speeds as fixed-point integers.
+# full name -> (wire key, scale); scale None means the value is sent as-is.
+WIRE_FIELDS = {
+    'latitude': ('la', 1_000_000),
+    'longitude': ('lo', 1_000_000),
+    'speed': ('sp', 10),
+    'heading': ('hd', 1),
+    'accuracy': ('ac', 1),
+    'students_onboard': ('so', None),
+    'timestamp': ('ts', None),
+    'bus_number': ('bn', None),
+    'route_name': ('rn', None),
+    'driver_name': ('dn', None),
+}
+WIRE_NAMES = {key: (name, scale) for name, (key, scale) in WIRE_FIELDS.items()}
+
+# Only sent in keyframes (first frame of a trip and snapshots)
+STATIC_FIELDS = ('bus_number', 'route_name', 'driver_name')
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _redis():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = redis.Redis.from_url(
+                    getattr(settings, 'TRANSPORT_LIVE_REDIS_URL', 'redis://127.0.0.1:6379/2'),
+                    socket_timeout=getattr(settings, 'TRANSPORT_LIVE_REDIS_TIMEOUT', 0.2),
+                    socket_connect_timeout=getattr(settings, 'TRANSPORT_LIVE_REDIS_TIMEOUT', 0.2),
+                )
+    return _client
+
+
+def to_wire(position):
+    # Full position dict -> {wire key: value} with fixed-point numbers
+    wire = {'t': position['trip_id']}
+    for name, (key, scale) in WIRE_FIELDS.items():
+        value = position.get(name)
+        if value is None:
+            continue
+        wire[key] = int(round(float(value) * scale)) if scale else value
+    return wire
+
+
+def from_wire(wire):
+    # Inverse of to_wire, for JSON clients and snapshot fallbacks
+    position = {'trip_id': wire['t']}
+    for key, value in wire.items():
+        if key not in WIRE_NAMES:
+            continue
+        name, scale = WIRE_NAMES[key]
+        position[name] = value / scale if scale else value
+    return position
+
+
+def delta(wire, previous):
+    # Keys that changed since `previous` (always with the trip id); a keyframe when there is no previous frame
+    if not previous:
+        return dict(wire, k=1)
+    changed = {key: value for key, value in wire.items() if previous.get(key) != value}
+    changed['t'] = wire['t']
+    for name in STATIC_FIELDS:
+        changed.pop(WIRE_FIELDS[name][0], None)
+    return changed
+
+
+def merge_frames(older, newer):
+    # Coalesce two packed deltas for the same trip into one (newer values win)
+    merged = msgpack.unpackb(older)
+    merged.update(msgpack.unpackb(newer))
+    return msgpack.packb(merged)
+
+
+class LivePositionService:
+    # Live bus positions for websocket subscribers.
+    # Every fix is written to a per-school Redis hash (the snapshot served to new subscribers, no DB hit)
+    # and fanned out once through the channel layer, pre-encoded both as JSON and as a msgpack delta.
+
+    @staticmethod
+    def snapshot_key(school_id):
+        return f"transport:live:school:{school_id}"
+
+    @staticmethod
+    def build_messages(position, previous_wire=None):
+        # Returns (wire, trip group message, school group message) for one fix
+        wire = to_wire(position)
+        packed = msgpack.packb(delta(wire, previous_wire))
+        trip_data = {
+            'latitude': position['latitude'],
+            'longitude': position['longitude'],
+            'speed': position.get('speed') or 0,
+            'heading': position.get('heading') or 0,
+            'accuracy': position.get('accuracy') or 0,
+            'timestamp': position.get('last_update'),
+        }
+        school_data = {
+            'trip_id': position['trip_id'],
+            'bus_number': position.get('bus_number'),
+            'route_name': position.get('route_name'),
+            'latitude': position['latitude'],
+            'longitude': position['longitude'],
+            'speed': position.get('speed') or 0,
+            'students_onboard': position.get('students_onboard'),
+            'last_update': position.get('last_update'),
+            'driver_name': position.get('driver_name'),
+        }
+        trip_message = {
+            'type': 'location_update',
+            'key': position['trip_id'],
+            'text': json.dumps({'type': 'location_update', 'data': trip_data}),
+            'bytes': packed,
+        }
+        school_message = {
+            'type': 'bus_location_update',
+            'key': position['trip_id'],
+            'text': json.dumps({'type': 'bus_location', 'data': school_data}),
+            'bytes': packed,
+        }
+        return wire, trip_message, school_message
+
+    @staticmethod
+    def publish(school_id, position, previous_wire=None):
+        # Store and broadcast one fix; returns the wire frame to pass as previous_wire next time
+        wire, trip_message, school_message = LivePositionService.build_messages(position, previous_wire)
+
+        try:
+            key = LivePositionService.snapshot_key(school_id)
+            pipeline = _redis().pipeline(transaction=False)
+            pipeline.hset(key, str(position['trip_id']), msgpack.packb(wire))
+            pipeline.expire(key, getattr(settings, 'TRANSPORT_LIVE_SNAPSHOT_TTL', 60 * 60))
+            pipeline.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Could not store live position for trip {position['trip_id']}: {str(e)}")
+
+        channel_layer = get_channel_layer()
+        if channel_layer is not None:
+            try:
+                async_to_sync(channel_layer.group_send)(f"trip_{position['trip_id']}", trip_message)
+                async_to_sync(channel_layer.group_send)(f"school_{school_id}", school_message)
+            except Exception as e:
+                logger.warning(f"Could not broadcast live position for trip {position['trip_id']}: {str(e)}")
+
+        return wire
+
+    @staticmethod
+    def remove(school_id, trip_id):
+        try:
+            _redis().hdel(LivePositionService.snapshot_key(school_id), str(trip_id))
+        except redis.RedisError as e:
+            logger.warning(f"Could not remove live position for trip {trip_id}: {str(e)}")
+
+    @staticmethod
+    def get_snapshot(school_id):
+        # Current wire frames for a school's buses, dropping any not updated within TRANSPORT_LIVE_MAX_AGE.
+        # Returns None if Redis is unavailable, so callers can fall back to the database.
+        key = LivePositionService.snapshot_key(school_id)
+        try:
+            entries = _redis().hgetall(key)
+        except redis.RedisError as e:
+            logger.warning(f"Could not read live snapshot for school {school_id}: {str(e)}")
+            return None
+
+        cutoff = time.time() - getattr(settings, 'TRANSPORT_LIVE_MAX_AGE', 300)
+        frames, stale = [], []
+        for field, value in entries.items():
+            wire = msgpack.unpackb(value)
+            if wire.get('ts', 0) < cutoff:
+                stale.append(field)
+            else:
+                frames.append(wire)
+
+        if stale:
+            try:
+                _redis().hdel(key, *stale)
+            except redis.RedisError:
+                pass
+        return frames
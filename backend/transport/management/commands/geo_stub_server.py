@@ -0,0 +1,114 @@
+import json
+import time
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from django.core.management.base import BaseCommand
+
+from transport.services import GPSService
+
+# Speed the stub's OSRM answers assume (km/h)
+STUB_SPEED_KMH = 30
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs a local stand-in for Nominatim (/search, /reverse) and OSRM (/route, /table, /trip) for '
+        'geocoding cache and rate limit testing. Point the app at it with '
+        'GEO_NOMINATIM_URL=http://127.0.0.1:<port> and GEO_OSRM_URL=http://127.0.0.1:<port>. '
+        'Addresses containing "nowhere" are not found.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8766)
+        parser.add_argument('--latency-ms', type=int, default=100, help='Delay before every response.')
+
+    def handle(self, *args, **options):
+        command = self
+        counts = {}
+
+        def coordinates_of(path):
+            # "/route/v1/driving/lng,lat;lng,lat" -> [(lat, lng), ...]
+            points = []
+            for pair in path.rsplit('/', 1)[-1].split(';'):
+                lng, lat = pair.split(',')
+                points.append((float(lat), float(lng)))
+            return points
+
+        def geocode(query):
+            digest = hashlib.sha1(query.lower().encode('utf-8')).digest()
+            lat = -1.2 + digest[0] / 255 * 0.2
+            lng = 36.7 + digest[1] / 255 * 0.2
+            return {'lat': f'{lat:.6f}', 'lon': f'{lng:.6f}', 'display_name': f'{query.title()}, Stub City'}
+
+        def leg(start, end):
+            distance = GPSService.calculate_distance(start[0], start[1], end[0], end[1]) * 1000
+            return {'distance': distance, 'duration': distance / (STUB_SPEED_KMH / 3.6), 'steps': []}
+
+        class StubHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlsplit(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                service = url.path.strip('/').split('/')[0]
+                counts[service] = counts.get(service, 0) + 1
+                time.sleep(options['latency_ms'] / 1000)
+
+                if service == 'search':
+                    query = params.get('q', '')
+                    return self._send(200, [] if 'nowhere' in query.lower() else [geocode(query)])
+                if service == 'reverse':
+                    return self._send(200, {'display_name': f"{params.get('lat')}, {params.get('lon')}, Stub City"})
+                if service not in ('route', 'table', 'trip'):
+                    return self._send(404, {'error': 'Not found'})
+
+                try:
+                    points = coordinates_of(url.path)
+                except ValueError:
+                    return self._send(400, {'code': 'InvalidQuery', 'message': 'Bad coordinates'})
+
+                if service == 'table':
+                    return self._send(200, {
+                        'code': 'Ok',
+                        'distances': [[leg(a, b)['distance'] for b in points] for a in points],
+                    })
+
+                legs = [leg(a, b) for a, b in zip(points, points[1:])]
+                route = {
+                    'distance': sum(item['distance'] for item in legs),
+                    'duration': sum(item['duration'] for item in legs),
+                    'geometry': {'type': 'LineString', 'coordinates': [[lng, lat] for lat, lng in points]},
+                    'legs': legs,
+                }
+                if service == 'route':
+                    return self._send(200, {'code': 'Ok', 'routes': [route]})
+                # Trip: keep the given order
+                self._send(200, {
+                    'code': 'Ok',
+                    'trips': [route],
+                    'waypoints': [
+                        {'waypoint_index': position, 'trips_index': 0, 'location': [lng, lat]}
+                        for position, (lat, lng) in enumerate(points)
+                    ],
+                })
+
+            def _send(self, status, payload):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                command.stdout.write(f"{self.address_string()} - {format % args}")
+
+        server = ThreadingHTTPServer(('127.0.0.1', options['port']), StubHandler)
+        self.stdout.write(self.style.SUCCESS(f"Geo stub listening on http://127.0.0.1:{options['port']}"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Requests served: {counts}")
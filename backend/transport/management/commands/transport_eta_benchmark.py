@@ -0,0 +1,102 @@
+from datetime import timedelta
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from transport.eta import EtaProfileBuilder, EtaTable, EtaService, stop_passages
+from transport.models import Route, BusStop
+from transport.services import GPSService
+from transport.stop_index import RouteStopIndex
+
+
+class Command(BaseCommand):
+    help = 'Replays recent trip tracks to compare learned ETAs against the straight-line estimate.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--route', type=int, help='Only benchmark this route id.')
+        parser.add_argument('--history-days', type=int, default=28, help='Days of tracks used to learn profiles.')
+        parser.add_argument('--holdout-days', type=int, default=7, help='Most recent days replayed as the test set.')
+        parser.add_argument('--stride', type=int, default=2, help='Evaluate every Nth track point.')
+
+    def handle(self, *args, **options):
+        if options['stride'] < 1:
+            raise CommandError('--stride must be at least 1')
+
+        now = timezone.now()
+        split = now - timedelta(days=options['holdout_days'])
+        since = split - timedelta(days=options['history_days'])
+
+        routes = Route.objects.all()
+        if options['route']:
+            routes = routes.filter(id=options['route'])
+
+        errors = {'learned_next': [], 'baseline_next': [], 'learned_final': [], 'baseline_final': []}
+        for route in routes:
+            stops = list(BusStop.objects.filter(route=route).order_by('sequence'))
+            if len(stops) < 2:
+                continue
+            index = RouteStopIndex(route.id, stops)
+
+            profile = EtaProfileBuilder.build(index, EtaProfileBuilder.route_tracks(route.id, since, split).iterator())
+            if not profile['trip_count']:
+                continue
+            table = EtaTable(index, profile)
+
+            replayed = 0
+            for track in EtaProfileBuilder.route_tracks(route.id, split).iterator():
+                if track.started_at and self._replay(index, table, track, options['stride'], errors):
+                    replayed += 1
+            self.stdout.write(f"Route {route}: learned from {profile['trip_count']} trips, replayed {replayed}")
+
+        if not errors['learned_next']:
+            self.stdout.write(self.style.WARNING('No replayable trips in the hold-out window'))
+            return
+
+        self.stdout.write("-" * 50)
+        self.stdout.write(f"{'ETA error (minutes)':24} {'MAE':>7} {'p90':>7} {'<=2 min':>8} {'samples':>8}")
+        for name in ('baseline_next', 'learned_next', 'baseline_final', 'learned_final'):
+            values = np.abs(np.array(errors[name]))
+            if not len(values):
+                continue
+            self.stdout.write(
+                f"{name:24} {values.mean():7.2f} {np.percentile(values, 90):7.2f} "
+                f"{(values <= 2).mean() * 100:7.1f}% {len(values):8}"
+            )
+        self.stdout.write("-" * 50)
+
+    def _replay(self, index, table, track, stride, errors):
+        # Predict at each replayed point and compare with when the track actually reached the stops
+        passages = stop_passages(index, track.points)
+        final_stop = index.final_stop
+        progress = None
+        replayed = False
+
+        for position, (offset, latitude, longitude, speed) in enumerate(track.points):
+            next_stop, distance, progress = index.locate(latitude, longitude, progress)
+            if position % stride:
+                continue
+
+            target = EtaService.target_position(index, next_stop, progress)
+            moment = track.started_at + timedelta(seconds=offset)
+            learned_next, learned_final = EtaService.estimate(
+                index, next_stop, distance, progress, latitude, longitude, speed or 30, moment, table=table
+            )
+
+            arrival = passages[target]
+            if arrival is not None and arrival > offset:
+                actual = (arrival - offset) / 60
+                errors['learned_next'].append(learned_next - actual)
+                errors['baseline_next'].append(GPSService.calculate_eta(
+                    latitude, longitude, float(next_stop.latitude), float(next_stop.longitude), speed or 30
+                ) - actual)
+                replayed = True
+
+            arrival = passages[-1]
+            if arrival is not None and arrival > offset:
+                actual = (arrival - offset) / 60
+                errors['learned_final'].append(learned_final - actual)
+                errors['baseline_final'].append(GPSService.calculate_eta(
+                    latitude, longitude, float(final_stop.latitude), float(final_stop.longitude), speed or 30
+                ) - actual)
+        return replayed
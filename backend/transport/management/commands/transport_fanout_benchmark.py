@@ -0,0 +1,165 @@
+import time
+import asyncio
+import random
+
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from channels.layers import channel_layers
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from transport.consumers import SchoolTrackingConsumer
+from transport.live import LivePositionService
+
+
+class BenchmarkUser:
+    is_authenticated = True
+
+    def __init__(self, school_id):
+        self.school_id = school_id
+
+
+class CountingConsumer(SchoolTrackingConsumer):
+    # Counts what actually goes out on the socket; `delay` simulates a slow client
+    stats = None
+    delay = 0
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        key = 'msgpack' if self.binary else 'json'
+        self.stats[key]['frames'] += 1
+        self.stats[key]['bytes'] += len(bytes_data) if bytes_data is not None else len(text_data.encode())
+        await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+
+    def enqueue_frame(self, event):
+        key = 'msgpack' if self.binary else 'json'
+        self.stats[key]['received'] += 1
+        super().enqueue_frame(event)
+
+
+class Command(BaseCommand):
+    help = 'Measures websocket fan-out of live bus positions (frames, bytes, coalescing) for many school subscribers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=2000, help='School websocket subscribers.')
+        parser.add_argument('--buses', type=int, default=40, help='Buses reporting positions.')
+        parser.add_argument('--rounds', type=int, default=10, help='Position fixes sent per bus.')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds between rounds of fixes.')
+        parser.add_argument('--slow-fraction', type=float, default=0.1, help='Share of clients that read slowly.')
+        parser.add_argument('--slow-delay', type=float, default=2.0, help='Seconds a slow client takes per frame.')
+        parser.add_argument('--school-id', type=int, default=999999, help='School id used for the benchmark groups.')
+        parser.add_argument(
+            '--in-memory',
+            action='store_true',
+            help='Use an in-process channel layer instead of CHANNEL_LAYERS (no Redis needed for the fan-out).'
+        )
+
+    def handle(self, *args, **options):
+        if options['clients'] < 1 or options['buses'] < 1 or options['rounds'] < 1:
+            raise CommandError('--clients, --buses and --rounds must be at least 1')
+
+        if options['in_memory']:
+            settings.CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+            channel_layers.backends = {}
+
+        asyncio.run(self._run(options))
+
+    async def _run(self, options):
+        school_id = options['school_id']
+        user = BenchmarkUser(school_id)
+        stats = {
+            'json': {'clients': 0, 'frames': 0, 'bytes': 0, 'received': 0},
+            'msgpack': {'clients': 0, 'frames': 0, 'bytes': 0, 'received': 0},
+        }
+
+        fast = type('FastConsumer', (CountingConsumer,), {'stats': stats})
+        slow = type('SlowConsumer', (CountingConsumer,), {'stats': stats, 'delay': options['slow_delay']})
+
+        slow_count = int(options['clients'] * options['slow_fraction'])
+
+        self.stdout.write(f"Connecting {options['clients']} clients ({slow_count} slow)...")
+        communicators = []
+        for i in range(options['clients']):
+            binary = i % 2 == 1
+            scope = {
+                'type': 'websocket',
+                'path': '/ws/transport/school/',
+                'query_string': b'format=msgpack' if binary else b'',
+                'headers': [],
+                'subprotocols': [],
+                'user': user,
+            }
+            consumer = slow if i < slow_count else fast
+            communicator = ApplicationCommunicator(consumer.as_asgi(), scope)
+            await communicator.send_input({'type': 'websocket.connect'})
+            message = await communicator.receive_output(timeout=5)
+            if message['type'] != 'websocket.accept':
+                raise CommandError('A benchmark client could not connect')
+            stats['msgpack' if binary else 'json']['clients'] += 1
+            communicators.append(communicator)
+
+        # Initial snapshots are not part of the fan-out numbers
+        for counts in stats.values():
+            counts['frames'] = counts['bytes'] = 0
+
+        publish = sync_to_async(LivePositionService.publish, thread_sensitive=False)
+        positions = {
+            trip_id: {
+                'trip_id': trip_id,
+                'latitude': -1.28 + random.uniform(-0.05, 0.05),
+                'longitude': 36.82 + random.uniform(-0.05, 0.05),
+                'bus_number': f'BENCH-{trip_id}',
+                'route_name': f'Benchmark route {trip_id}',
+                'driver_name': 'Benchmark Driver',
+                'students_onboard': 20,
+            }
+            for trip_id in range(1, options['buses'] + 1)
+        }
+        previous = {}
+
+        self.stdout.write(f"Publishing {options['rounds']} rounds for {options['buses']} buses...")
+        started = time.perf_counter()
+        publish_times = []
+        for _ in range(options['rounds']):
+            round_started = time.perf_counter()
+            for trip_id, position in positions.items():
+                position['latitude'] += random.uniform(-0.0005, 0.0005)
+                position['longitude'] += random.uniform(-0.0005, 0.0005)
+                position['speed'] = round(random.uniform(10, 50), 1)
+                position['heading'] = random.randint(0, 359)
+                position['timestamp'] = int(time.time())
+                t0 = time.perf_counter()
+                previous[trip_id] = await publish(school_id, dict(position), previous.get(trip_id))
+                publish_times.append((time.perf_counter() - t0) * 1000)
+            await asyncio.sleep(max(0, options['interval'] - (time.perf_counter() - round_started)))
+
+        # Let fast clients drain; slow ones keep whatever is still coalescing
+        await asyncio.sleep(1)
+        elapsed = time.perf_counter() - started
+
+        for communicator in communicators:
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            try:
+                await communicator.wait(timeout=1)
+            except asyncio.TimeoutError:
+                pass
+        for trip_id in positions:
+            await sync_to_async(LivePositionService.remove, thread_sensitive=False)(school_id, trip_id)
+
+        published = options['buses'] * options['rounds']
+        publish_times.sort()
+        self.stdout.write("-" * 50)
+        self.stdout.write(f"Fixes published: {published} in {elapsed:.2f} s")
+        self.stdout.write(f"Publish latency p50: {publish_times[len(publish_times) // 2]:.2f} ms")
+        for name, counts in stats.items():
+            if not counts['clients']:
+                continue
+            expected = counts['clients'] * published
+            sent = counts['frames']
+            self.stdout.write(
+                f"{name:8} clients: {counts['clients']:6}  frames: {sent}/{expected} "
+                f"({counts['received']} delivered to consumers, {counts['received'] - sent} coalesced or pending)  "
+                f"bytes/frame: {counts['bytes'] / sent if sent else 0:.1f}"
+            )
+        self.stdout.write("-" * 50)
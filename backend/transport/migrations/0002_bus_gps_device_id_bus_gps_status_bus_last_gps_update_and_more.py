@@ -0,0 +1,107 @@
+# Generated by Django 5.2.7 on 2026-10-17 15:15
+
+import django.core.validators
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bus',
+            name='gps_device_id',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='bus',
+            name='gps_status',
+            field=models.CharField(choices=[('ONLINE', 'Online'), ('OFFLINE', 'Offline'), ('UNKNOWN', 'Unknown')], default='UNKNOWN', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='bus',
+            name='last_gps_update',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='locationupdate',
+            name='altitude',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True),
+        ),
+        migrations.AddField(
+            model_name='locationupdate',
+            name='battery_level',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='locationupdate',
+            name='device_id',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='locationupdate',
+            name='signal_strength',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='distance_traveled',
+            field=models.DecimalField(decimal_places=3, default=0, max_digits=8),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='location_accuracy',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='location_altitude',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='location_heading',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='max_speed',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=5),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='next_stop_eta',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='school_eta',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='GPSDevice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(max_length=50, unique=True)),
+                ('device_model', models.CharField(blank=True, max_length=50)),
+                ('imei_number', models.CharField(blank=True, max_length=20)),
+                ('status', models.CharField(choices=[('ACTIVE', 'Active'), ('INACTIVE', 'Inactive'), ('FAULTY', 'Faulty')], default='ACTIVE', max_length=10)),
+                ('last_communication', models.DateTimeField(blank=True, null=True)),
+                ('battery_level', models.IntegerField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(100)])),
+                ('update_interval', models.IntegerField(default=30)),
+                ('gps_accuracy_threshold', models.IntegerField(default=50)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('bus', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='gps_devices', to='transport.bus')),
+            ],
+            options={
+                'db_table': 'gps_devices',
+                'ordering': ['device_id'],
+            },
+        ),
+    ]
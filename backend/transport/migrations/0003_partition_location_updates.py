@@ -0,0 +1,181 @@
+# Generated by Django 5.2.7 on 2026-10-17 15:16
+
+from datetime import timedelta
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+PARTITION_DAYS_AHEAD = 7
+
+
+def partition_location_updates(apps, schema_editor):
+    # Rebuild location_updates as a table range-partitioned by day on created_at (PostgreSQL only).
+    # The primary key has to include the partition key, so it becomes (id, created_at).
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT MIN(created_at), MAX(created_at) FROM location_updates")
+        first, last = cursor.fetchone()
+
+        cursor.execute("ALTER TABLE location_updates RENAME TO location_updates_legacy")
+        cursor.execute("ALTER INDEX location_trip_created_idx RENAME TO location_updates_legacy_trip_created_idx")
+        cursor.execute("CREATE SEQUENCE location_updates_part_id_seq")
+        cursor.execute(
+            "SELECT setval('location_updates_part_id_seq', "
+            "COALESCE((SELECT MAX(id) FROM location_updates_legacy), 0) + 1, false)"
+        )
+        cursor.execute("""
+            CREATE TABLE location_updates (
+                id bigint NOT NULL DEFAULT nextval('location_updates_part_id_seq'),
+                trip_id bigint NOT NULL REFERENCES trips (id) DEFERRABLE INITIALLY DEFERRED,
+                latitude double precision NOT NULL,
+                longitude double precision NOT NULL,
+                speed double precision NOT NULL,
+                heading double precision NULL,
+                accuracy double precision NULL,
+                altitude double precision NULL,
+                device_id varchar(50) NOT NULL,
+                battery_level integer NULL,
+                signal_strength integer NULL,
+                created_at timestamp with time zone NOT NULL,
+                PRIMARY KEY (id, created_at)
+            ) PARTITION BY RANGE (created_at)
+        """)
+        cursor.execute("ALTER SEQUENCE location_updates_part_id_seq OWNED BY location_updates.id")
+        cursor.execute("CREATE INDEX location_trip_created_idx ON location_updates (trip_id, created_at)")
+
+        # One partition per day of existing data and the days ahead; anything else lands in the default
+        today = django.utils.timezone.now().date()
+        day = first.date() if first else today
+        while day <= today + timedelta(days=PARTITION_DAYS_AHEAD):
+            cursor.execute(
+                f"CREATE TABLE location_updates_p{day:%Y%m%d} PARTITION OF location_updates "
+                f"FOR VALUES FROM ('{day.isoformat()}') TO ('{(day + timedelta(days=1)).isoformat()}')"
+            )
+            day += timedelta(days=1)
+        cursor.execute("CREATE TABLE location_updates_default PARTITION OF location_updates DEFAULT")
+
+        cursor.execute("""
+            INSERT INTO location_updates (
+                id, trip_id, latitude, longitude, speed, heading, accuracy, altitude,
+                device_id, battery_level, signal_strength, created_at
+            )
+            SELECT id, trip_id, latitude, longitude, speed, heading, accuracy, altitude,
+                   device_id, battery_level, signal_strength, created_at
+            FROM location_updates_legacy
+        """)
+        cursor.execute("DROP TABLE location_updates_legacy")
+
+
+def unpartition_location_updates(apps, schema_editor):
+    # Back to a plain location_updates table with an identity id, keeping the rows; the partitions
+    # and their sequence go with the partitioned table
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("ALTER TABLE location_updates RENAME TO location_updates_partitioned")
+        cursor.execute("ALTER INDEX location_trip_created_idx RENAME TO location_updates_partitioned_trip_created_idx")
+        cursor.execute("""
+            CREATE TABLE location_updates (
+                id bigint NOT NULL PRIMARY KEY GENERATED BY DEFAULT AS IDENTITY,
+                trip_id bigint NOT NULL REFERENCES trips (id) DEFERRABLE INITIALLY DEFERRED,
+                latitude double precision NOT NULL,
+                longitude double precision NOT NULL,
+                speed double precision NOT NULL,
+                heading double precision NULL,
+                accuracy double precision NULL,
+                altitude double precision NULL,
+                device_id varchar(50) NOT NULL,
+                battery_level integer NULL,
+                signal_strength integer NULL,
+                created_at timestamp with time zone NOT NULL
+            )
+        """)
+        cursor.execute("CREATE INDEX location_updates_trip_id_idx ON location_updates (trip_id)")
+        # Dropped again by the reverse of AddIndex below
+        cursor.execute("CREATE INDEX location_trip_created_idx ON location_updates (trip_id, created_at)")
+        cursor.execute("""
+            INSERT INTO location_updates (
+                id, trip_id, latitude, longitude, speed, heading, accuracy, altitude,
+                device_id, battery_level, signal_strength, created_at
+            )
+            SELECT id, trip_id, latitude, longitude, speed, heading, accuracy, altitude,
+                   device_id, battery_level, signal_strength, created_at
+            FROM location_updates_partitioned
+        """)
+        cursor.execute(
+            "SELECT setval(pg_get_serial_sequence('location_updates', 'id'), "
+            "COALESCE((SELECT MAX(id) FROM location_updates), 0) + 1, false)"
+        )
+        cursor.execute("DROP TABLE location_updates_partitioned CASCADE")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0002_bus_gps_device_id_bus_gps_status_bus_last_gps_update_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripTrack',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('interval_seconds', models.IntegerField()),
+                ('points', models.JSONField(default=list)),
+                ('point_count', models.IntegerField(default=0)),
+                ('raw_point_count', models.IntegerField(default=0)),
+                ('distance_km', models.FloatField(default=0)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('ended_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'trip_tracks',
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='locationupdate',
+            name='accuracy',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='locationupdate',
+            name='altitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='locationupdate',
+            name='heading',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='locationupdate',
+            name='latitude',
+            field=models.FloatField(),
+        ),
+        migrations.AlterField(
+            model_name='locationupdate',
+            name='longitude',
+            field=models.FloatField(),
+        ),
+        migrations.AlterField(
+            model_name='locationupdate',
+            name='speed',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='locationupdate',
+            index=models.Index(fields=['trip', 'created_at'], name='location_trip_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='triptrack',
+            name='trip',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='track', to='transport.trip'),
+        ),
+        migrations.RunPython(partition_location_updates, unpartition_location_updates),
+    ]
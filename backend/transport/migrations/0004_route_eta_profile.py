@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-17 15:28
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0003_partition_location_updates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RouteEtaProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stop_ids', models.JSONField(default=list)),
+                ('bucket_minutes', models.IntegerField(default=60)),
+                ('segment_seconds', models.JSONField(default=list)),
+                ('segment_default_seconds', models.JSONField(default=list)),
+                ('segment_samples', models.JSONField(default=list)),
+                ('trip_count', models.IntegerField(default=0)),
+                ('built_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('route', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='eta_profile', to='transport.route')),
+            ],
+            options={
+                'db_table': 'route_eta_profiles',
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-17 15:33
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0004_route_eta_profile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodeCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('GEOCODE', 'Geocode'), ('REVERSE', 'Reverse Geocode'), ('ROUTE', 'Route')], max_length=10)),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'geocode_cache',
+            },
+        ),
+    ]
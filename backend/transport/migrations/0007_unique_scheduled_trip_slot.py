@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-17 15:39
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def remove_duplicate_slots(apps, schema_editor):
+    # Earlier get_or_create runs could race; keep one trip per slot (one that ran, if any).
+    # Redundant trips that are still only scheduled are dropped; extra ones that already ran keep
+    # their history but become SPECIAL trips, which the constraint doesn't cover.
+    Trip = apps.get_model('transport', 'Trip')
+    duplicates = Trip.objects.filter(trip_type__in=['MORNING_PICKUP', 'EVENING_DROPOFF']).values(
+        'bus_id', 'trip_type', 'scheduled_start'
+    ).annotate(count=Count('id')).filter(count__gt=1)
+    for slot in duplicates:
+        trips = list(Trip.objects.filter(
+            bus_id=slot['bus_id'], trip_type=slot['trip_type'], scheduled_start=slot['scheduled_start']
+        ).order_by('id').values_list('id', 'status'))
+        keep = next((trip_id for trip_id, status in trips if status != 'SCHEDULED'), trips[0][0])
+        extra = [(trip_id, status) for trip_id, status in trips if trip_id != keep]
+        Trip.objects.filter(id__in=[trip_id for trip_id, status in extra if status == 'SCHEDULED']).delete()
+        Trip.objects.filter(id__in=[trip_id for trip_id, status in extra if status != 'SCHEDULED']).update(
+            trip_type='SPECIAL'
+        )
+
+    # Deleting trips leaves deferred foreign key checks pending, and PostgreSQL refuses to build the
+    # constraint's index in the same transaction until they have run
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0006_attendance_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_slots, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='trip',
+            constraint=models.UniqueConstraint(condition=models.Q(('trip_type__in', ['MORNING_PICKUP', 'EVENING_DROPOFF'])), fields=('bus', 'trip_type', 'scheduled_start'), name='unique_scheduled_trip_slot'),
+        ),
+    ]
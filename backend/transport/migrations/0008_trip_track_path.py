@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-17 15:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0007_unique_scheduled_trip_slot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='triptrack',
+            name='path_offsets',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='triptrack',
+            name='path_point_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='triptrack',
+            name='path_polyline',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='triptrack',
+            name='path_tolerance',
+            field=models.FloatField(default=0),
+        ),
+    ]
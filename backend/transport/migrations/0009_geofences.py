@@ -0,0 +1,55 @@
+# Generated by Django 5.2.7 on 2026-10-17 15:44
+
+import django.core.validators
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0008_trip_track_path'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Geofence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('kind', models.CharField(choices=[('SCHOOL', 'School'), ('DEPOT', 'Depot'), ('ZONE', 'Zone')], default='SCHOOL', max_length=10)),
+                ('shape', models.CharField(choices=[('CIRCLE', 'Circle'), ('POLYGON', 'Polygon')], default='CIRCLE', max_length=10)),
+                ('latitude', models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True)),
+                ('longitude', models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True)),
+                ('radius_meters', models.IntegerField(default=100, validators=[django.core.validators.MinValueValidator(1)])),
+                ('polygon', models.JSONField(blank=True, default=list)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('school', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='geofences', to='users.school')),
+            ],
+            options={
+                'db_table': 'geofences',
+                'ordering': ['school', 'name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='GeofenceEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(choices=[('ENTER', 'Enter'), ('EXIT', 'Exit'), ('DWELL', 'Dwell')], max_length=5)),
+                ('latitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('longitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('occurred_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('bus_stop', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='geofence_events', to='transport.busstop')),
+                ('geofence', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='events', to='transport.geofence')),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='geofence_events', to='transport.trip')),
+            ],
+            options={
+                'db_table': 'geofence_events',
+                'ordering': ['-occurred_at'],
+                'indexes': [models.Index(fields=['trip', 'occurred_at'], name='geofence_ev_trip_id_20cb4a_idx')],
+            },
+        ),
+    ]
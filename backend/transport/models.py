@@ -19,6 +19,11 @@ class Bus(models.Model):
         HYBRID = 'HYBRID', 'Hybrid'
         CNG = 'CNG', 'CNG'
 
+    class GPSStatus(models.TextChoices):
+        ONLINE = 'ONLINE', 'Online'
+        OFFLINE = 'OFFLINE', 'Offline'
+        UNKNOWN = 'UNKNOWN', 'Unknown'
+
     school = models.ForeignKey('users.School', on_delete=models.CASCADE, related_name='buses')
     bus_number = models.CharField(max_length=20, unique=True)
     license_plate = models.CharField(max_length=15, unique=True)
@@ -32,6 +37,9 @@ class Bus(models.Model):
     # Tracking
     current_driver = models.ForeignKey('Driver', on_delete=models.SET_NULL, null=True, blank=True, related_name='current_bus')
     current_route = models.ForeignKey('Route', on_delete=models.SET_NULL, null=True, blank=True, related_name='active_buses')
+    gps_device_id = models.CharField(max_length=50, blank=True)
+    last_gps_update = models.DateTimeField(null=True, blank=True)
+    gps_status = models.CharField(max_length=10, choices=GPSStatus.choices, default=GPSStatus.UNKNOWN)
     
     # Maintenance
     last_maintenance_date = models.DateField(null=True, blank=True)
@@ -55,6 +63,34 @@ class Bus(models.Model):
     def __str__(self):
         return f"{self.bus_number} - {self.make} {self.model}"
 
+class GPSDevice(models.Model):
+    class DeviceStatus(models.TextChoices):
+        ACTIVE = 'ACTIVE', 'Active'
+        INACTIVE = 'INACTIVE', 'Inactive'
+        FAULTY = 'FAULTY', 'Faulty'
+
+    device_id = models.CharField(max_length=50, unique=True)
+    bus = models.ForeignKey(Bus, on_delete=models.CASCADE, related_name='gps_devices')
+    device_model = models.CharField(max_length=50, blank=True)
+    imei_number = models.CharField(max_length=20, blank=True)
+    status = models.CharField(max_length=10, choices=DeviceStatus.choices, default=DeviceStatus.ACTIVE)
+    
+    # Telemetry
+    last_communication = models.DateTimeField(null=True, blank=True)
+    battery_level = models.IntegerField(null=True, blank=True, validators=[MinValueValidator(0), MaxValueValidator(100)])
+    update_interval = models.IntegerField(default=30)  # seconds
+    gps_accuracy_threshold = models.IntegerField(default=50)  # meters
+    
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'gps_devices'
+        ordering = ['device_id']
+    
+    def __str__(self):
+        return f"{self.device_id} ({self.bus.bus_number})"
+
 class Driver(models.Model):
     class LicenseType(models.TextChoices):
         LMV = 'LMV', 'Light Motor Vehicle'
@@ -177,10 +213,17 @@ class Trip(models.Model):
     current_latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     current_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     last_location_update = models.DateTimeField(null=True, blank=True)
+    location_accuracy = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    location_heading = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    location_altitude = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True)
+    next_stop_eta = models.DateTimeField(null=True, blank=True)
+    school_eta = models.DateTimeField(null=True, blank=True)
     
     # Metrics
     students_onboard = models.IntegerField(default=0)
     average_speed = models.DecimalField(max_digits=5, decimal_places=2, default=0) 
+    max_speed = models.DecimalField(max_digits=5, decimal_places=2, default=0)
+    distance_traveled = models.DecimalField(max_digits=8, decimal_places=3, default=0)  # km
     
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
@@ -188,27 +231,173 @@ class Trip(models.Model):
     class Meta:
         db_table = 'trips'
         ordering = ['-scheduled_start']
+        constraints = [
+            # One generated trip per bus and slot (see TripScheduleService)
+            models.UniqueConstraint(
+                fields=['bus', 'trip_type', 'scheduled_start'],
+                condition=models.Q(trip_type__in=['MORNING_PICKUP', 'EVENING_DROPOFF']),
+                name='unique_scheduled_trip_slot'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.bus.bus_number} - {self.route.name} - {self.get_trip_type_display()}"
 
 class LocationUpdate(models.Model):
+    # Stored in daily range partitions on created_at (PostgreSQL, see migration 0003);
+    # expired days are dropped by LocationPartitionService instead of DELETEd.
+    # Floats instead of Decimals: 8 bytes per coordinate, no numeric arithmetic on insert.
     trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='location_updates')
-    latitude = models.DecimalField(max_digits=9, decimal_places=6)
-    longitude = models.DecimalField(max_digits=9, decimal_places=6)
-    speed = models.DecimalField(max_digits=5, decimal_places=2, default=0) 
-    heading = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True) 
-    accuracy = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True) 
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    speed = models.FloatField(default=0) 
+    heading = models.FloatField(null=True, blank=True) 
+    accuracy = models.FloatField(null=True, blank=True) 
+    altitude = models.FloatField(null=True, blank=True)
+    
+    # Device telemetry
+    device_id = models.CharField(max_length=50, blank=True)
+    battery_level = models.IntegerField(null=True, blank=True)
+    signal_strength = models.IntegerField(null=True, blank=True)
     
     created_at = models.DateTimeField(default=timezone.now)
     
     class Meta:
         db_table = 'location_updates'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['trip', 'created_at'], name='location_trip_created_idx'),
+        ]
     
     def __str__(self):
         return f"Location update for {self.trip} at {self.created_at}"
 
+class TripTrack(models.Model):
+    # Downsampled path of a finished trip, kept after its raw LocationUpdate partitions are dropped.
+    # points: [[seconds since started_at, latitude, longitude, speed], ...]
+    trip = models.OneToOneField(Trip, on_delete=models.CASCADE, related_name='track')
+    interval_seconds = models.IntegerField()
+    points = models.JSONField(default=list)
+    point_count = models.IntegerField(default=0)
+    raw_point_count = models.IntegerField(default=0)
+    distance_km = models.FloatField(default=0)
+    started_at = models.DateTimeField(null=True, blank=True)
+    ended_at = models.DateTimeField(null=True, blank=True)
+    
+    # Full-resolution path simplified (Douglas-Peucker, path_tolerance meters) for replay:
+    # an encoded polyline plus the points' seconds since started_at, delta-encoded the same way
+    path_polyline = models.TextField(blank=True)
+    path_offsets = models.TextField(blank=True)
+    path_point_count = models.IntegerField(default=0)
+    path_tolerance = models.FloatField(default=0)
+    
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        db_table = 'trip_tracks'
+        ordering = ['-started_at']
+    
+    def __str__(self):
+        return f"Track for {self.trip} ({self.point_count} points)"
+
+class RouteEtaProfile(models.Model):
+    # Learned travel times between consecutive stops of a route, rebuilt nightly from TripTrack history.
+    # segment_seconds[i][b]: median seconds from stop i to stop i + 1 for departures in time-of-day bucket b
+    # (bucket_minutes wide, local time), null where there were too few trips.
+    route = models.OneToOneField(Route, on_delete=models.CASCADE, related_name='eta_profile')
+    stop_ids = models.JSONField(default=list)
+    bucket_minutes = models.IntegerField(default=60)
+    segment_seconds = models.JSONField(default=list)
+    segment_default_seconds = models.JSONField(default=list)
+    segment_samples = models.JSONField(default=list)
+    trip_count = models.IntegerField(default=0)
+    
+    built_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        db_table = 'route_eta_profiles'
+    
+    def __str__(self):
+        return f"ETA profile for {self.route.name} ({self.trip_count} trips)"
+
+class Geofence(models.Model):
+    # School-level fence (school grounds, depot, no-go zone). Every BusStop also gets implicit
+    # circular fences, see transport/geofence.py.
+    class Kind(models.TextChoices):
+        SCHOOL = 'SCHOOL', 'School'
+        DEPOT = 'DEPOT', 'Depot'
+        ZONE = 'ZONE', 'Zone'
+
+    class Shape(models.TextChoices):
+        CIRCLE = 'CIRCLE', 'Circle'
+        POLYGON = 'POLYGON', 'Polygon'
+
+    school = models.ForeignKey('users.School', on_delete=models.CASCADE, related_name='geofences')
+    name = models.CharField(max_length=100)
+    kind = models.CharField(max_length=10, choices=Kind.choices, default=Kind.SCHOOL)
+    shape = models.CharField(max_length=10, choices=Shape.choices, default=Shape.CIRCLE)
+    
+    # Circle: center and radius; polygon: [[latitude, longitude], ...] vertices
+    latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    radius_meters = models.IntegerField(default=100, validators=[MinValueValidator(1)])
+    polygon = models.JSONField(default=list, blank=True)
+    
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        db_table = 'geofences'
+        ordering = ['school', 'name']
+    
+    def __str__(self):
+        return f"{self.name} ({self.get_kind_display()})"
+
+class GeofenceEvent(models.Model):
+    class EventType(models.TextChoices):
+        ENTER = 'ENTER', 'Enter'
+        EXIT = 'EXIT', 'Exit'
+        DWELL = 'DWELL', 'Dwell'
+
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='geofence_events')
+    # Exactly one of bus_stop / geofence is set
+    bus_stop = models.ForeignKey(BusStop, on_delete=models.CASCADE, null=True, blank=True, related_name='geofence_events')
+    geofence = models.ForeignKey(Geofence, on_delete=models.CASCADE, null=True, blank=True, related_name='events')
+    event_type = models.CharField(max_length=5, choices=EventType.choices)
+    latitude = models.DecimalField(max_digits=9, decimal_places=6)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6)
+    occurred_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        db_table = 'geofence_events'
+        ordering = ['-occurred_at']
+        indexes = [
+            models.Index(fields=['trip', 'occurred_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.trip_id} {self.get_event_type_display()} {self.bus_stop or self.geofence}"
+
+class GeocodeCacheEntry(models.Model):
+    # Persistent cache of Nominatim/OSRM answers, keyed by normalized address or rounded coordinates.
+    # result is null for lookups that found nothing (kept for a shorter time).
+    class Kind(models.TextChoices):
+        GEOCODE = 'GEOCODE', 'Geocode'
+        REVERSE = 'REVERSE', 'Reverse Geocode'
+        ROUTE = 'ROUTE', 'Route'
+
+    kind = models.CharField(max_length=10, choices=Kind.choices)
+    key = models.CharField(max_length=255, unique=True)
+    result = models.JSONField(null=True, blank=True)
+    
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        db_table = 'geocode_cache'
+    
+    def __str__(self):
+        return f"{self.kind}: {self.key}"
+
 class StudentTransport(models.Model):
     student = models.OneToOneField(User, on_delete=models.CASCADE, related_name='transport_assignment',
                                   limit_choices_to={'role': User.Role.STUDENT})
@@ -252,11 +441,21 @@ class AttendanceLog(models.Model):
     marked_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='marked_attendance')
     notes = models.TextField(blank=True)
     
+    # Client-supplied key; a retried submission with the same key is not recorded twice
+    idempotency_key = models.CharField(max_length=100, null=True, blank=True)
+    
     created_at = models.DateTimeField(default=timezone.now)
     
     class Meta:
         db_table = 'attendance_logs'
         ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['trip', 'idempotency_key'],
+                condition=models.Q(idempotency_key__isnull=False),
+                name='unique_attendance_idempotency_key'
+            ),
+        ]
     
     def __str__(self):
         status = "Present" if self.is_present else "Absent"
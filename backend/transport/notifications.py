@@ -0,0 +1,243 @@
+import logging
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.mail import send_mass_mail
+from django.utils import timezone
+
+from .models import StudentTransport, NotificationPreference
+from .services import GPSService
+
+logger = logging.getLogger(__name__)
+
+
+def _marker_cache():
+    # Sent-markers must be shared between workers to dedupe across processes
+    return caches[getattr(settings, 'TRANSPORT_NOTIFICATION_CACHE', 'shared')]
+
+
+class BulkNotificationSender:
+    # Collects emails and in-app (push) notifications and delivers them in one go:
+    # all emails over a single SMTP connection, all push rows with one bulk_create.
+
+    def __init__(self):
+        self.emails = []
+        self.push = []
+
+    def add_email(self, subject, message, recipient):
+        if recipient:
+            self.emails.append((subject, message, settings.DEFAULT_FROM_EMAIL, [recipient]))
+
+    def add_push(self, user_id, message):
+        self.push.append((user_id, message))
+
+    def send(self):
+        sent = 0
+        if self.emails:
+            try:
+                sent += send_mass_mail(self.emails, fail_silently=True)
+            except Exception as e:
+                logger.error(f"Could not send {len(self.emails)} transport emails: {str(e)}")
+
+        if self.push:
+            from notifications.models import Notification
+            try:
+                Notification.objects.bulk_create([
+                    Notification(
+                        user_id=user_id,
+                        notification_type=Notification.Type.TRANSPORT_ALERT,
+                        message=message,
+                    )
+                    for user_id, message in self.push
+                ], batch_size=500)
+                sent += len(self.push)
+            except Exception as e:
+                logger.error(f"Could not queue {len(self.push)} transport push notifications: {str(e)}")
+        return sent
+
+
+class NotificationDispatcher:
+    # Route-wide transport notifications at a constant number of queries: one for the assignments
+    # (with student and profile), one for their preferences. Every (kind, trip, stop, student) is
+    # sent at most once, tracked with sent-markers in TRANSPORT_NOTIFICATION_CACHE.
+
+    @staticmethod
+    def marker_key(kind, trip_id, stop_id, student_id):
+        return f"transport_notified_{kind}_{trip_id}_{stop_id or 0}_{student_id}"
+
+    @staticmethod
+    def recipients(route_id, preference_field, bus_stop_id=None):
+        # [(assignment, preferences)] for active assignments whose preferences enable `preference_field`
+        assignments = StudentTransport.objects.filter(
+            route_id=route_id,
+            is_active=True
+        ).select_related('student__profile', 'bus_stop')
+        if bus_stop_id is not None:
+            assignments = assignments.filter(bus_stop_id=bus_stop_id)
+        assignments = list(assignments)
+        if not assignments:
+            return []
+
+        preferences = {
+            preference.user_id: preference
+            for preference in NotificationPreference.objects.filter(
+                user_id__in=[assignment.student_id for assignment in assignments]
+            )
+        }
+        return [
+            (assignment, preferences[assignment.student_id])
+            for assignment in assignments
+            if assignment.student_id in preferences and getattr(preferences[assignment.student_id], preference_field)
+        ]
+
+    @staticmethod
+    def claim(kind, trip_id, stop_id, student_ids):
+        # Student ids not notified yet for this trip/stop; marks them as sent
+        if not student_ids:
+            return []
+        cache = _marker_cache()
+        keys = {NotificationDispatcher.marker_key(kind, trip_id, stop_id, student_id): student_id
+                for student_id in student_ids}
+        ttl = getattr(settings, 'TRANSPORT_NOTIFICATION_SENT_TTL', 60 * 60 * 12)
+        claimed = []
+        for key, student_id in keys.items():
+            try:
+                # add() is atomic, so of two workers racing for a marker only one sends
+                if cache.add(key, 1, ttl):
+                    claimed.append(student_id)
+            except Exception as e:
+                # Better a rare duplicate than a missed alert
+                logger.warning(f"Could not check transport notification marker {key}: {str(e)}")
+                claimed.append(student_id)
+        return claimed
+
+    @staticmethod
+    def dispatch_arrival(trip, bus_stop, distance):
+        # Alert students (and parents) at `bus_stop` whose arrival window covers the current ETA.
+        # Returns the number of emails and push notifications sent.
+        # Anywhere in the approach ring, including its exit margin, since arrivals are re-checked there
+        ring = getattr(settings, 'GEOFENCE_APPROACH_RADIUS', 1000) + getattr(settings, 'GEOFENCE_EXIT_MARGIN', 20)
+        if distance > ring / 1000:
+            return 0
+
+        # The ETA is the same for everyone waiting at the stop; ingestion has just stored the learned one
+        if trip.next_stop_eta and trip.next_stop_eta > timezone.now():
+            eta_minutes = (trip.next_stop_eta - timezone.now()).total_seconds() / 60
+        else:
+            eta_minutes = GPSService.calculate_eta(
+                float(trip.current_latitude), float(trip.current_longitude),
+                float(bus_stop.latitude), float(bus_stop.longitude),
+                float(trip.average_speed or 30)
+            )
+
+        due = [
+            (assignment, preferences)
+            for assignment, preferences in NotificationDispatcher.recipients(
+                trip.route_id, 'bus_arriving', bus_stop_id=bus_stop.id
+            )
+            if eta_minutes <= preferences.arrival_alert_minutes
+        ]
+        claimed = set(NotificationDispatcher.claim(
+            'arrival', trip.id, bus_stop.id, [assignment.student_id for assignment, _ in due]
+        ))
+
+        subject = f'Bus Arriving Soon - {eta_minutes:.0f} minutes'
+        message = f'''
+                    Your bus is approaching your stop.
+
+                    Bus: {trip.bus.bus_number}
+                    Route: {trip.route.name}
+                    Stop: {bus_stop.name}
+                    Estimated Arrival: {eta_minutes:.0f} minutes
+
+                    Please be ready at your stop.
+
+                    Track live location: [App Tracking Link]
+                '''
+
+        sender = BulkNotificationSender()
+        for assignment, preferences in due:
+            if assignment.student_id not in claimed:
+                continue
+            student = assignment.student
+            if preferences.email_notifications:
+                sender.add_email(subject, message, student.email)
+            if preferences.push_notifications:
+                sender.add_push(student.id, f'Bus {trip.bus.bus_number} arrives at {bus_stop.name} in about {eta_minutes:.0f} minutes')
+            # Parents are told regardless of the student's delivery settings
+            profile = getattr(student, 'profile', None)
+            if profile and profile.parent_email:
+                sender.add_email(subject, message, profile.parent_email)
+
+        return sender.send()
+
+    @staticmethod
+    def dispatch_delay(trip, delay_minutes=15):
+        # Tell students on the trip's route who opted into delay alerts; once per trip
+        recipients = NotificationDispatcher.recipients(trip.route_id, 'bus_delayed')
+        claimed = set(NotificationDispatcher.claim(
+            'delay', trip.id, None, [assignment.student_id for assignment, _ in recipients]
+        ))
+
+        subject = f'Bus Delay - {trip.bus.bus_number}'
+        message = f'''
+                    Your bus is experiencing a delay.
+
+                    Bus: {trip.bus.bus_number}
+                    Route: {trip.route.name}
+                    Current Delay: Approximately {delay_minutes} minutes
+
+                    We apologize for the inconvenience.
+                '''
+
+        sender = BulkNotificationSender()
+        for assignment, preferences in recipients:
+            if assignment.student_id not in claimed:
+                continue
+            if preferences.email_notifications:
+                sender.add_email(subject, message, assignment.student.email)
+            if preferences.push_notifications:
+                sender.add_push(assignment.student_id, f'Bus {trip.bus.bus_number} is running about {delay_minutes} minutes late')
+
+        return sender.send()
+
+    @staticmethod
+    def dispatch_attendance(trip, bus_stop, attendance_type, actual_times):
+        # Pickup/dropoff confirmations for a batch of attendance marks, {student_id: actual_time}:
+        # one query for the students (with profile), one for the preferences that want them
+        if not actual_times:
+            return 0
+        User = get_user_model()
+        preferences = {
+            preference.user_id: preference
+            for preference in NotificationPreference.objects.filter(
+                user_id__in=list(actual_times), attendance_marked=True
+            )
+        }
+        if not preferences:
+            return 0
+
+        action = "picked up" if attendance_type == 'PICKUP' else "dropped off"
+        sender = BulkNotificationSender()
+        for student in User.objects.filter(id__in=list(preferences)).select_related('profile'):
+            preference = preferences[student.id]
+            actual_time = actual_times[student.id]
+            subject = f'Student {action} - {student.get_display_name()}'
+            message = f'''
+            {student.get_display_name()} has been {action} from the bus.
+            
+            Time: {timezone.localtime(actual_time).strftime("%I:%M %p") if actual_time else 'Not recorded'}
+            Bus Stop: {bus_stop.name}
+            Bus: {trip.bus.bus_number}
+            '''
+            if preference.email_notifications:
+                sender.add_email(subject, message, student.email)
+            if preference.push_notifications:
+                sender.add_push(student.id, f'{student.get_display_name()} has been {action} at {bus_stop.name}')
+            # Also notify parent
+            profile = getattr(student, 'profile', None)
+            if profile and profile.parent_email:
+                sender.add_email(subject, message, profile.parent_email)
+
+        return sender.send()
@@ -0,0 +1,336 @@
+import time
+import hashlib
+import logging
+from datetime import datetime
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, Min, Max
+
+from .models import Bus, BusStop, StudentTransport
+from .services import OpenStreetMapService
+from .stop_index import EARTH_RADIUS_KM, StopIndexCache
+from .geofence import GeofenceIndexCache
+
+logger = logging.getLogger(__name__)
+
+# Moves must gain at least this much to be applied (km), so float noise can't make the search cycle
+IMPROVEMENT_EPSILON = 1e-7
+
+# Longest stop chain Or-opt tries to move
+OR_OPT_MAX_SEGMENT = 3
+
+# Cost of one minute of lateness against a stop's pickup window, in km of driving
+LATENESS_PENALTY_KM = 2.0
+
+# Students are expected at their stop this long either side of their pickup time (seconds)
+PICKUP_WINDOW_TOLERANCE = 10 * 60
+
+
+def haversine_matrix(latitudes, longitudes):
+    # Great-circle distances between every pair of points, in km
+    lat = np.radians(latitudes)[:, None]
+    lng = np.radians(longitudes)[:, None]
+    dlat = lat - lat.T
+    dlng = lng - lng.T
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat) * np.cos(lat.T) * np.sin(dlng / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class DistanceMatrixCache:
+    # Stop-to-stop distance matrices keyed by the stops' coordinates, so re-optimizing an unchanged
+    # route (or one with the same stops) never recomputes or re-fetches them.
+    # source 'haversine' works offline; 'osrm' asks the OSRM table service once and falls back to haversine.
+
+    @staticmethod
+    def key(coordinates, source):
+        digest = hashlib.sha1(repr(coordinates).encode()).hexdigest()
+        return f"route_distance_matrix_{source}_{digest}"
+
+    @staticmethod
+    def get(coordinates, source='haversine'):
+        # coordinates: [(latitude, longitude), ...]; returns an (n x n) array in km
+        cache = caches[getattr(settings, 'ROUTE_MATRIX_CACHE', 'default')]
+        key = DistanceMatrixCache.key(coordinates, source)
+        try:
+            matrix = cache.get(key)
+        except Exception:
+            matrix = None
+        if matrix is not None:
+            return matrix
+
+        matrix = None
+        if source == 'osrm':
+            result = OpenStreetMapService.get_distance_matrix([(lng, lat) for lat, lng in coordinates])
+            if result is not None:
+                matrix = np.asarray(result, dtype=np.float64) / 1000
+        if matrix is None:
+            points = np.asarray(coordinates, dtype=np.float64)
+            matrix = haversine_matrix(points[:, 0], points[:, 1]) * getattr(settings, 'ROUTE_HAVERSINE_DETOUR_FACTOR', 1.3)
+
+        try:
+            cache.set(key, matrix, getattr(settings, 'ROUTE_MATRIX_TTL', 60 * 60 * 24 * 7))
+        except Exception as e:
+            logger.warning(f"Could not cache route distance matrix: {str(e)}")
+        return matrix
+
+
+class StopOrderSolver:
+    # Orders the stops of one bus run as an open path from a fixed first stop to a fixed last stop
+    # (the school): nearest-neighbour construction, then 2-opt and Or-opt until no move shortens it.
+    # With pickup windows, a final pass relocates late stops when that lowers distance + lateness.
+
+    def __init__(self, distances, speed_kmh=25, dwell_seconds=60, windows=None, time_budget=1.0):
+        # distances: (n x n) km; windows: {position: (earliest, latest)} in seconds from departure.
+        # time_budget bounds the window repair pass (seconds); the distance search always completes.
+        self.distances = (distances + distances.T) / 2
+        self.speed_kmh = speed_kmh
+        self.dwell_seconds = dwell_seconds
+        self.windows = windows or {}
+        self.time_budget = time_budget
+
+    def solve(self):
+        started = time.perf_counter()
+        count = len(self.distances)
+        if count <= 3:
+            return np.arange(count)
+
+        path = self.nearest_neighbour()
+        improved = True
+        while improved:
+            improved = self.two_opt(path)
+            improved = self.or_opt(path) or improved
+
+        if self.windows:
+            self.repair_windows(path, deadline=started + self.time_budget)
+        return path
+
+    def nearest_neighbour(self):
+        count = len(self.distances)
+        path = [0]
+        remaining = np.ones(count, dtype=bool)
+        remaining[0] = remaining[count - 1] = False
+        for _ in range(count - 2):
+            candidates = np.where(remaining, self.distances[path[-1]], np.inf)
+            nearest = int(np.argmin(candidates))
+            path.append(nearest)
+            remaining[nearest] = False
+        path.append(count - 1)
+        return np.array(path)
+
+    def length(self, path):
+        return float(self.distances[path[:-1], path[1:]].sum())
+
+    def two_opt(self, path):
+        # Reverse path[i + 1..j] when that shortens it; returns whether anything changed
+        distances = self.distances
+        changed = False
+        improved = True
+        while improved:
+            improved = False
+            for i in range(len(path) - 3):
+                a, b = path[i], path[i + 1]
+                j = np.arange(i + 2, len(path) - 1)
+                c, d = path[j], path[j + 1]
+                delta = distances[a, c] + distances[b, d] - distances[a, b] - distances[c, d]
+                best = int(np.argmin(delta))
+                if delta[best] < -IMPROVEMENT_EPSILON:
+                    end = j[best]
+                    path[i + 1:end + 1] = path[i + 1:end + 1][::-1].copy()
+                    improved = changed = True
+        return changed
+
+    def or_opt(self, path):
+        # Move chains of 1..OR_OPT_MAX_SEGMENT stops (either way round) to their cheapest position
+        distances = self.distances
+        changed = False
+        improved = True
+        while improved:
+            improved = False
+            for size in range(1, OR_OPT_MAX_SEGMENT + 1):
+                for i in range(1, len(path) - size):
+                    first, last = path[i], path[i + size - 1]
+                    before, after = path[i - 1], path[i + size]
+                    gain = distances[before, first] + distances[last, after] - distances[before, after]
+
+                    rest = np.concatenate([path[:i], path[i + size:]])
+                    left, right = rest[:-1], rest[1:]
+                    base = distances[left, right]
+                    forward = distances[left, first] + distances[last, right] - base
+                    backward = distances[left, last] + distances[first, right] - base
+                    # Putting the chain back where it was is not a move
+                    forward[i - 1] = backward[i - 1] = np.inf
+
+                    k_forward, k_backward = int(np.argmin(forward)), int(np.argmin(backward))
+                    reverse = backward[k_backward] < forward[k_forward]
+                    k = k_backward if reverse else k_forward
+                    cost = backward[k] if reverse else forward[k]
+                    if cost - gain < -IMPROVEMENT_EPSILON:
+                        chain = path[i:i + size][::-1] if reverse else path[i:i + size]
+                        path[:] = np.concatenate([rest[:k + 1], chain, rest[k + 1:]])
+                        improved = changed = True
+        return changed
+
+    def schedule(self, path):
+        # Arrival time (seconds from departure) at each position of `path`, waiting for windows that
+        # haven't opened yet; returns (arrivals, total lateness in seconds)
+        legs = (self.distances[path[:-1], path[1:]] * (3600 / self.speed_kmh) + self.dwell_seconds).tolist()
+        stops = path.tolist()
+        windows = self.windows
+        arrivals = [0.0]
+        lateness = 0.0
+        clock = 0.0
+        for position in range(1, len(stops)):
+            clock += legs[position - 1]
+            window = windows.get(stops[position])
+            if window:
+                earliest, latest = window
+                if clock < earliest:
+                    clock = earliest
+                elif clock > latest:
+                    lateness += clock - latest
+            arrivals.append(clock)
+        return np.array(arrivals), lateness
+
+    def cost(self, path):
+        return self.length(path) + LATENESS_PENALTY_KM * self.schedule(path)[1] / 60
+
+    def repair_windows(self, path, deadline, max_rounds=3):
+        # Move late stops earlier in the run wherever total cost (distance + lateness penalty) is lowest
+        for _ in range(max_rounds):
+            arrivals, lateness = self.schedule(path)
+            if not lateness:
+                return
+            moved = False
+            late = [
+                int(stop) for position, stop in enumerate(path[1:-1], start=1)
+                if int(stop) in self.windows and arrivals[position] > self.windows[int(stop)][1]
+            ]
+            for stop in late:
+                if time.perf_counter() > deadline:
+                    return
+                current = self.cost(path)
+                position = int(np.flatnonzero(path == stop)[0])
+                rest = np.delete(path, position)
+                best, best_cost = None, current
+                for k in range(1, position):
+                    candidate = np.insert(rest, k, stop)
+                    candidate_cost = self.cost(candidate)
+                    if candidate_cost < best_cost - IMPROVEMENT_EPSILON:
+                        best, best_cost = candidate, candidate_cost
+                if best is not None:
+                    path[:] = best
+                    moved = True
+            if not moved:
+                return
+
+
+class RouteOptimizationService:
+    # Reorders a route's stops with StopOrderSolver and writes the new BusStop.sequence
+
+    @staticmethod
+    def stop_demand(route):
+        # {bus_stop_id: (students, earliest pickup, latest pickup)} in one query
+        rows = StudentTransport.objects.filter(route=route, is_active=True).values('bus_stop_id').annotate(
+            students=Count('id'),
+            earliest=Min('morning_pickup_time'),
+            latest=Max('morning_pickup_time'),
+        )
+        return {row['bus_stop_id']: (row['students'], row['earliest'], row['latest']) for row in rows}
+
+    @staticmethod
+    def pickup_windows(stops, demand, start_time):
+        # Pickup windows relative to the route's morning start, by stop position
+        if not start_time:
+            return {}
+        start = datetime.combine(datetime.min, start_time)
+        windows = {}
+        for position, stop in enumerate(stops):
+            _, earliest, latest = demand.get(stop.id, (0, None, None))
+            if earliest is None or latest is None:
+                continue
+            windows[position] = (
+                (datetime.combine(datetime.min, earliest) - start).total_seconds() - PICKUP_WINDOW_TOLERANCE,
+                (datetime.combine(datetime.min, latest) - start).total_seconds() + PICKUP_WINDOW_TOLERANCE,
+            )
+        return windows
+
+    @staticmethod
+    def optimize(route, bus=None, source='haversine', apply=True):
+        # Returns a summary dict; 'error' is set (and nothing is saved) when the run can't be served
+        started = time.perf_counter()
+        stops = list(BusStop.objects.filter(route=route).order_by('sequence'))
+        if len(stops) < 2:
+            return {'error': 'Route needs at least 2 stops'}
+
+        demand = RouteOptimizationService.stop_demand(route)
+        students = sum(count for count, _, _ in demand.values())
+        if bus is None:
+            bus = Bus.objects.filter(current_route=route, status=Bus.BusStatus.ACTIVE).order_by('-capacity').first()
+        if bus is not None and students > bus.capacity:
+            return {'error': f'{students} students are assigned to this route but bus {bus.bus_number} seats {bus.capacity}'}
+
+        distances = DistanceMatrixCache.get([(float(stop.latitude), float(stop.longitude)) for stop in stops], source)
+        solver = StopOrderSolver(
+            distances,
+            speed_kmh=getattr(settings, 'ROUTE_OPTIMIZER_SPEED_KMH', 25),
+            dwell_seconds=getattr(settings, 'ROUTE_OPTIMIZER_DWELL_SECONDS', 60),
+            windows=RouteOptimizationService.pickup_windows(stops, demand, route.morning_start_time),
+            time_budget=getattr(settings, 'ROUTE_OPTIMIZER_TIME_BUDGET', 0.5),
+        )
+        original = np.arange(len(stops))
+        path = solver.solve()
+        arrivals, lateness = solver.schedule(path)
+        ordered = [stops[position] for position in path]
+
+        if apply:
+            RouteOptimizationService.save_order(route, ordered, arrivals, solver.length(path), arrivals[-1])
+
+        load = np.cumsum([demand.get(stop.id, (0, None, None))[0] for stop in ordered])
+        return {
+            'stops': [
+                {
+                    'id': stop.id,
+                    'name': stop.name,
+                    'sequence': sequence,
+                    'arrival_offset_minutes': round(arrivals[sequence - 1] / 60),
+                    'students': demand.get(stop.id, (0, None, None))[0],
+                    'load': int(load[sequence - 1]),
+                }
+                for sequence, stop in enumerate(ordered, start=1)
+            ],
+            'distance_km': round(solver.length(path), 2),
+            'original_distance_km': round(solver.length(original), 2),
+            'duration_minutes': round(arrivals[-1] / 60),
+            'late_minutes': round(lateness / 60),
+            'students': students,
+            'capacity': bus.capacity if bus is not None else None,
+            'source': source,
+            'solve_ms': round((time.perf_counter() - started) * 1000, 1),
+        }
+
+    @staticmethod
+    @transaction.atomic
+    def save_order(route, ordered, arrivals, distance_km, duration_seconds):
+        # (route, sequence) is unique, so sequences move out of the way before taking their new values
+        offset = len(ordered) + max(stop.sequence for stop in ordered)
+        for stop in ordered:
+            stop.sequence += offset
+        BusStop.objects.bulk_update(ordered, ['sequence'])
+
+        for sequence, (stop, arrival) in enumerate(zip(ordered, arrivals), start=1):
+            stop.sequence = sequence
+            stop.estimated_arrival_offset = round(arrival / 60)
+        BusStop.objects.bulk_update(ordered, ['sequence', 'estimated_arrival_offset'])
+
+        route.total_distance = round(distance_km, 2)
+        route.estimated_duration = round(duration_seconds / 60)
+        route.save(update_fields=['total_distance', 'estimated_duration', 'updated_at'])
+
+        # bulk_update skips the BusStop signals, so drop both route caches as reset_route_stops does
+        def invalidate():
+            StopIndexCache.invalidate(route.id)
+            GeofenceIndexCache.invalidate(route.id)
+        transaction.on_commit(invalidate)
@@ -0,0 +1,43 @@
+import io
+import gzip
+import zlib
+
+import msgpack
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+
+
+def _decoded_stream(stream, parser_context):
+    # Undo Content-Encoding: gzip, capped at GPS_BATCH_MAX_BYTES so a small upload can't inflate unbounded
+    request = (parser_context or {}).get('request')
+    encoding = request.META.get('HTTP_CONTENT_ENCODING', '') if request is not None else ''
+    if encoding.lower() != 'gzip':
+        return stream
+
+    limit = getattr(settings, 'GPS_BATCH_MAX_BYTES', 5 * 1024 * 1024)
+    try:
+        data = gzip.GzipFile(fileobj=stream).read(limit + 1)
+    except (OSError, EOFError, zlib.error) as e:
+        raise ParseError(f'Invalid gzip body: {str(e)}')
+    if len(data) > limit:
+        raise ParseError('Decompressed body too large')
+    return io.BytesIO(data)
+
+
+class GzipJSONParser(JSONParser):
+    # JSON, optionally sent with Content-Encoding: gzip
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return super().parse(_decoded_stream(stream, parser_context), media_type, parser_context)
+
+
+class MsgPackParser(BaseParser):
+    # application/msgpack bodies (optionally gzip-encoded) for driver devices on metered links
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(_decoded_stream(stream, parser_context).read(), raw=False)
+        except (ValueError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError) as e:
+            raise ParseError(f'Invalid msgpack body: {str(e)}')
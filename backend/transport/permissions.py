@@ -56,20 +56,14 @@ class CanUpdateLocation(permissions.BasePermission):
         if not request.user.is_authenticated:
             return False
         
-        # Only drivers can update location
-        if not hasattr(request.user, 'driver_profile'):
-            return False
-        
-        # Driver must be assigned to the trip they're updating
+        # Driver must be assigned to the trip they're updating (checked against the cached GPS state)
         if view.kwargs.get('trip_id'):
-            from .models import Trip
-            try:
-                trip = Trip.objects.get(id=view.kwargs['trip_id'])
-                return trip.driver == request.user.driver_profile
-            except Trip.DoesNotExist:
-                return False
+            from .ingestion import GPSIngestionService
+            state = GPSIngestionService.get_state(view.kwargs['trip_id'])
+            return state is not None and state['driver_user_id'] == request.user.id
         
-        return True
+        # Only drivers can update location
+        return hasattr(request.user, 'driver_profile')
 
 class CanMarkAttendance(permissions.BasePermission):
     def has_permission(self, request, view):
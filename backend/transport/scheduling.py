@@ -0,0 +1,123 @@
+import logging
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from users.models import School
+from .models import Bus, Trip
+
+logger = logging.getLogger(__name__)
+
+# (trip type, Route field with its start time)
+SCHEDULED_TRIP_TYPES = (
+    (Trip.TripType.MORNING_PICKUP, 'morning_start_time'),
+    (Trip.TripType.EVENING_DROPOFF, 'evening_start_time'),
+)
+
+# Generated trips get this long until a driver ends them
+SCHEDULED_TRIP_DURATION = timedelta(hours=1)
+
+
+class TripScheduleService:
+    # Set-based trip generation, one school at a time (each school is an independent shard):
+    # one query for the school's assigned buses, one for the trips already in the window,
+    # one bulk insert for the missing ones. The unique_scheduled_trip_slot constraint makes
+    # concurrent or repeated runs harmless.
+
+    @staticmethod
+    def school_ids():
+        return list(School.objects.order_by('id').values_list('id', flat=True))
+
+    @staticmethod
+    def service_dates(start_date, days):
+        weekdays = getattr(settings, 'TRANSPORT_TRIP_WEEKDAYS', (0, 1, 2, 3, 4, 5, 6))
+        return [
+            start_date + timedelta(days=offset)
+            for offset in range(days)
+            if (start_date + timedelta(days=offset)).weekday() in weekdays
+        ]
+
+    @staticmethod
+    def expected_trips(school_id, dates):
+        # Unsaved Trips every assigned, active bus of the school should run on `dates`
+        buses = Bus.objects.filter(
+            school_id=school_id,
+            status=Bus.BusStatus.ACTIVE,
+            current_route__isnull=False,
+            current_driver__isnull=False
+        ).values_list('id', 'current_route_id', 'current_driver_id',
+                      'current_route__morning_start_time', 'current_route__evening_start_time')
+
+        trips = []
+        for bus_id, route_id, driver_id, morning_start_time, evening_start_time in buses:
+            start_times = {'morning_start_time': morning_start_time, 'evening_start_time': evening_start_time}
+            for trip_type, field in SCHEDULED_TRIP_TYPES:
+                if not start_times[field]:
+                    continue
+                for day in dates:
+                    scheduled_start = timezone.make_aware(datetime.combine(day, start_times[field]))
+                    trips.append(Trip(
+                        bus_id=bus_id,
+                        route_id=route_id,
+                        driver_id=driver_id,
+                        trip_type=trip_type,
+                        scheduled_start=scheduled_start,
+                        scheduled_end=scheduled_start + SCHEDULED_TRIP_DURATION,
+                        status=Trip.TripStatus.SCHEDULED
+                    ))
+        return trips
+
+    @staticmethod
+    def generate_for_school(school_id, start_date=None, days=None):
+        # Creates the school's missing trips from `start_date` for `days` days; returns how many
+        if start_date is None:
+            start_date = timezone.localdate()
+        if days is None:
+            days = getattr(settings, 'TRANSPORT_TRIP_DAYS_AHEAD', 7)
+
+        dates = TripScheduleService.service_dates(start_date, days)
+        expected = TripScheduleService.expected_trips(school_id, dates)
+
+        # Future trips follow the bus's current driver, so a reassignment doesn't strand a week of trips
+        Trip.objects.filter(
+            bus__school_id=school_id,
+            bus__current_driver__isnull=False,
+            status=Trip.TripStatus.SCHEDULED,
+            scheduled_start__gt=timezone.now()
+        ).exclude(driver_id=Subquery(
+            Bus.objects.filter(id=OuterRef('bus_id')).values('current_driver_id')[:1]
+        )).update(driver_id=Subquery(
+            Bus.objects.filter(id=OuterRef('bus_id')).values('current_driver_id')[:1]
+        ))
+
+        if not expected:
+            return 0
+
+        window_start = timezone.make_aware(datetime.combine(start_date, datetime.min.time()))
+        existing = set(Trip.objects.filter(
+            bus_id__in={trip.bus_id for trip in expected},
+            trip_type__in=[trip_type for trip_type, _ in SCHEDULED_TRIP_TYPES],
+            scheduled_start__gte=window_start,
+            scheduled_start__lt=window_start + timedelta(days=days)
+        ).values_list('bus_id', 'trip_type', 'scheduled_start'))
+
+        missing = [
+            trip for trip in expected
+            if (trip.bus_id, trip.trip_type, trip.scheduled_start) not in existing
+        ]
+        # Another worker may insert the same slots meanwhile; the constraint drops those rows
+        Trip.objects.bulk_create(missing, batch_size=500, ignore_conflicts=True)
+        return len(missing)
+
+    @staticmethod
+    def generate_all(start_date=None, days=None):
+        # Inline run over every school; returns {school_id: trips created}
+        created = {}
+        for school_id in TripScheduleService.school_ids():
+            try:
+                created[school_id] = TripScheduleService.generate_for_school(school_id, start_date, days)
+            except Exception as e:
+                logger.error(f"Could not generate trips for school {school_id}: {str(e)}")
+        return created
@@ -1,5 +1,8 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+from django.conf import settings
+from datetime import datetime, timezone as dt_timezone
 from .models import (
     Bus, Driver, Route, BusStop, Trip, LocationUpdate,
     StudentTransport, AttendanceLog, MaintenanceLog,
@@ -151,14 +154,22 @@ class TripSerializer(serializers.ModelSerializer):
                     'latitude': float(next_stop.latitude),
                     'longitude': float(next_stop.longitude),
                     'distance_km': round(distance, 2),
-                    'eta_minutes': GPSService.calculate_eta(
-                        float(obj.current_latitude), float(obj.current_longitude),
-                        float(next_stop.latitude), float(next_stop.longitude),
-                        float(obj.average_speed or 30)
-                    ) if obj.average_speed else None
+                    'eta_minutes': self._next_stop_eta_minutes(obj, next_stop)
                 }
         return None
     
+    def _next_stop_eta_minutes(self, obj, next_stop):
+        # Learned ETA stored by GPS ingestion; straight-line estimate for trips without one
+        if obj.next_stop_eta:
+            return max(1, round((obj.next_stop_eta - timezone.now()).total_seconds() / 60))
+        if obj.average_speed:
+            return GPSService.calculate_eta(
+                float(obj.current_latitude), float(obj.current_longitude),
+                float(next_stop.latitude), float(next_stop.longitude),
+                float(obj.average_speed)
+            )
+        return None
+    
     def get_eta_to_school(self, obj):
         if obj.school_eta:
             return obj.school_eta.isoformat()
@@ -169,9 +180,17 @@ class TripSerializer(serializers.ModelSerializer):
             'distance_traveled_km': float(obj.distance_traveled) if obj.distance_traveled else 0,
             'average_speed_kmh': float(obj.average_speed) if obj.average_speed else 0,
             'max_speed_kmh': float(obj.max_speed) if obj.max_speed else 0,
-            'location_updates_count': obj.location_updates.count()
+            'location_updates_count': self._location_updates_count(obj)
         }
 
+    def _location_updates_count(self, obj):
+        # Raw pings only live for GPS_LOCATION_RETENTION_DAYS; older trips report their rollup size
+        from .tracks import LocationPartitionService
+        count = LocationPartitionService.trip_updates(obj).count()
+        if not count and hasattr(obj, 'track'):
+            return obj.track.raw_point_count
+        return count
+
 class StudentTransportSerializer(serializers.ModelSerializer):
     student_name = serializers.CharField(source='student.get_display_name', read_only=True)
     student_grade = serializers.CharField(source='student.grade_level', read_only=True)
@@ -261,6 +280,32 @@ class LiveLocationSerializer(serializers.Serializer):
     battery_level = serializers.IntegerField(required=False, allow_null=True)
     signal_strength = serializers.IntegerField(required=False, allow_null=True)
 
+class EpochDateTimeField(serializers.DateTimeField):
+    # ISO 8601 strings, or unix timestamps in seconds or milliseconds (compact msgpack uploads)
+    def to_internal_value(self, value):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            seconds = value / 1000 if value > 1e11 else value
+            try:
+                return datetime.fromtimestamp(seconds, tz=dt_timezone.utc)
+            except (OverflowError, OSError, ValueError):
+                self.fail('invalid', format='unix timestamp')
+        return super().to_internal_value(value)
+
+class BatchLocationPointSerializer(LiveLocationSerializer):
+    # One buffered fix of a batch upload; the time is when the device took it
+    timestamp = EpochDateTimeField()
+
+class LocationBatchSerializer(serializers.Serializer):
+    # Points are validated one by one (BatchLocationPointSerializer) so a bad fix doesn't sink the batch
+    device_id = serializers.CharField(required=False, default='')
+    points = serializers.ListField(child=serializers.DictField(), allow_empty=False)
+    
+    def validate_points(self, value):
+        limit = getattr(settings, 'GPS_BATCH_MAX_POINTS', 1000)
+        if len(value) > limit:
+            raise serializers.ValidationError(f'At most {limit} points per batch')
+        return value
+
 class TripStartSerializer(serializers.Serializer):
     trip_id = serializers.IntegerField(required=False)
     start_location_lat = serializers.DecimalField(max_digits=9, decimal_places=6)
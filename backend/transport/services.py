@@ -1,4 +1,3 @@
-import requests
 from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
@@ -60,67 +59,44 @@ class GPSService:
 
 class OpenStreetMapService:
     # OpenStreetMap API integration - COMPLETELY FREE
+    # Lookups go through GeoService (cached, pooled, rate limited); see transport/geocoding.py
     
     @staticmethod
     def get_route_with_eta(origin_lat, origin_lng, dest_lat, dest_lng):
         # Get detailed route information with ETA using OSRM (Open Source Routing Machine)
+        from .geocoding import GeoService
         try:
-            url = f"http://router.project-osrm.org/route/v1/driving/{origin_lng},{origin_lat};{dest_lng},{dest_lat}"
-            params = {
-                'overview': 'full',
-                'geometries': 'geojson',
-                'steps': 'true'
-            }
-            
-            response = requests.get(url, params=params)
-            if response.status_code == 200:
-                data = response.json()
+            route = GeoService.route(origin_lat, origin_lng, dest_lat, dest_lng)
+            if route:
+                leg = route['legs'][0] if 'legs' in route else route
                 
-                if data['code'] == 'Ok' and data['routes']:
-                    route = data['routes'][0]
-                    leg = route['legs'][0] if 'legs' in route else route
-                    
-                    return {
-                        'distance_meters': route['distance'],
-                        'distance_text': f"{route['distance'] / 1000:.1f} km",
-                        'duration_seconds': route['duration'],
-                        'duration_text': f"{route['duration'] / 60:.0f} min",
-                        'eta': timezone.now() + timedelta(seconds=route['duration']),
-                        'polyline': route['geometry'],
-                        'steps': [
-                            {
-                                'instruction': step.get('name', 'Continue'),
-                                'distance': f"{step['distance'] / 1000:.1f} km",
-                                'duration': f"{step['duration'] / 60:.0f} min",
-                                'maneuver': step.get('maneuver', {}).get('type', 'turn')
-                            }
-                            for step in leg.get('steps', [])
-                        ] if 'legs' in route else []
-                    }
+                return {
+                    'distance_meters': route['distance'],
+                    'distance_text': f"{route['distance'] / 1000:.1f} km",
+                    'duration_seconds': route['duration'],
+                    'duration_text': f"{route['duration'] / 60:.0f} min",
+                    'eta': timezone.now() + timedelta(seconds=route['duration']),
+                    'polyline': route['geometry'],
+                    'steps': [
+                        {
+                            'instruction': step.get('name', 'Continue'),
+                            'distance': f"{step['distance'] / 1000:.1f} km",
+                            'duration': f"{step['duration'] / 60:.0f} min",
+                            'maneuver': step.get('maneuver', {}).get('type', 'turn')
+                        }
+                        for step in leg.get('steps', [])
+                    ] if 'legs' in route else []
+                }
         except Exception as e:
             print(f"OSRM API error: {e}")
-            return None
+        return None
     
     @staticmethod
     def geocode_address(address):
         # Convert address to GPS coordinates using Nominatim (free)
+        from .geocoding import GeoService
         try:
-            url = "https://nominatim.openstreetmap.org/search"
-            params = {
-                'q': address,
-                'format': 'json',
-                'limit': 1
-            }
-            
-            response = requests.get(url, params=params)
-            if response.status_code == 200:
-                results = response.json()
-                if results:
-                    return {
-                        'latitude': float(results[0]['lat']),
-                        'longitude': float(results[0]['lon']),
-                        'formatted_address': results[0]['display_name']
-                    }
+            return GeoService.geocode(address)
         except Exception as e:
             print(f"Geocoding error: {e}")
             return None
@@ -128,18 +104,9 @@ class OpenStreetMapService:
     @staticmethod
     def reverse_geocode(latitude, longitude):
         # Convert GPS coordinates to address using Nominatim
+        from .geocoding import GeoService
         try:
-            url = "https://nominatim.openstreetmap.org/reverse"
-            params = {
-                'lat': latitude,
-                'lon': longitude,
-                'format': 'json'
-            }
-            
-            response = requests.get(url, params=params)
-            if response.status_code == 200:
-                result = response.json()
-                return result.get('display_name', 'Address not found')
+            return GeoService.reverse(latitude, longitude) or 'Address not found'
         except Exception as e:
             print(f"Reverse geocoding error: {e}")
             return None
@@ -149,22 +116,31 @@ class OpenStreetMapService:
         # Generate static map image using OpenStreetMap
         return f"https://staticmap.openstreetmap.de/staticmap.php?center={latitude},{longitude}&zoom={zoom}&size={width}x{height}&markers={latitude},{longitude},red"
     
+    @staticmethod
+    def get_distance_matrix(coordinates):
+        # Road distances in meters between every pair of [lng, lat] points (OSRM table service)
+        from .geocoding import GeoService
+        try:
+            coordinates_str = ";".join([f"{coord[0]},{coord[1]}" for coord in coordinates])
+            data = GeoService.request('osrm', f"table/v1/driving/{coordinates_str}", {'annotations': 'distance'})
+            if data.get('code') == 'Ok' and data.get('distances'):
+                return data['distances']
+        except Exception as e:
+            print(f"OSRM table API error: {e}")
+        
+        return None
+    
     @staticmethod
     def get_optimized_route(coordinates):
         # Get optimized route using OSRM trip plugin
         # coordinates: list of [lng, lat] pairs
+        from .geocoding import GeoService
         try:
             coordinates_str = ";".join([f"{coord[0]},{coord[1]}" for coord in coordinates])
-            url = f"http://router.project-osrm.org/trip/v1/driving/{coordinates_str}"
-            
-            params = {
+            return GeoService.request('osrm', f"trip/v1/driving/{coordinates_str}", {
                 'steps': 'true',
                 'geometries': 'geojson'
-            }
-            
-            response = requests.get(url, params=params)
-            if response.status_code == 200:
-                return response.json()
+            })
         except Exception as e:
             print(f"OSRM trip API error: {e}")
         
@@ -181,108 +157,24 @@ class RealTimeTrackingService:
     
     @staticmethod
     def calculate_next_stop(trip, current_lat, current_lng):
-        # Calculate which stop is next based on current position
-        from .models import BusStop
+        # Calculate which stop is next based on current position and progress along the route
+        from .stop_index import StopIndexCache
+        from .ingestion import GPSIngestionService
         
-        stops = trip.route.stops.order_by('sequence')
-        if not stops:
-            return None
-        
-        # Find the closest stop that hasn't been passed yet
-        closest_stop = None
-        min_distance = float('inf')
+        stop_index = StopIndexCache.get(trip.route_id)
+        if not len(stop_index):
+            return None, None
         
-        for stop in stops:
-            distance = GPSService.calculate_distance(
-                current_lat, current_lng,
-                stop.latitude, stop.longitude
-            )
-            
-            if distance < min_distance:
-                min_distance = distance
-                closest_stop = stop
+        # Resume from the progress recorded by GPS ingestion, so passed stops are skipped
+        state = GPSIngestionService.get_state(trip.id)
+        progress = state.get('stop_progress') if state else None
         
-        return closest_stop, min_distance
+        next_stop, distance, _ = stop_index.locate(float(current_lat), float(current_lng), progress)
+        return next_stop, distance
     
     @staticmethod
     def should_send_arrival_notification(trip, bus_stop, distance):
-        # Determine if arrival notification should be sent
-        from .models import NotificationPreference
-        
-        # Send notification if within 1km and bus is moving toward stop
-        if distance <= 1.0:  
-            # Get students assigned to this stop
-            student_assignments = trip.route.student_assignments.filter(
-                bus_stop=bus_stop,
-                is_active=True
-            )
-            
-            notifications_sent = 0
-            for assignment in student_assignments:
-                preferences = NotificationPreference.objects.filter(
-                    user=assignment.student
-                ).first()
-                
-                if preferences and preferences.bus_arriving:
-                    # Calculate precise ETA using our GPS service
-                    eta_minutes = GPSService.calculate_eta(
-                        trip.current_latitude, trip.current_longitude,
-                        bus_stop.latitude, bus_stop.longitude,
-                        trip.average_speed or 30
-                    )
-                    
-                    # Only send if ETA is within user's preferred alert window
-                    if eta_minutes <= preferences.arrival_alert_minutes:
-                        RealTimeTrackingService.send_arrival_notification(
-                            assignment.student, trip, bus_stop, eta_minutes
-                        )
-                        notifications_sent += 1
-            
-            return notifications_sent > 0
-        
-        return False
-    
-    @staticmethod
-    def send_arrival_notification(student, trip, bus_stop, eta_minutes):
-        # Send arrival notification to student/parent
-        from django.core.mail import send_mail
-        from django.conf import settings
-        from .models import NotificationPreference
-        
-        subject = f'Bus Arriving Soon - {eta_minutes:.0f} minutes'
-        message = f'''
-                    Your bus is approaching your stop.
-                    
-                    Bus: {trip.bus.bus_number}
-                    Route: {trip.route.name}
-                    Stop: {bus_stop.name}
-                    Estimated Arrival: {eta_minutes:.0f} minutes
-                    
-                    Please be ready at your stop.
-                    
-                    Track live location: [App Tracking Link]
-                '''
-        
-        # Send to student
-        preferences = NotificationPreference.objects.filter(user=student).first()
-        if preferences and preferences.email_notifications:
-            send_mail(
-                subject,
-                message,
-                settings.DEFAULT_FROM_EMAIL,
-                [student.email],
-                fail_silently=True,
-            )
-        
-        # Send to parent if available
-        if hasattr(student, 'profile') and student.profile.parent_email:
-            send_mail(
-                subject,
-                message,
-                settings.DEFAULT_FROM_EMAIL,
-                [student.profile.parent_email],
-                fail_silently=True,
-            )
+        # Send arrival notifications for a stop within 1km; batched and deduped per student
+        from .notifications import NotificationDispatcher
         
-        # TODO: Add push notification integration
-        print(f"Arrival notification sent for {student.get_display_name()} - ETA: {eta_minutes} min")
\ No newline at end of file
+        return NotificationDispatcher.dispatch_arrival(trip, bus_stop, distance) > 0
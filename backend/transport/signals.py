@@ -1,15 +1,18 @@
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_save, pre_save, post_delete
 from django.dispatch import receiver
+from django.db import transaction
 from django.core.mail import send_mail
 from django.conf import settings
-from django.utils import timezone
 from datetime import timedelta
 
 from .models import (
-    Trip, LocationUpdate, StudentTransport, AttendanceLog,
-    EmergencyAlert, NotificationPreference
+    Trip, BusStop, StudentTransport, AttendanceLog,
+    EmergencyAlert, NotificationPreference, Geofence
 )
-from .tasks import send_arrival_notifications, check_maintenance_schedule
+from .ingestion import GPSIngestionService
+from .stop_index import StopIndexCache
+from .geofence import GeofenceIndexCache
+from .live import LivePositionService
 
 @receiver(post_save, sender=Trip)
 def handle_trip_status_change(sender, instance, **kwargs):
@@ -50,31 +53,27 @@ def handle_trip_status_change(sender, instance, **kwargs):
                                 fail_silently=True,
                             )
             
-            # Trip completed
-            elif (old_instance.status == Trip.TripStatus.IN_PROGRESS and 
-                  instance.status == Trip.TripStatus.COMPLETED):
-                
-                # Schedule maintenance check
-                check_maintenance_schedule.delay(instance.bus.id)
-                
         except Trip.DoesNotExist:
             pass
 
-@receiver(post_save, sender=LocationUpdate)
-def handle_location_update(sender, instance, created, **kwargs):
-    if created:
-        # Update trip's current location
-        instance.trip.current_latitude = instance.latitude
-        instance.trip.current_longitude = instance.longitude
-        instance.trip.last_location_update = timezone.now()
-        
-        if instance.speed:
-            instance.trip.average_speed = instance.speed
-        
-        instance.trip.save()
-        
-        # Check if bus is approaching any stops for notifications
-        send_arrival_notifications.delay(instance.trip.id)
+# GPS pings update trips with queryset.update() and never reach these receivers;
+# any full save (start/end, admin edits, driver changes) drops the cached ingestion state
+@receiver(post_save, sender=Trip)
+def reset_trip_gps_state(sender, instance, **kwargs):
+    GPSIngestionService.clear_state(instance.pk)
+    # Finished or cancelled trips leave the live map straight away
+    if instance.status in (Trip.TripStatus.COMPLETED, Trip.TripStatus.CANCELLED):
+        LivePositionService.remove(instance.bus.school_id, instance.pk)
+
+@receiver([post_save, post_delete], sender=BusStop)
+def reset_route_stops(sender, instance, **kwargs):
+    StopIndexCache.invalidate(instance.route_id)
+    GeofenceIndexCache.invalidate(instance.route_id)
+
+@receiver([post_save, post_delete], sender=Geofence)
+def reset_geofences(sender, instance, **kwargs):
+    # School fences are part of every route's index
+    GeofenceIndexCache.invalidate()
 
 @receiver(post_save, sender=StudentTransport)
 def handle_student_transport_assignment(sender, instance, created, **kwargs):
@@ -115,40 +114,11 @@ def handle_student_transport_assignment(sender, instance, created, **kwargs):
 
 @receiver(post_save, sender=AttendanceLog)
 def handle_attendance_marking(sender, instance, created, **kwargs):
+    # Single marks only; bulk_mark_attendance bulk-creates and queues one notification batch itself
     if created and instance.is_present:
-        # Notify parents when attendance is marked
-        preferences = NotificationPreference.objects.filter(user=instance.student).first()
-        
-        if preferences and preferences.attendance_marked:
-            action = "picked up" if instance.attendance_type == 'PICKUP' else "dropped off"
-            
-            subject = f'Student {action} - {instance.student.get_display_name()}'
-            message = f'''
-            {instance.student.get_display_name()} has been {action} from the bus.
-            
-            Time: {instance.actual_time.strftime("%I:%M %p") if instance.actual_time else 'Not recorded'}
-            Bus Stop: {instance.bus_stop.name}
-            Bus: {instance.trip.bus.bus_number}
-            '''
-            
-            if preferences.email_notifications:
-                send_mail(
-                    subject,
-                    message,
-                    settings.DEFAULT_FROM_EMAIL,
-                    [instance.student.email],
-                    fail_silently=True,
-                )
-            
-            # Also notify parent
-            if hasattr(instance.student, 'profile') and instance.student.profile.parent_email:
-                send_mail(
-                    subject,
-                    message,
-                    settings.DEFAULT_FROM_EMAIL,
-                    [instance.student.profile.parent_email],
-                    fail_silently=True,
-                )
+        from .tasks import send_attendance_notifications
+        args = (instance.trip_id, instance.bus_stop_id, instance.attendance_type, {instance.student_id: instance.actual_time})
+        transaction.on_commit(lambda: send_attendance_notifications(*args))
 
 @receiver(post_save, sender=EmergencyAlert)
 def handle_emergency_alert(sender, instance, created, **kwargs):
@@ -194,41 +164,13 @@ def handle_emergency_alert(sender, instance, created, **kwargs):
 @receiver(pre_save, sender=Trip)
 def check_trip_delays(sender, instance, **kwargs):
     if instance.pk and instance.status == Trip.TripStatus.IN_PROGRESS:
-        try:
-            old_instance = Trip.objects.get(pk=instance.pk)
+        old_start = Trip.objects.filter(pk=instance.pk).values_list('actual_start', flat=True).first()
+        
+        # Check if trip is significantly delayed
+        if (instance.actual_start and old_start and
+            instance.actual_start > old_start + timedelta(minutes=15)):
             
-            # Check if trip is significantly delayed
-            if (instance.actual_start and old_instance.actual_start and
-                instance.actual_start > old_instance.actual_start + timedelta(minutes=15)):
-                
-                # Notify about delay
-                student_assignments = StudentTransport.objects.filter(
-                    route=instance.route,
-                    is_active=True
-                )
-                
-                for assignment in student_assignments:
-                    preferences = NotificationPreference.objects.filter(user=assignment.student).first()
-                    if preferences and preferences.bus_delayed:
-                        subject = f'Bus Delay - {instance.bus.bus_number}'
-                        message = f'''
-                                    Your bus is experiencing a delay.
-                                    
-                                    Bus: {instance.bus.bus_number}
-                                    Route: {instance.route.name}
-                                    Current Delay: Approximately 15 minutes
-                                    
-                                    We apologize for the inconvenience.
-                                '''
-                        
-                        if preferences.email_notifications:
-                            send_mail(
-                                subject,
-                                message,
-                                settings.DEFAULT_FROM_EMAIL,
-                                [assignment.student.email],
-                                fail_silently=True,
-                            )
-                            
-        except Trip.DoesNotExist:
-            pass
\ No newline at end of file
+            # Notify about delay once the save is committed, off the request thread
+            from .tasks import send_delay_notifications
+            trip_id = instance.pk
+            transaction.on_commit(lambda: send_delay_notifications(trip_id))
@@ -0,0 +1,171 @@
+import time
+import math
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .models import BusStop
+
+EARTH_RADIUS_KM = 6371
+
+# Stops closer than this to each other close a looping route (first stop == last stop) (km)
+LOOP_CLOSE_DISTANCE = 0.15
+
+# Route segments ahead of the last known position that are considered on each fix
+SEGMENT_LOOKAHEAD = 4
+
+# Fixes further than this from every segment in the lookahead trigger a whole-route search (km)
+OFF_ROUTE_DISTANCE = 0.5
+
+# Segments this much further than the closest one still win if they come earlier on the route,
+# so out-and-back stretches resolve to the leg the bus is actually on (km)
+SEGMENT_TIE_DISTANCE = 0.05
+
+# A stop counts as reached (and progress moves past it) within this distance (km)
+STOP_ARRIVAL_DISTANCE = 0.05
+
+
+class RouteStopIndex:
+    # Precomputed geometry of one route's stops, ordered by sequence.
+    # Stops are projected onto a local flat plane (equirectangular, fine at city scale) so a fix is
+    # matched to the nearest route segment with a few vectorized operations. Matching starts from the
+    # caller's progress along the route, so stops the bus already passed are never picked again.
+
+    def __init__(self, route_id, stops):
+        self.route_id = route_id
+        self.stops = stops
+        count = len(stops)
+
+        latitudes = np.array([float(stop.latitude) for stop in stops], dtype=np.float64)
+        longitudes = np.array([float(stop.longitude) for stop in stops], dtype=np.float64)
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+
+        self.origin_lat = float(latitudes.mean()) if count else 0.0
+        self.origin_lng = float(longitudes.mean()) if count else 0.0
+        self.x_scale = math.radians(1) * EARTH_RADIUS_KM * math.cos(math.radians(self.origin_lat))
+        self.y_scale = math.radians(1) * EARTH_RADIUS_KM
+        self.x = (longitudes - self.origin_lng) * self.x_scale
+        self.y = (latitudes - self.origin_lat) * self.y_scale
+
+        self.is_loop = count > 2 and math.hypot(self.x[0] - self.x[-1], self.y[0] - self.y[-1]) <= LOOP_CLOSE_DISTANCE
+
+        # Segment i runs from stop i to stop i + 1
+        self.segment_dx = np.diff(self.x)
+        self.segment_dy = np.diff(self.y)
+        length_sq = self.segment_dx ** 2 + self.segment_dy ** 2
+        # Zero-length segments (two stops at one spot) project everything onto their start
+        self.segment_inv_length_sq = np.divide(1.0, length_sq, out=np.zeros_like(length_sq), where=length_sq > 0)
+        self.segment_lengths = np.sqrt(length_sq)
+        self.segment_count = max(count - 1, 0)
+        self.positions = {stop.id: i for i, stop in enumerate(stops)}
+
+    def __len__(self):
+        return len(self.stops)
+
+    @property
+    def final_stop(self):
+        return self.stops[-1] if self.stops else None
+
+    def locate(self, latitude, longitude, progress=None):
+        # Returns (next_stop, distance_km, progress). progress is the index of the segment the bus was
+        # last matched to; pass it back on the next fix. None searches the whole route.
+        if not self.stops:
+            return None, None, None
+
+        px = (longitude - self.origin_lng) * self.x_scale
+        py = (latitude - self.origin_lat) * self.y_scale
+
+        if self.segment_count == 0:
+            return self.stops[0], self._distance_to(0, latitude, longitude), 0
+
+        if progress is None:
+            candidates = np.arange(self.segment_count)
+        else:
+            candidates = np.arange(progress, progress + SEGMENT_LOOKAHEAD)
+            if self.is_loop:
+                candidates %= self.segment_count
+            else:
+                candidates = candidates[candidates < self.segment_count]
+                if not len(candidates):
+                    candidates = np.array([self.segment_count - 1])
+
+        segment, t = self._match(candidates, px, py)
+        if segment is None:
+            # Far off the expected stretch (detour, or progress lost with the cache) - search everywhere
+            segment, t = self._match(np.arange(self.segment_count), px, py, max_offset=None)
+
+        # Before the start of the segment the bus is still heading for its first stop
+        next_index = segment if t <= 0 else segment + 1
+        next_index = self._wrap(next_index)
+        distance = self._distance_to(next_index, latitude, longitude)
+
+        # At the stop: it is passed, so progress continues from the segment that starts there
+        if distance <= STOP_ARRIVAL_DISTANCE and (self.is_loop or next_index < self.segment_count):
+            segment = next_index % self.segment_count
+            next_index = self._wrap(next_index + 1)
+            distance = self._distance_to(next_index, latitude, longitude)
+
+        return self.stops[next_index], distance, segment
+
+    def _wrap(self, index):
+        if index < len(self.stops):
+            return index
+        return 0 if self.is_loop else len(self.stops) - 1
+
+    def _match(self, candidates, px, py, max_offset=OFF_ROUTE_DISTANCE):
+        # Project the fix onto each candidate segment; returns (segment, position along it 0..1)
+        dx = self.segment_dx[candidates]
+        dy = self.segment_dy[candidates]
+        rx = px - self.x[candidates]
+        ry = py - self.y[candidates]
+        t = np.clip((rx * dx + ry * dy) * self.segment_inv_length_sq[candidates], 0, 1)
+        offsets = (rx - t * dx) ** 2 + (ry - t * dy) ** 2
+
+        distances = np.sqrt(offsets)
+        closest = distances.min()
+        if max_offset is not None and closest > max_offset:
+            return None, None
+        # Candidates are in route order from the current progress; take the first one that is about as close
+        best = int(np.argmax(distances <= closest + SEGMENT_TIE_DISTANCE))
+        return int(candidates[best]), float(t[best])
+
+    def _distance_to(self, index, latitude, longitude):
+        # Haversine, in km, to stop `index`
+        lat1 = math.radians(latitude)
+        lat2 = math.radians(self.latitudes[index])
+        dlat = lat2 - lat1
+        dlng = math.radians(self.longitudes[index] - longitude)
+        a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlng / 2) ** 2
+        return EARTH_RADIUS_KM * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+class StopIndexCache:
+    # Process-level RouteStopIndex per route. Entries expire after GPS_STOP_INDEX_TTL seconds and are
+    # dropped by the BusStop post_save/post_delete signals in transport.signals when a route changes.
+    _entries = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get(route_id):
+        now = time.monotonic()
+        entry = StopIndexCache._entries.get(route_id)
+        if entry and entry[0] > now:
+            return entry[1]
+
+        stops = list(BusStop.objects.filter(route_id=route_id).order_by('sequence'))
+        index = RouteStopIndex(route_id, stops)
+
+        ttl = getattr(settings, 'GPS_STOP_INDEX_TTL', 300)
+        with StopIndexCache._lock:
+            StopIndexCache._entries[route_id] = (now + ttl, index)
+        return index
+
+    @staticmethod
+    def invalidate(route_id=None):
+        with StopIndexCache._lock:
+            if route_id is None:
+                StopIndexCache._entries.clear()
+            else:
+                StopIndexCache._entries.pop(route_id, None)
@@ -3,11 +3,12 @@ from datetime import timedelta
 from django.core.mail import send_mail
 from django.conf import settings
 from django.db.models import Q, F
+from celery import shared_task
 import threading
 import time
 import requests
 
-from .models import Trip, Bus, MaintenanceLog, StudentTransport, NotificationPreference, GPSDevice, LocationUpdate
+from .models import Trip, Bus, MaintenanceLog, StudentTransport, NotificationPreference, GPSDevice
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -45,6 +46,102 @@ def sync_gps_devices_status(school_id):
     thread.daemon = True
     thread.start()
 
+def send_arrival_notifications(trip_id, bus_stop_id, distance):
+    # Notify students/parents at a stop the bus is approaching, outside the GPS ping request
+    def _send():
+        from .models import BusStop
+        from .services import RealTimeTrackingService
+        try:
+            trip = Trip.objects.select_related('bus', 'route').get(id=trip_id)
+            bus_stop = BusStop.objects.get(id=bus_stop_id)
+            RealTimeTrackingService.should_send_arrival_notification(trip, bus_stop, distance)
+        except Exception as e:
+            print(f"Error sending arrival notifications for trip {trip_id}: {e}")
+    
+    thread = threading.Thread(target=_send)
+    thread.daemon = True
+    thread.start()
+
+def send_delay_notifications(trip_id, delay_minutes=15):
+    # Notify students on a delayed trip's route, outside the request that saved the trip
+    def _send():
+        from .notifications import NotificationDispatcher
+        try:
+            trip = Trip.objects.select_related('bus', 'route').get(id=trip_id)
+            NotificationDispatcher.dispatch_delay(trip, delay_minutes)
+        except Exception as e:
+            print(f"Error sending delay notifications for trip {trip_id}: {e}")
+    
+    thread = threading.Thread(target=_send)
+    thread.daemon = True
+    thread.start()
+
+def send_attendance_notifications(trip_id, bus_stop_id, attendance_type, actual_times):
+    # Pickup/dropoff confirmations for a batch of attendance marks, {student_id: actual_time}
+    def _send():
+        from .models import BusStop
+        from .notifications import NotificationDispatcher
+        try:
+            trip = Trip.objects.select_related('bus').get(id=trip_id)
+            bus_stop = BusStop.objects.get(id=bus_stop_id)
+            NotificationDispatcher.dispatch_attendance(trip, bus_stop, attendance_type, actual_times)
+        except Exception as e:
+            print(f"Error sending attendance notifications for trip {trip_id}: {e}")
+    
+    thread = threading.Thread(target=_send)
+    thread.daemon = True
+    thread.start()
+
+def handle_geofence_events(trip_id, school_id, events, latitude, longitude, moment):
+    # Store a fix's stop/zone geofence events and tell the trip's and school's websocket clients
+    def _handle():
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+        from .geofence import GeofenceEngine
+        try:
+            recorded = GeofenceEngine.record(trip_id, events, latitude, longitude, moment)
+            channel_layer = get_channel_layer()
+            if channel_layer is None:
+                return
+            for event in recorded:
+                message = {
+                    'type': 'geofence_event',
+                    'data': {
+                        'trip_id': trip_id,
+                        'event': event.event_type,
+                        'bus_stop_id': event.bus_stop_id,
+                        'geofence_id': event.geofence_id,
+                        'latitude': latitude,
+                        'longitude': longitude,
+                        'timestamp': moment.isoformat(),
+                    }
+                }
+                async_to_sync(channel_layer.group_send)(f"trip_{trip_id}", message)
+                async_to_sync(channel_layer.group_send)(f"school_{school_id}", message)
+        except Exception as e:
+            print(f"Error handling geofence events for trip {trip_id}: {e}")
+    
+    thread = threading.Thread(target=_handle)
+    thread.daemon = True
+    thread.start()
+
+def build_trip_track(trip_id):
+    # Store a just-ended trip's replay track (TripTrack) outside the request that ended it
+    def _build():
+        from .ingestion import location_buffer
+        from .tracks import TrackRollupService
+        try:
+            # This worker's buffered pings belong in the track; other workers' are picked up by the
+            # scheduled rollup, which rebuilds tracks made before GPS_TRACK_ROLLUP_DELAY had passed
+            location_buffer.flush()
+            TrackRollupService.rollup_trip(Trip.objects.get(id=trip_id))
+        except Exception as e:
+            print(f"Error building track for trip {trip_id}: {e}")
+    
+    thread = threading.Thread(target=_build)
+    thread.daemon = True
+    thread.start()
+
 def check_bus_maintenance():
     # Check and schedule bus maintenance - run as scheduled task
     maintenance_threshold_km = 5000
@@ -101,56 +198,28 @@ def check_bus_maintenance():
         
         print(f"Scheduled maintenance for bus {bus.bus_number}")
 
-def generate_daily_trips():
-    # Generate daily trips for all active routes - run as scheduled task
-    today = timezone.now().date()
+def generate_daily_trips(days_ahead=None):
+    # Generate trips for all active routes, a week ahead - run as scheduled task (daily).
+    # With TRANSPORT_TRIP_GENERATION_FANOUT each school is a separate Celery task.
+    from .scheduling import TripScheduleService
     
-    for school in User.objects.values_list('school', flat=True).distinct():
-        active_buses = Bus.objects.filter(
-            school=school, 
-            status=Bus.BusStatus.ACTIVE,
-            current_route__isnull=False,
-            current_driver__isnull=False
-        )
-        
-        for bus in active_buses:
-            # Create morning trip
-            if bus.current_route.morning_start_time:
-                morning_start = timezone.make_aware(
-                    timezone.datetime.combine(today, bus.current_route.morning_start_time)
-                )
-                
-                Trip.objects.get_or_create(
-                    bus=bus,
-                    route=bus.current_route,
-                    driver=bus.current_driver,
-                    trip_type=Trip.TripType.MORNING_PICKUP,
-                    scheduled_start=morning_start,
-                    defaults={
-                        'scheduled_end': morning_start + timedelta(hours=1),
-                        'status': Trip.TripStatus.SCHEDULED
-                    }
-                )
-            
-            # Create evening trip
-            if bus.current_route.evening_start_time:
-                evening_start = timezone.make_aware(
-                    timezone.datetime.combine(today, bus.current_route.evening_start_time)
-                )
-                
-                Trip.objects.get_or_create(
-                    bus=bus,
-                    route=bus.current_route,
-                    driver=bus.current_driver,
-                    trip_type=Trip.TripType.EVENING_DROPOFF,
-                    scheduled_start=evening_start,
-                    defaults={
-                        'scheduled_end': evening_start + timedelta(hours=1),
-                        'status': Trip.TripStatus.SCHEDULED
-                    }
-                )
+    if getattr(settings, 'TRANSPORT_TRIP_GENERATION_FANOUT', False):
+        school_ids = TripScheduleService.school_ids()
+        for school_id in school_ids:
+            generate_school_trips.delay(school_id, days_ahead)
+        print(f"Queued trip generation for {len(school_ids)} schools")
+        return
+    
+    created = TripScheduleService.generate_all(days=days_ahead)
+    print(f"Generated {sum(created.values())} trips for {len(created)} schools from {timezone.localdate()}")
+
+@shared_task(acks_late=True)
+def generate_school_trips(school_id, days_ahead=None):
+    # One school's shard of generate_daily_trips
+    from .scheduling import TripScheduleService
     
-    print(f"Generated daily trips for {timezone.now().date()}")
+    created = TripScheduleService.generate_for_school(school_id, days=days_ahead)
+    return f"Generated {created} trips for school {school_id}"
 
 def auto_end_completed_trips():
     # Automatically end trips that should be completed - run as scheduled task
@@ -213,14 +282,24 @@ def cleanup_old_data():
     )
     archived_count = old_trips.count()
     
-    # Delete very old location updates
-    delete_threshold = timezone.now() - timedelta(days=7)
-    deleted_locations = LocationUpdate.objects.filter(
-        created_at__lt=delete_threshold
-    ).delete()
-    
     print(f"Archived {archived_count} old trips")
-    print(f"Deleted {deleted_locations[0]} old location updates")
+
+def maintain_location_storage():
+    # Create upcoming LocationUpdate partitions, roll up finished trips, then drop expired raw days
+    from .tracks import LocationPartitionService, TrackRollupService
+    
+    created = LocationPartitionService.ensure_partitions()
+    rolled_up = TrackRollupService.rollup_completed_trips()
+    dropped = LocationPartitionService.drop_expired_partitions()
+    
+    print(f"Created {len(created)} location partitions, rolled up {rolled_up} trip tracks, removed {dropped} expired location days")
+
+def rebuild_eta_profiles():
+    # Relearn per-segment travel times from recent trip tracks (run nightly, after track rollups)
+    from .eta import EtaProfileBuilder
+    
+    built = EtaProfileBuilder.rebuild_all()
+    print(f"Rebuilt ETA profiles for {built} routes")
 
 # Management command for scheduled tasks
 def run_scheduled_transport_tasks():
@@ -233,6 +312,12 @@ def run_scheduled_transport_tasks():
     # Auto-end completed trips (run hourly)
     auto_end_completed_trips()
     
+    # Location partitions, track rollups and raw retention (run daily)
+    maintain_location_storage()
+    
+    # Learned ETA lookup tables (run nightly)
+    rebuild_eta_profiles()
+    
     # Check maintenance (run weekly)
     if timezone.now().weekday() == 0:  # Monday
         check_bus_maintenance()
@@ -0,0 +1,348 @@
+import logging
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q, F
+from django.utils import timezone
+
+from .models import Trip, LocationUpdate, TripTrack
+from .services import GPSService
+
+logger = logging.getLogger(__name__)
+
+PARTITION_PREFIX = 'location_updates_p'
+
+# Meters per degree of latitude; longitude degrees are scaled by cos(latitude)
+METERS_PER_DEGREE = 111320
+
+
+def simplify(latitudes, longitudes, tolerance):
+    # Douglas-Peucker: indexes of the points to keep so that no dropped point is more than
+    # `tolerance` meters from the simplified line. Works on a local flat projection, which is
+    # exact enough at trip scale.
+    count = len(latitudes)
+    if count < 3 or tolerance <= 0:
+        return np.arange(count)
+
+    lat = np.asarray(latitudes, dtype=np.float64)
+    lng = np.asarray(longitudes, dtype=np.float64)
+    y = (lat - lat[0]) * METERS_PER_DEGREE
+    x = (lng - lng[0]) * METERS_PER_DEGREE * np.cos(np.radians(lat.mean()))
+
+    keep = np.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        px, py = x[first + 1:last] - x[first], y[first + 1:last] - y[first]
+        length = np.hypot(dx, dy)
+        if length > 0:
+            distances = np.abs(dx * py - dy * px) / length
+        else:
+            distances = np.hypot(px, py)
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return np.flatnonzero(keep)
+
+
+def _encode_delta(delta, chunks):
+    # Encoded polyline algorithm: zig-zag signed integer in 5-bit chunks as printable ASCII
+    delta = ~(delta << 1) if delta < 0 else delta << 1
+    while delta >= 0x20:
+        chunks.append(chr((0x20 | (delta & 0x1f)) + 63))
+        delta >>= 5
+    chunks.append(chr(delta + 63))
+
+
+def _decode_deltas(encoded):
+    deltas = []
+    shift = result = 0
+    for char in encoded:
+        byte = ord(char) - 63
+        result |= (byte & 0x1f) << shift
+        shift += 5
+        if byte < 0x20:
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+            shift = result = 0
+    return deltas
+
+
+def encode_values(values):
+    # A single integer series (e.g. seconds since start), delta-encoded like a polyline
+    chunks = []
+    previous = 0
+    for value in values:
+        _encode_delta(int(value) - previous, chunks)
+        previous = int(value)
+    return ''.join(chunks)
+
+
+def decode_values(encoded):
+    return np.cumsum(_decode_deltas(encoded), dtype=np.int64).tolist()
+
+
+def encode_polyline(latitudes, longitudes, precision=5):
+    # Google encoded polyline, readable by the Leaflet/Mapbox/Google polyline decoders
+    factor = 10 ** precision
+    chunks = []
+    previous_lat = previous_lng = 0
+    for latitude, longitude in zip(latitudes, longitudes):
+        lat_value, lng_value = round(float(latitude) * factor), round(float(longitude) * factor)
+        _encode_delta(lat_value - previous_lat, chunks)
+        _encode_delta(lng_value - previous_lng, chunks)
+        previous_lat, previous_lng = lat_value, lng_value
+    return ''.join(chunks)
+
+
+def decode_polyline(encoded, precision=5):
+    # (latitudes, longitudes) as numpy arrays
+    deltas = _decode_deltas(encoded)
+    factor = 10 ** precision
+    return np.cumsum(deltas[0::2]) / factor, np.cumsum(deltas[1::2]) / factor
+
+
+class LocationPartitionService:
+    # Daily range partitions of location_updates (PostgreSQL). Other databases keep a
+    # plain table, so every method falls back to ordinary queries there.
+
+    @staticmethod
+    def is_partitioned():
+        return connection.vendor == 'postgresql'
+
+    @staticmethod
+    def partition_name(day):
+        return f"{PARTITION_PREFIX}{day:%Y%m%d}"
+
+    @staticmethod
+    def existing_partitions():
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT child.relname
+                FROM pg_inherits
+                JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+                JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                WHERE parent.relname = %s
+            """, [LocationUpdate._meta.db_table])
+            return {row[0] for row in cursor.fetchall()}
+
+    @staticmethod
+    def ensure_partitions(days_ahead=None):
+        # Create today's partition and the next few days'; returns the names created
+        if not LocationPartitionService.is_partitioned():
+            return []
+
+        if days_ahead is None:
+            days_ahead = getattr(settings, 'GPS_LOCATION_PARTITION_DAYS_AHEAD', 7)
+
+        existing = LocationPartitionService.existing_partitions()
+        today = timezone.now().date()
+        created = []
+        for offset in range(days_ahead + 1):
+            day = today + timedelta(days=offset)
+            name = LocationPartitionService.partition_name(day)
+            if name in existing:
+                continue
+            try:
+                LocationPartitionService.create_partition(day)
+                created.append(name)
+            except Exception as e:
+                logger.error(f"Could not create location partition {name}: {str(e)}")
+        return created
+
+    @staticmethod
+    def default_partition():
+        return f"{LocationUpdate._meta.db_table}_default"
+
+    @staticmethod
+    def create_partition(day):
+        # A day's partition can't be created while the default partition holds rows of that day,
+        # so the table is built on its own, those rows are moved in and it is then attached
+        table = LocationUpdate._meta.db_table
+        name = LocationPartitionService.partition_name(day)
+        start, end = day.isoformat(), (day + timedelta(days=1)).isoformat()
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+            cursor.execute(
+                f"WITH moved AS (DELETE FROM {LocationPartitionService.default_partition()} "
+                f"WHERE created_at >= %s AND created_at < %s RETURNING *) "
+                f"INSERT INTO {name} SELECT * FROM moved",
+                [start, end]
+            )
+            cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')")
+
+    @staticmethod
+    def drop_expired_partitions(retention_days=None):
+        # Drop whole days older than the raw retention window; returns how many days were removed
+        if retention_days is None:
+            retention_days = getattr(settings, 'GPS_LOCATION_RETENTION_DAYS', 7)
+        cutoff = timezone.now().date() - timedelta(days=retention_days)
+
+        if not LocationPartitionService.is_partitioned():
+            deleted, _ = LocationUpdate.objects.filter(
+                created_at__lt=timezone.make_aware(datetime.combine(cutoff, time.min))
+            ).delete()
+            return deleted
+
+        # Rows that fell outside every daily partition expire like the rest
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {LocationPartitionService.default_partition()} WHERE created_at < %s",
+                [timezone.make_aware(datetime.combine(cutoff, time.min))]
+            )
+
+        dropped = 0
+        for name in sorted(LocationPartitionService.existing_partitions()):
+            if not name.startswith(PARTITION_PREFIX):
+                continue
+            try:
+                day = datetime.strptime(name[len(PARTITION_PREFIX):], '%Y%m%d').date()
+            except ValueError:
+                continue
+            if day < cutoff:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"DROP TABLE IF EXISTS {name}")
+                dropped += 1
+        return dropped
+
+    @staticmethod
+    def trip_window(trip):
+        # created_at bounds of a trip's pings, so queries only scan the partitions it spans
+        start = (trip.actual_start or trip.created_at) - timedelta(hours=1)
+        end = trip.actual_end + timedelta(minutes=10) if trip.actual_end else None
+        return start, end
+
+    @staticmethod
+    def trip_updates(trip):
+        start, end = LocationPartitionService.trip_window(trip)
+        queryset = LocationUpdate.objects.filter(trip=trip, created_at__gte=start)
+        if end:
+            queryset = queryset.filter(created_at__lte=end)
+        return queryset
+
+
+class TrackRollupService:
+    # Downsamples finished trips to one point per GPS_TRACK_ROLLUP_INTERVAL seconds into TripTrack,
+    # so replay keeps working after the raw partitions are dropped
+
+    @staticmethod
+    def downsample(rows, interval_seconds):
+        # rows: (created_at, latitude, longitude, speed) ordered by time.
+        # Keeps the last fix of every interval plus the very first and last fix.
+        if not rows:
+            return [], 0.0
+
+        started_at = rows[0][0]
+        points = []
+        distance = 0.0
+        previous = None
+        current_bucket = None
+
+        for created_at, latitude, longitude, speed in rows:
+            if previous is not None:
+                distance += GPSService.calculate_distance(previous[0], previous[1], latitude, longitude)
+            previous = (latitude, longitude)
+
+            offset = (created_at - started_at).total_seconds()
+            bucket = int(offset // interval_seconds)
+            point = [round(offset), round(latitude, 6), round(longitude, 6), round(speed or 0, 1)]
+            if points and bucket == current_bucket and len(points) > 1:
+                points[-1] = point
+            else:
+                points.append(point)
+            current_bucket = bucket
+
+        return points, distance
+
+    @staticmethod
+    def rollup_trip(trip, interval_seconds=None):
+        if interval_seconds is None:
+            interval_seconds = getattr(settings, 'GPS_TRACK_ROLLUP_INTERVAL', 30)
+
+        rows = list(
+            LocationPartitionService.trip_updates(trip)
+            .order_by('created_at')
+            .values_list('created_at', 'latitude', 'longitude', 'speed')
+        )
+        points, distance = TrackRollupService.downsample(rows, interval_seconds)
+
+        defaults = {
+            'interval_seconds': interval_seconds,
+            'points': points,
+            'point_count': len(points),
+            'raw_point_count': len(rows),
+            'distance_km': round(distance, 3),
+            'started_at': rows[0][0] if rows else None,
+            'ended_at': rows[-1][0] if rows else None,
+            'created_at': timezone.now(),
+        }
+        defaults.update(TrackRollupService.simplified_path(rows))
+        track, _ = TripTrack.objects.update_or_create(trip=trip, defaults=defaults)
+        return track
+
+    @staticmethod
+    def simplified_path(rows, tolerance=None):
+        # TripTrack path_* fields from raw (created_at, latitude, longitude, speed) rows
+        if tolerance is None:
+            tolerance = getattr(settings, 'GPS_TRACK_SIMPLIFY_TOLERANCE', 5)
+        if not rows:
+            return {'path_polyline': '', 'path_offsets': '', 'path_point_count': 0, 'path_tolerance': tolerance}
+
+        started_at = rows[0][0]
+        latitudes = [float(row[1]) for row in rows]
+        longitudes = [float(row[2]) for row in rows]
+        kept = simplify(latitudes, longitudes, tolerance)
+        return {
+            'path_polyline': encode_polyline([latitudes[i] for i in kept], [longitudes[i] for i in kept]),
+            'path_offsets': encode_values([round((rows[i][0] - started_at).total_seconds()) for i in kept]),
+            'path_point_count': len(kept),
+            'path_tolerance': tolerance,
+        }
+
+    @staticmethod
+    def path(track, tolerance=None):
+        # (offsets, latitudes, longitudes, tolerance used) of a track's replay path. Coarser tolerances
+        # re-simplify the stored path; tracks rolled up before paths were stored use their points.
+        if track.path_polyline:
+            latitudes, longitudes = decode_polyline(track.path_polyline)
+            offsets = np.asarray(decode_values(track.path_offsets), dtype=np.int64)
+            stored = track.path_tolerance
+        else:
+            points = np.asarray(track.points, dtype=np.float64).reshape(-1, 4)
+            offsets, latitudes, longitudes = points[:, 0].astype(np.int64), points[:, 1], points[:, 2]
+            stored = 0
+
+        if tolerance is None or tolerance <= stored:
+            return offsets, latitudes, longitudes, stored
+        kept = simplify(latitudes, longitudes, tolerance)
+        return offsets[kept], latitudes[kept], longitudes[kept], tolerance
+
+    @staticmethod
+    def rollup_completed_trips():
+        # Roll up trips that ended at least GPS_TRACK_ROLLUP_DELAY seconds ago and have no track yet
+        # Tracks built when the trip ended (end_trip) are rebuilt once here, picking up pings
+        # that were still buffered in other workers at the time
+        delay = getattr(settings, 'GPS_TRACK_ROLLUP_DELAY', 60 * 10)
+        trips = Trip.objects.filter(
+            status=Trip.TripStatus.COMPLETED,
+            actual_end__lte=timezone.now() - timedelta(seconds=delay)
+        ).filter(
+            Q(track__isnull=True) | Q(track__created_at__lt=F('actual_end') + timedelta(seconds=delay))
+        )
+
+        rolled_up = 0
+        for trip in trips.iterator():
+            try:
+                TrackRollupService.rollup_trip(trip)
+                rolled_up += 1
+            except Exception as e:
+                logger.error(f"Could not roll up track for trip {trip.id}: {str(e)}")
+        return rolled_up
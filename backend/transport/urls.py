@@ -29,7 +29,9 @@ urlpatterns = [
     # Real-time Tracking & GPS
     path('trips/<int:trip_id>/start/', views.start_trip, name='start-trip'),
     path('trips/<int:trip_id>/end/', views.end_trip, name='end-trip'),
+    path('trips/<int:trip_id>/track/', views.TripTrackView.as_view(), name='trip-track'),
     path('trips/<int:trip_id>/gps-location/', views.GPSLocationUpdateView.as_view(), name='gps-location-update'),
+    path('trips/<int:trip_id>/gps-batch/', views.GPSBatchUploadView.as_view(), name='gps-batch-upload'),
     
     # Student Transport Assignments
     path('student-transport/', views.StudentTransportListCreateView.as_view(), name='student-transport-list'),
@@ -39,6 +41,7 @@ urlpatterns = [
     # Attendance
     path('attendance/', views.AttendanceLogListCreateView.as_view(), name='attendance-list'),
     path('trips/<int:trip_id>/bulk-attendance/', views.bulk_mark_attendance, name='bulk-attendance'),
+    path('trips/<int:trip_id>/attendance-suggestions/', views.attendance_suggestions, name='attendance-suggestions'),
     
     # Maintenance
     path('maintenance/', views.MaintenanceLogListCreateView.as_view(), name='maintenance-list'),
@@ -1,216 +1,227 @@
+import logging
 from rest_framework import generics, status, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from django.http import HttpResponse
 from django.db.models import Q, Count, Avg, F, ExpressionWrapper, DecimalField
 from django.utils import timezone
 from datetime import timedelta, datetime
+import numpy as np
 from django.contrib.auth import get_user_model
 from django.conf import settings
 
 from .models import (
     Bus, Driver, Route, BusStop, Trip, LocationUpdate,
     StudentTransport, AttendanceLog, MaintenanceLog,
-    NotificationPreference, EmergencyAlert, GPSDevice
+    NotificationPreference, EmergencyAlert, GPSDevice, TripTrack
 )
 from .serializers import (
     BusSerializer, DriverSerializer, RouteSerializer, BusStopSerializer,
     TripSerializer, LocationUpdateSerializer, StudentTransportSerializer,
     AttendanceLogSerializer, MaintenanceLogSerializer, NotificationPreferenceSerializer,
     EmergencyAlertSerializer, LiveLocationSerializer, TripStartSerializer, TripEndSerializer,
-    TransportDashboardSerializer, BusLocationSerializer, GPSDeviceSerializer
+    TransportDashboardSerializer, BusLocationSerializer, GPSDeviceSerializer,
+    LocationBatchSerializer, BatchLocationPointSerializer
 )
 from .permissions import (
     IsSchoolMember, CanManageTransport, IsDriver, IsParentOrStudent,
     CanViewStudentTransport, CanUpdateLocation, CanMarkAttendance,
     IsOwnerOrAdmin, CanViewLiveTracking, CanCreateEmergencyAlert
 )
-from .services import OpenStreetMapService, RealTimeTrackingService, GPSService
+from .services import OpenStreetMapService, GPSService
+from .geocoding import GeoService, GeoRateLimitError, GeoUpstreamError
+from .attendance import BulkAttendanceService, AttendanceError, AttendanceSuggestionService
+from .ingestion import GPSIngestionService, GPSBatchError
+from .parsers import GzipJSONParser, MsgPackParser
+from .tracks import LocationPartitionService, TrackRollupService, encode_polyline, encode_values
+from .tasks import build_trip_track
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
 # GPS Enhanced Views
 class GPSLocationUpdateView(APIView):
     # Enhanced GPS location update endpoint with validation
+    # Ownership, last position and stops come from the GPS state cache; a ping costs one trip UPDATE
     permission_classes = [permissions.IsAuthenticated, CanUpdateLocation]
     
     def post(self, request, trip_id):
+        serializer = LiveLocationSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        location_data = serializer.validated_data
+        
+        # Validate GPS coordinates
+        is_valid, message = GPSService.validate_coordinates(
+            location_data['latitude'], 
+            location_data['longitude']
+        )
+        
+        if not is_valid:
+            return Response(
+                {'error': f'Invalid GPS coordinates: {message}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Check GPS accuracy
+        if (location_data.get('accuracy') and 
+            location_data['accuracy'] > getattr(settings, 'MIN_GPS_ACCURACY', 50)):
+            return Response(
+                {'error': f'GPS accuracy too low: {location_data["accuracy"]}m'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Add device info
+        if not location_data.get('device_id'):
+            location_data['device_id'] = 'mobile_app'
+        
         try:
-            trip = Trip.objects.get(id=trip_id, driver=request.user.driver_profile)
-            
-            serializer = LiveLocationSerializer(data=request.data)
-            if serializer.is_valid():
-                location_data = serializer.validated_data
-                
-                # Validate GPS coordinates
-                is_valid, message = GPSService.validate_coordinates(
-                    location_data['latitude'], 
-                    location_data['longitude']
-                )
-                
-                if not is_valid:
-                    return Response(
-                        {'error': f'Invalid GPS coordinates: {message}'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                # Check GPS accuracy
-                if (location_data.get('accuracy') and 
-                    location_data['accuracy'] > getattr(settings, 'MIN_GPS_ACCURACY', 50)):
-                    return Response(
-                        {'error': f'GPS accuracy too low: {location_data["accuracy"]}m'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                # Add device info
-                location_data['device_id'] = getattr(request.user.driver_profile, 'device_id', 'mobile_app')
-                
-                # Create location update
-                location_update = LocationUpdate.objects.create(
-                    trip=trip,
-                    **location_data
-                )
-                
-                # Update trip current location
-                trip.current_latitude = location_data['latitude']
-                trip.current_longitude = location_data['longitude']
-                trip.last_location_update = timezone.now()
-                trip.location_accuracy = location_data.get('accuracy')
-                trip.location_heading = location_data.get('heading')
-                trip.location_altitude = location_data.get('altitude')
-                
-                if location_data.get('speed'):
-                    trip.average_speed = location_data['speed']
-                    trip.max_speed = max(trip.max_speed or 0, location_data['speed'])
-                
-                # Calculate distance traveled (simplified)
-                if trip.current_latitude and trip.current_longitude:
-                    last_update = LocationUpdate.objects.filter(
-                        trip=trip
-                    ).exclude(id=location_update.id).order_by('-created_at').first()
-                    
-                    if last_update:
-                        distance = GPSService.calculate_distance(
-                            float(last_update.latitude), float(last_update.longitude),
-                            float(location_data['latitude']), float(location_data['longitude'])
-                        )
-                        trip.distance_traveled = (trip.distance_traveled or 0) + distance
-                
-                trip.save()
-                
-                # Check for arrival notifications
-                RealTimeTrackingService.should_send_arrival_notification(trip, None, 0)
-                
-                # Calculate ETAs
-                self.update_etas(trip)
-                
-                return Response({
-                    'message': 'Location updated successfully',
-                    'update_id': str(location_update.id),
-                    'timestamp': location_update.created_at.isoformat()
-                })
-            else:
-                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-                
+            result = GPSIngestionService.ingest(trip_id, location_data, user=request.user)
         except Trip.DoesNotExist:
             return Response({'error': 'Trip not found'}, status=status.HTTP_404_NOT_FOUND)
-    
-    def update_etas(self, trip):
-        # Update ETAs for next stop and school
-        if not (trip.current_latitude and trip.current_longitude):
-            return
         
-        # Calculate ETA to next stop
-        next_stop, distance = RealTimeTrackingService.calculate_next_stop(
-            trip, float(trip.current_latitude), float(trip.current_longitude)
-        )
+        # Location history is written in batches, so the row may not have an id yet
+        location_update = result['location_update']
+        return Response({
+            'message': 'Location updated successfully',
+            'update_id': str(location_update.id) if location_update.id else None,
+            'timestamp': result['timestamp'].isoformat()
+        })
+
+class GPSBatchUploadView(APIView):
+    # Buffered fixes from driver devices that were offline: {"device_id", "points": [{..., "timestamp"}]}
+    # as JSON or msgpack, optionally with Content-Encoding: gzip. Retried uploads are harmless:
+    # fixes already stored for (device_id, timestamp) are skipped. Invalid fixes are reported, not fatal.
+    permission_classes = [permissions.IsAuthenticated, CanUpdateLocation]
+    parser_classes = [GzipJSONParser, MsgPackParser]
+    
+    def post(self, request, trip_id):
+        serializer = LocationBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
-        if next_stop:
-            eta_minutes = GPSService.calculate_eta(
-                float(trip.current_latitude), float(trip.current_longitude),
-                float(next_stop.latitude), float(next_stop.longitude),
-                float(trip.average_speed or 30)
-            )
-            trip.next_stop_eta = timezone.now() + timedelta(minutes=eta_minutes)
+        points = []
+        positions = []
+        invalid = []
+        for position, raw_point in enumerate(serializer.validated_data['points']):
+            point_serializer = BatchLocationPointSerializer(data=raw_point)
+            if not point_serializer.is_valid():
+                invalid.append({'index': position, 'errors': point_serializer.errors})
+                continue
+            point = point_serializer.validated_data
+            is_valid, message = GPSService.validate_coordinates(point['latitude'], point['longitude'])
+            if not is_valid:
+                invalid.append({'index': position, 'errors': message})
+                continue
+            points.append(point)
+            positions.append(position)
         
-        # Calculate ETA to school (last stop)
-        school_stop = trip.route.stops.order_by('-sequence').first()
-        if school_stop:
-            eta_minutes = GPSService.calculate_eta(
-                float(trip.current_latitude), float(trip.current_longitude),
-                float(school_stop.latitude), float(school_stop.longitude),
-                float(trip.average_speed or 30)
+        try:
+            result = GPSIngestionService.ingest_batch(
+                trip_id, points, device_id=serializer.validated_data['device_id'], user=request.user
             )
-            trip.school_eta = timezone.now() + timedelta(minutes=eta_minutes)
+        except Trip.DoesNotExist:
+            return Response({'error': 'Trip not found'}, status=status.HTTP_404_NOT_FOUND)
+        except GPSBatchError as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
         
-        trip.save()
+        invalid.extend({'index': positions[point['index']], 'errors': point['errors']} for point in result['invalid_points'])
+        invalid.sort(key=lambda point: point['index'])
+        return Response({
+            'accepted': result['accepted'],
+            'duplicates': result['duplicates'],
+            'rejected': len(invalid),
+            'invalid_points': invalid,
+            'latest_timestamp': result['latest_timestamp'].isoformat() if result['latest_timestamp'] else None,
+        })
 
 class RouteOptimizationView(APIView):
-    # Optimize bus routes using OpenStreetMap API
+    # Reorder a route's stops with the local solver (haversine, or cached OSRM road distances)
     permission_classes = [permissions.IsAuthenticated, CanManageTransport]
     
     def post(self, request, route_id):
+        from .optimizer import RouteOptimizationService
+        
         try:
             route = Route.objects.get(id=route_id, school=request.user.school)
-            stops = route.stops.order_by('sequence')
-            
-            if stops.count() < 2:
-                return Response({'error': 'Route needs at least 2 stops'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Use OpenStreetMap to optimize route
-            osm_service = OpenStreetMapService()  
-            
-            # Calculate route from first to last stop
-            first_stop = stops.first()
-            last_stop = stops.last()
-            
-            route_data = osm_service.get_route_with_eta(  
-                float(first_stop.latitude), float(first_stop.longitude), 
-                float(last_stop.latitude), float(last_stop.longitude)
-            )
-            
-            if not route_data:
-                return Response({'error': 'Could not calculate optimized route'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Update route with optimized data
-            route.total_distance = route_data['distance_meters'] / 1000 
-            route.estimated_duration = route_data['duration_seconds'] // 60  
-            route.save()
-            
-            return Response({
-                'message': 'Route optimized successfully',
-                'optimized_route': {
-                    'distance': route_data['distance_text'],
-                    'duration': route_data['duration_text'],
-                    'eta': route_data['eta'].isoformat()
-                }
-            })
-            
         except Route.DoesNotExist:
             return Response({'error': 'Route not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        bus = None
+        if request.data.get('bus_id'):
+            try:
+                bus = Bus.objects.get(id=request.data['bus_id'], school=request.user.school)
+            except Bus.DoesNotExist:
+                return Response({'error': 'Bus not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        source = 'osrm' if request.data.get('road_distances') else 'haversine'
+        apply = str(request.data.get('apply', True)).lower() not in ('false', '0')
+        
+        result = RouteOptimizationService.optimize(route, bus=bus, source=source, apply=apply)
+        if 'error' in result:
+            return Response({'error': result['error']}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'message': 'Route optimized successfully' if apply else 'Route optimization preview',
+            'optimized_route': result
+        })
+
 class GeocodingView(APIView):
-    # Geocoding service for address to coordinates conversion
+    # Geocoding service for address to coordinates conversion.
+    # Send 'address' for one lookup or 'addresses' (a list) to geocode a batch, e.g. for a
+    # StudentTransport import; batches are answered from the cache where possible.
     permission_classes = [permissions.IsAuthenticated, CanManageTransport]
     
+    @staticmethod
+    def _format(address, result):
+        return {
+            'address': address,
+            'coordinates': {
+                'latitude': result['latitude'],
+                'longitude': result['longitude']
+            },
+            'formatted_address': result['formatted_address']
+        }
+    
     def post(self, request):
+        addresses = request.data.get('addresses')
+        if addresses is not None:
+            return self._bulk(addresses)
+        
         address = request.data.get('address')
         if not address:
             return Response({'error': 'Address is required'}, status=status.HTTP_400_BAD_REQUEST)
         
-        osm_service = OpenStreetMapService() 
-        result = osm_service.geocode_address(address)  
+        try:
+            result = GeoService.geocode(address)
+        except GeoRateLimitError:
+            return Response({'error': 'Geocoding rate limit reached, try again shortly'}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+        except GeoUpstreamError as e:
+            logger.warning(f"Geocoding error: {e}")
+            return Response({'error': 'Geocoding service unavailable'}, status=status.HTTP_502_BAD_GATEWAY)
         
         if result:
-            return Response({
-                'address': address,
-                'coordinates': {
-                    'latitude': result['latitude'],
-                    'longitude': result['longitude']
-                },
-                'formatted_address': result['formatted_address']
-            })
+            return Response(self._format(address, result))
         else:
             return Response({'error': 'Could not geocode address'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    def _bulk(self, addresses):
+        limit = getattr(settings, 'GEO_BULK_MAX_ADDRESSES', 500)
+        if not isinstance(addresses, list) or not all(isinstance(address, str) for address in addresses):
+            return Response({'error': 'addresses must be a list of strings'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(addresses) > limit:
+            return Response({'error': f'At most {limit} addresses per request'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        results = GeoService.bulk_geocode(addresses)
+        found = [self._format(address, result) for address, result in results.items() if result]
+        # Unresolved addresses are either unknown or were left for a retry once the rate limit allows
+        return Response({
+            'results': found,
+            'unresolved': [address for address, result in results.items() if not result],
+            'count': len(found)
+        })
 class LiveMapView(APIView):
     # Generate live map with bus locations
     permission_classes = [permissions.IsAuthenticated, CanViewLiveTracking]
@@ -270,15 +281,28 @@ class TripDetailWithGPSView(generics.RetrieveAPIView):
         # Add GPS and route data
         response_data = serializer.data
         
-        # Get location history
-        location_updates = LocationUpdate.objects.filter(
-            trip=instance
+        # Get location history (only the partitions this trip spans)
+        location_updates = LocationPartitionService.trip_updates(
+            instance
         ).order_by('-created_at')[:50]  
         
         response_data['location_history'] = LocationUpdateSerializer(
             location_updates, many=True
         ).data
         
+        # Raw pings past retention - fall back to the downsampled track
+        if not response_data['location_history'] and hasattr(instance, 'track'):
+            track = instance.track
+            response_data['location_history'] = [
+                {
+                    'latitude': latitude,
+                    'longitude': longitude,
+                    'speed': speed,
+                    'created_at': (track.started_at + timedelta(seconds=offset)).isoformat()
+                }
+                for offset, latitude, longitude, speed in reversed(track.points[-50:])
+            ]
+        
         # Get route stops with ETAs
         stops = instance.route.stops.order_by('sequence')
         stop_data = []
@@ -504,6 +528,9 @@ def end_trip(request, trip_id):
                 longitude=trip.current_longitude or 0
             )
             
+            # Store the replay track now rather than at the next scheduled rollup
+            build_trip_track(trip.id)
+            
             return Response({'message': 'Trip ended successfully'})
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -511,6 +538,70 @@ def end_trip(request, trip_id):
     except Trip.DoesNotExist:
         return Response({'error': 'Trip not found'}, status=status.HTTP_404_NOT_FOUND)
 
+class TripTrackView(APIView):
+    # Replay path of a trip, simplified with Douglas-Peucker:
+    #   ?encoding=polyline (default): JSON with an encoded polyline (precision 5) and the points'
+    #     seconds since started_at, delta-encoded the same way
+    #   ?encoding=binary: little-endian int32 triples (seconds, latitude * 1e6, longitude * 1e6)
+    #   ?tolerance=<meters>: coarser than the stored GPS_TRACK_SIMPLIFY_TOLERANCE re-simplifies
+    # ("format" is taken by DRF's renderer negotiation, hence "encoding")
+    permission_classes = [permissions.IsAuthenticated, CanViewLiveTracking]
+    
+    def get(self, request, trip_id):
+        try:
+            trip = Trip.objects.get(id=trip_id, bus__school=request.user.school)
+        except Trip.DoesNotExist:
+            return Response({'error': 'Trip not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        encoding = request.query_params.get('encoding', 'polyline')
+        if encoding not in ('polyline', 'binary'):
+            return Response({'error': 'encoding must be polyline or binary'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            tolerance = float(request.query_params['tolerance']) if 'tolerance' in request.query_params else None
+        except ValueError:
+            return Response({'error': 'tolerance must be a number of meters'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        track = TripTrack.objects.filter(trip=trip).first()
+        if track is None:
+            # Trip still running (or not rolled up yet): simplify its raw pings on the fly
+            rows = list(
+                LocationPartitionService.trip_updates(trip)
+                .order_by('created_at')
+                .values_list('created_at', 'latitude', 'longitude', 'speed')
+            )
+            if not rows:
+                return Response({'error': 'No track recorded for this trip'}, status=status.HTTP_404_NOT_FOUND)
+            track = TripTrack(
+                trip=trip, started_at=rows[0][0], ended_at=rows[-1][0],
+                **TrackRollupService.simplified_path(rows, tolerance)
+            )
+        
+        offsets, latitudes, longitudes, used_tolerance = TrackRollupService.path(track, tolerance)
+        
+        if encoding == 'binary':
+            body = np.column_stack([
+                offsets,
+                np.round(latitudes * 1e6),
+                np.round(longitudes * 1e6)
+            ]).astype('<i4').tobytes()
+            response = HttpResponse(body, content_type='application/octet-stream')
+            response['X-Track-Started-At'] = track.started_at.isoformat() if track.started_at else ''
+            response['X-Track-Points'] = str(len(offsets))
+            response['X-Track-Tolerance'] = str(used_tolerance)
+            return response
+        
+        return Response({
+            'trip_id': trip.id,
+            'started_at': track.started_at.isoformat() if track.started_at else None,
+            'ended_at': track.ended_at.isoformat() if track.ended_at else None,
+            'distance_km': track.distance_km if track.pk else None,
+            'tolerance': used_tolerance,
+            'point_count': len(offsets),
+            'precision': 5,
+            'polyline': encode_polyline(latitudes, longitudes),
+            'offsets': encode_values(offsets)
+        })
+
 # Student Transport Assignment Views
 class StudentTransportListCreateView(generics.ListCreateAPIView):
     serializer_class = StudentTransportSerializer
@@ -561,64 +652,48 @@ class AttendanceLogListCreateView(generics.ListCreateAPIView):
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated, CanMarkAttendance])
 def bulk_mark_attendance(request, trip_id):
+    # Marks a stop's worth of students at once. Send an 'idempotency_key' (or an Idempotency-Key
+    # header, or a key per entry) so a driver app can safely retry after a dropped connection.
+    attendance_data = request.data.get('attendance', [])
+    bus_stop_id = request.data.get('bus_stop_id')
+    attendance_type = request.data.get('attendance_type')
+    
+    if not bus_stop_id or not attendance_type:
+        return Response(
+            {'error': 'bus_stop_id and attendance_type are required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if not isinstance(attendance_data, list) or not all(isinstance(entry, dict) for entry in attendance_data):
+        return Response({'error': 'attendance must be a list of objects'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    idempotency_key = request.data.get('idempotency_key') or request.headers.get('Idempotency-Key')
     try:
-        trip = Trip.objects.get(id=trip_id)
-        
-        attendance_data = request.data.get('attendance', [])
-        bus_stop_id = request.data.get('bus_stop_id')
-        attendance_type = request.data.get('attendance_type')
-        
-        if not bus_stop_id or not attendance_type:
-            return Response(
-                {'error': 'bus_stop_id and attendance_type are required'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        try:
-            bus_stop = BusStop.objects.get(id=bus_stop_id, route=trip.route)
-        except BusStop.DoesNotExist:
-            return Response({'error': 'Invalid bus stop'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        created_count = 0
-        for student_attendance in attendance_data:
-            student_id = student_attendance.get('student_id')
-            is_present = student_attendance.get('is_present', False)
-            notes = student_attendance.get('notes', '')
-            
-            try:
-                student = User.objects.get(id=student_id, role=User.Role.STUDENT)
-                
-                AttendanceLog.objects.create(
-                    trip=trip,
-                    student=student,
-                    bus_stop=bus_stop,
-                    attendance_type=attendance_type,
-                    scheduled_time=timezone.now(),
-                    actual_time=timezone.now() if is_present else None,
-                    is_present=is_present,
-                    marked_by=request.user,
-                    notes=notes
-                )
-                created_count += 1
-                
-                # Update students onboard count
-                if is_present and attendance_type == 'PICKUP':
-                    trip.students_onboard = F('students_onboard') + 1
-                elif is_present and attendance_type == 'DROPOFF':
-                    trip.students_onboard = F('students_onboard') - 1
-                
-            except User.DoesNotExist:
-                continue
-        
-        trip.save()
-        
-        return Response({
-            'message': f'Attendance marked for {created_count} students',
-            'created_count': created_count
-        })
-        
+        result = BulkAttendanceService.mark(
+            trip_id, bus_stop_id, attendance_type, attendance_data, request.user, idempotency_key
+        )
     except Trip.DoesNotExist:
         return Response({'error': 'Trip not found'}, status=status.HTTP_404_NOT_FOUND)
+    except AttendanceError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response({
+        'message': f"Attendance marked for {result['created_count']} students",
+        **result
+    })
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated, CanMarkAttendance])
+def attendance_suggestions(request, trip_id):
+    # Students to mark at the stop the bus just reached, from the trip's geofence events
+    try:
+        trip = Trip.objects.get(id=trip_id, bus__school=request.user.school)
+    except Trip.DoesNotExist:
+        return Response({'error': 'Trip not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    suggestions = AttendanceSuggestionService.for_trip(trip)
+    if suggestions is None:
+        return Response({'bus_stop': None, 'students': []})
+    return Response(suggestions)
 
 # Maintenance Views
 class MaintenanceLogListCreateView(generics.ListCreateAPIView):